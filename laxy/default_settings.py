@@ -104,11 +104,16 @@ default_env = PrefixedEnv(
     JOB_EXPIRY_TTL_DEFAULT=(int, 30 * 24 * 60 * 60),  # 30 days
     JOB_EXPIRY_TTL_CANCELLED=(int, 0),  # immediate
     JOB_EXPIRY_TTL_FAILED=(int, 3 * 24 * 60 * 60),  # 3 days
+    EVENTLOG_RETENTION_DAYS=(int, 90),
     WEB_SCRAPER_BACKEND=(str, "simple"),
     WEB_SCRAPER_SPLASH_HOST=(str, "http://localhost:8050"),
+    WEB_SCRAPER_WORKERS=(int, 4),
+    WEB_SCRAPER_TIMEOUT=(int, 60),
+    WEB_SCRAPER_HOST_TIMEOUTS=(dictify_json_loads, {}),
     DEGUST_URL=(str, "https://degust.erc.monash.edu"),
     EMAIL_DOMAIN_ALLOWED_COMPUTE=(dictify_json_loads, {"*": ["*"]}),
     LINK_SCRAPER_MAPPINGS=(dictify_json_loads, {}),
+    FILE_SIZE_REMOTE_LOOKUP=(bool, False),
 )
 
 
@@ -225,9 +230,21 @@ if SENTRY_DSN:
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 8000000  # default is 2621440 (~2Mb)
 
+# CSV/TSV uploads (file registration, sample carts) are parsed as a stream,
+# so aren't bound by DATA_UPLOAD_MAX_MEMORY_SIZE - these limit them instead
+CSV_UPLOAD_MAX_BYTES = 512 * 1024 * 1024
+CSV_UPLOAD_MAX_ROWS = 1000000
+
+# Remote tar archives without a published manifest are streamed through (in the
+# request) to list them - only if they are smaller than this
+REMOTE_ARCHIVE_STREAM_MAX_BYTES = 32 * 1024 * 1024
+
 JOB_EXPIRY_TTL_CANCELLED = env("JOB_EXPIRY_TTL_CANCELLED")
 JOB_EXPIRY_TTL_FAILED = env("JOB_EXPIRY_TTL_FAILED")
 
+# Events of finished jobs older than this are compacted into a summary event
+EVENTLOG_RETENTION_DAYS = env("EVENTLOG_RETENTION_DAYS")
+
 SFTP_STORAGE_PIPELINED = True
 
 USE_SSL = env("USE_SSL")
@@ -250,6 +267,14 @@ The base path where job directories will be created if `base_dir` isn't
 specified in ComputeResource.extra on the compute node for a job.
 """
 
+FILE_SIZE_REMOTE_LOOKUP = env("FILE_SIZE_REMOTE_LOOKUP")
+"""
+If True, File.size queries the storage backend (eg via SFTP) when the size isn't
+already recorded in File.metadata. This is one network round trip and one database
+write per file, so it's disabled by default - sizes are populated in bulk by
+laxy_backend.tasks.file.stat_files instead.
+"""
+
 WEB_SCRAPER_BACKEND = env("WEB_SCRAPER_BACKEND")
 """
 Valid options are 'simple', 'splash' (and possibly 'pyppeteer' in the future)
@@ -261,6 +286,43 @@ The URL to a Splash scraping server (eg https://splash.readthedocs.io/en/stable/
 When running under docker-compose this might be 'http://splash:8050'.
 """
 
+WEB_SCRAPER_WORKERS = env("WEB_SCRAPER_WORKERS")
+"""
+The number of threads (per web process) fetching remote pages for RemoteBrowseView.
+"""
+
+WEB_SCRAPER_TIMEOUT = env("WEB_SCRAPER_TIMEOUT")
+"""
+The time limit (in seconds) for fetching a whole remote page.
+"""
+
+WEB_SCRAPER_HOST_TIMEOUTS = env("WEB_SCRAPER_HOST_TIMEOUTS")
+"""
+Connect and read timeouts (in seconds) for specific hosts, as JSON,
+eg '{"slow.example.com": [10, 120]}'. Other hosts use 5 and 30 seconds.
+"""
+
+REMOTE_BROWSE_MAX_DEPTH = 5
+"""
+The deepest RemoteBrowseView will crawl FTP and WebDAV directory trees (`depth`).
+"""
+
+REMOTE_BROWSE_MAX_ENTRIES = 50000
+"""
+The most entries RemoteBrowseView will list from a FTP or WebDAV crawl (`max_entries`).
+"""
+
+REMOTE_BROWSE_REGEX_MAX_LENGTH = 200
+"""
+The longest `regex` RemoteBrowseView will filter a listing by.
+"""
+
+REMOTE_BROWSE_REGEX_TIMEOUT = 2.0
+"""
+Seconds RemoteBrowseView may spend matching a `regex` against a listing, before
+giving up (so a pathological pattern can't tie up a worker).
+"""
+
 DEGUST_URL = env("DEGUST_URL")
 """
 The base URL to the Degust instance you'd like to use (eg, could be changed to 
@@ -396,6 +458,14 @@ CELERYBEAT_SCHEDULE = {
         "task": "laxy_backend.tasks.job.clean_orphan_obj_perms",
         "schedule": timedelta(hours=24),
     },
+    "prewarm_conda_environments": {
+        "task": "laxy_backend.tasks.job.prewarm_conda_environments",
+        "schedule": timedelta(hours=24),
+    },
+    "compact_old_job_events": {
+        "task": "laxy_backend.tasks.job.compact_old_job_events",
+        "schedule": timedelta(hours=24),
+    },
 }
 
 MEDIA_ROOT = str(env("MEDIA_ROOT"))
@@ -826,6 +896,14 @@ CACHES = {
         "LOCATION": "ena-lookups-cache",
         # 'TIMEOUT': 24*60*60,
     },
+    # Remote directory listings and archive introspection results (validated
+    # by ETag/mtime before reuse), see laxy_backend.scraping.crawl and
+    # laxy_backend.storage.http_remote
+    "remote-browse": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "remote-browse-cache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
     # For cache_memoize usage on small miscellaneous functions
     # (time consuming functions or those that use HTTP requests to
     # external services with mostly static responses)
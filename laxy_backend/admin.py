@@ -779,6 +779,7 @@ class FileAdmin(Timestamped, VersionAdmin):
         "fix_metadata",
         "verify",
         "copy_to_archive",
+        "stat_files",
     )
     form = FileAdminForm
 
@@ -840,6 +841,13 @@ class FileAdmin(Timestamped, VersionAdmin):
 
     verify.short_description = "Verify file (all locations)"
 
+    @takes_instance_or_queryset
+    def stat_files(self, request, queryset):
+        n_updated = file_tasks.stat_files(queryset, refresh=True)
+        self.message_user(request, f"Updated size for {n_updated} file(s)")
+
+    stat_files.short_description = "Update file size (via remote stat)"
+
     # TODO: This should be refactored alongside the equivalent function on JobAdmin
     #       to used common code
     @takes_instance_or_queryset
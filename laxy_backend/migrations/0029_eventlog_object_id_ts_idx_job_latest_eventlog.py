@@ -0,0 +1,37 @@
+# Generated by Django 5.2.11 on 2026-10-19 12:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("laxy_backend", "0028_alter_filelocation_unique_together_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="eventlog",
+            index=models.Index(
+                fields=["object_id", "timestamp"], name="eventlog_object_id_ts_idx"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="eventlog",
+            name="object_id",
+            field=models.CharField(max_length=24, null=True),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="latest_eventlog",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="laxy_backend.eventlog",
+            ),
+        ),
+    ]
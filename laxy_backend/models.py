@@ -1,5 +1,6 @@
 import os
 import socket
+import time
 import typing
 from typing import List, Sequence, Tuple, Union, AnyStr, Iterable
 import collections
@@ -16,11 +17,10 @@ from io import StringIO, BytesIO, BufferedRandom
 
 import backoff
 from django.db.utils import IntegrityError
-import pandas as pd
 import paramiko
 from paramiko import SSHClient, ssh_exception, RSAKey, AutoAddPolicy
-from jsonschema import validate as JSONSchemaValidate
-from jsonschema.exceptions import ValidationError as JSONSchemaValidationError
+from jsonschema import validators as JSONSchemaValidators
+from jsonschema.exceptions import best_match as json_schema_best_match
 
 from django.conf import settings
 from django.utils import timezone
@@ -65,8 +65,13 @@ from .util import (
     generate_uuid,
     generate_secret_key,
     find_filename_and_size_from_url,
+    filename_from_url_path,
+    resolve_filenames_from_urls,
     laxy_sftp_url,
     generate_cluster_stack_name,
+    batched,
+    iter_csv_records,
+    iter_text_lines,
 )
 
 import logging
@@ -316,6 +321,15 @@ class EventLog(UUIDModel):
     class Meta:
         ordering = ["-timestamp"]
         get_latest_by = ["timestamp"]
+        indexes = [
+            # Events are almost always fetched for one object (Job), newest first
+            models.Index(
+                fields=["object_id", "timestamp"], name="eventlog_object_id_ts_idx"
+            ),
+        ]
+
+    # Events that don't count as a Job's 'latest event' (see Job.latest_event)
+    NOT_LATEST_EVENTS = ("JOB_STATUS_CHANGED", "JOB_EVENTS_COMPACTED")
 
     user = ForeignKey(
         User,
@@ -330,7 +344,7 @@ class EventLog(UUIDModel):
     extra = JSONField(default=OrderedDict)
 
     content_type = ForeignKey(ContentType, null=True, on_delete=models.SET_NULL)
-    object_id = CharField(null=True, max_length=24, db_index=True)
+    object_id = CharField(null=True, max_length=24)
     obj = GenericForeignKey("content_type", "object_id")
 
     @staticmethod
@@ -471,9 +485,22 @@ class ComputeResource(Timestamped, UUIDModel):
         return f"{self.name} ({self.id})"
 
     @classmethod
-    def get_best_available(cls):
-        return (
-            cls.objects.filter(status=cls.STATUS_ONLINE).order_by("-priority").first()
+    def get_best_available(cls, input_files=None):
+        """
+        Returns the online ComputeResource a new Job would start on soonest
+        (and reach its `input_files` with the fewest transfers), taking the
+        current load on each into account (see laxy_backend.scheduling).
+
+        :param input_files: The new Job's input Files, if any.
+        :type input_files: Union[QuerySet, Iterable[File], None]
+        :return: The best ComputeResource, or None if none are online.
+        :rtype: Union[ComputeResource, None]
+        """
+        from laxy_backend.scheduling import choose_compute_resource
+
+        return choose_compute_resource(
+            list(cls.objects.filter(status=cls.STATUS_ONLINE).order_by("-priority")),
+            input_files=input_files,
         )
 
     @property
@@ -758,6 +785,16 @@ class Job(Expires, Timestamped, UUIDModel):
 
     completed_time = DateTimeField(blank=True, null=True)
 
+    # Denormalised pointer to latest_event(), kept up to date as events are
+    # inserted (see Job.update_latest_event) so job lists don't query EventLog
+    latest_eventlog = ForeignKey(
+        "EventLog",
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+
     @transaction.atomic()
     def _init_filesets(self, save=True):
         if not self.input_files:
@@ -776,16 +813,19 @@ class Job(Expires, Timestamped, UUIDModel):
 
     def save(self, *args, **kwargs):
         if self._state.adding:
-            if not self.input_files:
-                self.input_files = FileSet.objects.create(
-                    name=f"Input for job {self.id}", owner=self.owner
-                )
-            if not self.output_files:
-                self.output_files = FileSet.objects.create(
-                    name=f"Output for job {self.id}", owner=self.owner
-                )
-
-        super(Job, self).save(*args, **kwargs)
+            with transaction.atomic():
+                self._insert_with_filesets_and_event(*args, **kwargs)
+        else:
+            if not args and kwargs.get("update_fields") is None:
+                # latest_eventlog is only ever set by update_latest_event, so a
+                # Job loaded before an event arrived doesn't write back a stale
+                # value
+                kwargs["update_fields"] = [
+                    f.name
+                    for f in self._meta.concrete_fields
+                    if not f.primary_key and f.name != "latest_eventlog"
+                ]
+            super(Job, self).save(*args, **kwargs)
 
         # For a single-use ('disposable') ComputeResource associated with a
         # single job, we automatically name the resource based on the associated
@@ -795,6 +835,46 @@ class Job(Expires, Timestamped, UUIDModel):
             compute.name = generate_cluster_stack_name(self)
             compute.save()
 
+    def _insert_with_filesets_and_event(self, *args, **kwargs):
+        """
+        Inserts a new Job, along with its input and output FileSets and its
+        job_created event, one INSERT each. The event is inserted first so the
+        Job can point latest_eventlog at it directly, rather than updating the
+        Job from an EventLog post_save signal.
+        """
+        filesets = []
+        if not self.input_files:
+            self.input_files = FileSet(
+                name=f"Input files for job: {self.id}", owner=self.owner
+            )
+            filesets.append(self.input_files)
+        if not self.output_files:
+            self.output_files = FileSet(
+                name=f"Output files for job: {self.id}", owner=self.owner
+            )
+            filesets.append(self.output_files)
+        if filesets:
+            FileSet.objects.bulk_create(filesets)
+
+        # bulk_create skips the EventLog post_save signal, which would update
+        # a Job that doesn't exist yet
+        (event,) = EventLog.objects.bulk_create(
+            [
+                EventLog(
+                    event="job_created",
+                    message=f"Job created: {self.id}",
+                    extra={},
+                    user=self.owner,
+                    object_id=self.id,
+                    content_type=ContentType.objects.get_for_model(Job),
+                )
+            ]
+        )
+        if self.latest_eventlog_id is None:
+            self.latest_eventlog = event
+
+        super(Job, self).save(*args, **kwargs)
+
     def events(self):
         return EventLog.objects.filter(object_id=self.id)
 
@@ -814,14 +894,37 @@ class Job(Expires, Timestamped, UUIDModel):
         return eventlog
 
     def latest_event(self):
+        if self.latest_eventlog_id is not None:
+            return self.latest_eventlog
+
+        # Jobs with events from before latest_eventlog existed
         try:
-            return (
+            event = (
                 EventLog.objects.filter(object_id=self.id)
-                .exclude(event__exact="JOB_STATUS_CHANGED")
+                .exclude(event__in=EventLog.NOT_LATEST_EVENTS)
                 .latest()
             )
         except EventLog.DoesNotExist:
             return EventLog.objects.none()
+        Job.update_latest_event(self.id, [event])
+        self.latest_eventlog = event
+        return event
+
+    @staticmethod
+    def update_latest_event(job_id: str, events: Sequence[EventLog]) -> None:
+        """
+        Points Job.latest_eventlog at the newest of some just-inserted events,
+        unless the Job already has a newer one (events may arrive out of order).
+        Also updates modified_time, since job lists include the latest event.
+        """
+        events = [e for e in events if e.event not in EventLog.NOT_LATEST_EVENTS]
+        if not events:
+            return
+        newest = max(events, key=lambda e: e.timestamp)
+        Job.objects.filter(id=job_id).filter(
+            Q(latest_eventlog__isnull=True)
+            | Q(latest_eventlog__timestamp__lte=newest.timestamp)
+        ).update(latest_eventlog=newest, modified_time=timezone.now())
 
     def get_files(self) -> models.query.QuerySet:
         # Combine querysets
@@ -859,10 +962,15 @@ class Job(Expires, Timestamped, UUIDModel):
             or self.status == Job.STATUS_FAILED
         )
 
+    # Bulk registered files are looked up and added to filesets this many at a time
+    FILE_REGISTRATION_BATCH_SIZE = 500
+
     @transaction.atomic()
-    def add_files_from_tsv(self, tsv_table: Union[List[dict], str, bytes], save=True):
+    def add_files_from_tsv(
+        self, tsv_table: Union[Iterable[dict], str, bytes], save=True
+    ):
         """
-        Works with TSV and CSV, due to use of pd.read_table(sep=None)
+        Works with TSV and CSV (the delimiter is detected from the header row).
 
         ```tsv
         filepath	checksum	type_tags	metadata
@@ -884,8 +992,12 @@ class Job(Expires, Timestamped, UUIDModel):
         laxy+sftp://BlA4F00/Vl4F1U/output/sample2/alignments/sample2.bai    output/sample2/alignments/sample2.bai	md5:e57ea180602b69ab03605dad86166fa7	bai,jbrowse	{}
         ```
 
-        :param tsv_table:
-        :type tsv_table:
+        Rows are registered in batches of FILE_REGISTRATION_BATCH_SIZE, so an
+        iterator of rows (eg lazily parsed by CSVRecordParser) is never held in
+        memory all at once.
+
+        :param tsv_table: The CSV/TSV text, or an iterable of dicts, one per row.
+        :type tsv_table: Iterable[dict] | str | bytes
         :param save:
         :type save:
         :return:
@@ -893,37 +1005,45 @@ class Job(Expires, Timestamped, UUIDModel):
         """
         from laxy_backend.serializers import FileBulkRegisterSerializer
 
-        if isinstance(tsv_table, str) or isinstance(tsv_table, bytes):
-            table = json.loads(
-                pd.read_table(BytesIO(tsv_table), sep=None, engine="python").to_json(
-                    orient="records"
-                )
-            )
-        elif isinstance(tsv_table, list):
+        if isinstance(tsv_table, str):
+            tsv_table = tsv_table.encode("utf-8")
+        if isinstance(tsv_table, bytes):
+            table = iter_csv_records(iter_text_lines(BytesIO(tsv_table)))
+        elif isinstance(tsv_table, collections.abc.Iterable):
             table = tsv_table
         else:
-            raise ValueError("tsv_table must be str, bytes or a list of dicts")
+            raise ValueError("tsv_table must be str, bytes or an iterable of dicts")
 
         in_files = []
         out_files = []
 
         self._init_filesets()
 
-        for row in table:
-            # When a pd.DataFrame is converted to JSON (.to_json()), values than
-            # contain JSON strings are not converted to nested JSON objects.
-            # So we do this manually for the metadata field.
-            if row.get("metadata", None):
-                row["metadata"] = json.loads(row["metadata"])
-
-            f = FileBulkRegisterSerializer(data=row)
-            if f.is_valid(raise_exception=True):
+        for batch in batched(table, self.FILE_REGISTRATION_BATCH_SIZE):
+            validated = []
+            for row in batch:
+                # The metadata field is a JSON string in a CSV cell
+                if isinstance(row.get("metadata", None), str):
+                    row["metadata"] = json.loads(row["metadata"])
+
+                f = FileBulkRegisterSerializer(data=row)
+                f.is_valid(raise_exception=True)
+                validated.append((row, f))
+
+            # Files that exist by path in input/output filesets already are
+            # updated - find them with one query per batch
+            names = {f.validated_data["name"] for _, f in validated}
+            existing_files = {
+                (existing.path, existing.name): existing
+                for existing in self.get_files().filter(name__in=names)
+            }
 
-                # Check if file exists by path in input/output filesets already,
-                # if so, update existing file
+            batch_in_files = []
+            batch_out_files = []
+            for row, f in validated:
                 fpath = f.validated_data["path"]
                 fname = f.validated_data["name"]
-                existing = self.get_files().filter(name=fname, path=fpath).first()
+                existing = existing_files.get((fpath, fname), None)
                 if existing:
                     f = FileBulkRegisterSerializer(existing, data=row, partial=True)
                     f.is_valid(raise_exception=True)
@@ -938,22 +1058,29 @@ class Job(Expires, Timestamped, UUIDModel):
                     f_obj.location = location
                 if save:
                     f_obj = f.save()
+                # A later row for the same path updates this one
+                existing_files[(fpath, fname)] = f_obj
 
-            pathbits = Path(f.validated_data.get("path", "").strip("/")).parts
-            if pathbits and pathbits[0] == "input":
-                self.input_files.add(f_obj)
-                in_files.append(f_obj)
+                pathbits = Path(f.validated_data.get("path", "").strip("/")).parts
+                if pathbits and pathbits[0] == "input":
+                    batch_in_files.append(f_obj)
 
-            elif pathbits and pathbits[0] == "output":
-                self.output_files.add(f_obj)
-                out_files.append(f_obj)
+                elif pathbits and pathbits[0] == "output":
+                    batch_out_files.append(f_obj)
 
-            else:
-                logger.debug(
-                    f"Not adding file {f_obj.full_path} ({f_obj.id}) "
-                    f"- File paths for a Job must begin with input/ or output/"
-                )
-                # raise ValueError("File paths for a Job must begin with input/ or output/")
+                else:
+                    logger.debug(
+                        f"Not adding file {f_obj.full_path} ({f_obj.id}) "
+                        f"- File paths for a Job must begin with input/ or output/"
+                    )
+                    # raise ValueError("File paths for a Job must begin with input/ or output/")
+
+            if batch_in_files:
+                self.input_files.add(batch_in_files)
+            if batch_out_files:
+                self.output_files.add(batch_out_files)
+            in_files.extend(batch_in_files)
+            out_files.extend(batch_out_files)
 
         return in_files, out_files
 
@@ -969,7 +1096,9 @@ def update_job_completed_time(sender, instance, raw, using, update_fields, **kwa
     Takes actions every time a Job is saved, so changes to certain fields
     can have side effects (eg automatically setting completion time).
     """
-    if update_fields is not None and "done" not in update_fields:
+    if instance._state.adding or (
+        update_fields is not None and "done" not in update_fields
+    ):
         return
 
     try:
@@ -986,7 +1115,9 @@ def job_status_changed_event_log(sender, instance, raw, using, update_fields, **
     """
     Creates an event log entry every time a Job is saved with a changed status.
     """
-    if update_fields is not None and "status" not in update_fields:
+    if instance._state.adding or (
+        update_fields is not None and "status" not in update_fields
+    ):
         return
 
     try:
@@ -1010,6 +1141,12 @@ def job_init_filesets(sender, instance: Job, raw, using, update_fields, **kwargs
         instance._init_filesets(save=False)
 
 
+JOB_PARAMS_VALIDATOR = JSONSchemaValidators.validator_for(Job.JOB_PARAMS_SCHEMA)(
+    Job.JOB_PARAMS_SCHEMA
+)
+JOB_PARAMS_VALIDATOR.check_schema(Job.JOB_PARAMS_SCHEMA)
+
+
 @receiver(pre_save, sender=Job)
 def sanitize_job_params(sender, instance: Job, raw, using, update_fields, **kwargs):
     """
@@ -1029,11 +1166,10 @@ def sanitize_job_params(sender, instance: Job, raw, using, update_fields, **kwar
                     {'params': f"Job.params is not valid JSON: {e}"}
                 ) from e
 
-        try:
-            # We use our own renamed import to avoid confusion with Django's
-            # own ValidationError
-            JSONSchemaValidate(instance=params, schema=Job.JOB_PARAMS_SCHEMA)
-        except JSONSchemaValidationError as e:
+        # As jsonschema.validate, but with the validator compiled once
+        # (see JOB_PARAMS_VALIDATOR) rather than on every save
+        e = json_schema_best_match(JOB_PARAMS_VALIDATOR.iter_errors(params))
+        if e is not None:
             # Raising a Django ValidationError is more idiomatic here
             # and will be handled nicely by serializers and forms.
             raise DjangoValidationError(
@@ -1041,32 +1177,19 @@ def sanitize_job_params(sender, instance: Job, raw, using, update_fields, **kwar
             ) from e
 
 
-@receiver(post_save, sender=Job)
-def job_init_filesets_on_create(sender, instance: Job, created, **kwargs):
+@receiver(post_save, sender=EventLog)
+def eventlog_update_job_latest_event(sender, instance, created, raw, **kwargs):
     """
-    Initialize input_files and output_files FileSet objects when a new Job is created.
-    This prevents AttributeError when trying to access these fields before they are set.
+    Keeps Job.latest_eventlog current as events are created (bulk_create skips
+    this, so callers of that use Job.update_latest_event directly).
     """
-    if created:
-        if not instance.input_files:
-            instance.input_files = FileSet.objects.create(
-                name=f"Input for job {instance.id}", owner=instance.owner
-            )
-        if not instance.output_files:
-            instance.output_files = FileSet.objects.create(
-                name=f"Output for job {instance.id}", owner=instance.owner
-            )
-        # Save the instance with the new FileSet objects
-        Job.objects.filter(id=instance.id).update(
-            input_files=instance.input_files,
-            output_files=instance.output_files
-        )
-
-
-@receiver(post_save, sender=Job)
-def new_job_event_log(sender, instance, created, raw, using, update_fields, **kwargs):
-    if created and not raw:
-        instance.log_event("job_created", f"Job created: {instance.id}")
+    if (
+        created
+        and not raw
+        and instance.object_id
+        and instance.content_type_id == ContentType.objects.get_for_model(Job).id
+    ):
+        Job.update_latest_event(instance.object_id, [instance])
 
 
 @reversion.register()
@@ -1147,6 +1270,17 @@ class FileLocation(UUIDModel):
         return file_path
 
 
+@receiver(post_save, sender=FileLocation)
+@receiver(post_delete, sender=FileLocation)
+def filelocation_touch_file(sender, instance: FileLocation, raw=False, **kwargs):
+    """
+    A File's location is part of its representation, so changes to its
+    FileLocations update its modified_time (used for ETags).
+    """
+    if not raw:
+        File.objects.filter(id=instance.file_id).update(modified_time=timezone.now())
+
+
 @receiver(post_delete, sender=FileLocation)
 def ensure_one_default_filelocation(
     sender: typing.Type[FileLocation], instance: FileLocation, using, **kwargs
@@ -1787,21 +1921,37 @@ class File(Timestamped, UUIDModel):
     @property
     def size(self) -> Union[int, None]:
         """
-        Get the file size from metadata or via the storage class, opportunistically caching the value in metadata.
-        Assumes the file size never changes once cached.
+        Get the file size from metadata. This never does remote I/O, so it is safe
+        to use in serializers and listings. Use `laxy_backend.tasks.file.stat_files`
+        to populate sizes for many files in bulk.
 
-        Returns None if there is no size and the storage backend cannot provide one.
+        Returns None if the size isn't known, unless settings.FILE_SIZE_REMOTE_LOOKUP
+        is enabled, in which case the storage backend is queried on demand (one
+        round trip per file) and the value cached in metadata.
 
-        :return:
-        :rtype:
+        :return: The file size in bytes, or None if unknown.
+        :rtype: Union[int, None]
         """
         size = None
         if has_method(self.metadata, "get"):
             size = self.metadata.get("size", None)
+
+        if size is None and getattr(settings, "FILE_SIZE_REMOTE_LOOKUP", False):
+            size = self._size_from_storage()
+
+        return size
+
+    def _size_from_storage(self) -> Union[int, None]:
+        """
+        Query the storage backend for the file size, caching the value in metadata.
+        Assumes the file size never changes once cached.
+        """
+        size = None
+        start = time.monotonic()
         try:
-            if size is None and self.file is not None and hasattr(self.file, "size"):
-                size = int(self.file.size)
-                # set on demand
+            filelike = self.file
+            if filelike is not None and hasattr(filelike, "size"):
+                size = int(filelike.size)
                 self.metadata["size"] = size
                 self.save(update_fields=["metadata"])
         except NotImplementedError as ex:
@@ -1815,6 +1965,10 @@ class File(Timestamped, UUIDModel):
             # Decommissioned locations are no longer available to query, so we ignore those too
             pass
 
+        logger.info(
+            f"File.size remote lookup for {self.id} took "
+            f"{time.monotonic() - start:.3f}s (size: {size})"
+        )
         return size
 
     @size.setter
@@ -2165,15 +2319,22 @@ class SampleCart(Timestamped, UUIDModel):
 
     def from_csv(
         self,
-        csv_string: Union[str, Sequence],
+        csv_string: Union[str, bytes, Iterable[Sequence]],
         header=False,
         dialect="excel",
         encoding="utf-8-sig",
         comment_char="#",
         save=True,
+        resolve_names=True,
     ):
         """
-        Accepts a raw string, or a pre-parsed list-of-lists (eg from Python's csv.reader)
+        Accepts a raw string, or pre-parsed rows (eg a list-of-lists, or a lazy
+        iterator from Python's csv.reader or CSVTextParser)
+
+        File names are found with `resolve_file_names`, unless `resolve_names`
+        is False - then URLs that don't name their file are given a provisional
+        name (the last part of their path), to be resolved later (eg by the
+        `resolve_samplecart_file_names` task).
 
         CSV format:
 
@@ -2201,14 +2362,16 @@ class SampleCart(Timestamped, UUIDModel):
             csv_string = csv_string.decode(encoding)
 
         if isinstance(csv_string, str):
-            lines = list(csv.reader(csv_string.splitlines(), dialect=dialect))
-        elif isinstance(csv_string, collections.abc.Sequence):
-            lines = csv_string
+            lines = csv.reader(csv_string.splitlines(), dialect=dialect)
+        elif isinstance(csv_string, collections.abc.Iterable):
+            lines = iter(csv_string)
         else:
-            raise TypeError("csv_string must be a string or Sequence (eg list, tuple)")
+            raise TypeError(
+                "csv_string must be a string or an iterable of rows (eg list, csv.reader)"
+            )
 
         if header:  # skip header
-            lines = lines[1:]
+            next(lines, None)
 
         for line in lines:
             fields = line
@@ -2235,7 +2398,7 @@ class SampleCart(Timestamped, UUIDModel):
                 {
                     f"R{n + 1}": {
                         "location": file.strip(),
-                        "name": find_filename_and_size_from_url(file.strip())[0],
+                        "name": filename_from_url_path(file.strip(), guess=True),
                     }
                     for n, file in enumerate(fields[1:])
                 }
@@ -2252,6 +2415,49 @@ class SampleCart(Timestamped, UUIDModel):
             sample_list.append({"name": sample_name, "files": files})
 
         self.samples = sample_list
+        if resolve_names:
+            self.resolve_file_names(save=False)
+        if save:
+            self.save()
+
+    def _sample_files(self) -> Iterable[dict]:
+        for sample in self.samples:
+            for pair in sample.get("files", []):
+                for f in pair.values():
+                    if isinstance(f, dict):
+                        yield f
+
+    def unresolved_file_locations(self) -> List[str]:
+        """
+        The locations of files in the cart whose name can't be determined from
+        the URL alone (see util.filename_from_url_path).
+        """
+        return [
+            f["location"]
+            for f in self._sample_files()
+            if f.get("location") and not filename_from_url_path(f["location"])
+        ]
+
+    def set_file_names(self, names: typing.Mapping[str, str]):
+        """
+        Sets the name of each file in the cart with a location in `names`.
+
+        :param names: File names, keyed by location URL.
+        :type names: Mapping[str, str]
+        """
+        for f in self._sample_files():
+            if f.get("location") in names:
+                f["name"] = names[f["location"]]
+
+    def resolve_file_names(self, save=True, **kwargs):
+        """
+        Finds the name of each file in the cart from its location URL - see
+        util.resolve_filenames_from_urls, which `kwargs` are passed to.
+
+        :raises ValueError: If a name can't be found for a location.
+        """
+        locations = [f["location"] for f in self._sample_files() if f.get("location")]
+        self.set_file_names(resolve_filenames_from_urls(locations, **kwargs))
         if save:
             self.save()
 
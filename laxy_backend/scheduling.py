@@ -0,0 +1,254 @@
+"""
+Load-aware placement of new Jobs on ComputeResources.
+
+For each candidate ComputeResource we estimate how long a new Job would wait
+to start there, and how many of its input files would need to be transferred
+there first, and place the Job where the combined cost is lowest:
+
+- Jobs still waiting to start (queued, or submitted to the cluster but with
+  no JOB_PIPELINE_STARTING event yet) are the resource's live queue depth.
+  Each delays a new Job by about one recent start latency, shared across the
+  resource's job slots (`extra["max_jobs"]`, one if unset).
+- The recent start latency is the median time from creation to the pipeline
+  starting, for the resource's most recently created Jobs. A resource with
+  no recent history is assumed to be typical (the median of the other
+  candidates' latencies), so it is neither favoured nor avoided for it.
+- A resource with `extra["max_jobs"]` Jobs already active is full, and is only
+  used if every candidate is full.
+- Input files stored on another ComputeResource (when all of a Job's input
+  files are stored on the same one) each cost TRANSFER_COST seconds. The
+  input files may be a QuerySet (eg a Job's input FileSet), or Files with
+  just a location (eg unsaved, from a job submission's `input_files`).
+
+measure_load gathers these figures (two aggregate queries however many
+candidates there are, and a couple more for a QuerySet of input files) as
+ComputeLoads, and place_job chooses between ComputeLoads without touching the
+database, so placement can be tested with simulated resources.
+"""
+
+import logging
+import statistics
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterable, List, Optional, Sequence, Union
+
+from django.db.models import Count, Exists, F, OuterRef, QuerySet, Subquery, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import (
+    ComputeResource,
+    EventLog,
+    File,
+    Job,
+    get_compute_resource_str_for_location,
+    get_primary_compute_location_for_files,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_START_LATENCY = 60.0
+"""Assumed start latency (seconds) when no candidate has any recent history."""
+
+TRANSFER_COST = 120.0
+"""The cost (in seconds of start latency) of transferring one input file."""
+
+LATENCY_WINDOW = timedelta(days=7)
+"""Only Jobs created this recently count towards a resource's start latency."""
+
+LATENCY_SAMPLE_SIZE = 20
+"""The start latency is the median of (up to) this many recent Jobs."""
+
+ACTIVE_STATUSES = (Job.STATUS_CREATED, Job.STATUS_STARTING, Job.STATUS_RUNNING)
+
+
+@dataclass
+class ComputeLoad:
+    """The load on a ComputeResource, as seen by a Job about to be placed."""
+
+    compute: ComputeResource
+    active_jobs: int = 0
+    """Jobs created, starting or running on the resource."""
+    waiting_jobs: int = 0
+    """Active Jobs whose pipeline hasn't started yet (the live queue depth)."""
+    max_jobs: Optional[int] = None
+    """The most Jobs the resource runs at once (from extra), if limited."""
+    start_latency: Optional[float] = None
+    """Median seconds from creation to pipeline start, for recent Jobs."""
+    transfers: int = 0
+    """Input files that would need to be transferred to this resource."""
+
+    @property
+    def full(self) -> bool:
+        return self.max_jobs is not None and self.active_jobs >= self.max_jobs
+
+    def expected_start_delay(self, typical_latency=DEFAULT_START_LATENCY) -> float:
+        """
+        :param typical_latency: The start latency to assume if this resource
+                                has no recent history.
+        :type typical_latency: float
+        """
+        latency = self.start_latency
+        if latency is None:
+            latency = typical_latency
+        return latency * (1 + self.waiting_jobs / (self.max_jobs or 1))
+
+    def cost(self, typical_latency=DEFAULT_START_LATENCY) -> float:
+        return (
+            self.expected_start_delay(typical_latency) + self.transfers * TRANSFER_COST
+        )
+
+
+def _max_jobs(compute: ComputeResource) -> Optional[int]:
+    max_jobs = (compute.extra or {}).get("max_jobs", None)
+    if max_jobs is None:
+        return None
+    try:
+        return max(int(max_jobs), 1)
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring invalid max_jobs for ComputeResource {compute.id}")
+        return None
+
+
+def measure_load(
+    candidates: Sequence[ComputeResource],
+    input_files: Union[QuerySet, Iterable[File], None] = None,
+) -> List[ComputeLoad]:
+    """
+    Measure the current load on some ComputeResources (and the transfers
+    `input_files` would need to reach each of them).
+
+    :param candidates: The ComputeResources a Job could be placed on.
+    :type candidates: Sequence[ComputeResource]
+    :param input_files: The Job's input Files, if any.
+    :type input_files: Union[QuerySet, Iterable[File], None]
+    :return: A ComputeLoad for each candidate, in the same order.
+    :rtype: List[ComputeLoad]
+    """
+    ids = [c.id for c in candidates]
+    pipeline_started = EventLog.objects.filter(
+        object_id=OuterRef("id"), event="JOB_PIPELINE_STARTING"
+    )
+
+    active = (
+        Job.objects.filter(compute_resource__in=ids, status__in=ACTIVE_STATUSES)
+        .values("compute_resource")
+        .annotate(
+            active=Count("id"),
+            waiting=Count("id", filter=~Exists(pipeline_started)),
+        )
+    )
+    counts = {row["compute_resource"]: row for row in active}
+
+    # The most recent LATENCY_SAMPLE_SIZE started Jobs on each resource (so
+    # a busy resource doesn't crowd the others out of the sample)
+    latencies = defaultdict(list)
+    recent = (
+        Job.objects.filter(
+            compute_resource__in=ids,
+            created_time__gte=timezone.now() - LATENCY_WINDOW,
+        )
+        .annotate(
+            started_time=Subquery(
+                pipeline_started.order_by("timestamp").values("timestamp")[:1]
+            )
+        )
+        .filter(started_time__isnull=False)
+        .annotate(
+            recency=Window(
+                RowNumber(),
+                partition_by=F("compute_resource"),
+                order_by=F("created_time").desc(),
+            )
+        )
+        .filter(recency__lte=LATENCY_SAMPLE_SIZE)
+        .values_list("compute_resource", "created_time", "started_time")
+    )
+    for compute_id, created_time, started_time in recent:
+        latency = (started_time - created_time).total_seconds()
+        latencies[compute_id].append(max(latency, 0.0))
+
+    # Inputs all stored on one ComputeResource need transferring to any other
+    stored_at_id = None
+    n_input_files = 0
+    if isinstance(input_files, QuerySet):
+        n_input_files = input_files.count()
+        if n_input_files:
+            stored_at = get_primary_compute_location_for_files(input_files)
+            stored_at_id = stored_at.id if stored_at is not None else None
+    elif input_files is not None:
+        # (by ID, so a Job with many input files doesn't fetch the
+        # ComputeResource for each)
+        locations = [f.location for f in input_files]
+        compute_ids = {get_compute_resource_str_for_location(l) for l in locations}
+        n_input_files = len(locations)
+        if len(compute_ids) == 1:
+            stored_at_id = compute_ids.pop()
+
+    loads = []
+    for compute in candidates:
+        row = counts.get(compute.id, {})
+        samples = latencies.get(compute.id, None)
+        loads.append(
+            ComputeLoad(
+                compute=compute,
+                active_jobs=row.get("active", 0),
+                waiting_jobs=row.get("waiting", 0),
+                max_jobs=_max_jobs(compute),
+                start_latency=statistics.median(samples) if samples else None,
+                transfers=(
+                    n_input_files
+                    if stored_at_id is not None and stored_at_id != compute.id
+                    else 0
+                ),
+            )
+        )
+    return loads
+
+
+def place_job(loads: Sequence[ComputeLoad]) -> Optional[ComputeLoad]:
+    """
+    Choose where to place a Job: the ComputeResource with the lowest cost
+    (expected start delay, plus transfers), preferring any that aren't full.
+    Ties go to the highest priority resource, then the first candidate.
+    Resources with no recent history are costed with the median start latency
+    of the others (or DEFAULT_START_LATENCY if none have any).
+
+    :param loads: The load on each candidate ComputeResource.
+    :type loads: Sequence[ComputeLoad]
+    :return: The chosen ComputeLoad, or None if there are no candidates.
+    :rtype: Optional[ComputeLoad]
+    """
+    available = [load for load in loads if not load.full] or list(loads)
+    if not available:
+        return None
+    known = [load.start_latency for load in loads if load.start_latency is not None]
+    typical_latency = statistics.median(known) if known else DEFAULT_START_LATENCY
+    return min(
+        available,
+        key=lambda load: (load.cost(typical_latency), -(load.compute.priority or 0)),
+    )
+
+
+def choose_compute_resource(
+    candidates: Sequence[ComputeResource],
+    input_files: Union[QuerySet, Iterable[File], None] = None,
+) -> Optional[ComputeResource]:
+    """
+    Choose the ComputeResource (from `candidates`) a new Job will start on
+    soonest, and reach its `input_files` with the fewest transfers.
+
+    :param candidates: The ComputeResources the Job may be placed on.
+    :type candidates: Sequence[ComputeResource]
+    :param input_files: The Job's input Files, if any.
+    :type input_files: Union[QuerySet, Iterable[File], None]
+    :return: The chosen ComputeResource, or None if there are no candidates.
+    :rtype: Optional[ComputeResource]
+    """
+    if len(candidates) < 2:
+        # No choice to make, so no need to measure anything
+        return candidates[0] if candidates else None
+
+    chosen = place_job(measure_load(candidates, input_files))
+    return chosen.compute if chosen is not None else None
@@ -2,7 +2,7 @@ import logging
 import os
 import re
 from fnmatch import fnmatch
-from typing import List, Optional, Pattern, Union
+from typing import Iterator, List, Optional, Pattern, Tuple, Union
 from contextlib import closing
 from urllib.parse import (
     urljoin,
@@ -14,8 +14,10 @@ from urllib.parse import (
     quote_plus,
 )
 from pathlib import Path
+from posixpath import join as join_path
 import asyncio
 import concurrent.futures
+import time
 import requests
 from bs4 import BeautifulSoup
 from webdav4.client import Client as WebDAVClient
@@ -23,6 +25,7 @@ from webdav4.client import Client as WebDAVClient
 from django.conf import settings
 
 from ..storage.http_remote import is_archive_link
+from .crawl import DirectoryCrawler, WebDAVLister
 
 logger = logging.getLogger(__name__)
 
@@ -131,43 +134,75 @@ SPLASH_HOST = getattr(settings, "WEB_SCRAPER_SPLASH_HOST", "http://localhost:805
 
 
 def render_page(url: str, backend=None) -> str:
+    """
+    Fetch (render) the page at `url` via the worker pool of the process
+    RenderService (see laxy_backend.scraping.render_service).
+
+    :raises TimeoutError: If the page takes longer than WEB_SCRAPER_TIMEOUT to fetch.
+    :raises MemoryError: If the page is too large.
+    :raises ValueError: If the page doesn't look like text.
+    """
+    from .render_service import get_render_service
+
     if backend is None:
         backend = BACKEND
 
-    if backend == "simple":
-        return render_simple(url)
-    elif backend == "splash":
-        return render_with_splash(url)
-    # elif backend == 'pyppeteer':
-    #     return render_with_pyppeteer(url)
-    else:
-        raise ValueError(f"Unknown HTML rendering backend: {backend}")
+    return get_render_service().render(url, backend=backend)
+
 
+# Large reads keep the per-chunk overhead low for huge index pages
+RENDER_CHUNK_SIZE = 256 * 1024
 
-def render_simple(url: str, max_size: int = 10 * 1024 * 1024):
+
+def render_simple(
+    url: str,
+    max_size: int = 10 * 1024 * 1024,
+    session: Optional[requests.Session] = None,
+    timeout=None,
+    deadline: Optional[float] = None,
+):
+    """
+    Fetch the page at `url` with a plain GET request.
+
+    :param max_size: Raise MemoryError if the page is larger than this (in bytes).
+    :type max_size: int
+    :param session: The session to make the request with (eg with pooled
+                    connections), otherwise `request_with_retries` is used.
+    :type session: requests.Session
+    :param timeout: The requests (connect, read) timeout.
+    :type timeout: float | tuple
+    :param deadline: A time.monotonic() time to raise TimeoutError after,
+                     if the whole page hasn't arrived.
+    :type deadline: float
+    :return: The page text.
+    :rtype: str
+    """
     from ..tasks.download import request_with_retries
 
-    try:
-        with closing(request_with_retries("GET", url, allow_redirects=True)) as resp:
-            resp.raise_for_status()
+    if session is not None:
+        resp = session.get(url, allow_redirects=True, stream=True, timeout=timeout)
+    else:
+        resp = request_with_retries(
+            "GET", url, allow_redirects=True, stream=True, timeout=timeout
+        )
 
-            text = []
-            chunk_size = 1024
-            size = 0
-            for chunk in resp.iter_content(chunk_size=chunk_size, decode_unicode=True):
-                text.append(chunk)
-                size += chunk_size
-                if size > max_size:
-                    raise MemoryError(f"File is too large (> {max_size} bytes)")
+    with closing(resp):
+        resp.raise_for_status()
+        # requests finds no text encoding for non-text Content-Types
+        if resp.encoding is None:
+            raise ValueError(f"File doesn't look like sane HTML")
 
-            try:
-                text = "".join(text)
-                return text
-            except TypeError as ex:
-                raise ValueError(f"File doesn't look like sane HTML")
+        chunks = []
+        size = 0
+        for chunk in resp.iter_content(chunk_size=RENDER_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise MemoryError(f"File is too large (> {max_size} bytes)")
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out fetching {url}")
+            chunks.append(chunk)
 
-    except BaseException as e:
-        raise e
+        return b"".join(chunks).decode(resp.encoding, errors="replace")
 
 
 def render_with_splash(
@@ -471,6 +506,53 @@ def _parse_nextcloud_webdav_legacy(text: Union[str, None] = None, url=None) -> L
     return links
 
 
+def crawl_nextcloud_share(
+    url: str, **crawler_kwargs
+) -> Tuple[DirectoryCrawler, Iterator[List[dict]]]:
+    """
+    Crawl an ownCloud/Nextcloud public share via the new-style
+    /public.php/dav/files/{token}/ WebDAV endpoint (Nextcloud 29+).
+
+    :param url: The public share URL (eg https://somenextcloud.net/s/lnSmyyug1fexY8l?path=/subdir)
+    :type url: str
+    :param crawler_kwargs: Passed to DirectoryCrawler (eg max_depth, max_entries).
+    :return: The crawler, and an iterator of listings (lists of dicts describing
+             the files and directories), one per directory as it is listed.
+    :rtype: Tuple[DirectoryCrawler, Iterator[List[dict]]]
+    """
+    base_url, share_id, path, last_dir_in_path, up_dir = _parse_nextcloud_share_url(url)
+
+    lister = WebDAVLister(f"{base_url}/public.php/dav/files/{share_id}/")
+    crawler = DirectoryCrawler(lister, **crawler_kwargs)
+
+    def _to_links(entries: List[dict]) -> List[dict]:
+        links = []
+        for entry in entries:
+            name = join_path(entry["path"], entry["name"])
+            if entry["type"] == "directory":
+                full_path = join_path(path, name)
+                links.append(
+                    dict(
+                        type="directory",
+                        name=name,
+                        location=f"{base_url}/s/{share_id}?path=/{quote(full_path)}",
+                        tags=[],
+                    )
+                )
+            else:
+                links.append(
+                    dict(
+                        type="file",
+                        name=name,
+                        location=entry["location"],
+                        tags=["archive"] if is_archive_link(entry["name"]) else [],
+                    )
+                )
+        return links
+
+    return crawler, (_to_links(entries) for entries in crawler.crawl(path))
+
+
 def parse_nextcloud_webdav(text: Union[str, None] = None, url=None) -> List[dict]:
     """
     Return the file and directory listing for a ownCloud/Nextcloud WebDAV shared link.
@@ -478,6 +560,7 @@ def parse_nextcloud_webdav(text: Union[str, None] = None, url=None) -> List[dict
 
     Uses the new-style /public.php/dav/files/{token}/ endpoint (Nextcloud 29+),
     falling back to the legacy /public.php/webdav/ endpoint for older instances.
+    New-style listings are cached, and reused while the directory's ETag is unchanged.
 
     :param text: Unused, included for link parser plugin compatibility.
     :type text: str
@@ -489,9 +572,8 @@ def parse_nextcloud_webdav(text: Union[str, None] = None, url=None) -> List[dict
     base_url, share_id, path, last_dir_in_path, up_dir = _parse_nextcloud_share_url(url)
 
     try:
-        webdav_server = f"{base_url}/public.php/dav/files/{share_id}/"
-        client = WebDAVClient(webdav_server)
-        ls = client.ls(path, detail=False)
+        _, listings = crawl_nextcloud_share(url, max_depth=1)
+        ls = [link for listing in listings for link in listing]
     except Exception as e:
         logger.info(
             f"New-style Nextcloud WebDAV endpoint failed for {url}, "
@@ -511,30 +593,6 @@ def parse_nextcloud_webdav(text: Union[str, None] = None, url=None) -> List[dict
                 tags=[],
             )
         )
-    for name in ls:
-        if name == last_dir_in_path:
-            continue
-
-        if name.endswith("/"):
-            name = name.rstrip("/")
-            full_path = os.path.join(path, name)
-            links.append(
-                dict(
-                    type="directory",
-                    name=name,
-                    location=f"{base_url}/s/{share_id}?path=/{quote(full_path)}",
-                    tags=[],
-                )
-            )
-        else:
-            full_path = f"{path}/{name}" if path else name
-            links.append(
-                dict(
-                    type="file",
-                    name=name,
-                    location=f"{base_url}/public.php/dav/files/{share_id}/{quote(full_path, safe='/')}",
-                    tags=["archive"] if is_archive_link(name) else [],
-                )
-            )
+    links.extend(ls)
 
     return links
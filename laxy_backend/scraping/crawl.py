@@ -0,0 +1,357 @@
+"""
+Concurrent, bounded-depth listing of remote directory trees (FTP and WebDAV),
+for RemoteBrowseView.
+
+A DirectoryCrawler lists several directories at a time, breadth first, over a
+small pool of connections per host, yielding each directory's entries as they
+arrive. Listings are cached per directory along with a validator (the
+directory's ETag or modification time), so an unchanged directory is checked
+with one small request rather than listed again.
+"""
+
+import hashlib
+import logging
+import queue
+import threading
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from posixpath import join as join_path, normpath
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from fs.errors import RemoteConnectionError
+from fs.ftpfs import FTPFS
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+FTP_CONNECTIONS_PER_HOST = 4
+"""The most FTP connections kept open (and used at once) per host."""
+
+LISTING_CACHE_TIMEOUT = 24 * 60 * 60
+
+_PROPFIND_BODY = """<?xml version="1.0" encoding="UTF-8"?>
+<d:propfind xmlns:d="DAV:">
+  <d:prop>
+    <d:resourcetype/><d:getetag/><d:getlastmodified/><d:getcontentlength/>
+  </d:prop>
+</d:propfind>"""
+
+_DAV = "{DAV:}"
+
+
+def listing_cache():
+    """The cache for remote directory listings (and RemoteBrowseView result pages)."""
+    alias = "remote-browse" if "remote-browse" in settings.CACHES else "default"
+    return caches[alias]
+
+
+class FTPLister:
+    """
+    Lists directories on an FTP server, via a pool of (pyfilesystem) FTPFS
+    connections shared by all FTPListers for the same host and user.
+    """
+
+    _pools: Dict[tuple, "queue.LifoQueue[FTPFS]"] = {}
+    _open_counts: Dict[tuple, int] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, url: str, timeout: int = 30):
+        u = urlparse(url)
+        self.url = url
+        self.host = u.hostname
+        self.port = u.port or 21
+        self.user = unquote(u.username) if u.username else "anonymous"
+        self.passwd = unquote(u.password) if u.password else ""
+        self.path = normpath(unquote(u.path) or "/")
+        self.timeout = timeout
+        self._key = (self.host, self.port, self.user, self.passwd)
+
+    def location(self, path: str) -> str:
+        u = urlparse(self.url)
+        return u._replace(path=quote(path), params="", query="", fragment="").geturl()
+
+    @contextmanager
+    def _connection(self):
+        with self._pools_lock:
+            pool = self._pools.setdefault(self._key, queue.LifoQueue())
+            try:
+                ftp_fs = pool.get_nowait()
+            except queue.Empty:
+                ftp_fs = None
+                if self._open_counts.get(self._key, 0) < FTP_CONNECTIONS_PER_HOST:
+                    self._open_counts[self._key] = (
+                        self._open_counts.get(self._key, 0) + 1
+                    )
+                    ftp_fs = FTPFS(
+                        self.host,
+                        port=self.port,
+                        user=self.user,
+                        passwd=self.passwd,
+                        timeout=self.timeout,
+                    )
+        if ftp_fs is None:
+            ftp_fs = pool.get(timeout=self.timeout)
+
+        try:
+            yield ftp_fs
+        except RemoteConnectionError:
+            # Don't return a broken connection to the pool
+            with self._pools_lock:
+                self._open_counts[self._key] -= 1
+            ftp_fs.close()
+            raise
+        except BaseException:
+            pool.put(ftp_fs)
+            raise
+        else:
+            pool.put(ftp_fs)
+
+    def _with_retry(self, fn):
+        # An idle pooled connection may have been dropped by the server
+        try:
+            with self._connection() as ftp_fs:
+                return fn(ftp_fs)
+        except RemoteConnectionError:
+            with self._connection() as ftp_fs:
+                return fn(ftp_fs)
+
+    def validator(self, path: str) -> Optional[str]:
+        info = self._with_retry(lambda ftp_fs: ftp_fs.getinfo(path, ["details"]))
+        return info.modified.isoformat() if info.modified else None
+
+    def list_dir(self, path: str) -> List[dict]:
+        def _scandir(ftp_fs):
+            return list(ftp_fs.scandir(path, namespaces=["details"]))
+
+        return [
+            dict(
+                name=info.name,
+                type="directory" if info.is_dir else "file",
+                size=None if info.is_dir else info.size,
+                validator=info.modified.isoformat() if info.modified else None,
+            )
+            for info in self._with_retry(_scandir)
+        ]
+
+
+class WebDAVLister:
+    """
+    Lists collections on a WebDAV server with PROPFIND requests, over a session
+    shared by all WebDAVListers (so connections are pooled and kept alive per host).
+    """
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    def __init__(self, root_url: str, auth=None, timeout=(5, 30)):
+        """
+        :param root_url: The WebDAV root, eg https://nextcloud.example.com/public.php/dav/files/{token}/
+        :type root_url: str
+        :param auth: A requests auth, eg (username, password)
+        :type auth: tuple
+        """
+        self.root_url = root_url.rstrip("/") + "/"
+        self.auth = auth
+        self.timeout = timeout
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        with cls._session_lock:
+            if cls._session is None:
+                cls._session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=FTP_CONNECTIONS_PER_HOST)
+                cls._session.mount("http://", adapter)
+                cls._session.mount("https://", adapter)
+            return cls._session
+
+    def location(self, path: str) -> str:
+        return self.root_url + quote(path.strip("/"), safe="/")
+
+    def _propfind(self, path: str, depth: int) -> List[Tuple[str, dict]]:
+        url = self.location(path)
+        if not url.endswith("/"):
+            url += "/"
+        resp = self.session().request(
+            "PROPFIND",
+            url,
+            data=_PROPFIND_BODY.encode("utf-8"),
+            headers={"Depth": str(depth), "Content-Type": "application/xml"},
+            auth=self.auth,
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+
+        responses = []
+        for response in ElementTree.fromstring(resp.content).iter(f"{_DAV}response"):
+            href = unquote(urlparse(response.findtext(f"{_DAV}href", "")).path)
+            props = {}
+            for propstat in response.iter(f"{_DAV}propstat"):
+                if " 200 " not in (propstat.findtext(f"{_DAV}status") or " 200 "):
+                    continue
+                for prop in propstat.iter(f"{_DAV}prop"):
+                    for child in prop:
+                        props[child.tag[len(_DAV) :]] = child
+            responses.append((href, props))
+        return responses
+
+    @staticmethod
+    def _validator(props: dict) -> Optional[str]:
+        for name in ("getetag", "getlastmodified"):
+            if name in props and props[name].text:
+                return props[name].text.strip()
+        return None
+
+    def validator(self, path: str) -> Optional[str]:
+        for _, props in self._propfind(path, depth=0):
+            return self._validator(props)
+        return None
+
+    def list_dir(self, path: str) -> List[dict]:
+        collection = urlparse(self.location(path)).path.rstrip("/")
+        entries = []
+        for href, props in self._propfind(path, depth=1):
+            if unquote(collection) == href.rstrip("/"):
+                continue
+            is_dir = (
+                "resourcetype" in props
+                and props["resourcetype"].find(f"{_DAV}collection") is not None
+            )
+            size = props.get("getcontentlength", None)
+            entries.append(
+                dict(
+                    name=href.rstrip("/").rsplit("/", 1)[-1],
+                    type="directory" if is_dir else "file",
+                    size=int(size.text) if size is not None and size.text else None,
+                    validator=self._validator(props),
+                )
+            )
+        return entries
+
+
+class DirectoryCrawler:
+    """
+    Lists a directory tree breadth first, up to `max_depth` levels and
+    `max_entries` entries, several directories at a time.
+
+    ```
+    crawler = DirectoryCrawler(FTPLister(url), max_depth=2)
+    for entries in crawler.crawl("/vol1/run1"):
+        ...
+    ```
+
+    Each entry is a dict with `path` (the directory containing it, relative to
+    the crawled path), `name`, `type` ('file' or 'directory'), `size` and
+    `location` (its URL).
+    """
+
+    def __init__(
+        self,
+        lister,
+        max_depth: int = 1,
+        max_entries: int = 10000,
+        max_workers: int = FTP_CONNECTIONS_PER_HOST,
+        use_cache: bool = True,
+    ):
+        self.lister = lister
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        # Set once a crawl stops at max_entries
+        self.truncated = False
+
+    def _cache_key(self, path: str) -> str:
+        location = self.lister.location(path)
+        return f"remote-listing:{hashlib.sha1(location.encode()).hexdigest()}"
+
+    def list_dir(
+        self, path: str, validator: Optional[str] = None
+    ) -> Tuple[List[dict], bool]:
+        """
+        The entries of one directory, from the cache if its validator is
+        unchanged. `validator` is the directory's validator if already known
+        (eg from a fresh listing of its parent).
+
+        :return: The entries, and True if they were listed (not cached).
+        :rtype: Tuple[List[dict], bool]
+        """
+        if not self.use_cache:
+            return self.lister.list_dir(path), True
+
+        cache = listing_cache()
+        key = self._cache_key(path)
+        cached = cache.get(key, None)
+        # Found before listing, so a change during listing isn't missed next time
+        if validator is None:
+            validator = self.lister.validator(path)
+        if cached is not None and validator is not None:
+            if cached["validator"] == validator:
+                return cached["entries"], False
+
+        entries = self.lister.list_dir(path)
+        if validator is not None:
+            cache.set(
+                key,
+                {"validator": validator, "entries": entries},
+                timeout=LISTING_CACHE_TIMEOUT,
+            )
+        return entries, True
+
+    def crawl(self, path: str) -> Iterator[List[dict]]:
+        """
+        Yield the entries of each directory as it is listed.
+        """
+        self.truncated = False
+        total = 0
+        pool = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="laxy-crawl"
+        )
+        pending = {}
+
+        def _submit(relpath: str, depth: int, validator=None):
+            future = pool.submit(self.list_dir, join_path(path, relpath), validator)
+            pending[future] = (relpath, depth)
+
+        try:
+            _submit("", 1)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    relpath, depth = pending.pop(future)
+                    entries, fresh = future.result()
+
+                    entries = [
+                        dict(
+                            entry,
+                            path=relpath,
+                            location=self.lister.location(
+                                join_path(path, relpath, entry["name"])
+                            ),
+                        )
+                        for entry in entries[: self.max_entries - total]
+                    ]
+                    total += len(entries)
+                    yield entries
+
+                    if total >= self.max_entries:
+                        self.truncated = True
+                        return
+
+                    if depth < self.max_depth:
+                        for entry in entries:
+                            if entry["type"] == "directory":
+                                # A cached parent may hold stale validators for
+                                # its subdirectories, so those are checked
+                                _submit(
+                                    join_path(relpath, entry["name"]),
+                                    depth + 1,
+                                    entry.get("validator") if fresh else None,
+                                )
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
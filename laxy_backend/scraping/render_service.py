@@ -0,0 +1,159 @@
+"""
+A small pool of worker threads that fetch (render) remote pages for
+RemoteBrowseView, outside of request threads.
+
+Pages are fetched over a shared requests.Session, so connections to each host
+are pooled and kept alive between renders. Each render has a time limit (and
+each host a connect/read timeout), and concurrent renders of the same URL share
+a single fetch.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST_TIMEOUT = (5, 30)
+"""The (connect, read) timeout in seconds for hosts not in WEB_SCRAPER_HOST_TIMEOUTS."""
+
+
+class RenderService:
+    def __init__(
+        self,
+        max_workers: int = 4,
+        timeout: float = 60,
+        host_timeouts: Optional[Dict[str, Sequence[float]]] = None,
+        default_host_timeout: Tuple[float, float] = DEFAULT_HOST_TIMEOUT,
+    ):
+        """
+        :param max_workers: The number of pages that can be fetched at once.
+        :type max_workers: int
+        :param timeout: The time limit (in seconds) to fetch a whole page.
+        :type timeout: float
+        :param host_timeouts: (connect, read) timeouts in seconds, keyed by hostname.
+        :type host_timeouts: dict
+        :param default_host_timeout: The (connect, read) timeout for other hosts.
+        :type default_host_timeout: tuple
+        """
+        self.timeout = timeout
+        self.host_timeouts = host_timeouts or {}
+        self.default_host_timeout = default_host_timeout
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="laxy-render"
+        )
+        # Retry failed connections, and 502s (common while a reverse proxied
+        # server restarts), but not slow reads - the read timeout is raised as is
+        retries = Retry(
+            total=False,
+            connect=2,
+            read=False,
+            status=2,
+            status_forcelist=[502],
+            backoff_factor=0.5,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=max_workers, max_retries=retries)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._in_flight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def host_timeout(self, url: str) -> Tuple[float, float]:
+        host = urlparse(url).hostname
+        return tuple(self.host_timeouts.get(host, self.default_host_timeout))
+
+    def submit(self, url: str, backend: str = "simple") -> Future:
+        """
+        Start rendering a page in the worker pool, or join a render of the same
+        page that is already underway.
+
+        :return: A Future for the page text.
+        :rtype: concurrent.futures.Future
+        """
+        key = (backend, url)
+        with self._lock:
+            future = self._in_flight.get(key, None)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._render, url, backend)
+            self._in_flight[key] = future
+
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def render(self, url: str, backend: str = "simple") -> str:
+        """
+        Render a page, waiting at most `timeout` seconds.
+
+        :raises TimeoutError: If the page takes longer than `timeout` to fetch.
+        """
+        return self.submit(url, backend).result(timeout=self.timeout)
+
+    async def render_async(self, url: str, backend: str = "simple") -> str:
+        """
+        Like `render`, for async views (the page is still fetched by the pool).
+        """
+        return await asyncio.wait_for(
+            asyncio.wrap_future(self.submit(url, backend)), timeout=self.timeout
+        )
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+        self.session.close()
+
+    def _forget(self, key: Tuple[str, str], future: Future):
+        with self._lock:
+            if self._in_flight.get(key, None) is future:
+                del self._in_flight[key]
+
+    def _render(self, url: str, backend: str) -> str:
+        from . import render_simple, render_with_splash
+
+        deadline = time.monotonic() + self.timeout
+        if backend == "simple":
+            return render_simple(
+                url,
+                session=self.session,
+                timeout=self.host_timeout(url),
+                deadline=deadline,
+            )
+        elif backend == "splash":
+            return render_with_splash(url, timeout=self.timeout)
+        # elif backend == 'pyppeteer':
+        #     return render_with_pyppeteer(url)
+        else:
+            raise ValueError(f"Unknown HTML rendering backend: {backend}")
+
+
+_render_service: Optional[RenderService] = None
+_render_service_lock = threading.Lock()
+
+
+def get_render_service() -> RenderService:
+    """
+    The RenderService for this process, configured by the WEB_SCRAPER_* settings.
+    It's created on first use, so each (forked) web worker gets its own.
+    """
+    global _render_service
+    with _render_service_lock:
+        if _render_service is None:
+            _render_service = RenderService(
+                max_workers=getattr(settings, "WEB_SCRAPER_WORKERS", 4),
+                timeout=getattr(settings, "WEB_SCRAPER_TIMEOUT", 60),
+                host_timeouts=getattr(settings, "WEB_SCRAPER_HOST_TIMEOUTS", {}),
+            )
+        return _render_service
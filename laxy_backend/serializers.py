@@ -258,7 +258,7 @@ class FileBulkRegisterSerializer(FileSerializer):
         fields = ("name", "path", "location", "checksum", "type_tags", "metadata")
 
     def to_internal_value(self, data):
-        if isinstance(data.get("type_tags", ""), str):
+        if isinstance(data.get("type_tags", None), str):
             data["type_tags"] = data["type_tags"].replace(" ", "").split(",")
         if "filepath" in data:
             data["name"] = Path(data["filepath"]).name
@@ -457,7 +457,8 @@ class JobSerializerBase(BaseModelSerializer):
 
     class Meta:
         model = models.Job
-        fields = "__all__"
+        # latest_eventlog is internal; list views expose latest_event instead
+        exclude = ("latest_eventlog",)
         # not actually required for id since editable=False on model
         read_only_fields = ("id",)
         depth = 0
@@ -478,6 +479,7 @@ class JobSerializerResponse(JobSerializerBase):
         exclude = (
             "input_files",
             "output_files",
+            "latest_eventlog",
         )
         depth = 0
         error_status_codes = status_codes()
@@ -500,7 +502,7 @@ class JobListSerializerResponse(JobSerializerResponse):
 
     class Meta:
         model = models.Job
-        exclude = ("input_files", "output_files")
+        exclude = ("input_files", "output_files", "latest_eventlog")
         depth = 0
         error_status_codes = status_codes()
 
@@ -618,50 +620,46 @@ class JobSerializerRequest(JobSerializerBase):
         # flat id - unwrap it.
         if isinstance(compute_resource_id, dict):
             compute_resource_id = compute_resource_id.get("id")
-        job = models.Job.objects.create(**validated_data)
-        job = self._set_owner(job)
+        # Used when no compute_resource is given (eg passed by the view via
+        # serializer.save(default_compute_resource=...))
+        default_compute_resource = validated_data.pop("default_compute_resource", None)
+
+        # The Job is fully populated before it's saved, so it's inserted
+        # (along with its FileSets) once, rather than inserted then updated
+        job = self._set_owner(models.Job(**validated_data))
 
         if compute_resource_id:
-            compute = models.ComputeResource.objects.get(id=compute_resource_id)
-            job.compute_resource = compute
+            job.compute_resource = models.ComputeResource.objects.get(
+                id=compute_resource_id
+            )
+        else:
+            job.compute_resource = default_compute_resource
 
         # We create new file objects if the input file in the list has
         # details other than the id set. If only the id is set, we assume
         # it's an existing file and use that. If an input_fileset id is provided
         # we ignore anything in input_files and just use the specified FileSet.
-        if not input_fileset_id:
-            ifileset = job.input_files
-            if not ifileset:
-                ifileset = models.FileSet.objects.create(name="input", owner=job.owner)
-            ifileset.name = f"Input files for job: {job.id}"
-            for f in input_files_data:
-                f_id = f.get("id", None)
-                if not f_id:
-                    input_file = models.File.objects.create(**f)
-                else:
-                    input_file = models.File.objects.get(id=f_id)
-
-                ifileset.add(input_file)
-
-            ifileset.save()
-        else:
+        if input_fileset_id:
             if input_files_data:
                 raise serializers.ValidationError(
                     "You should only specify an "
                     "input_fileset ID or a list "
                     "of input_files, not both."
                 )
-            ifileset = models.FileSet.objects.get(id=input_fileset_id)
+            job.input_files = models.FileSet.objects.get(id=input_fileset_id)
 
-        job.input_files = ifileset
+        job.save()
 
-        if not job.output_files:
-            job.output_files = models.FileSet.objects.create(
-                name=f"Output files for job: {job.id}", owner=job.owner
-            )
-            job.output_files.save()
+        if input_files_data:
+            input_files = []
+            for f in input_files_data:
+                f_id = f.get("id", None)
+                if not f_id:
+                    input_files.append(models.File.objects.create(**f))
+                else:
+                    input_files.append(models.File.objects.get(id=f_id))
 
-        job.save()
+            job.input_files.add(input_files)
 
         return job
 
@@ -790,6 +788,21 @@ class JobEventLogSerializer(EventLogSerializer):
         error_status_codes = status_codes()
 
 
+class JobEventLogBatchItemSerializer(EventLogSerializer):
+    """
+    One event in a batch sent by a running job. Unlike JobEventLogSerializer,
+    an optional `timestamp` (when the event happened on the compute node) is
+    accepted, so events keep their order however they were batched.
+    """
+
+    class Meta:
+        model = models.EventLog
+        fields = ("event", "message", "extra", "timestamp")
+        extra_kwargs = {"timestamp": {"required": False}}
+        depth = 0
+        error_status_codes = status_codes()
+
+
 class FileListingItem(serializers.Serializer):
     name = serializers.CharField(required=True)
     location = serializers.URLField(required=True)
@@ -799,6 +812,10 @@ class FileListingItem(serializers.Serializer):
 
 class FileListing(serializers.Serializer):
     listing = FileListingItem(many=True)
+    truncated = serializers.BooleanField(default=False)
+    # Only when paged (RemoteBrowseView page_size / cursor)
+    count = serializers.IntegerField(required=False)
+    next = serializers.CharField(required=False, allow_null=True)
 
 
 class LoginRequestSerializer(serializers.Serializer):
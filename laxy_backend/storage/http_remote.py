@@ -1,7 +1,11 @@
+import hashlib
+import io
 import logging
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 from pathlib import Path
-from typing import List, Tuple, Pattern, Union, Dict
+from typing import Callable, List, Optional, Tuple, Pattern, Union, Dict
 from collections import defaultdict
 import urllib
 from urllib.parse import urljoin, urlparse
@@ -12,10 +16,97 @@ from requests import HTTPError, Response
 import magic  # python-magic
 from cache_memoize import cache_memoize
 
+from django.conf import settings
+from django.core.cache import caches
+
 from laxy_backend.tasks.download import request_with_retries
 
 logger = logging.getLogger(__name__)
 
+ARCHIVE_CACHE_TIMEOUT = 24 * 60 * 60
+"""
+Seconds to cache archive introspection results. They are keyed by the remote
+file's validator, so a changed file is introspected again regardless.
+"""
+
+HEAD_CACHE_TIMEOUT = 60
+"""Seconds to reuse a HEAD response (and so a file's validator) before checking again."""
+
+TAR_BLOCK_SIZE = 512
+
+_CACHE_MISS = object()
+
+
+def _introspection_cache():
+    alias = 'remote-browse' if 'remote-browse' in settings.CACHES else 'default'
+    return caches[alias]
+
+
+def _cache_key(kind: str, *parts: str) -> str:
+    digest = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+    return f'remote-archive:{kind}:{digest}'
+
+
+def remote_file_head(url: str) -> Dict[str, Union[str, int, bool, None]]:
+    """
+    HEAD an HTTP(S) URL, following redirects. Responses are reused for
+    HEAD_CACHE_TIMEOUT seconds.
+
+    :param url: The URL of interest
+    :type url: str
+    :return: The final `url` (after redirects), `content_length`, `content_type`,
+             `accept_ranges` (True if Range requests are supported) and a `validator`
+             (from the ETag or Last-Modified header, and the Content-Length) that
+             changes when the file does - None if the server doesn't send one.
+    :rtype: dict
+    :raises requests.HTTPError: If the HEAD request fails.
+    """
+    cache = _introspection_cache()
+    key = _cache_key('head', url)
+    head = cache.get(key, None)
+    if head is not None:
+        return head
+
+    with closing(request_with_retries('HEAD', url, allow_redirects=True)) as resp:
+        resp.raise_for_status()
+        content_length = resp.headers.get('content-length', '')
+        validator = resp.headers.get('etag', None) or resp.headers.get('last-modified', None)
+        head = {
+            'url': resp.url,
+            'content_length': int(content_length) if content_length.isdigit() else None,
+            'content_type': resp.headers.get('content-type', '').split(';')[0].strip(),
+            'accept_ranges': resp.headers.get('accept-ranges', '').strip().lower() == 'bytes',
+            'validator': f'{validator}|{content_length}' if validator else None,
+        }
+
+    cache.set(key, head, timeout=HEAD_CACHE_TIMEOUT)
+    return head
+
+
+def _cached_by_validator(kind: str, url: str, fn: Callable):
+    """
+    Return `fn()`, cached by `url` and the current validator of the remote file.
+    Results for FTP URLs, or for files without an ETag or Last-Modified header,
+    aren't cached.
+    """
+    validator = None
+    if urlparse(url).scheme in ['http', 'https']:
+        try:
+            validator = remote_file_head(url)['validator']
+        except HTTPError as ex:
+            # Some servers refuse HEAD requests, but will serve a GET
+            logger.debug(f'Unable to find a validator for {url}: {ex}')
+    if validator is None:
+        return fn()
+
+    cache = _introspection_cache()
+    key = _cache_key(kind, url, validator)
+    result = cache.get(key, _CACHE_MISS)
+    if result is _CACHE_MISS:
+        result = fn()
+        cache.set(key, result, timeout=ARCHIVE_CACHE_TIMEOUT)
+    return result
+
 
 # @cache_memoize(timeout=1*60*60)
 def is_archive_link(url: str, content_head: bytes = None, use_network=False) -> bool:
@@ -29,13 +120,14 @@ def is_archive_link(url: str, content_head: bytes = None, use_network=False) ->
     :type content_head: bytes
     :param use_network: If we can't guess from the filename or content head,
                         attempt to retrieve the first 512 bytes of the file and use
-                        file magic to detect it's type.
+                        file magic to detect it's type. The result is cached until
+                        the file changes.
     :type use_network:  bool
     :return: True if URL is detected as a TAR file
     :rtype: bool
     """
     def _smells_like_tar(content):
-        sniffed_type = magic.from_buffer(content_head, mime=True)
+        sniffed_type = magic.from_buffer(content, mime=True)
         logger.debug('is_archive_link - detected MIME type: %s', sniffed_type)
         return sniffed_type.startswith('application/x-tar')
 
@@ -48,8 +140,10 @@ def is_archive_link(url: str, content_head: bytes = None, use_network=False) ->
         return True
 
     if use_network and content_head is None:
-        content_head = get_url_filelike(url).read(512)
-        return _smells_like_tar(content_head)
+        return _cached_by_validator(
+            'is_archive',
+            url,
+            lambda: _smells_like_tar(get_url_head_block(url, TAR_BLOCK_SIZE)))
 
     return False
 
@@ -93,63 +187,244 @@ def get_url_filelike(url: str, headers=None, auth=None):
         return resp
 
 
+def get_url_head_block(url: str, size: int = TAR_BLOCK_SIZE, headers=None, auth=None) -> bytes:
+    """
+    Returns the first `size` bytes of the file at an HTTP(S) or FTP URL.
+    Over HTTP(S) only those bytes are requested (with a Range header) - servers
+    that ignore Range stop sending when the connection is closed.
+    """
+    if urlparse(url).scheme in ['http', 'https']:
+        headers = dict(headers or {}, Range=f'bytes=0-{size - 1}')
+
+    with closing(get_url_streaming(url, headers=headers, auth=auth)) as resp:
+        filelike = resp.raw if isinstance(resp, requests.Response) else resp
+        return filelike.read(size)
+
+
 def _check_content_size_and_resolve_redirects(url: str, max_size: int = 10*1024*1024):
-    try:
-        with closing(request_with_retries('HEAD', url, allow_redirects=True)) as resp:
-            resp.raise_for_status()
-            content_length = int(resp.headers.get('content-length', 0))
-            content_type = resp.headers.get('content-type', '').split(';')[0].strip()
-            if content_length > max_size:
-                raise MemoryError(f"File is too large (> {max_size} bytes)")
-            if content_type != 'text/html':
-                raise ValueError(f"File doesn't look like sane HTML (Content-Type: {content_type})")
+    head = remote_file_head(url)
+    content_length = head['content_length'] or 0
+    content_type = head['content_type']
+    if content_length > max_size:
+        raise MemoryError(f"File is too large (> {max_size} bytes)")
+    if content_type != 'text/html':
+        raise ValueError(f"File doesn't look like sane HTML (Content-Type: {content_type})")
+
+    # Return the URL to the final destination in case we were redirected
+    return head['url']
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    A read-only, seekable file-like over an HTTP(S) URL, that fetches the parts
+    that are read with Range requests (`block_size` bytes at a time) over a
+    single kept-alive connection.
+    """
+
+    def __init__(self, url: str, size: int, block_size: int = 64 * 1024):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.block_size = block_size
+        self._pos = 0
+        self._block_start = None
+        self._block = b''
+        self._session = requests.Session()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def _fetch_block(self, start: int):
+        end = min(start + self.block_size, self.size) - 1
+        resp = self._session.get(self.url, headers={'Range': f'bytes={start}-{end}'})
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            raise IOError(f'Server ignored the Range request for {self.url}')
+        self._block_start = start
+        self._block = resp.content
+
+    def readinto(self, buffer) -> int:
+        buffer = memoryview(buffer).cast('B')
+        filled = 0
+        while filled < len(buffer) and self._pos < self.size:
+            offset = None
+            if self._block_start is not None:
+                offset = self._pos - self._block_start
+            if offset is None or not 0 <= offset < len(self._block):
+                self._fetch_block(self._pos)
+                offset = 0
+            chunk = self._block[offset:offset + len(buffer) - filled]
+            buffer[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+            self._pos += len(chunk)
+        return filled
+
+    def close(self):
+        self._session.close()
+        super().close()
+
+
+class _LimitedReader(io.RawIOBase):
+    def __init__(self, filelike, max_size: int):
+        super().__init__()
+        self._filelike = filelike
+        self._remaining = max_size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._filelike.read(len(buffer))
+        self._remaining -= len(data)
+        if self._remaining < 0:
+            raise ValueError('Archive is too large to stream for a listing')
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def get_tar_manifest_from_headers(tar_url: str, max_stream_size: Optional[int] = None) -> List[Dict]:
+    """
+    List the files in a remote tar archive from its header blocks, for archives
+    without a published manifest.
+
+    An uncompressed tar on a server that supports Range requests is read
+    header by header, skipping over the file contents. Otherwise (eg a .tar.gz)
+    the whole archive must be streamed through, so this is only attempted for
+    archives up to `max_stream_size` bytes (default
+    settings.REMOTE_ARCHIVE_STREAM_MAX_BYTES).
+
+    :return: A list of dicts, with the `filepath` of each file (and a `checksum` of None).
+    :rtype: List[Dict]
+    """
+    max_stream_size = max_stream_size or settings.REMOTE_ARCHIVE_STREAM_MAX_BYTES
 
-            # Return the URL to the final destination in case we were redirected
-            return resp.url
+    def _listing(tar):
+        return [{'filepath': os.path.normpath(member.name), 'checksum': None}
+                for member in tar if member.isfile()]
 
-    except BaseException as e:
-        raise e
+    if urlparse(tar_url).scheme in ['http', 'https']:
+        head = remote_file_head(tar_url)
+        if head['accept_ranges'] and head['content_length']:
+            with closing(HTTPRangeFile(head['url'], head['content_length'])) as fh:
+                try:
+                    with tarfile.open(fileobj=fh, mode='r:') as tar:
+                        return _listing(tar)
+                except tarfile.ReadError:
+                    # Probably compressed, so it can't be read out of order
+                    pass
+        if head['content_length'] and head['content_length'] > max_stream_size:
+            raise ValueError(f'Archive is too large to stream for a listing (> {max_stream_size} bytes)')
+
+    with closing(get_url_streaming(tar_url)) as resp:
+        filelike = resp.raw if isinstance(resp, requests.Response) else resp
+        with tarfile.open(fileobj=_LimitedReader(filelike, max_stream_size), mode='r|*') as tar:
+            return _listing(tar)
+
+
+def _manifest_url_candidates(tar_url: str, index_suffix: str) -> List[str]:
+    """
+    The places a manifest for `tar_url` may be published, most likely first
+    (eg for data.tar.gz, data.tar.gz.manifest-md5 then data.tar.manifest-md5).
+    """
+    u = urlparse(tar_url)
+    paths = [u.path]
+    for compressed_suffix in ['.gz', '.bz2', '.xz']:
+        if u.path.endswith(f'.tar{compressed_suffix}'):
+            paths.append(u.path[:-len(compressed_suffix)])
+    if u.path.endswith('.tgz'):
+        paths.append(f'{u.path[:-len(".tgz")]}.tar')
+    return [u._replace(path=f'{path}{index_suffix}').geturl() for path in paths]
+
+
+def _read_url_text(url: str) -> str:
+    with closing(get_url_streaming(url)) as resp:
+        filelike = resp.raw if isinstance(resp, requests.Response) else resp
+        return filelike.read().decode('utf-8')
+
+
+def _discover_manifest(manifest_urls: List[str]) -> str:
+    """
+    Fetch the first of `manifest_urls` that exists, trying them all at once.
+    """
+    if len(manifest_urls) == 1:
+        return _read_url_text(manifest_urls[0])
+
+    pool = ThreadPoolExecutor(max_workers=len(manifest_urls), thread_name_prefix='laxy-manifest')
+    try:
+        futures = [pool.submit(_read_url_text, url) for url in manifest_urls]
+        first_error = None
+        for future in futures:
+            try:
+                return future.result()
+            except Exception as e:
+                first_error = first_error or e
+        raise first_error
+    finally:
+        pool.shutdown(wait=False)
 
 
 def get_tar_file_manifest(
         tar_url: str,
         index_suffix='.manifest-md5',
-        checksum_type='md5') -> List[Dict[str, str]]:
+        checksum_type='md5',
+        stream_fallback=True) -> List[Dict[str, str]]:
     """
     Given a URL to a tar archive or .tar.manifest-md5 file, fetch the corresponding
     .manifest-md5 and return a list of (checksum, filename) pairs.
+
+    The manifest locations for an archive are tried concurrently. If there is no
+    manifest (and `stream_fallback`), the archive's own header blocks are read
+    instead, via `get_tar_manifest_from_headers`. Results are cached until the
+    archive changes, but a missing manifest isn't - a listing from the tar
+    headers is only used while there is still no manifest.
+
     :param tar_url: The URL to the tar file or .tar.manifest-md5 (eg https://example.com/data.tar,
                     https://example.com/data.tar.gz or https://example.com/data.tar.manifest-md5)
     :type tar_url: str
     :param index_suffix: The suffix to add to the URL path to find the manifest
                          file.
     :type index_suffix: str
-    :return: A list of tuples, (checksum, filename)
-    :rtype: Tuple[List[str], List[str]]
+    :param stream_fallback: List the archive from its tar headers if there is no manifest.
+    :type stream_fallback: bool
+    :return: A list of dicts with `filepath` and `checksum` keys
+    :rtype: List[Dict[str, str]]
     """
-    def _discover_manifest_url(tar_url):
-        murl = urlparse(tar_url)
-        murl = murl._replace(path=f'{murl.path}.manifest-md5')
-        murl = murl.geturl()
-        return murl
-
     fn = Path(urlparse(tar_url).path).name
-    if fn.endswith('.manifest-md5'):
-        manifest_url = tar_url
+    is_manifest_url = fn.endswith(index_suffix)
+    if is_manifest_url:
+        manifest_urls = [tar_url]
     else:
-        manifest_url = _discover_manifest_url(tar_url)
+        manifest_urls = _manifest_url_candidates(tar_url, index_suffix)
+
+    def _read_manifest():
+        text = _discover_manifest(manifest_urls)
+        file_index = []
+        for line in text.splitlines():
+            checksum, filename = line.split('  ', 1)
+            file_index.append({'filepath': os.path.normpath(filename.strip()),
+                               'checksum': f'{checksum_type}:{checksum.strip()}'})
+        return file_index
 
     try:
-        # req = requests.get(manifest_url)
-        # req.raise_for_status()
-        # text = requests.get(manifest_url).text
-        text = get_url_filelike(manifest_url).read().decode('utf-8')
-    except BaseException as e:
-        raise e
-
-    file_index = []
-    for line in text.splitlines():
-        checksum, filename = line.split('  ', 1)
-        file_index.append({'filepath': os.path.normpath(filename.strip()),
-                           'checksum': f'{checksum_type}:{checksum.strip()}'})
-    return file_index
+        return _cached_by_validator('manifest', tar_url, _read_manifest)
+    except Exception as e:
+        if is_manifest_url or not stream_fallback:
+            raise e
+        logger.debug(f'No manifest found for {tar_url} ({e}), reading tar headers instead')
+
+    return _cached_by_validator(
+        'tar-headers', tar_url, lambda: get_tar_manifest_from_headers(tar_url))
@@ -1,7 +1,7 @@
 import fnmatch
 import traceback
 import shlex
-from typing import Sequence, Union, Iterable
+from typing import Dict, List, Sequence, Union, Iterable
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
@@ -9,6 +9,7 @@ import hashlib
 import xxhash
 import logging
 import os
+import posixpath
 from os.path import join, expanduser
 import random
 import time
@@ -17,14 +18,19 @@ import base64
 from io import BytesIO, StringIO, BufferedRandom, BufferedReader
 from copy import copy
 from contextlib import closing
-from collections import namedtuple
+from collections import namedtuple, defaultdict, OrderedDict
 
 import numpy as np
 
 from django.db import transaction
 from django.conf import settings
 from django.db.models import QuerySet
+from django.utils import timezone
 from storages.backends.sftpstorage import SFTPStorage
+from paramiko.ssh_exception import SSHException
+
+from fabric.api import settings as fabsettings
+from fabric.api import put, run, hide
 
 from celery.result import AsyncResult
 from celery.utils.log import get_task_logger
@@ -44,6 +50,7 @@ from ..models import (
     FileLocation,
     EventLog,
     get_compute_resource_for_location,
+    get_compute_resource_str_for_location,
     get_storage_class_for_location,
     ComputeResource,
     get_primary_compute_location_for_files,
@@ -51,10 +58,37 @@ from ..models import (
 )
 
 from .verify import verify, verify_task, VerifMode
-from ..util import get_traceback_message
+from ..util import generate_uuid, get_traceback_message, has_method
 
 logger = get_task_logger(__name__)
 
+TRANSFER_LOCAL = "local"
+"""Source and destination are on the same host - copy with `cp` on that host."""
+
+TRANSFER_DIRECT = "direct"
+"""The destination host can reach the source host over SSH - pull directly with rsync."""
+
+TRANSFER_RELAY = "relay"
+"""Stream the bytes through this (Celery worker) host."""
+
+RELAY_BUFFER_SIZE = 4 * 1024 * 1024
+"""
+Read/write block size used when relaying file content through the worker. Large
+blocks amortise the SFTP request round trips.
+"""
+
+STAT_FILES_BATCH_SIZE = 500
+"""
+Maximum number of paths passed to a single remote `stat` command by stat_files
+(keeps the command line well under ARG_MAX).
+"""
+
+STAT_SIZES_COMMAND = r"stat -L --printf '%s\t%n\n' -- "
+"""
+Prints 'size<TAB>path' for each path. Note `--printf` (unlike `-c`) interprets
+the backslash escapes.
+"""
+
 
 def _conservative_exp_backoff(n_retries, a=6, b=6.1, max_time=5 * 24 * 60 * 60):
     # From ~3 min (retry 1) to 3 days (retry 5) for a=6, b=6.1
@@ -133,6 +167,7 @@ def move_file_task(self, task_data=None, **kwargs):
             self.send_event("progress", step="copy_and_verify")
             if from_location != to_location:
                 start_time = datetime.utcnow()
+                transfer_stats = {}
                 file = copy_file_to(
                     file,
                     from_location,
@@ -141,6 +176,7 @@ def move_file_task(self, task_data=None, **kwargs):
                     clobber=clobber,
                     verify_on=verify_on,
                     delete_failed_destination_copy=deleted_failed,
+                    transfer_stats=transfer_stats,
                 )
                 end_time = datetime.utcnow()
                 wall_time = (end_time - start_time).total_seconds()
@@ -153,6 +189,7 @@ def move_file_task(self, task_data=None, **kwargs):
                     "start_time": start_time.isoformat(),
                     "end_time": end_time.isoformat(),
                     "walltime_seconds": wall_time,
+                    **transfer_stats,
                 }
             else:
                 result["copy"] = {
@@ -235,6 +272,128 @@ def location_path_on_compute(
     return file_path
 
 
+def _same_host(src_compute: ComputeResource, dst_compute: ComputeResource) -> bool:
+    """
+    Returns True if two ComputeResources refer to the same login on the same host
+    (eg the same machine registered twice with different base_dir settings).
+    """
+    if src_compute.id == dst_compute.id:
+        return True
+    return (
+        src_compute.hostname == dst_compute.hostname
+        and str(src_compute.port) == str(dst_compute.port)
+        and src_compute.extra.get("username") == dst_compute.extra.get("username")
+    )
+
+
+def plan_file_transfer(
+    src_compute: Union[ComputeResource, None],
+    dst_compute: Union[ComputeResource, None],
+) -> str:
+    """
+    Decide how bytes should travel between two ComputeResources.
+
+    Returns TRANSFER_LOCAL if both are the same host, TRANSFER_DIRECT if the
+    destination is configured to reach the source directly, otherwise
+    TRANSFER_RELAY (content is streamed through the Celery worker).
+
+    A destination declares which sources it can pull from over SSH via
+    `ComputeResource.extra['direct_transfer_sources']`, a list of ComputeResource IDs
+    (or `["*"]` for any). The source must trust its own private key
+    (as for bulk_move_job_rsync).
+    """
+    if src_compute is None or dst_compute is None:
+        return TRANSFER_RELAY
+
+    if _same_host(src_compute, dst_compute):
+        return TRANSFER_LOCAL
+
+    allowed = dst_compute.extra.get("direct_transfer_sources", []) or []
+    if src_compute.id in allowed or "*" in allowed:
+        return TRANSFER_DIRECT
+
+    return TRANSFER_RELAY
+
+
+def _copy_on_host(
+    src_compute: ComputeResource,
+    src_path: str,
+    dst_compute: ComputeResource,
+    dst_path: str,
+    method: str,
+):
+    """
+    Copy a file by running `cp` (TRANSFER_LOCAL) or `rsync` (TRANSFER_DIRECT) on
+    the destination host, so content doesn't pass through this worker.
+    """
+    from .job import _init_fabric_env
+
+    _init_fabric_env()
+
+    dst_dir = posixpath.dirname(dst_path)
+    with fabsettings(
+        gateway=dst_compute.gateway_server,
+        host_string=dst_compute.host,
+        user=dst_compute.extra.get("username", None),
+        key=dst_compute.private_key,
+    ):
+        with hide("output"):
+            if method == TRANSFER_LOCAL:
+                run(
+                    f"mkdir -p {shlex.quote(dst_dir)} && "
+                    f"cp -p {shlex.quote(src_path)} {shlex.quote(dst_path)}"
+                )
+                return
+
+            src_userstr = src_compute.extra.get("username", "")
+            if src_userstr != "":
+                src_userstr = f"{src_userstr}@"
+            src_str = f"{src_userstr}{src_compute.hostname}:{src_path}"
+
+            # As per bulk_move_job_rsync, the source private key is put on the
+            # destination at an unguessable path for the duration of the copy.
+            tmpkeyfn = f"/tmp/.laxy/ssh/id_rsa-{src_compute.id}_{generate_uuid()}"
+            _tmpdirpath = posixpath.dirname(tmpkeyfn)
+            run(f"mkdir -p {_tmpdirpath} && chmod 700 {_tmpdirpath}")
+            put(
+                BytesIO(src_compute.private_key.encode("utf-8")),
+                tmpkeyfn,
+                mode=0o600,
+            )
+            ssh_cmd = (
+                f"ssh -i {tmpkeyfn} -p {src_compute.port} "
+                f"-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null"
+            )
+            run(
+                f"mkdir -p {shlex.quote(dst_dir)} && "
+                f"nice rsync -sLp -e {shlex.quote(ssh_cmd)} "
+                f"{shlex.quote(src_str)} {shlex.quote(dst_path)}; "
+                f"_rc=$?; rm -f {tmpkeyfn}; exit $_rc"
+            )
+
+
+def _relay_copy(src_fh, dst_storage: SFTPStorage, dst_path: str) -> int:
+    """
+    Stream content from an open file-like object to an SFTP destination in
+    RELAY_BUFFER_SIZE blocks. Returns the number of bytes relayed.
+    """
+    dst_dir = posixpath.dirname(dst_path)
+    if not dst_storage.exists(dst_dir):
+        dst_storage._mkdir(dst_dir)
+
+    n_bytes = 0
+    with dst_storage.sftp.open(dst_path, "wb", bufsize=RELAY_BUFFER_SIZE) as dst_fh:
+        dst_fh.set_pipelined(True)
+        while True:
+            chunk = src_fh.read(RELAY_BUFFER_SIZE)
+            if not chunk:
+                break
+            dst_fh.write(chunk)
+            n_bytes += len(chunk)
+
+    return n_bytes
+
+
 def copy_file_to(
     file: File,
     from_location: Union[None, str, FileLocation],
@@ -243,7 +402,18 @@ def copy_file_to(
     clobber=False,
     verify_on=VerifMode.CHECKSUM_ELSE_SIZE,
     delete_failed_destination_copy=True,
+    transfer_stats: Union[dict, None] = None,
 ) -> File:
+    """
+    Copy a File from one location to another, verifying the copy.
+
+    Where the source and destination ComputeResources can talk to each other
+    (see plan_file_transfer), the copy is run on the destination host. Otherwise
+    content is relayed through this worker.
+
+    If a `transfer_stats` dict is provided, it is updated with the transfer method
+    used and the number of bytes copied directly versus relayed via the worker.
+    """
 
     if verify_on not in list(VerifMode):
         raise ValueError(f'verify_on must be one of: {", ".join(list(VerifMode))}')
@@ -265,13 +435,7 @@ def copy_file_to(
         #       Refactor parts onto the File or ComputeResource models and
         #       deal with other supported schemes.
 
-        # TODO: If scheme is laxy+sftp and netloc is the same between from_location and to_location,
-        #       skip using storage.save and use fabric to do a 'local' copy on the ComputeResource
-        #       (probably via rsync). Think about how to detect if we should do a node-local copy
-        #       even if the ComputeResource IDs in the locations don't match (maybe same IP/hostname and
-        #       same metadata.username, but different metadata.base_dir ?).
-        #
-        #       We could also do node-local moves, but only via `mv` if the operation is atomic
+        # TODO: We could also do node-local moves, but only via `mv` if the operation is atomic
         #       [eg on the same filesystem] - otherwise we should do a copy-delete. Check same
         #       filesystem:
         #       https://unix.stackexchange.com/questions/44249/how-to-check-if-two-directories-or-files-belong-to-same-filesystem
@@ -279,6 +443,12 @@ def copy_file_to(
         src_storage: SFTPStorage = get_storage_class_for_location(from_location)
         dst_storage: SFTPStorage = get_storage_class_for_location(to_location)
         dst_compute: ComputeResource = get_compute_resource_for_location(to_location)
+        src_compute: Union[ComputeResource, None] = None
+        if urlparse(from_location).scheme == "laxy+sftp":
+            src_compute = get_compute_resource_for_location(from_location)
+        method = plan_file_transfer(src_compute, dst_compute)
+        bytes_direct = 0
+        bytes_relayed = 0
 
         try:
             dst_path = location_path_on_compute(file.location, dst_compute)
@@ -304,12 +474,34 @@ def copy_file_to(
                 logger.info(f"Copying file to: {dst_compute}:{dst_path}")
 
                 if from_location != to_location:
-                    dst_storage.save(dst_path, file._file(from_location))
+                    if method in (TRANSFER_LOCAL, TRANSFER_DIRECT):
+                        # cp -p / rsync -p preserve the source mode
+                        _copy_on_host(
+                            src_compute, src_path, dst_compute, dst_path, method
+                        )
+                        bytes_direct = dst_storage.size(dst_path)
+                    else:
+                        src_fh = src_storage.sftp.open(
+                            src_path, "rb", bufsize=RELAY_BUFFER_SIZE
+                        )
+                        src_fh.prefetch()
+                        with closing(src_fh):
+                            bytes_relayed = _relay_copy(src_fh, dst_storage, dst_path)
 
-                    # chmod the destination to be the same as the source
+                        # chmod the destination to be the same as the source
+                        src_mode: int = src_storage.sftp.stat(src_path).st_mode
+                        dst_storage.sftp.chmod(dst_path, src_mode)
 
-                    src_mode: int = src_storage.sftp.stat(src_path).st_mode
-                    dst_storage.sftp.chmod(dst_path, src_mode)
+                    logger.info(
+                        f"Copied {file.id} ({method}): "
+                        f"{bytes_direct} bytes direct, {bytes_relayed} bytes relayed"
+                    )
+                    if transfer_stats is not None:
+                        transfer_stats.update(
+                            method=method,
+                            bytes_direct=bytes_direct,
+                            bytes_relayed=bytes_relayed,
+                        )
 
                 verification_ok = verify(file, to_location, verify_on=verify_on)
 
@@ -368,6 +560,7 @@ def copy_file_task(self, task_data=None, **kwargs):
         elif not file.locations.filter(url=from_location).exists():
             raise ValueError(f"File {file.id} does not have location: {from_location}")
 
+        transfer_stats = {}
         try:
             start_time = datetime.utcnow()
             file = copy_file_to(
@@ -378,6 +571,7 @@ def copy_file_task(self, task_data=None, **kwargs):
                 clobber=clobber,
                 verify_on=verify_on,
                 delete_failed_destination_copy=deleted_failed,
+                transfer_stats=transfer_stats,
             )
             end_time = datetime.utcnow()
             wall_time = (end_time - start_time).total_seconds()
@@ -396,6 +590,7 @@ def copy_file_task(self, task_data=None, **kwargs):
                 "start_time": start_time.isoformat(),
                 "end_time": end_time.isoformat(),
                 "walltime_seconds": wall_time,
+                **transfer_stats,
             }
         )
     except BaseException as e:
@@ -430,20 +625,51 @@ def add_file_replica_records(
 
     new_prefix = f"laxy+sftp://{compute_resource.id}"
 
-    n_added = 0
+    files = list(files)
+    if not files:
+        return 0
+
+    # Resolve the Job ID once per FileSet rather than once per File
+    job_ids_by_fileset = {}
+    replica_urls = {}
+    for f in files:
+        if f.fileset_id not in job_ids_by_fileset:
+            job_ids_by_fileset[f.fileset_id] = f.fileset.job.id
+        job_id = job_ids_by_fileset[f.fileset_id]
+        replica_urls[f.id] = f"{new_prefix}/{job_id}/{f.full_path}"
+
     with transaction.atomic():
-        for f in files:
-            replica_url = f"{new_prefix}/{f.fileset.job.id}/{f.full_path}"
-            # try:
-            loc, created = FileLocation.objects.get_or_create(file=f, url=replica_url)
-            if set_as_default:
-                loc.set_as_default(save=True)
-            if created:
-                n_added += 1
-            #
-            # except IntegrityError as ex:
-            #     if 'unique constraint' in ex.message:
-            #         pass
+        existing = set(
+            FileLocation.objects.filter(
+                file_id__in=list(replica_urls.keys()),
+                url__in=list(replica_urls.values()),
+            ).values_list("file_id", "url")
+        )
+        new_locations = [
+            FileLocation(file_id=file_id, url=url)
+            for file_id, url in replica_urls.items()
+            if (file_id, url) not in existing
+        ]
+        FileLocation.objects.bulk_create(new_locations)
+        n_added = len(new_locations)
+
+        if set_as_default:
+            # Equivalent to FileLocation.set_as_default for every replica, but as
+            # two UPDATE statements rather than a save() per location.
+            FileLocation.objects.filter(file_id__in=list(replica_urls.keys())).update(
+                default=False
+            )
+            FileLocation.objects.filter(
+                file_id__in=list(replica_urls.keys()),
+                url__in=list(replica_urls.values()),
+            ).update(default=True)
+
+        # bulk_create and update() skip the FileLocation post_save receiver that
+        # touches File.modified_time, so bump it here to invalidate cached ETags.
+        if n_added or set_as_default:
+            File.objects.filter(id__in=list(replica_urls.keys())).update(
+                modified_time=timezone.now()
+            )
 
     return n_added
 
@@ -487,3 +713,218 @@ def remove_file_replica_records(
         oldlocs.delete()
 
     return n_deleted
+
+
+def _remote_file_sizes(compute: ComputeResource, paths: List[str]) -> Dict[str, int]:
+    """
+    Stat many paths on a ComputeResource using one SSH command per
+    STAT_FILES_BATCH_SIZE paths. Returns {absolute_path: size} for the paths that
+    exist (missing paths are omitted).
+    """
+    sizes = {}
+    with compute.ssh_client() as client:
+        for i in range(0, len(paths), STAT_FILES_BATCH_SIZE):
+            batch = paths[i : i + STAT_FILES_BATCH_SIZE]
+            cmd = STAT_SIZES_COMMAND + " ".join(shlex.quote(p) for p in batch)
+            _stdin, stdout, _stderr = client.exec_command(cmd)
+            # stat exits non-zero if any path is missing - we just take what we get
+            sizes.update(
+                _parse_stat_sizes(stdout.read().decode("utf-8", errors="replace"))
+            )
+
+    return sizes
+
+
+def _parse_stat_sizes(output: str) -> Dict[str, int]:
+    """
+    Parse the output of STAT_SIZES_COMMAND (one 'size<TAB>path' line per path)
+    into {path: size}.
+    """
+    sizes = {}
+    for line in output.splitlines():
+        size, _, path = line.partition("\t")
+        if path and size.isdigit():
+            sizes[path] = int(size)
+    return sizes
+
+
+def stat_files(files: Union[Iterable[File], QuerySet], refresh=False) -> int:
+    """
+    Populate File.metadata['size'] for many Files at once. Files are grouped by the
+    ComputeResource of their default (laxy+sftp://) location, paths are stat-ed in
+    batches over a single SSH connection per host and the metadata is written back
+    with a bulk update.
+
+    This is the explicit replacement for the on-demand (per file) remote lookup
+    File.size used to do.
+
+    :param files: The Files to update.
+    :type files: Union[Iterable[File], QuerySet]
+    :param refresh: If True, also re-stat Files that already have a recorded size.
+    :type refresh: bool
+    :return: The number of Files updated.
+    :rtype: int
+    """
+    files = [
+        f
+        for f in files
+        if refresh
+        or not has_method(f.metadata, "get")
+        or f.metadata.get("size", None) is None
+    ]
+    if not files:
+        return 0
+
+    default_locations = dict(
+        FileLocation.objects.filter(file__in=files, default=True).values_list(
+            "file_id", "url"
+        )
+    )
+
+    files_by_compute = defaultdict(list)
+    for f in files:
+        url = default_locations.get(f.id, None)
+        compute_id = get_compute_resource_str_for_location(url) if url else None
+        if compute_id is not None:
+            files_by_compute[compute_id].append((f, urlparse(url).path))
+
+    computes = ComputeResource.objects.in_bulk(list(files_by_compute.keys()))
+
+    updated = []
+    now = timezone.now()
+    for compute_id, file_paths in files_by_compute.items():
+        compute = computes.get(compute_id, None)
+        if compute is None or not compute.available:
+            continue
+
+        files_by_abspath = defaultdict(list)
+        for f, url_path in file_paths:
+            abspath = str(Path(compute.jobs_dir) / Path(url_path).relative_to("/"))
+            files_by_abspath[abspath].append(f)
+
+        try:
+            sizes = _remote_file_sizes(compute, list(files_by_abspath.keys()))
+        except (IOError, OSError, SSHException) as ex:
+            logger.warning(f"stat_files: unable to stat files on {compute_id}: {ex}")
+            continue
+
+        for abspath, size in sizes.items():
+            for f in files_by_abspath.get(abspath, []):
+                if not has_method(f.metadata, "get"):
+                    f.metadata = OrderedDict()
+                f.metadata["size"] = size
+                # bulk_update bypasses auto_now, so set it explicitly
+                f.modified_time = now
+                updated.append(f)
+
+    File.objects.bulk_update(
+        updated, ["metadata", "modified_time"], batch_size=STAT_FILES_BATCH_SIZE
+    )
+
+    return len(updated)
+
+
+@shared_task(queue="low-priority", bind=True, track_started=True)
+def stat_files_task(self, task_data=None, **kwargs):
+    """
+    Populate missing File sizes for a Job or FileSet (via stat_files).
+
+    task_data should contain a `job_id` or a `fileset_id`. Set `refresh` to True
+    to re-stat files with a recorded size.
+    """
+    from ..models import Job, FileSet
+
+    if task_data is None:
+        raise InvalidTaskError("task_data is None")
+
+    job_id = task_data.get("job_id", None)
+    fileset_id = task_data.get("fileset_id", None)
+    refresh = task_data.get("refresh", False)
+
+    if job_id is not None:
+        files = Job.objects.get(id=job_id).get_files()
+    elif fileset_id is not None:
+        files = FileSet.objects.get(id=fileset_id).get_files()
+    else:
+        raise InvalidTaskError("task_data must contain a job_id or fileset_id")
+
+    start_time = datetime.utcnow()
+    n_updated = stat_files(files, refresh=refresh)
+    end_time = datetime.utcnow()
+
+    task_data.update(
+        result={
+            "updated": n_updated,
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+            "walltime_seconds": (end_time - start_time).total_seconds(),
+        }
+    )
+    return task_data
+
+
+@shared_task(bind=True, track_started=True)
+def resolve_samplecart_file_names(self, task_data=None, **kwargs):
+    """
+    Find the file names for a SampleCart imported from CSV without them
+    (via SampleCart.resolve_file_names).
+
+    task_data should contain a `samplecart_id`. Progress is recorded as
+    SAMPLECART_IMPORT_PROGRESS events for the SampleCart (and in the task
+    state), followed by a SAMPLECART_IMPORT_COMPLETE or
+    SAMPLECART_IMPORT_FAILED event.
+    """
+    from ..models import SampleCart
+
+    if task_data is None:
+        raise InvalidTaskError("task_data is None")
+
+    cart = SampleCart.objects.get(id=task_data.get("samplecart_id"))
+    reported = {"percent": -1}
+
+    def _progress(resolved: int, total: int):
+        percent = int(100 * resolved / total) if total else 100
+        # Report every 10%, not every URL
+        if percent // 10 == reported["percent"] // 10:
+            return
+        reported["percent"] = percent
+        progress = {"resolved": resolved, "total": total, "percent": percent}
+        self.update_state(state="PROGRESS", meta=progress)
+        EventLog.log(
+            "SAMPLECART_IMPORT_PROGRESS",
+            f"Found names for {resolved} of {total} files",
+            user=cart.owner,
+            extra=progress,
+            obj=cart,
+        )
+
+    try:
+        # Resolve against a snapshot of the cart, then only update the names of
+        # the current content, since it could be replaced while we wait
+        cart.resolve_file_names(save=False, progress=_progress)
+        names = {
+            f["location"]: f["name"] for f in cart._sample_files() if f.get("location")
+        }
+        with transaction.atomic():
+            cart = SampleCart.objects.select_for_update().get(id=cart.id)
+            cart.set_file_names(names)
+            cart.save()
+    except ValueError as ex:
+        EventLog.log(
+            "SAMPLECART_IMPORT_FAILED",
+            str(ex),
+            user=cart.owner,
+            extra={"task_id": self.request.id},
+            obj=cart,
+        )
+        raise
+
+    EventLog.log(
+        "SAMPLECART_IMPORT_COMPLETE",
+        "Found names for all files",
+        user=cart.owner,
+        extra={"task_id": self.request.id},
+        obj=cart,
+    )
+    task_data.update(result={"files": len(names)})
+    return task_data
@@ -1,5 +1,7 @@
 import fnmatch
+import hashlib
 import shlex
+import tarfile
 import traceback
 from django.core.exceptions import ImproperlyConfigured
 from django.db import transaction
@@ -18,8 +20,9 @@ import base64
 from io import BytesIO
 from copy import copy
 from contextlib import closing
+from functools import lru_cache
 from django.conf import settings
-from django.db.models import QuerySet
+from django.db.models import QuerySet, Count, Min, Max
 from django.db import IntegrityError
 
 from paramiko.config import SSHConfig
@@ -60,9 +63,14 @@ from ..models import (
     job_path_on_compute,
     get_compute_resources_for_files,
 )
-from ..util import generate_uuid, laxy_sftp_url, get_traceback_message
+from ..util import (
+    generate_uuid,
+    has_method,
+    laxy_sftp_url,
+    get_traceback_message,
+)
 
-from .file import add_file_replica_records, move_file_task
+from .file import add_file_replica_records, move_file_task, stat_files
 from .verify import verify, verify_task, VerifMode
 
 logger = get_task_logger(__name__)
@@ -290,6 +298,218 @@ def _remote_rglobdict(pathspec: str, relative_to: str = "") -> Mapping[str, str]
     return {os.path.relpath(p, relative_to): p for p in files_abs}
 
 
+@lru_cache(maxsize=1024)
+def _static_job_template_content(abspath: str, mtime_ns: int) -> Union[bytes, None]:
+    """
+    Returns the rendered content of a job template file if it contains no
+    template tags or variables (so renders the same for every job), otherwise
+    None. Cached by modification time, since most files never change.
+    """
+    from django.template.base import Lexer, TokenType
+
+    text = Path(abspath).read_text(encoding="utf-8")
+    tokens = Lexer(text).tokenize()
+    if any(t.token_type not in (TokenType.TEXT, TokenType.COMMENT) for t in tokens):
+        return None
+    rendered = Template(text).render(Context())
+    return rendered.replace("\r\n", "\n").encode("utf-8")
+
+
+JOB_FILE_CHMOD_MAPPINGS = {".py": 0o700, ".sh": 0o700}
+
+
+def infer_job_file_chmod(filename, default=0o600, mappings=JOB_FILE_CHMOD_MAPPINGS):
+    """
+    The mode a job template file is given on the ComputeResource: scripts are
+    executable (by the owner only), everything else just readable.
+    """
+    for ext, chmod in mappings.items():
+        if filename.endswith(ext):
+            return chmod
+    return default
+
+
+def job_script_bundle(
+    job_template_files: Mapping[str, str], infer_chmod
+) -> Tuple[str, Dict[str, Tuple[bytes, int]]]:
+    """
+    Picks out the job template files that are the same for every job (most
+    helper scripts, which contain no template tags) so they can be uploaded
+    once per ComputeResource as a shared bundle, rather than rendered and
+    uploaded for every job.
+
+    The bundle is content-addressed: its ID is a hash over the relative path,
+    mode and content of each file, so pipeline versions that share identical
+    scripts share a bundle, and a changed script gives a new one.
+
+    Args:
+        job_template_files: {relpath: abspath}, as from get_job_template_files.
+        infer_chmod: Function returning the file mode for a relpath.
+
+    Returns:
+        (bundle_id, {relpath: (content, mode)}). Files not in the bundle still
+        need rendering per job.
+    """
+    files = {}
+    for bundle_relpath, abspath in job_template_files.items():
+        content = _static_job_template_content(abspath, os.stat(abspath).st_mtime_ns)
+        if content is not None:
+            files[bundle_relpath] = (content, infer_chmod(bundle_relpath))
+
+    digest = hashlib.sha256()
+    for bundle_relpath in sorted(files):
+        content, mode = files[bundle_relpath]
+        digest.update(f"{bundle_relpath}\0{mode:o}\0".encode("utf-8"))
+        digest.update(hashlib.sha256(content).digest())
+
+    return digest.hexdigest()[:32], files
+
+
+JOB_SCRIPT_BUNDLE_MIN_AGE = timedelta(days=1)
+"""
+A job script bundle unused for this long (no job symlinks into it, and no job
+has started from it) is removed by remove_unused_job_script_bundles. Reusing a
+bundle refreshes its mtime, so a job starting while the bundles are checked
+keeps the one it's linking to.
+"""
+
+
+def job_script_bundles_dir(compute: ComputeResource) -> str:
+    return join(compute.jobs_dir, ".script_bundles")
+
+
+def job_script_bundle_path(compute: ComputeResource, bundle_id: str) -> str:
+    return join(job_script_bundles_dir(compute), bundle_id)
+
+
+def ensure_remote_job_script_bundle(
+    bundle_path: str, files: Mapping[str, Tuple[bytes, int]]
+) -> bool:
+    """
+    Uploads a job script bundle (from job_script_bundle) to bundle_path on the
+    current Fabric host, unless it's already there. Must be called inside a
+    fabric settings context for the ComputeResource.
+
+    The bundle is uploaded as a single tarball and unpacked beside
+    bundle_path, then renamed into place, so bundle_path only ever exists
+    complete. If another job uploads the same bundle at the same time, the
+    rename loses the race harmlessly.
+
+    Returns:
+        True if the bundle was uploaded, False if it already existed.
+    """
+    bundle_q = shlex.quote(bundle_path)
+    with hide("output", "warnings"), fabsettings(warn_only=True):
+        # (touch marks it as recently used, see JOB_SCRIPT_BUNDLE_MIN_AGE)
+        if run(f"test -d {bundle_q} && touch {bundle_q}").succeeded:
+            return False
+
+    tarball = BytesIO()
+    with tarfile.open(fileobj=tarball, mode="w:gz") as tar:
+        for bundle_relpath, (content, mode) in sorted(files.items()):
+            info = tarfile.TarInfo(bundle_relpath)
+            info.size = len(content)
+            info.mode = mode
+            tar.addfile(info, BytesIO(content))
+    tarball.seek(0)
+
+    tmp_path = f"{bundle_path}.{generate_uuid()}"
+    tmp_q = shlex.quote(tmp_path)
+    put(tarball, f"{tmp_path}.tar.gz", mode=0o600)
+    run(
+        f"mkdir -p {tmp_q} && chmod 700 {tmp_q} && "
+        f"tar -xzpf {tmp_q}.tar.gz -C {tmp_q} && rm -f {tmp_q}.tar.gz && "
+        f"find {tmp_q} -type d -exec chmod 700 {{}} + && "
+        f"(mv -T {tmp_q} {bundle_q} 2>/dev/null || rm -rf {tmp_q})"
+    )
+    return True
+
+
+def unused_job_script_bundles(
+    bundle_names: Iterable[str], link_targets: Iterable[str], bundles_dir: str
+) -> List[str]:
+    """
+    The entries of a host's job script bundles directory that no job symlinks
+    into. Leftovers of interrupted uploads ('<bundle_id>.<uuid>' directories
+    and tarballs) are never linked to, so they are included.
+
+    Args:
+        bundle_names: The names of the entries in bundles_dir.
+        link_targets: The targets of the symlinks in the job directories.
+        bundles_dir: The directory, as from job_script_bundles_dir.
+
+    Returns:
+        The unused entries of bundle_names.
+    """
+    prefix = bundles_dir.rstrip("/") + "/"
+    used = set(
+        target[len(prefix) :].split("/", 1)[0]
+        for target in link_targets
+        if target.startswith(prefix)
+    )
+    return sorted(set(name for name in bundle_names if name) - used)
+
+
+def remove_unused_remote_job_script_bundles(compute: ComputeResource) -> List[str]:
+    """
+    Removes the job script bundles on a ComputeResource that no job symlinks
+    into, once they are older than JOB_SCRIPT_BUNDLE_MIN_AGE. Must be called
+    inside a fabric settings context for the ComputeResource.
+
+    Returns:
+        The names of the bundles removed.
+    """
+    bundles_dir = job_script_bundles_dir(compute)
+    bundles_q = shlex.quote(bundles_dir)
+    jobs_q = shlex.quote(compute.jobs_dir)
+    min_age_mins = int(JOB_SCRIPT_BUNDLE_MIN_AGE.total_seconds() // 60)
+
+    with hide("output", "warnings"), fabsettings(warn_only=True):
+        listing = run(
+            f"find {bundles_q} -mindepth 1 -maxdepth 1 -mmin +{min_age_mins} "
+            f"-printf '%f\\n'"
+        )
+        if listing.failed or not listing.strip():
+            return []
+        # Job outputs hold most of the files on a host, and never link into a
+        # bundle, so they aren't searched
+        links = run(
+            f"find {jobs_q} \\( -path {bundles_q} -o -path {jobs_q}'/*/output' \\) "
+            f"-prune -o -type l -lname {shlex.quote(bundles_dir + '/*')} -printf '%l\\n'"
+        )
+        if links.failed:
+            # Without a complete list of links we can't tell what's unused
+            raise Exception(f"Unable to list job script links on {compute.id}")
+
+    unused = unused_job_script_bundles(
+        listing.splitlines(), links.splitlines(), bundles_dir
+    )
+    for name in unused:
+        # Re-checks the age, in case a job started using it meanwhile
+        run(
+            f"find {bundles_q} -mindepth 1 -maxdepth 1 -name {shlex.quote(name)} "
+            f"-mmin +{min_age_mins} -exec rm -rf {{}} +"
+        )
+    return unused
+
+
+def detach_remote_job_script_bundle(job: Job):
+    """
+    Replaces a job's symlinks into a shared job script bundle with copies of
+    the files, so the bundle can be removed once no other job uses it. Must be
+    called inside a fabric settings context for the job's ComputeResource.
+    """
+    bundles_dir = job_script_bundles_dir(job.compute_resource)
+    job_q = shlex.quote(job_path_on_compute(job, job.compute_resource))
+    run(
+        f"find {job_q} -path {job_q}/output -prune -o "
+        f"-type l -lname {shlex.quote(bundles_dir + '/*')} "
+        "-exec sh -c 'for l; do "
+        'cp -p --remove-destination "$(readlink "$l")" "$l"; '
+        "done' _ {} +"
+    )
+
+
 @shared_task(bind=True, track_started=True)
 def start_job(self, task_data=None, **kwargs):
     from ..models import Job
@@ -338,14 +558,6 @@ def start_job(self, task_data=None, **kwargs):
     # }
     job_template_files = get_job_template_files(pipeline_name, pipeline_version)
 
-    extension_chmod_mappings = {".py": 0o700, ".sh": 0o700}
-
-    def infer_chmod(filename, default=0o600, mappings=extension_chmod_mappings):
-        for ext, chmod in mappings.items():
-            if filename.endswith(ext):
-                return chmod
-        return default
-
     remote_id = None
     message = "Failure, without exception."
     try:
@@ -368,10 +580,29 @@ def start_job(self, task_data=None, **kwargs):
             for d in set(remote_subdirs):
                 result = run(f"mkdir -p {d} && chmod 700 {d}")
 
+            # Files that are the same for every job come from a shared bundle,
+            # uploaded once per ComputeResource and symlinked into the job
+            # directory. The job-specific ones are rendered and uploaded here.
+            bundle_id, bundle_files = job_script_bundle(
+                job_template_files, infer_job_file_chmod
+            )
+            bundle_path = job_script_bundle_path(job.compute_resource, bundle_id)
+            if bundle_files:
+                if ensure_remote_job_script_bundle(bundle_path, bundle_files):
+                    logger.info(
+                        f"Uploaded job script bundle {bundle_id} "
+                        f"({len(bundle_files)} files) to {job.compute_resource.id}"
+                    )
+                run(
+                    f"cp -rsf {shlex.quote(bundle_path)}/. {shlex.quote(working_dir)}/"
+                )
+
             # TODO/IDEA: Treat only .j2 files as templates where we apply a context dict,
             #       remove the .j2 extension when copying
             for remote_relpath, local_fpath in job_template_files.items():
-                fmode = infer_chmod(remote_relpath)
+                if remote_relpath in bundle_files:
+                    continue
+                fmode = infer_job_file_chmod(remote_relpath)
                 if local_fpath:
                     flike = template_filelike(local_fpath)
                     put(flike, join(working_dir, remote_relpath), mode=fmode)
@@ -433,7 +664,7 @@ def start_job(self, task_data=None, **kwargs):
                     )
 
                 for remote_relpath, remote_abspath in remote_templates_all.items():
-                    fmode = infer_chmod(remote_relpath)
+                    fmode = infer_job_file_chmod(remote_relpath)
                     remote_abspath_q = shlex.quote(remote_abspath)
                     remote_file_content_result = run(f"cat {remote_abspath_q}")
 
@@ -447,13 +678,17 @@ def start_job(self, task_data=None, **kwargs):
                         rendered_content_unix = rendered_content.replace("\r\n", "\n")
                         flike = BytesIO(rendered_content_unix.encode("utf-8"))
 
+                        # Don't write through a symlink into the shared bundle
+                        target = join(working_dir, remote_relpath)
+                        run(f"rm -f {shlex.quote(target)}")
+
                         # Upload the rendered file
                         logger.info(f"Applying remote template: {remote_relpath}")
                         job.log_event(
                             "JOB_INFO",
                             f"Applying custom job template file from remote host: {remote_relpath}",
                         )
-                        put(flike, join(working_dir, remote_relpath), mode=fmode)
+                        put(flike, target, mode=fmode)
                     else:
                         logger.warning(
                             f"Could not read remote template file: {remote_abspath} "
@@ -1180,6 +1415,13 @@ def expire_old_job(self, task_data=None, **kwargs):
         .filter(created_time__lt=timezone.now() - timedelta(seconds=ttl))
         .all()
     )
+    try:
+        # file_should_be_deleted depends on File.size - fill in any unknown sizes
+        # up front, in bulk.
+        stat_files(old_files)
+    except (OSError, IOError, SSHException) as ex:
+        logger.warning(f"Unable to populate file sizes for job {job.id}: {ex}")
+
     message = "No message."
     try:
         count = 0
@@ -1235,6 +1477,23 @@ def expire_old_job(self, task_data=None, **kwargs):
         job.save()
         result = {"deleted_count": count}
 
+        try:
+            compute = job.compute_resource
+            if compute is not None and compute.available:
+                with fabsettings(
+                    gateway=compute.gateway_server,
+                    host_string=compute.host,
+                    user=compute.extra.get("username", None),
+                    key=compute.private_key,
+                ):
+                    detach_remote_job_script_bundle(job)
+        except Exception as ex:
+            # The bundle is just kept until a later expiry manages this
+            logger.warning(
+                f"Unable to detach job script bundle for Job {job.id}: "
+                f"{get_traceback_message(ex)}"
+            )
+
         try:
             if count > 0:
                 r = estimate_job_tarball_size.apply_async(
@@ -1281,6 +1540,257 @@ def expire_old_jobs(self, task_data=None, *kwargs):
         logging.info(f"Expiring job: {job.id}")
         expire_old_job.s(task_data=dict(job_id=job.id)).apply_async()
 
+    # Bundles freed by the jobs expiring now are removed next time round
+    remove_unused_job_script_bundles.s().apply_async()
+
+
+@shared_task(queue="low-priority", bind=True, track_started=True)
+def remove_unused_job_script_bundles(self, task_data=None, **kwargs):
+    """
+    Removes job script bundles (see job_script_bundle) that no job on the
+    host symlinks into any more, on each online ComputeResource.
+    """
+    _init_fabric_env()
+    removed = {}
+    computes = ComputeResource.objects.filter(status=ComputeResource.STATUS_ONLINE)
+    for compute in computes:
+        try:
+            with fabsettings(
+                gateway=compute.gateway_server,
+                host_string=compute.host,
+                user=compute.extra.get("username", None),
+                key=compute.private_key,
+            ):
+                removed[compute.id] = remove_unused_remote_job_script_bundles(compute)
+        except Exception as ex:
+            logger.warning(
+                f"Failed to remove unused job script bundles on {compute.id}: "
+                f"{get_traceback_message(ex)}"
+            )
+            continue
+        if removed[compute.id]:
+            logger.info(
+                f"Removed {len(removed[compute.id])} unused job script bundles "
+                f"from {compute.id}"
+            )
+
+    task_data = task_data or {}
+    task_data.update(result={"removed": removed})
+    return task_data
+
+
+# Kept when a job's events are compacted: its status history, and any
+# summaries of earlier compactions
+EVENTLOG_COMPACT_KEEP_EVENTS = (
+    "job_created",
+    "JOB_STATUS_CHANGED",
+    "JOB_EVENTS_COMPACTED",
+)
+
+
+def compact_job_events(job: Job, before: datetime) -> int:
+    """
+    Replaces a finished job's events from before a given time (other than
+    EVENTLOG_COMPACT_KEEP_EVENTS and its latest event) with a single
+    JOB_EVENTS_COMPACTED event summarising them. Returns the number of events
+    removed.
+    """
+    old_events = EventLog.objects.filter(
+        object_id=job.id, timestamp__lt=before
+    ).exclude(event__in=EVENTLOG_COMPACT_KEEP_EVENTS)
+    # (latest_event, not latest_eventlog_id, since older jobs may not have
+    # latest_eventlog set yet)
+    latest = job.latest_event()
+    if isinstance(latest, EventLog):
+        old_events = old_events.exclude(id=latest.id)
+    with transaction.atomic():
+        summary = old_events.aggregate(
+            count=Count("id"), first=Min("timestamp"), last=Max("timestamp")
+        )
+        if not summary["count"]:
+            return 0
+        counts = dict(
+            old_events.order_by()
+            .values_list("event")
+            .annotate(n=Count("id"))
+            .values_list("event", "n")
+        )
+        EventLog.log(
+            "JOB_EVENTS_COMPACTED",
+            message=f"{summary['count']} older events compacted.",
+            user=job.owner,
+            obj=job,
+            timestamp=summary["last"],
+            extra={
+                "counts": counts,
+                "first": summary["first"].isoformat(),
+                "last": summary["last"].isoformat(),
+            },
+        )
+        old_events.delete()
+    return summary["count"]
+
+
+@shared_task(queue="low-priority", bind=True, track_started=True)
+def compact_old_job_events(self, task_data=None, batch_size=500, **kwargs):
+    """
+    Compacts the events of finished jobs older than EVENTLOG_RETENTION_DAYS
+    (see compact_job_events), up to batch_size jobs per run, so the EventLog
+    table doesn't grow without bound.
+    """
+    retention_days = getattr(settings, "EVENTLOG_RETENTION_DAYS", 90)
+    before = timezone.now() - timedelta(days=retention_days)
+    finished = Job.objects.filter(
+        status__in=[Job.STATUS_COMPLETE, Job.STATUS_FAILED, Job.STATUS_CANCELLED]
+    )
+    # A job's latest event is never compacted, so it alone doesn't make the job
+    # a candidate (otherwise the job would be picked, and compact nothing, on
+    # every run). Jobs without latest_eventlog get it set by compact_job_events.
+    job_ids = (
+        EventLog.objects.filter(
+            content_type=ContentType.objects.get_for_model(Job),
+            timestamp__lt=before,
+            object_id__in=finished.values("id"),
+        )
+        .exclude(event__in=EVENTLOG_COMPACT_KEEP_EVENTS)
+        .exclude(
+            id__in=finished.filter(latest_eventlog__isnull=False).values(
+                "latest_eventlog_id"
+            )
+        )
+        .order_by()
+        .values_list("object_id", flat=True)
+        .distinct()[:batch_size]
+    )
+
+    removed = 0
+    jobs = list(Job.objects.filter(id__in=list(job_ids)))
+    for job in jobs:
+        removed += compact_job_events(job, before)
+    logger.info(f"Compacted {removed} events from {len(jobs)} jobs.")
+
+    task_data = task_data or {}
+    task_data.update(result={"jobs": len(jobs), "events_removed": removed})
+    return task_data
+
+
+def recent_pipeline_versions(
+    compute: ComputeResource, since: datetime
+) -> List[Tuple[str, str]]:
+    """
+    The (pipeline_name, pipeline_version) pairs of jobs created on a
+    ComputeResource since a given time, most used first.
+    """
+    from collections import Counter
+
+    counts = Counter()
+    for params in Job.objects.filter(
+        compute_resource=compute, created_time__gte=since
+    ).values_list("params", flat=True):
+        pipeline_name = (params or {}).get("pipeline")
+        if pipeline_name:
+            version = params.get("params", {}).get("pipeline_version", "default")
+            counts[(pipeline_name, version)] += 1
+    return [pv for pv, _ in counts.most_common()]
+
+
+def _conda_prewarm_script(bundle_path: str, conda_base: str, pipeline_name, version):
+    lib_q = shlex.quote(join(bundle_path, "input/scripts/laxy.lib.sh"))
+    config_q = shlex.quote(join(bundle_path, "input/config"))
+    return (
+        "#!/bin/bash\n"
+        "set -o errexit\n"
+        f"source {lib_q}\n"
+        'function send_event() { echo "${1}: ${2}"; }\n'
+        f"export CONDA_BASE={shlex.quote(conda_base)}\n"
+        "export TMP=$(mktemp -d)\n"
+        "trap 'rm -rf \"${TMP}\"' EXIT\n"
+        'export INPUT_CONFIG_PATH="${TMP}/config"\n'
+        f'cp -rL {config_q} "${{INPUT_CONFIG_PATH}}"\n'
+        "install_miniconda\n"
+        f"init_conda_env {shlex.quote(pipeline_name)} {shlex.quote(version)}\n"
+    )
+
+
+@shared_task(queue="low-priority", bind=True, track_started=True)
+def prewarm_conda_environments(self, task_data=None, **kwargs):
+    """
+    Builds the conda environments of recently run pipeline versions ahead of
+    time, on each online ComputeResource with `extra["conda_prewarm"]` set,
+    so new jobs find them already in the host's environment pool (see
+    init_conda_env in laxy.lib.sh).
+
+    Builds run detached on the host (logged to <jobs_dir>/.conda_prewarm.log).
+    An environment that is already built is just marked as recently used, and
+    a job starting mid-build waits for it rather than building it again.
+    """
+    task_data = task_data or {}
+    days = task_data.get("days", getattr(settings, "CONDA_PREWARM_RECENT_DAYS", 14))
+    since = timezone.now() - timedelta(days=days)
+
+    _init_fabric_env()
+    computes = ComputeResource.objects.filter(status=ComputeResource.STATUS_ONLINE)
+    for compute in computes:
+        if not compute.extra.get("conda_prewarm", False):
+            continue
+
+        for pipeline_name, version in recent_pipeline_versions(compute, since):
+            try:
+                template_files = get_job_template_files(pipeline_name, version)
+            except ImproperlyConfigured as ex:
+                logger.warning(f"Not prewarming {pipeline_name} {version}: {ex}")
+                continue
+            bundle_id, bundle_files = job_script_bundle(
+                template_files, infer_job_file_chmod
+            )
+            if not any(
+                bundle_relpath.startswith("input/config/conda_environment")
+                for bundle_relpath in bundle_files
+            ):
+                # No conda env, or its spec is rendered per job
+                continue
+
+            bundle_path = job_script_bundle_path(compute, bundle_id)
+            script_path = join(
+                compute.jobs_dir, ".conda_prewarm", f"{pipeline_name}-{version}.sh"
+            )
+            log_path = join(compute.jobs_dir, ".conda_prewarm.log")
+            try:
+                with fabsettings(
+                    gateway=compute.gateway_server,
+                    host_string=compute.host,
+                    user=compute.extra.get("username", None),
+                    key=compute.private_key,
+                ):
+                    ensure_remote_job_script_bundle(bundle_path, bundle_files)
+                    run(f"mkdir -p {shlex.quote(dirname(script_path))}")
+                    put(
+                        BytesIO(
+                            _conda_prewarm_script(
+                                bundle_path,
+                                join(compute.jobs_dir, "miniconda3"),
+                                pipeline_name,
+                                version,
+                            ).encode("utf-8")
+                        ),
+                        script_path,
+                        mode=0o700,
+                    )
+                    run(
+                        f"nohup bash {shlex.quote(script_path)} "
+                        f">>{shlex.quote(log_path)} 2>&1 </dev/null &",
+                        pty=False,
+                    )
+                logger.info(
+                    f"Prewarming conda environment for {pipeline_name} {version} "
+                    f"on {compute.id}"
+                )
+            except Exception as ex:
+                logger.warning(
+                    f"Failed to prewarm {pipeline_name} {version} on {compute.id}: "
+                    f"{get_traceback_message(ex)}"
+                )
+
 
 @shared_task(
     bind=True,
@@ -1433,6 +1943,61 @@ def move_job_files_to_archive_task(self, task_data=None, *kwargs):
     return task_data
 
 
+def _parse_rsync_itemized_output(output: str) -> Dict[str, int]:
+    """
+    Parse the output of rsync run with `-ii --out-format="%i|%l|%n"` into a
+    dictionary of {relative_path: size_in_bytes} for every regular file that is
+    present at the destination once the transfer has completed (both
+    transferred and unchanged files are reported when -i is given twice).
+
+    Directories, symlinks, deletions and any non-itemized lines (warnings,
+    summaries) are ignored.
+    """
+    present = {}
+    for line in output.splitlines():
+        line = line.rstrip("\r")
+        parts = line.split("|", 2)
+        if len(parts) != 3:
+            continue
+        itemized, size, name = parts
+        # Itemized change strings look like '>f+++++++++' or '.f         ',
+        # update type followed by file type. Messages like '*deleting' are
+        # skipped, as are non-files.
+        if len(itemized) < 2 or itemized[0] not in "<>ch." or itemized[1] != "f":
+            continue
+        try:
+            present[os.path.normpath(name)] = int(size)
+        except ValueError:
+            continue
+
+    return present
+
+
+def _parse_find_printf_output(output: str) -> Dict[str, int]:
+    """
+    Parse the output of `find <path> -type f -printf "%s\\t%p\\n"` into a
+    dictionary of {path: size_in_bytes}.
+    """
+    present = {}
+    for line in output.splitlines():
+        line = line.rstrip("\r")
+        size, _, name = line.partition("\t")
+        if not name:
+            continue
+        try:
+            present[os.path.normpath(name)] = int(size)
+        except ValueError:
+            continue
+
+    return present
+
+
+def _per_second(amount: Union[int, float], seconds: float) -> Union[float, None]:
+    if not seconds:
+        return None
+    return round(amount / seconds, 2)
+
+
 @shared_task(
     queue="low-priority",
     bind=True,
@@ -1456,6 +2021,11 @@ def bulk_move_job_rsync(self, task_data=None, optional=False, **kwargs):
     Note that this task requires that the source trusts the destination
     via ~/.ssh/authorized_keys. rsync is run on the destination, pulling
     from the source over SSH.
+
+    Destination file presence is confirmed from rsync's own itemized report of
+    what is present at the destination, falling back to a single remote
+    `find -printf` listing for any files not covered by the report, rather than
+    stat-ing each file individually over SFTP.
     """
     task_result = dict()
     try:
@@ -1513,8 +2083,11 @@ def bulk_move_job_rsync(self, task_data=None, optional=False, **kwargs):
                 # generate_uuid is random, so the path to the temporary private key should
                 # be unguessable
                 tmpkeyfn = f"/tmp/.laxy/ssh/id_rsa-{src_compute.id}_{generate_uuid()}"
+                # -ii with an %i out-format reports every file present at the
+                # destination (transferred or unchanged), along with its size.
+                # This report is used to verify the transfer below.
                 cmd = (
-                    f"nice rsync -avsL -e "
+                    f"nice rsync -asL -ii --out-format='%i|%l|%n' -e "
                     f'"ssh -i {tmpkeyfn} -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null" '
                     f'"{src_str}" "{dst_compute.jobs_dir}/"; '
                     f"rm -f {tmpkeyfn}"
@@ -1528,7 +2101,10 @@ def bulk_move_job_rsync(self, task_data=None, optional=False, **kwargs):
                     mode=0o600,
                 )
 
+                rsync_start_time = datetime.utcnow()
                 result = run(cmd)
+                rsync_end_time = datetime.utcnow()
+                rsync_report = _parse_rsync_itemized_output(result.stdout)
                 task_result["stdout"] = result.stdout.strip()
                 task_result["stderr"] = result.stderr.strip()
                 task_result["exit_code"] = result.return_code
@@ -1559,36 +2135,122 @@ def bulk_move_job_rsync(self, task_data=None, optional=False, **kwargs):
                             task_result["exit_code"] = 1
                         break
 
+        rsync_walltime = (rsync_end_time - rsync_start_time).total_seconds()
+        rsync_bytes = sum(rsync_report.values())
+        task_result["metrics"] = {
+            "rsync": {
+                "start_time": rsync_start_time.isoformat(),
+                "end_time": rsync_end_time.isoformat(),
+                "walltime_seconds": rsync_walltime,
+                "files": len(rsync_report),
+                "bytes": rsync_bytes,
+                "bytes_per_second": _per_second(rsync_bytes, rsync_walltime),
+            }
+        }
+
         src_prefix = f"laxy+sftp://{src_compute.id}/"
         dst_prefix = f"laxy+sftp://{dst_compute.id}/"
         if rsync_succeeded:
-            for file in job.get_files():
-                from_location = str(file.location)
-                to_location = str(file.location).replace(src_prefix, dst_prefix, 1)
+            verify_start_time = datetime.utcnow()
+            files = list(job.get_files())
+            default_locations = dict(
+                FileLocation.objects.filter(file__in=files, default=True).values_list(
+                    "file_id", "url"
+                )
+            )
+
+            moves = []
+            for file in files:
+                from_location = default_locations.get(file.id, None)
+                to_location = str(from_location).replace(src_prefix, dst_prefix, 1)
 
                 # If file location hasn't been set, we assume the to/from
                 # locations are the same as the rsync destination. File existance
                 # check next will verify that it's there.
                 # TODO: Verify md5sum in this case, if set
-                if file.location == "" or file.location is None:
+                if from_location == "" or from_location is None:
                     to_location = f"{dst_prefix}{file.path}/{file.name}"
                     from_location = to_location
 
-                if file.exists(loc=to_location):
-                    # Make destination the new default file location
-                    add_file_replica_records([file], dst_compute, set_as_default=True)
-                    # Get file record from database again to ensure our record is fresh and has both locations
-                    _updated_file_record = File.objects.get(id=file.id)
-                    # Delete the real file at the old location, remove old location record
-                    if (
-                        from_location != to_location
-                        and _updated_file_record.locations.filter(
-                            url=from_location
-                        ).exists()
-                    ):
-                        _updated_file_record.delete_at_location(
+                # Path relative to dst_compute.jobs_dir, as reported by rsync
+                rsync_relpath = os.path.normpath(
+                    urlparse(to_location).path.lstrip("/")
+                )
+                moves.append((file, from_location, to_location, rsync_relpath))
+
+            def _present(_report: Dict[str, int], _file: File, _relpath: str) -> bool:
+                if _relpath not in _report:
+                    return False
+                expected_size = None
+                if has_method(_file.metadata, "get"):
+                    expected_size = _file.metadata.get("size", None)
+                return expected_size is None or int(expected_size) == _report[_relpath]
+
+            unconfirmed = [m for m in moves if not _present(rsync_report, m[0], m[3])]
+            remote_listing = {}
+            if unconfirmed:
+                # One remote listing of the job directory at the destination confirms
+                # anything rsync didn't report on, instead of one stat per file.
+                with fabsettings(
+                    gateway=gateway,
+                    host_string=host,
+                    user=remote_username,
+                    key=private_key,
+                    warn_only=True,
+                ):
+                    with hide("output"):
+                        listing = run(
+                            f"cd {shlex.quote(dst_compute.jobs_dir)} && "
+                            f"find {shlex.quote(job.id)} -type f -printf '%s\\t%p\\n'"
+                        )
+                remote_listing = _parse_find_printf_output(listing.stdout)
+
+            confirmed = []
+            missing = []
+            for m in moves:
+                if _present(rsync_report, m[0], m[3]) or _present(
+                    remote_listing, m[0], m[3]
+                ):
+                    confirmed.append(m)
+                else:
+                    missing.append(m[0].id)
+            if missing:
+                logger.warning(
+                    f"bulk_move_job_rsync: {len(missing)} files for job {job.id} "
+                    f"not found at destination {dst_compute.id} after rsync"
+                )
+
+            # Make destination the new default file location
+            add_file_replica_records(
+                [m[0] for m in confirmed], dst_compute, set_as_default=True
+            )
+            verify_end_time = datetime.utcnow()
+
+            # Delete the real file at the old location, remove old location record
+            for file, from_location, to_location, rsync_relpath in confirmed:
+                if from_location != to_location:
+                    try:
+                        file.delete_at_location(
                             from_location, allow_delete_default=False
                         )
+                    except FileLocation.DoesNotExist:
+                        pass
+
+            verify_walltime = (verify_end_time - verify_start_time).total_seconds()
+            confirmed_bytes = sum(
+                rsync_report.get(m[3], remote_listing.get(m[3], 0)) for m in confirmed
+            )
+            task_result["metrics"]["verify"] = {
+                "start_time": verify_start_time.isoformat(),
+                "end_time": verify_end_time.isoformat(),
+                "walltime_seconds": verify_walltime,
+                "files_confirmed": len(confirmed),
+                "files_missing": len(missing),
+                "bytes_confirmed": confirmed_bytes,
+                "remote_listing_used": bool(unconfirmed),
+                "files_per_second": _per_second(len(confirmed), verify_walltime),
+            }
+            task_result["missing_file_ids"] = missing
     except (OSError, IOError, SSHException) as ex:
         self.retry(exc=ex)
     except BaseException as ex:
@@ -5,6 +5,7 @@
 #
 
 function remove_secrets() {
+    flush_events
     if [[ ${DEBUG} != "yes" ]]; then
       # Brief wait to let any outstanding requests finish
       sleep 10
@@ -38,42 +39,131 @@ function update_permissions() {
     find "${JOB_PATH}" -type f -exec chmod "${JOB_FILE_PERMS}" {} \;
 }
 
-function send_event() {
-    local event=${1:-"HEARTBEAT"}
-    local message=${2:-""}
-    local extra=${3:-"{}"}
-    # escape double quotes since this is JSON nested inside JSON ?
-    # extra=$(sed 's/"/\\"/g' <<< "${extra}")
-
-    # || true so we don't stop on errors irrespective of set -o errexit state,
-    # so if a curl call fails we don't bring down the whole script
-    # NOTE: curl v7.55+ is required to use -H @filename
+# Events are spooled to a file and sent in batches to the job's batch event
+# endpoint by a background flusher, rather than one request per event.
+# Set EVENT_BATCH_WINDOW=0 to send each event immediately instead.
+EVENT_SPOOL_DIR="${EVENT_SPOOL_DIR:-${JOB_PATH:-.}/.event_spool}"
+EVENT_BATCH_WINDOW="${EVENT_BATCH_WINDOW:-2}"
+EVENT_BATCH_MAX="${EVENT_BATCH_MAX:-500}"
 
-    VERBOSITY="--silent"
-    if [[ "${DEBUG}" == "yes" ]]; then
+function curl_verbosity() {
+    if [[ "${DEBUG:-}" == "yes" ]]; then
         # NOTE: verbose mode should NOT be used in production since it prints
         # full headers to stdout/stderr, including Authorization tokens.
         # Use -v only: -vv/-vvv on modern curl floods logs with per-byte [WRITE] trace lines.
-        VERBOSITY="-v"
+        echo "-v"
+    else
+        echo "--silent"
     fi
+}
 
+function post_events() {
+    # POSTs JSON from stdin to the given URL, printing the HTTP status code
+    local url="$1"
     curl -X POST \
-         ${CURL_INSECURE} \
+         ${CURL_INSECURE:-} \
          -H "Content-Type: application/json" \
          -H @"${AUTH_HEADER_FILE}" \
          -o /dev/null \
          -w "%{http_code}" \
          --connect-timeout 10 \
-         --max-time 10 \
+         --max-time 30 \
          --retry 8 \
          --retry-max-time 600 \
-         -d '{"event":"'"${event}"'","message":"'"${message}"'","extra":'"${extra}"'}' \
-         ${VERBOSITY} \
-         "${JOB_EVENT_URL}" || true
+         --data-binary @- \
+         $(curl_verbosity) \
+         "${url}" || true
+}
+
+function send_event() {
+    local event=${1:-"HEARTBEAT"}
+    local message=${2:-""}
+    local extra=${3:-"{}"}
+    # escape double quotes since this is JSON nested inside JSON ?
+    # extra=$(sed 's/"/\\"/g' <<< "${extra}")
+
+    # || true so we don't stop on errors irrespective of set -o errexit state,
+    # so if a curl call fails we don't bring down the whole script
+    # NOTE: curl v7.55+ is required to use -H @filename
+
+    local json='{"event":"'"${event}"'","message":"'"${message}"'","extra":'"${extra}"
+    if [[ "${EVENT_BATCH_WINDOW}" == "0" ]] || ! command -v flock >/dev/null; then
+        post_events "${JOB_EVENT_URL}" <<<"${json}}" || true
+        return 0
+    fi
+
+    # The client timestamp keeps events in the order they happened, however
+    # they end up batched
+    local timestamp
+    timestamp=$(date -u +%Y-%m-%dT%H:%M:%S.%6NZ)
+    mkdir -p "${EVENT_SPOOL_DIR}"
+    (
+        flock 9
+        echo "${json}"',"timestamp":"'"${timestamp}"'"}' >>"${EVENT_SPOOL_DIR}/pending"
+    ) 9>>"${EVENT_SPOOL_DIR}/spool.lock" || true
+    start_event_flusher || true
+}
+
+function start_event_flusher() {
+    local pidfile="${EVENT_SPOOL_DIR}/flusher.pid"
+    if [[ -f "${pidfile}" ]] && kill -0 "$(cat "${pidfile}")" 2>/dev/null; then
+        return 0
+    fi
+
+    # Flushes every EVENT_BATCH_WINDOW seconds while this script runs, then
+    # once more after it exits
+    local parent=$$
+    (
+        set +o xtrace +o errexit
+        trap - EXIT
+        while kill -0 "${parent}" 2>/dev/null; do
+            sleep "${EVENT_BATCH_WINDOW}"
+            flush_events
+        done
+        flush_events
+    ) </dev/null >/dev/null 2>&1 &
+    echo $! >"${pidfile}"
+}
+
+function flush_events() {
+    # Sends spooled events in batches of up to EVENT_BATCH_MAX. A batch that
+    # fails to send is kept and resent (with anything spooled since) by the
+    # next flush.
+    local spool="${EVENT_SPOOL_DIR}"
+    [[ -d "${spool}" ]] || return 0
+    local batch_url="${JOB_EVENT_BATCH_URL:-${JOB_EVENT_URL%event/}events/}"
+    (
+        flock 8
+        (
+            flock 9
+            if [[ -s "${spool}/pending" ]]; then
+                cat "${spool}/pending" >>"${spool}/batch" && rm -f "${spool}/pending"
+            fi
+        ) 9>>"${spool}/spool.lock"
+
+        while [[ -s "${spool}/batch" ]]; do
+            head -n "${EVENT_BATCH_MAX}" "${spool}/batch" >"${spool}/chunk"
+            local code
+            code=$( (echo "["; sed '$!s/$/,/' "${spool}/chunk"; echo "]") | post_events "${batch_url}")
+            if [[ "${code}" == 400 ]]; then
+                # The batch as a whole was rejected (eg an event that isn't
+                # valid JSON) - send events one at a time so only bad ones are lost
+                while read -r line; do
+                    post_events "${JOB_EVENT_URL}" <<<"${line}" >/dev/null
+                done <"${spool}/chunk"
+            elif [[ "${code}" != 2* ]]; then
+                break
+            fi
+            sed -i "1,$(wc -l <"${spool}/chunk")d" "${spool}/batch"
+        done
+        rm -f "${spool}/chunk"
+    ) 8>>"${spool}/flush.lock" || true
 }
 
 function send_job_finished() {
     local _exit_code=$1
+    # Events reach the server before the job is marked finished
+    flush_events
     curl -X PATCH \
          ${CURL_INSECURE} \
          -H "Content-Type: application/json" \
@@ -256,15 +346,75 @@ function install_miniforge() {
     fi
 }
 
+# Conda environments are pooled per ComputeResource (in ${CONDA_BASE}/envs/laxy-<hash>),
+# keyed by a hash of the canonicalised environment spec, so jobs - and pipeline
+# versions - with the same spec share one environment. Comments, whitespace, line
+# endings and the `name:` line don't change the hash.
+function conda_env_spec_hash() {
+    sed -e 's/\r$//' \
+        -e 's/\(^\|[[:space:]]\)#.*$//' \
+        -e 's/[[:space:]]*$//' \
+        -e '/^$/d' \
+        -e '/^name:/d' \
+        "${1}" | sha256sum | cut -c1-16
+}
+
+# Take a shared lock on a pooled environment (${prefix}.lock), held until the job
+# exits, so conda_env_pool_gc (which needs it exclusively) never removes an
+# environment a running job is using. Any number of jobs can hold it at once -
+# building an environment takes a separate lock, ${prefix}.build.lock.
+function conda_env_use_lock() {
+    local _prefix="${1}"
+
+    if ! command -v flock >/dev/null 2>&1; then
+        return 0
+    fi
+    exec {CONDA_ENV_LOCK_FD}>>"${_prefix}.lock"
+    flock -s "${CONDA_ENV_LOCK_FD}"
+}
+
+# Remove pooled environments not used for LAXY_CONDA_ENV_MAX_AGE_DAYS, and the least
+# recently used beyond the newest LAXY_CONDA_ENV_POOL_SIZE. Environments in use by a
+# running job (or being built) are locked (see conda_env_use_lock), so are skipped.
+function conda_env_pool_gc() {
+    local _max_age_days="${LAXY_CONDA_ENV_MAX_AGE_DAYS:-30}"
+    local _pool_size="${LAXY_CONDA_ENV_POOL_SIZE:-8}"
+
+    if ! command -v flock >/dev/null 2>&1; then
+        return 0
+    fi
+
+    local -i _n=0
+    local _last_used _prefix
+    while read -r _last_used _prefix; do
+        _n+=1
+        if (( _n <= _pool_size )) && \
+           [[ -f "${_prefix}/.laxy_env_ready" ]] && \
+           (( _last_used > $(date +%s) - _max_age_days * 86400 )); then
+            continue
+        fi
+        (
+            flock -n -x 9 || exit 0
+            echo "Removing unused conda environment ${_prefix}"
+            rm -rf "${_prefix}"
+        ) 9>>"${_prefix}.lock"
+    done < <(
+        for _prefix in "${CONDA_BASE}"/envs/laxy-*/; do
+            [[ -d "${_prefix}" ]] || continue
+            _prefix="${_prefix%/}"
+            echo "$(stat -c %Y "${_prefix}/.laxy_last_used" 2>/dev/null || echo 0) ${_prefix}"
+        done | sort -rn
+    )
+}
+
 function init_conda_env() {
 
     CONDA_INSTALL_BINARY=mamba
     #CONDA_INSTALL_BINARY=conda
 
-    # By convention, we name our Conda environments after {pipeline}-{version}
-    # Each new pipeline version has it's own Conda env
+    # By convention, we name our Conda environments after {pipeline}-{version}.
+    # The environment itself is shared by every job with the same spec.
     local env_name="${1}-${2}"
-    local pip="${CONDA_BASE}/envs/${env_name}/bin/pip"
 
     # Conda activate misbehaves if nounset and errexit are set
     # https://github.com/conda/conda/issues/3200
@@ -278,24 +428,41 @@ function init_conda_env() {
     set --
     source "${CONDA_BASE}/bin/activate"
 
-    # A directory existing isn't enough to know the env is usable - env creation can fail
-    # partway through (eg the pip step), leaving a broken directory behind that would
-    # otherwise be silently reused forever. We key the completion marker on a hash of the
-    # environment spec file, so editing conda_environment(_explicit).yml/txt also triggers
-    # a rebuild rather than silently reusing a now-stale environment.
     local _env_spec_file="${INPUT_CONFIG_PATH}/conda_environment.yml"
     [[ -f "${INPUT_CONFIG_PATH}/conda_environment_explicit.txt" ]] && _env_spec_file="${INPUT_CONFIG_PATH}/conda_environment_explicit.txt"
-    local _env_spec_hash
-    _env_spec_hash=$(md5sum "${_env_spec_file}" | cut -d' ' -f1)
-    local _env_ready_marker="${CONDA_BASE}/envs/${env_name}/.laxy_env_ready-${_env_spec_hash}"
-    if [[ -d "${CONDA_BASE}/envs/${env_name}" ]] && [[ ! -f "${_env_ready_marker}" ]]; then
-        send_event "JOB_INFO" "Removing incomplete or outdated conda environment ${env_name} from a previous install"
-        rm -rf "${CONDA_BASE}/envs/${env_name}"
+    local _env_prefix="${CONDA_BASE}/envs/laxy-$(conda_env_spec_hash "${_env_spec_file}")"
+    local _env_ready_marker="${_env_prefix}/.laxy_env_ready"
+    mkdir -p "${CONDA_BASE}/envs"
+
+    # In use from here (even while being built), so it isn't garbage collected
+    conda_env_use_lock "${_env_prefix}" || return 1
+
+    # Concurrent jobs needing the same environment (not yet built) wait here for
+    # a single build. Once it's ready, jobs go straight past.
+    local _build_lock_fd
+    if [[ ! -f "${_env_ready_marker}" ]] && command -v flock >/dev/null 2>&1; then
+        exec {_build_lock_fd}>>"${_env_prefix}.build.lock"
+        flock -x "${_build_lock_fd}"
+    fi
+
+    # A directory existing isn't enough to know the env is usable - env creation can fail
+    # partway through (eg the pip step), leaving a broken directory behind that would
+    # otherwise be silently reused forever.
+    if [[ -d "${_env_prefix}" ]] && [[ ! -f "${_env_ready_marker}" ]]; then
+        send_event "JOB_INFO" "Removing incomplete conda environment for ${env_name} from a previous install"
+        rm -rf "${_env_prefix}"
     fi
 
     if [[ ! -f "${_env_ready_marker}" ]]; then
         send_event "JOB_INFO" "Installing dependencies (conda environment ${env_name})"
 
+        # Jobs building different environments still share the base environment
+        local _base_lock_fd
+        if command -v flock >/dev/null 2>&1; then
+            exec {_base_lock_fd}>>"${CONDA_BASE}/.laxy_base.lock"
+            flock -x "${_base_lock_fd}"
+        fi
+
         # Accept the terms of service for the conda channels. CONDA_PLUGINS_AUTO_ACCEPT_TOS
         # covers conda versions/plugins that enforce channel ToS without needing the `conda tos`
         # subcommand at all: https://www.anaconda.com/docs/getting-started/tos-plugin#ci%2Fcd-environments
@@ -319,36 +486,42 @@ function init_conda_env() {
         # We need gcc to compile some pip dependencies for laxydl, so grab that too :/
         ${CONDA_INSTALL_BINARY} install --yes -n base -c conda-forge curl git jq gcc_linux-64 || return 1
 
-        # Create an empty environment
-        # conda create --yes -m -n "${env_name}" || return 1
+        if [[ -n "${_base_lock_fd:-}" ]]; then
+            exec {_base_lock_fd}>&-
+        fi
 
 ##       TODO: Also consider `conda-pack` support to find and use pre-packaged environment tarballs
 ##       https://conda.github.io/conda-pack/ - less likely to break than an enviroment.yml (on a single arch)
 #        CONDA_PACK_PATH="${JOB_PATH}/../conda-pack"
 #        if [[ -f "${CONDA_PACK_PATH}/${env_name}.tar.gz" ]]; then
-#          mkdir -p "${CONDA_BASE}/envs/${env_name}"
-#          tar -xzf  "${CONDA_PACK_PATH}/${env_name}.tar.gz" -C "${CONDA_BASE}/envs/${env_name}"
-#          conda activate "${CONDA_BASE}/envs/${env_name}" || return 1
+#          mkdir -p "${_env_prefix}"
+#          tar -xzf  "${CONDA_PACK_PATH}/${env_name}.tar.gz" -C "${_env_prefix}"
+#          conda activate "${_env_prefix}" || return 1
 #          conda-unpack || return 1
 #        fi
 
         if [[ -f "${INPUT_CONFIG_PATH}/conda_environment_explicit.txt" ]]; then
             # Create environment with explicit dependencies
-            ${CONDA_INSTALL_BINARY} create --name "${env_name}" --file "${INPUT_CONFIG_PATH}/conda_environment_explicit.txt" || return 1
+            ${CONDA_INSTALL_BINARY} create --prefix "${_env_prefix}" --file "${INPUT_CONFIG_PATH}/conda_environment_explicit.txt" || return 1
         else
             # Create from an environment (yml) file
-            ${CONDA_INSTALL_BINARY} env create --name "${env_name}" --file "${INPUT_CONFIG_PATH}/conda_environment.yml" || return 1
+            ${CONDA_INSTALL_BINARY} env create --prefix "${_env_prefix}" --file "${INPUT_CONFIG_PATH}/conda_environment.yml" || return 1
         fi
 
         touch "${_env_ready_marker}"
     fi
 
+    if [[ -n "${_build_lock_fd:-}" ]]; then
+        exec {_build_lock_fd}>&-
+    fi
+    touch "${_env_prefix}/.laxy_last_used"
+
     # We shouldn't need to do this .. but it seems required for _some_ environments (ie M3)
-    export JAVA_HOME="${CONDA_BASE}/envs/${env_name}/jre"
+    export JAVA_HOME="${_env_prefix}/jre"
 
     # shellcheck disable=SC1090
-    # source "${CONDA_BASE}/bin/activate" "${CONDA_BASE}/envs/${env_name}"
-    conda activate "${CONDA_BASE}/envs/${env_name}" || return 1
+    # source "${CONDA_BASE}/bin/activate" "${_env_prefix}"
+    conda activate "${_env_prefix}" || return 1
 
     # Capture conda environment files
     conda env export >"${INPUT_CONFIG_PATH}/conda_environment.snapshot.yml" || true
@@ -358,6 +531,8 @@ function init_conda_env() {
     # version of curl (>7.55)
     send_event "JOB_INFO" "Successfully activated conda environment (${env_name})."
 
+    conda_env_pool_gc || true
+
     set -o nounset
 }
 
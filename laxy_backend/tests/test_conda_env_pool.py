@@ -0,0 +1,168 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import time
+import unittest
+from pathlib import Path
+
+LAXY_LIB_SH = (
+    Path(__file__).resolve().parent.parent
+    / "templates/common/job/input/scripts/laxy.lib.sh"
+)
+
+# Stands in for both conda and mamba: records each call, and 'creates' an
+# environment by making its prefix directory (slowly, so concurrent jobs overlap).
+STUB_CONDA = """\
+#!/bin/bash
+echo "$(basename "$0") $*" >>"${STUB_CONDA_LOG}"
+while [[ $# -gt 0 ]]; do
+    if [[ "$1" == "--prefix" ]]; then
+        sleep 1
+        mkdir -p "$2/bin"
+    fi
+    shift
+done
+"""
+
+STUB_ACTIVATE = """\
+function conda() {
+    echo "activate $*" >>"${STUB_CONDA_LOG}"
+}
+"""
+
+
+@unittest.skipUnless(
+    shutil.which("flock") and shutil.which("bash"), "needs bash and flock"
+)
+class CondaEnvPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.conda_base = self.tmp / "miniconda3"
+        bindir = self.conda_base / "bin"
+        bindir.mkdir(parents=True)
+        for name in ("conda", "mamba"):
+            (bindir / name).write_text(STUB_CONDA)
+            (bindir / name).chmod(0o755)
+        (bindir / "activate").write_text(STUB_ACTIVATE)
+        self.log = self.tmp / "conda.log"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _job_config(self, name: str, spec: str) -> Path:
+        config = self.tmp / name / "input" / "config"
+        config.mkdir(parents=True)
+        (config / "conda_environment.yml").write_text(spec)
+        return config
+
+    def _start_job(self, config: Path, after: str = "", **env) -> subprocess.Popen:
+        script = textwrap.dedent(
+            f"""
+            set -o errexit
+            source "{LAXY_LIB_SH}"
+            function send_event() {{ :; }}
+            init_conda_env test-pipeline 1.0
+            {after}
+            """
+        )
+        return subprocess.Popen(
+            ["bash", "-c", script],
+            env=dict(
+                os.environ,
+                CONDA_BASE=str(self.conda_base),
+                INPUT_CONFIG_PATH=str(config),
+                STUB_CONDA_LOG=str(self.log),
+                **env,
+            ),
+        )
+
+    def _run_job(self, config: Path, **env) -> None:
+        self.assertEqual(self._start_job(config, **env).wait(), 0)
+
+    def _creates(self):
+        return [
+            line for line in self.log.read_text().splitlines() if "--prefix" in line
+        ]
+
+    def _pool(self):
+        return sorted(p.name for p in (self.conda_base / "envs").glob("laxy-*") if p.is_dir())
+
+    def test_concurrent_jobs_share_one_build(self):
+        spec = "name: one\ndependencies:\n  - jq\n"
+        jobs = [
+            self._start_job(self._job_config(f"job{i}", spec)) for i in range(3)
+        ]
+        self.assertEqual([job.wait() for job in jobs], [0, 0, 0])
+
+        self.assertEqual(len(self._creates()), 1)
+        self.assertEqual(len(self._pool()), 1)
+        prefix = self.conda_base / "envs" / self._pool()[0]
+        self.assertTrue((prefix / ".laxy_env_ready").exists())
+        self.assertIn(f"activate activate {prefix}", self.log.read_text())
+
+    def test_jobs_using_an_environment_dont_block_each_other(self):
+        spec = "dependencies:\n  - jq\n"
+        release = self.tmp / "release"
+        running = self._start_job(
+            self._job_config("running", spec),
+            after=f'while [[ ! -f "{release}" ]]; do sleep 0.1; done',
+        )
+        try:
+            ready = self.conda_base / "envs"
+            while not list(ready.glob("laxy-*/.laxy_last_used")):
+                self.assertIsNone(running.poll())
+                time.sleep(0.05)
+
+            # Same spec, while the first job still holds the environment
+            second = self._start_job(self._job_config("second", spec))
+            self.assertEqual(second.wait(timeout=30), 0)
+            self.assertIsNone(running.poll())
+            self.assertEqual(len(self._creates()), 1)
+        finally:
+            release.touch()
+        self.assertEqual(running.wait(), 0)
+
+    def test_spec_hash_is_canonical(self):
+        self._run_job(self._job_config("a", "name: a\ndependencies:\n  - jq\n"))
+        self._run_job(
+            self._job_config(
+                "b", "# a comment\r\nname: b\r\n\r\ndependencies:  \r\n  - jq # why\r\n"
+            )
+        )
+        self.assertEqual(len(self._creates()), 1)
+
+        self._run_job(self._job_config("c", "dependencies:\n  - jq=1.7\n"))
+        self.assertEqual(len(self._creates()), 2)
+        self.assertEqual(len(self._pool()), 2)
+
+    def test_gc_removes_least_recently_used_but_not_in_use(self):
+        # Holds its environment (as a running job does) until we release it
+        release = self.tmp / "release"
+        in_use = self._start_job(
+            self._job_config("busy", "dependencies:\n  - busy\n"),
+            after=f'while [[ ! -f "{release}" ]]; do sleep 0.1; done',
+        )
+        while len(self._pool()) < 1 or not list(
+            (self.conda_base / "envs").glob("laxy-*/.laxy_last_used")
+        ):
+            self.assertIsNone(in_use.poll())
+            time.sleep(0.05)
+        busy = self._pool()[0]
+
+        self._run_job(
+            self._job_config("old", "dependencies:\n  - old\n"),
+            LAXY_CONDA_ENV_POOL_SIZE="8",
+        )
+        self._run_job(
+            self._job_config("new", "dependencies:\n  - new\n"),
+            LAXY_CONDA_ENV_POOL_SIZE="1",
+        )
+
+        # 'old' is collected; 'busy' is beyond the pool size too, but in use
+        self.assertEqual(len(self._pool()), 2)
+        self.assertIn(busy, self._pool())
+
+        release.touch()
+        self.assertEqual(in_use.wait(), 0)
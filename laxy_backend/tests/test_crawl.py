@@ -0,0 +1,456 @@
+import json
+import socket
+import socketserver
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from posixpath import join as join_path, normpath
+from urllib.parse import quote, unquote, urlparse
+
+from django.test import TestCase
+from django.urls import reverse
+
+from laxy_backend.scraping import parse_nextcloud_webdav
+from laxy_backend.scraping.crawl import (
+    FTP_CONNECTIONS_PER_HOST,
+    DirectoryCrawler,
+    FTPLister,
+    WebDAVLister,
+    listing_cache,
+)
+from .test_views import _create_user_and_login
+
+
+def _synthetic_tree(runs: int = 4, files_per_run: int = 3) -> dict:
+    """
+    /data/run{n}/ directories of fastq.gz files, each with a qc/ subdirectory.
+    Directories are dicts, files are their size.
+    """
+    data = {}
+    for n in range(runs):
+        run = {f"SRR{n:03d}{i}_1.fastq.gz": 1000 + i for i in range(files_per_run)}
+        run["qc"] = {"report.html": 10}
+        data[f"run{n}"] = run
+    return {"data": data, "README.txt": 5}
+
+
+class _Tree:
+    """A directory tree with a modification time per node, shared by the stand-ins."""
+
+    def __init__(self, tree: dict):
+        self.tree = tree
+        self.mtimes = {}
+
+    def lookup(self, path: str):
+        node = self.tree
+        for part in normpath("/" + path.lstrip("/")).strip("/").split("/"):
+            if not part:
+                continue
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def modified(self, path: str) -> str:
+        return self.mtimes.get(normpath("/" + path.lstrip("/")), "20240101000000")
+
+    def touch(self, path: str, mtime: str):
+        self.mtimes[normpath("/" + path.lstrip("/"))] = mtime
+
+
+class StandInFTPServer(_Tree):
+    """
+    A minimal local stand-in for a remote FTP server (anonymous login, PASV,
+    CWD, MLST, MLSD, LIST and RETR only). Each listing takes `delay` seconds.
+    Records the number of control connections and the commands received.
+    """
+
+    def __init__(self, tree: dict, delay: float = 0.0):
+        super().__init__(tree)
+        self.delay = delay
+        self.connections = 0
+        self.commands = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _reply(self, line: str):
+                self.wfile.write(f"{line}\r\n".encode("utf-8"))
+
+            def _facts(self, path: str, node) -> str:
+                if isinstance(node, dict):
+                    return f"type=dir;modify={server.modified(path)};"
+                return f"type=file;size={node};modify={server.modified(path)};"
+
+            def handle(self):
+                with server._lock:
+                    server.connections += 1
+                self._reply("220 Stand-in FTP server")
+                passive = None
+                cwd = "/"
+                for raw in self.rfile:
+                    cmd, _, arg = raw.decode("utf-8").rstrip("\r\n").partition(" ")
+                    cmd = cmd.upper()
+                    arg = normpath(join_path(cwd, arg)) if arg else cwd
+                    with server._lock:
+                        server.commands.append(cmd)
+
+                    if cmd == "USER":
+                        self._reply("331 Any password will do")
+                    elif cmd == "PASS":
+                        self._reply("230 Logged in")
+                    elif cmd == "FEAT":
+                        self.wfile.write(
+                            b"211-Features:\r\n MLST type*;size*;modify*;\r\n UTF8\r\n211 End\r\n"
+                        )
+                    elif cmd in ["OPTS", "TYPE", "NOOP"]:
+                        self._reply("200 OK")
+                    elif cmd == "PWD":
+                        self._reply(f'257 "{cwd}"')
+                    elif cmd == "CWD":
+                        if isinstance(server.lookup(arg), dict):
+                            cwd = arg
+                            self._reply("250 OK")
+                        else:
+                            self._reply("550 No such directory")
+                    elif cmd == "PASV":
+                        passive = socket.socket()
+                        passive.bind(("127.0.0.1", 0))
+                        passive.listen(1)
+                        port = passive.getsockname()[1]
+                        self._reply(
+                            f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 255})"
+                        )
+                    elif cmd == "MLST":
+                        node = server.lookup(arg)
+                        if node is None:
+                            self._reply("550 No such file or directory")
+                        else:
+                            self._reply("250-Listing")
+                            self._reply(f" {self._facts(arg, node)} {arg}")
+                            self._reply("250 End")
+                    elif cmd in ["MLSD", "LIST"]:
+                        time.sleep(server.delay)
+                        node = server.lookup(arg)
+                        if not isinstance(node, dict):
+                            passive.close()
+                            self._reply("550 Not a directory")
+                            continue
+                        self._reply("150 Here comes the listing")
+                        conn, _ = passive.accept()
+                        for name, child in node.items():
+                            facts = self._facts(join_path(arg, name), child)
+                            conn.sendall(f"{facts} {name}\r\n".encode("utf-8"))
+                        conn.close()
+                        passive.close()
+                        self._reply("226 Done")
+                    elif cmd == "RETR":
+                        node = server.lookup(arg)
+                        if not isinstance(node, int):
+                            passive.close()
+                            self._reply("550 Not a file")
+                            continue
+                        self._reply("150 Here comes the file")
+                        conn, _ = passive.accept()
+                        try:
+                            conn.sendall(b"x" * node)
+                        except OSError:
+                            pass
+                        conn.close()
+                        passive.close()
+                        self._reply("226 Done")
+                    elif cmd == "QUIT":
+                        self._reply("221 Bye")
+                        break
+                    else:
+                        self._reply("502 Not implemented")
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"ftp://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StandInWebDAVServer(_Tree):
+    """
+    A local stand-in for a Nextcloud public share, answering PROPFIND under
+    /public.php/dav/files/{token}/ with an ETag per collection. Records the
+    Depth of each PROPFIND.
+    """
+
+    def __init__(self, tree: dict, token: str = "lnSmyyug1fexY8l"):
+        super().__init__(tree)
+        self.token = token
+        self.propfinds = []
+        self._lock = threading.Lock()
+        server = self
+        prefix = f"/public.php/dav/files/{token}"
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _response_xml(self, path: str, node) -> str:
+                href = quote(
+                    f"{prefix}{path}" + ("/" if isinstance(node, dict) else "")
+                )
+                if isinstance(node, dict):
+                    props = "<d:resourcetype><d:collection/></d:resourcetype>"
+                else:
+                    props = f"<d:resourcetype/><d:getcontentlength>{node}</d:getcontentlength>"
+                props += f'<d:getetag>"{server.modified(path)}"</d:getetag>'
+                return (
+                    f"<d:response><d:href>{href}</d:href><d:propstat><d:prop>{props}"
+                    f"</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+                )
+
+            def do_PROPFIND(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                depth = self.headers.get("Depth", "1")
+                with server._lock:
+                    server.propfinds.append(depth)
+
+                path = unquote(urlparse(self.path).path)[len(prefix) :]
+                path = normpath("/" + path.lstrip("/"))
+                node = server.lookup(path)
+                if not self.path.startswith(prefix) or node is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                responses = [self._response_xml(path, node)]
+                if depth == "1" and isinstance(node, dict):
+                    responses.extend(
+                        self._response_xml(join_path(path, name), child)
+                        for name, child in node.items()
+                    )
+                body = (
+                    '<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">'
+                    + "".join(responses)
+                    + "</d:multistatus>"
+                ).encode("utf-8")
+                self.send_response(207)
+                self.send_header("Content-Type", "application/xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def _crawl_all(crawler: DirectoryCrawler, path: str) -> list:
+    return [entry for entries in crawler.crawl(path) for entry in entries]
+
+
+class FTPCrawlTest(unittest.TestCase):
+    def setUp(self):
+        listing_cache().clear()
+        self.server = StandInFTPServer(_synthetic_tree(), delay=0.3).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_crawl_lists_directories_concurrently(self):
+        crawler = DirectoryCrawler(FTPLister(self.server.url), max_depth=2)
+
+        start = time.monotonic()
+        entries = _crawl_all(crawler, "/data")
+        elapsed = time.monotonic() - start
+
+        # /data, then its four runs at once - one after another would take 1.5 s
+        self.assertLess(elapsed, 1.2)
+        self.assertEqual(self.server.commands.count("MLSD"), 5)
+        self.assertEqual(
+            sorted(
+                join_path(e["path"], e["name"]) for e in entries if e["path"] == "run0"
+            ),
+            [
+                "run0/SRR0000_1.fastq.gz",
+                "run0/SRR0001_1.fastq.gz",
+                "run0/SRR0002_1.fastq.gz",
+                "run0/qc",
+            ],
+        )
+        self.assertIn(
+            f"{self.server.url}/data/run0/SRR0000_1.fastq.gz",
+            [e["location"] for e in entries],
+        )
+        self.assertFalse(crawler.truncated)
+
+    def test_depth_and_entry_limits(self):
+        entries = _crawl_all(DirectoryCrawler(FTPLister(self.server.url)), "/data")
+        self.assertEqual(
+            sorted(e["name"] for e in entries), [f"run{n}" for n in range(4)]
+        )
+
+        entries = _crawl_all(
+            DirectoryCrawler(FTPLister(self.server.url), max_depth=3), "/data"
+        )
+        self.assertIn("report.html", [e["name"] for e in entries])
+
+        crawler = DirectoryCrawler(
+            FTPLister(self.server.url), max_depth=3, max_entries=6
+        )
+        self.assertEqual(len(_crawl_all(crawler, "/data")), 6)
+        self.assertTrue(crawler.truncated)
+
+    def test_unchanged_directories_are_not_listed_again(self):
+        crawler = DirectoryCrawler(FTPLister(self.server.url), max_depth=2)
+        first = _crawl_all(crawler, "/data")
+        self.assertEqual(self.server.commands.count("MLSD"), 5)
+
+        second = _crawl_all(crawler, "/data")
+        self.assertEqual(self.server.commands.count("MLSD"), 5)
+        self.assertEqual(
+            sorted(e["location"] for e in first), sorted(e["location"] for e in second)
+        )
+
+        # A changed directory is listed again
+        self.server.tree["data"]["run1"]["new.fastq.gz"] = 1
+        self.server.touch("/data/run1", "20250101000000")
+        third = _crawl_all(crawler, "/data")
+        self.assertEqual(self.server.commands.count("MLSD"), 6)
+        self.assertIn("new.fastq.gz", [e["name"] for e in third])
+
+    def test_connections_are_pooled(self):
+        crawler = DirectoryCrawler(FTPLister(self.server.url), max_depth=3)
+        _crawl_all(crawler, "/data")
+        _crawl_all(DirectoryCrawler(FTPLister(self.server.url), use_cache=False), "/")
+        self.assertLessEqual(self.server.connections, FTP_CONNECTIONS_PER_HOST)
+        self.assertEqual(self.server.commands.count("USER"), self.server.connections)
+
+
+class WebDAVCrawlTest(unittest.TestCase):
+    def setUp(self):
+        listing_cache().clear()
+        self.server = StandInWebDAVServer(_synthetic_tree()).__enter__()
+        self.root_url = f"{self.server.url}/public.php/dav/files/{self.server.token}/"
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_crawl(self):
+        crawler = DirectoryCrawler(WebDAVLister(self.root_url), max_depth=2)
+        entries = _crawl_all(crawler, "data")
+        self.assertEqual(len(entries), 4 + 4 * 4)
+        sizes = {join_path(e["path"], e["name"]): e["size"] for e in entries}
+        self.assertEqual(sizes["run2/SRR0021_1.fastq.gz"], 1001)
+        self.assertIsNone(sizes["run2/qc"])
+
+        # Unchanged, so only checked (Depth: 0) rather than listed (Depth: 1)
+        self.server.propfinds.clear()
+        _crawl_all(crawler, "data")
+        self.assertEqual(self.server.propfinds, ["0"] * 5)
+
+    def test_parse_nextcloud_webdav(self):
+        url = f"{self.server.url}/s/{self.server.token}?path=/data/run0"
+        links = parse_nextcloud_webdav(None, url)
+        by_name = {link["name"]: link for link in links}
+
+        self.assertEqual(
+            by_name[".."]["location"],
+            f"{self.server.url}/s/{self.server.token}?path=/data",
+        )
+        self.assertEqual(
+            by_name["qc"]["location"],
+            f"{self.server.url}/s/{self.server.token}?path=/data/run0/qc",
+        )
+        self.assertEqual(
+            by_name["SRR0000_1.fastq.gz"]["location"],
+            f"{self.root_url}data/run0/SRR0000_1.fastq.gz",
+        )
+        self.assertEqual(by_name["SRR0000_1.fastq.gz"]["type"], "file")
+        self.assertEqual(len(links), 5)
+
+
+class RemoteBrowseCrawlViewTest(TestCase):
+    def setUp(self):
+        listing_cache().clear()
+        self.user, self.client = _create_user_and_login()
+        self.server = StandInFTPServer(_synthetic_tree()).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_ftp_listing(self):
+        response = self.client.post(
+            reverse("laxy_backend:remote-browse"),
+            data=json.dumps(
+                {
+                    "url": f"{self.server.url}/data",
+                    "depth": 2,
+                    "fileglob": "*_1.fastq.gz",
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        names = [item["name"] for item in response.json()["listing"]]
+        self.assertEqual(len(names), 4 + 4 * 4)
+        self.assertIn("run3/SRR0032_1.fastq.gz", names)
+        self.assertFalse(response.json()["truncated"])
+
+    def test_ftp_listing_stream(self):
+        response = self.client.post(
+            reverse("laxy_backend:remote-browse"),
+            data=json.dumps(
+                {"url": f"{self.server.url}/data", "depth": 3, "stream": True}
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+
+        # /data, four runs and four qc directories, then the end
+        self.assertEqual(len(lines), 1 + 4 + 4 + 1)
+        self.assertEqual(
+            lines[-1], {"listing": [], "complete": True, "truncated": False}
+        )
+        self.assertIn(
+            "run1/qc/report.html",
+            [item["name"] for line in lines for item in line["listing"]],
+        )
+
+    def test_ftp_file(self):
+        response = self.client.post(
+            reverse("laxy_backend:remote-browse"),
+            data=json.dumps({"url": f"{self.server.url}/README.txt"}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["listing"],
+            [
+                {
+                    "name": "README.txt",
+                    "location": f"{self.server.url}/README.txt",
+                    "type": "file",
+                    "tags": [],
+                }
+            ],
+        )
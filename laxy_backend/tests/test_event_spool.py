@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+
+LAXY_LIB_SH = (
+    Path(__file__).resolve().parent.parent
+    / "templates/common/job/input/scripts/laxy.lib.sh"
+)
+
+JOB_EVENT_URL = "https://laxy.example.com/api/v1/job/someJobId/event/"
+
+# Records each request (URL and body), and answers batch requests with the
+# status code in STUB_CURL_CODE and single events with 201.
+STUB_CURL = """\
+#!/bin/bash
+url="${@: -1}"
+data=$(cat)
+printf '%s\\t%s\\n' "${url}" "$(tr -d '\\n' <<<"${data}")" >>"${STUB_CURL_LOG}"
+if [[ "${url}" == */events/ ]]; then
+    cat "${STUB_CURL_CODE}"
+else
+    echo -n 201
+fi
+"""
+
+
+@unittest.skipUnless(
+    shutil.which("flock") and shutil.which("bash"), "needs bash and flock"
+)
+class EventSpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        bindir = self.tmp / "bin"
+        bindir.mkdir()
+        (bindir / "curl").write_text(STUB_CURL)
+        (bindir / "curl").chmod(0o755)
+        self.log = self.tmp / "curl.log"
+        self.code = self.tmp / "code"
+        self.code.write_text("200")
+        self.spool = self.tmp / ".event_spool"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _run(self, commands: str, window: str = "60") -> None:
+        script = textwrap.dedent(
+            f"""
+            set -o errexit
+            set -o nounset
+            source "{LAXY_LIB_SH}"
+            {commands}
+            """
+        )
+        result = subprocess.run(
+            ["bash", "-c", script],
+            env=dict(
+                os.environ,
+                PATH=f"{self.tmp / 'bin'}:{os.environ['PATH']}",
+                JOB_PATH=str(self.tmp),
+                JOB_EVENT_URL=JOB_EVENT_URL,
+                AUTH_HEADER_FILE=str(self.tmp / "auth_header"),
+                EVENT_BATCH_WINDOW=window,
+                STUB_CURL_LOG=str(self.log),
+                STUB_CURL_CODE=str(self.code),
+            ),
+            timeout=60,
+        )
+        self.assertEqual(result.returncode, 0)
+
+    def _stop_flusher(self) -> str:
+        return f'kill $(cat "{self.spool}/flusher.pid")'
+
+    def _requests(self):
+        if not self.log.exists():
+            return []
+        requests = []
+        for line in self.log.read_text().splitlines():
+            url, data = line.split("\t", 1)
+            events = json.loads(data)
+            requests.append((url, events if isinstance(events, list) else [events]))
+        return requests
+
+    def _messages(self, events):
+        return [e["message"] for e in events]
+
+    def test_events_sent_in_one_batch(self):
+        self._run(
+            "send_event JOB_INFO one; send_event JOB_INFO two '{\"n\":2}'; "
+            "send_event JOB_INFO three; sleep 1.5",
+            window="0.5",
+        )
+
+        requests = self._requests()
+        self.assertEqual(len(requests), 1)
+        url, events = requests[0]
+        self.assertEqual(url, JOB_EVENT_URL.replace("/event/", "/events/"))
+        self.assertEqual(self._messages(events), ["one", "two", "three"])
+        self.assertEqual(events[1]["extra"], {"n": 2})
+        self.assertEqual(
+            [e["timestamp"] for e in events], sorted(e["timestamp"] for e in events)
+        )
+
+    def test_failed_batch_is_resent(self):
+        self._run(
+            f'echo -n 503 >"{self.code}"; send_event JOB_INFO one; flush_events; '
+            f'echo -n 200 >"{self.code}"; send_event JOB_INFO two; flush_events; '
+            + self._stop_flusher()
+        )
+
+        requests = self._requests()
+        self.assertEqual(
+            [self._messages(events) for _, events in requests],
+            [["one"], ["one", "two"]],
+        )
+        self.assertEqual((self.spool / "batch").read_text(), "")
+
+    def test_rejected_batch_sent_one_at_a_time(self):
+        self.code.write_text("400")
+        self._run(
+            "send_event JOB_INFO one; send_event JOB_INFO two; flush_events; "
+            + self._stop_flusher()
+        )
+
+        requests = self._requests()
+        self.assertEqual(
+            [(url, self._messages(events)) for url, events in requests],
+            [
+                (JOB_EVENT_URL.replace("/event/", "/events/"), ["one", "two"]),
+                (JOB_EVENT_URL, ["one"]),
+                (JOB_EVENT_URL, ["two"]),
+            ],
+        )
@@ -0,0 +1,209 @@
+import io
+import tarfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import override_settings
+
+from laxy_backend.storage import http_remote
+from laxy_backend.storage.http_remote import (
+    _introspection_cache,
+    get_tar_file_manifest,
+    is_archive_link,
+)
+
+
+def _make_tar(files: dict, compression: str = "") -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=f"w:{compression}") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class ArchiveServer:
+    """
+    A local stand-in for a remote file server, serving `files` (path -> bytes)
+    with ETags and Range support. Records each request's method, path and Range
+    header, and the number of body bytes sent.
+    """
+
+    def __init__(self, files: dict):
+        self.files = files
+        self.requests = []
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, send_body: bool):
+                with server._lock:
+                    server.requests.append(
+                        (self.command, self.path, self.headers.get("Range", None))
+                    )
+                content = server.files.get(self.path, None)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                start, end = 0, len(content) - 1
+                range_header = self.headers.get("Range", None)
+                if range_header is not None:
+                    first, _, last = range_header[len("bytes=") :].partition("-")
+                    start, end = int(first), min(int(last), len(content) - 1)
+                    self.send_response(206)
+                    self.send_header(
+                        "Content-Range", f"bytes {start}-{end}/{len(content)}"
+                    )
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", f'"{hash(content)}"')
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(content[start : end + 1])
+                    with server._lock:
+                        server.bytes_sent += end - start + 1
+
+            def do_HEAD(self):
+                self._respond(send_body=False)
+
+            def do_GET(self):
+                self._respond(send_body=True)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def gets(self) -> list:
+        return [r for r in self.requests if r[0] == "GET"]
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class ArchiveIntrospectionTest(unittest.TestCase):
+    def setUp(self):
+        _introspection_cache().clear()
+        self.reads = {f"reads/SRR{i}_1.fastq": b"@read\nACGT\n+\nIIII\n" for i in range(3)}
+        self.big = {"big.bin": b"\0" * (4 * 1024 * 1024), "small.txt": b"hello"}
+        self.server = ArchiveServer(
+            {
+                "/download?id=1": _make_tar(self.reads),
+                "/not-a-tar": b"just some text\n" * 100,
+                "/published.tar.gz": _make_tar(self.reads, "gz"),
+                "/published.tar.manifest-md5": b"".join(
+                    f"{i:032x}  {name}\n".encode() for i, name in enumerate(self.reads)
+                ),
+                "/big.tar": _make_tar(self.big),
+                "/big.tar.gz": _make_tar(self.big, "gz"),
+            }
+        ).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_is_archive_link_sniffs_first_block_once(self):
+        url = f"{self.server.url}/download?id=1"
+        self.assertTrue(is_archive_link(url, use_network=True))
+        self.assertFalse(is_archive_link(f"{self.server.url}/not-a-tar", use_network=True))
+        self.assertEqual(
+            self.server.gets(),
+            [
+                ("GET", "/download?id=1", "bytes=0-511"),
+                ("GET", "/not-a-tar", "bytes=0-511"),
+            ],
+        )
+
+        self.server.requests.clear()
+        self.assertTrue(is_archive_link(url, use_network=True))
+        self.assertEqual(self.server.requests, [])
+
+    def test_cached_results_are_revalidated(self):
+        url = f"{self.server.url}/download?id=1"
+        with mock.patch.object(http_remote, "HEAD_CACHE_TIMEOUT", 0):
+            self.assertTrue(is_archive_link(url, use_network=True))
+            self.assertTrue(is_archive_link(url, use_network=True))
+            self.assertEqual(len(self.server.gets()), 1)
+
+            # A changed file is sniffed again
+            self.server.files["/download?id=1"] = b"no longer a tar\n" * 100
+            self.assertFalse(is_archive_link(url, use_network=True))
+            self.assertEqual(len(self.server.gets()), 2)
+
+    def test_published_manifest(self):
+        manifest = get_tar_file_manifest(f"{self.server.url}/published.tar.gz")
+        self.assertEqual([f["filepath"] for f in manifest], list(self.reads))
+        self.assertEqual(manifest[1]["checksum"], f"md5:{1:032x}")
+
+        # Both manifest locations were tried, and the archive itself never fetched
+        paths = {path for _, path, _ in self.server.gets()}
+        self.assertEqual(
+            paths,
+            {"/published.tar.gz.manifest-md5", "/published.tar.manifest-md5"},
+        )
+
+        self.server.requests.clear()
+        get_tar_file_manifest(f"{self.server.url}/published.tar.gz")
+        self.assertEqual(self.server.requests, [])
+
+    def test_manifest_from_tar_headers(self):
+        size = len(self.server.files["/big.tar"])
+        manifest = get_tar_file_manifest(f"{self.server.url}/big.tar")
+        self.assertEqual(
+            manifest,
+            [
+                {"filepath": "big.bin", "checksum": None},
+                {"filepath": "small.txt", "checksum": None},
+            ],
+        )
+        # Only the header blocks were fetched, not the 4 Mb member
+        self.assertLess(self.server.bytes_sent, size / 10)
+
+    def test_manifest_from_compressed_tar(self):
+        manifest = get_tar_file_manifest(f"{self.server.url}/big.tar.gz")
+        self.assertEqual([f["filepath"] for f in manifest], ["big.bin", "small.txt"])
+
+        _introspection_cache().clear()
+        with override_settings(REMOTE_ARCHIVE_STREAM_MAX_BYTES=1024):
+            with self.assertRaises(ValueError):
+                get_tar_file_manifest(f"{self.server.url}/big.tar.gz")
+
+    def test_manifest_published_after_header_listing(self):
+        url = f"{self.server.url}/big.tar"
+        manifest = get_tar_file_manifest(url)
+        self.assertEqual(manifest[0]["checksum"], None)
+
+        # The header listing is reused while there's no manifest ..
+        self.server.requests.clear()
+        self.assertEqual(get_tar_file_manifest(url), manifest)
+        self.assertEqual(
+            {path for _, path, _ in self.server.gets()}, {"/big.tar.manifest-md5"}
+        )
+
+        # .. but a manifest published later (for the same archive) is used
+        self.server.files["/big.tar.manifest-md5"] = (
+            f"{1:032x}  big.bin\n{2:032x}  small.txt\n".encode()
+        )
+        manifest = get_tar_file_manifest(url)
+        self.assertEqual(
+            manifest[1], {"filepath": "small.txt", "checksum": f"md5:{2:032x}"}
+        )
@@ -1,9 +1,10 @@
 # from __future__ import absolute_import
 from collections import OrderedDict
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.utils import timezone
 
 import unittest
+from unittest import mock
 import os
 import random
 import codecs
@@ -16,7 +17,7 @@ from django.template.defaultfilters import default
 
 import jwt
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.test.client import Client
 from django.urls import reverse
@@ -25,7 +26,15 @@ from rest_framework.test import APIClient
 from laxy_backend import models
 from ..util import ordereddicts_to_dicts, laxy_sftp_url
 from ..util import reverse_querystring
-from ..models import FileLocation, Job, File, FileSet, SampleCart, ComputeResource
+from ..models import (
+    FileLocation,
+    Job,
+    File,
+    FileSet,
+    SampleCart,
+    ComputeResource,
+    EventLog,
+)
 from ..jwt_helpers import (
     get_jwt_user_header_dict,
     make_jwt_header_dict,
@@ -235,6 +244,33 @@ class FileModelTest(TestCase):
         content = f.file.read().decode()
         raise NotImplementedError()
 
+    def test_size_without_remote_io(self):
+        compute = ComputeResource.objects.create(
+            host="unreachable.example.com",
+            status=ComputeResource.STATUS_ONLINE,
+            extra={"base_dir": "/tmp/laxyjobs"},
+        )
+        f = File(owner=self.user, name="reads.fastq.gz", path="input")
+        f.location = f"laxy+sftp://{compute.id}/somejob/input/reads.fastq.gz"
+        f.save()
+        sized = File(owner=self.user, location=f.location, metadata={"size": 1024})
+        sized.save()
+
+        with mock.patch.object(
+            File, "_file", side_effect=AssertionError("Unexpected remote I/O")
+        ) as remote_io:
+            from ..serializers import FileSerializer
+
+            FileSerializer([f, sized], many=True).data
+            self.assertIsNone(f.size)
+            self.assertEqual(sized.size, 1024)
+            remote_io.assert_not_called()
+
+        with override_settings(FILE_SIZE_REMOTE_LOOKUP=True):
+            with mock.patch.object(File, "_file", return_value=None) as remote_io:
+                self.assertIsNone(f.size)
+                remote_io.assert_called_once()
+
     def test_add_remove_type_tags(self):
         f = File(
             location="https://www.apache.org/licenses/LICENSE-2.0.txt",
@@ -350,6 +386,43 @@ class FileSetModelTest(TestCase):
         self.assertIn(self.file_d_unsaved, list(fileset.files.all()))
 
 
+class JobLatestEventTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("user1", "", "userpass1")
+        self.job = Job(owner=self.user, params={})
+        self.job.save()
+
+    def _latest(self):
+        return Job.objects.get(id=self.job.id).latest_event()
+
+    def test_latest_event_pointer(self):
+        now = timezone.now()
+        self.job.log_event("JOB_INFO", "first")
+        self.assertEqual(self._latest().message, "first")
+
+        # Events that arrive late don't replace newer ones, and status
+        # changes never count as the latest event
+        EventLog.log("JOB_INFO", "earlier", obj=self.job, timestamp=now - timedelta(hours=1))
+        self.job.status = Job.STATUS_RUNNING
+        self.job.save()
+        self.assertEqual(self._latest().message, "first")
+
+        # Saving a Job loaded before the latest event arrived doesn't undo it
+        stale = Job.objects.get(id=self.job.id)
+        self.job.log_event("JOB_INFO", "second")
+        stale.status = Job.STATUS_COMPLETE
+        stale.save()
+        self.assertEqual(self._latest().message, "second")
+        self.assertEqual(Job.objects.get(id=self.job.id).status, Job.STATUS_COMPLETE)
+
+    def test_latest_event_without_pointer(self):
+        self.job.log_event("JOB_INFO", "before the pointer existed")
+        Job.objects.filter(id=self.job.id).update(latest_eventlog=None)
+
+        self.assertEqual(self._latest().message, "before the pointer existed")
+        self.assertIsNotNone(Job.objects.get(id=self.job.id).latest_eventlog_id)
+
+
 class SampleCartTest(TestCase):
     def setUp(self):
         self.csv_text = """SampleA,ftp://ftp.example.com/pub/bla_lane1_R1.fastq.gz,ftp://ftp.example.com/pub/bla_lane1_R2.fastq.gz
@@ -563,3 +636,26 @@ class JobModelTest(TestCase):
         self.job_one.save()
         updated = Job.objects.get(id=self.job_one.id)
         self._assert_add_files_from_tsv(updated)
+
+    def test_add_files_from_tsv_in_batches(self):
+        rows = [
+            {"filepath": f"input/reads/sample{n}.fastq.gz", "checksum": f"md5:{n}"}
+            for n in range(5)
+        ]
+        # The same path again, in a later batch, updates the existing file
+        rows.append({"filepath": "input/reads/sample0.fastq.gz", "checksum": "md5:new"})
+        rows.append({"filepath": "output/counts.tsv", "type_tags": "counts"})
+
+        with mock.patch.object(Job, "FILE_REGISTRATION_BATCH_SIZE", 2):
+            in_files, out_files = self.job_one.add_files_from_tsv(iter(rows))
+        self.job_one.save()
+
+        self.assertEqual(len(in_files), 6)
+        self.assertEqual(len(out_files), 1)
+        job = Job.objects.get(id=self.job_one.id)
+        self.assertEqual(job.input_files.files.count(), 5)
+        self.assertEqual(
+            job.input_files.get_file_by_path("input/reads/sample0.fastq.gz").checksum,
+            "md5:new",
+        )
+        self.assertListEqual(job.output_files.get_files()[0].type_tags, ["counts"])
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from laxy_backend.scraping.crawl import listing_cache
+from laxy_backend.scraping.plugins import RemoteBrowseSitePluginResult
+from laxy_backend.storage.http_remote import _introspection_cache
+from .test_views import _create_user_and_login
+
+SYNTHETIC_ENTRIES = 100_000
+
+synthetic_listing_calls = []
+
+
+def synthetic_listing_plugin(original_url: str, resolved_url: str):
+    """
+    A RemoteBrowseView site plugin that 'scrapes' a listing of SYNTHETIC_ENTRIES
+    entries (a thousand directories, and pairs of FASTQs) for any /synthetic URL.
+    """
+    if "/synthetic" not in resolved_url:
+        return None
+    synthetic_listing_calls.append(resolved_url)
+    listing = [
+        dict(
+            type="directory", name=f"dir{n:04d}", location=f"{resolved_url}dir{n:04d}/"
+        )
+        for n in range(1000)
+    ]
+    for n in range((SYNTHETIC_ENTRIES - len(listing)) // 2):
+        for read in [1, 2]:
+            name = f"SRR{n:06d}_{read}.fastq.gz"
+            listing.append(
+                dict(type="file", name=name, location=f"{resolved_url}{name}", tags=[])
+            )
+    return RemoteBrowseSitePluginResult(listing=listing)
+
+
+class IndexPageHeadServer:
+    """A local stand-in for a web server with an (empty) index page at every path."""
+
+    def __init__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", "13")
+                self.end_headers()
+
+            def do_GET(self):
+                self.do_HEAD()
+                self.wfile.write(b"<html></html>")
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@override_settings(
+    REMOTE_BROWSE_SITE_PLUGINS=[
+        "laxy_backend.tests.test_remote_browse.synthetic_listing_plugin"
+    ]
+)
+class RemoteBrowsePagingTest(TestCase):
+    def setUp(self):
+        listing_cache().clear()
+        _introspection_cache().clear()
+        synthetic_listing_calls.clear()
+        self.user, self.client = _create_user_and_login()
+        self.server = IndexPageHeadServer().__enter__()
+        self.url = f"{self.server.url}/synthetic/"
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def _browse(self, **params):
+        return self.client.post(
+            reverse("laxy_backend:remote-browse"),
+            data=json.dumps(dict(url=self.url, **params)),
+            content_type="application/json",
+        )
+
+    def test_pages_of_a_filtered_sorted_listing(self):
+        query = dict(fileglob="*_2.fastq.gz", ordering="type,-name", page_size=5000)
+        response = self._browse(**query)
+        self.assertEqual(response.status_code, 200)
+        first = response.json()
+
+        # A thousand directories, then the _2 files, newest accession first
+        self.assertEqual(first["count"], 1000 + 49500)
+        self.assertEqual(len(first["listing"]), 5000)
+        self.assertEqual(first["listing"][0]["name"], "dir0999")
+        self.assertEqual(first["listing"][1000]["name"], "SRR049499_2.fastq.gz")
+
+        names = [item["name"] for item in first["listing"]]
+        cursor = first["next"]
+        page_turn_times = []
+        while cursor is not None:
+            start = time.monotonic()
+            page = self._browse(cursor=cursor, **query).json()
+            page_turn_times.append(time.monotonic() - start)
+            names.extend(item["name"] for item in page["listing"])
+            cursor = page["next"]
+
+        self.assertEqual(len(names), first["count"])
+        self.assertEqual(len(set(names)), first["count"])
+        self.assertEqual(names[-1], "SRR000000_2.fastq.gz")
+
+        # Only the first page listed the URL - the others came from the cache
+        self.assertEqual(len(synthetic_listing_calls), 1)
+        self.assertLess(max(page_turn_times), 0.5)
+
+    def test_regex_filter(self):
+        response = self._browse(
+            regex=r"SRR0000[0-4]\d_1", ordering="name", page_size=10
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 1000 + 50)
+        self.assertEqual(data["listing"][0]["name"], "SRR000000_1.fastq.gz")
+
+    def test_unpaged_listing(self):
+        response = self._browse(fileglob="SRR00000?_1.fastq.gz")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["listing"]), 1000 + 10)
+        self.assertNotIn("count", data)
+
+    def test_expired_cursor_lists_again(self):
+        first = self._browse(page_size=100).json()
+        listing_cache().clear()
+        second = self._browse(page_size=100, cursor=first["next"]).json()
+        self.assertEqual(len(synthetic_listing_calls), 2)
+        self.assertEqual(second["listing"][0]["name"], "dir0100")
+
+    def test_invalid_queries(self):
+        first = self._browse(page_size=100).json()
+        # A cursor is only valid for the query it came from
+        self.assertEqual(
+            self._browse(
+                page_size=100, cursor=first["next"], fileglob="*.gz"
+            ).status_code,
+            400,
+        )
+        self.assertEqual(
+            self._browse(page_size=100, cursor="nonsense").status_code, 400
+        )
+        self.assertEqual(self._browse(ordering="size").status_code, 400)
+        self.assertEqual(self._browse(regex="(unclosed").status_code, 400)
+        self.assertEqual(self._browse(regex="x" * 1000).status_code, 400)
+
+    def test_regex_timeout(self):
+        # Slow to (not) match each file name, so the listing takes minutes
+        with override_settings(REMOTE_BROWSE_REGEX_TIMEOUT=0.5):
+            start = time.monotonic()
+            response = self._browse(regex=r"(.|..)*$\d", page_size=10)
+            self.assertEqual(response.status_code, 400)
+            self.assertLess(time.monotonic() - start, 10)
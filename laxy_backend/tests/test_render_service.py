@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from laxy_backend.scraping.render_service import RenderService
+
+INDEX_ROW = b'<tr><td><a href="SRR000001_1.fastq.gz">SRR000001_1.fastq.gz</a></td></tr>\n'
+
+
+class IndexPageServer:
+    """
+    A local stand-in for a remote file server. Serves a small index page at
+    /index, one that takes `delay` seconds to start at /slow, and one of
+    `huge_size` bytes at /huge - over HTTP/1.1, so connections are kept alive.
+    Records the number of requests per path and the number of connections.
+    """
+
+    def __init__(self, delay: float = 0.5, huge_size: int = 12 * 1024 * 1024):
+        self.requests = {}
+        self.connections = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests[self.path] = server.requests.get(self.path, 0) + 1
+                if self.path == "/slow":
+                    time.sleep(delay)
+                rows = huge_size // len(INDEX_ROW) if self.path == "/huge" else 10
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(rows * len(INDEX_ROW)))
+                self.end_headers()
+                for _ in range(0, rows, 1000):
+                    self.wfile.write(INDEX_ROW * min(1000, rows - _))
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class RenderServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = IndexPageServer().__enter__()
+        self.service = RenderService(max_workers=4, timeout=5)
+
+    def tearDown(self):
+        self.service.shutdown()
+        self.server.__exit__()
+
+    def test_render(self):
+        text = self.service.render(f"{self.server.url}/index")
+        self.assertEqual(text, INDEX_ROW.decode() * 10)
+
+    def test_concurrent_renders_of_a_url_are_deduplicated(self):
+        url = f"{self.server.url}/slow"
+        with ThreadPoolExecutor(max_workers=4) as requesters:
+            pages = list(requesters.map(lambda _: self.service.render(url), range(4)))
+
+        self.assertEqual(self.server.requests["/slow"], 1)
+        self.assertEqual(len(set(pages)), 1)
+
+        # Once finished, the next render fetches the page again
+        self.service.render(url)
+        self.assertEqual(self.server.requests["/slow"], 2)
+
+    def test_connections_kept_alive(self):
+        for _ in range(3):
+            self.service.render(f"{self.server.url}/index")
+            self.service.render(f"{self.server.url}/slow")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_huge_page(self):
+        with self.assertRaises(MemoryError):
+            self.service.render(f"{self.server.url}/huge")
+
+    def test_timeouts(self):
+        url = f"{self.server.url}/slow"
+        impatient = RenderService(timeout=0.1)
+        with self.assertRaises(TimeoutError):
+            impatient.render(url)
+        impatient.shutdown()
+
+        slow_host = RenderService(host_timeouts={"127.0.0.1": (1, 0.1)})
+        with self.assertRaises(requests.exceptions.Timeout):
+            slow_host.render(url)
+        slow_host.shutdown()
+
+    def test_render_async(self):
+        async def _render_both():
+            return await asyncio.gather(
+                self.service.render_async(f"{self.server.url}/index"),
+                self.service.render_async(f"{self.server.url}/slow"),
+            )
+
+        index, slow = asyncio.run(_render_both())
+        self.assertEqual(index, slow)
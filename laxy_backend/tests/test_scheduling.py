@@ -0,0 +1,170 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from ..models import ComputeResource, EventLog, File, Job, User
+from .. import scheduling
+from ..scheduling import ComputeLoad, measure_load, place_job
+
+
+def _simulated(name, priority=0, **load):
+    return ComputeLoad(compute=ComputeResource(name=name, priority=priority), **load)
+
+
+class PlacementTest(SimpleTestCase):
+    def _placed(self, *loads):
+        return place_job(loads).compute.name
+
+    def test_no_candidates(self):
+        self.assertIsNone(place_job([]))
+
+    def test_idle_resources_by_priority(self):
+        self.assertEqual(
+            self._placed(_simulated("low", priority=1), _simulated("high", priority=5)),
+            "high",
+        )
+
+    def test_avoids_saturated_resource(self):
+        # Jobs queue on the high priority cluster, so new ones go elsewhere
+        saturated = _simulated(
+            "saturated", priority=10, active_jobs=40, waiting_jobs=12, start_latency=60
+        )
+        quiet = _simulated("quiet", active_jobs=2, start_latency=90)
+        self.assertEqual(self._placed(saturated, quiet), "quiet")
+
+        # .. unless it has the slots to run its queue at once
+        saturated.max_jobs = 200
+        self.assertEqual(self._placed(saturated, quiet), "saturated")
+
+    def test_start_latency(self):
+        slow = _simulated("slow", priority=10, start_latency=3600)
+        fast = _simulated("fast", start_latency=30)
+        self.assertEqual(self._placed(slow, fast), "fast")
+
+    def test_no_history_is_typical(self):
+        # A new resource is assumed to start jobs as fast as the others do,
+        # not faster
+        established = _simulated("established", priority=10, start_latency=600)
+        new = _simulated("new")
+        self.assertEqual(self._placed(established, new), "established")
+
+        new.compute.priority = 20
+        self.assertEqual(self._placed(established, new), "new")
+
+    def test_full_resources_only_used_when_all_full(self):
+        full = _simulated("full", priority=10, active_jobs=4, max_jobs=4)
+        busy = _simulated("busy", active_jobs=10, waiting_jobs=5, start_latency=600)
+        self.assertEqual(self._placed(full, busy), "busy")
+
+        busy.max_jobs = 10
+        self.assertEqual(self._placed(full, busy), "full")
+
+    def test_data_locality(self):
+        # Inputs stored on 'local' would be transferred to 'remote'
+        local = _simulated("local", waiting_jobs=1, start_latency=60)
+        remote = _simulated("remote", priority=10, start_latency=60, transfers=10)
+        self.assertEqual(self._placed(local, remote), "local")
+
+        # .. but not at any price
+        local.waiting_jobs = 100
+        self.assertEqual(self._placed(local, remote), "remote")
+
+
+class MeasureLoadTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("scheduler", "", "testpass")
+        self.cluster_a = ComputeResource.objects.create(
+            name="cluster-a",
+            host="localhost",
+            status=ComputeResource.STATUS_ONLINE,
+            priority=10,
+            extra={"base_dir": "/tmp", "max_jobs": 2},
+        )
+        self.cluster_b = ComputeResource.objects.create(
+            name="cluster-b",
+            host="localhost",
+            status=ComputeResource.STATUS_ONLINE,
+            priority=1,
+            extra={"base_dir": "/tmp"},
+        )
+
+    def _job(self, compute, status, start_latency=None, age=timedelta(hours=1)):
+        job = Job.objects.create(owner=self.user, compute_resource=compute, params={})
+        created = timezone.now() - age
+        Job.objects.filter(id=job.id).update(status=status, created_time=created)
+        if start_latency is not None:
+            EventLog.log(
+                "JOB_PIPELINE_STARTING",
+                obj=job,
+                timestamp=created + timedelta(seconds=start_latency),
+            )
+        return job
+
+    def test_measure_load(self):
+        self._job(self.cluster_a, Job.STATUS_RUNNING, start_latency=100)
+        self._job(self.cluster_a, Job.STATUS_RUNNING, start_latency=300)
+        self._job(self.cluster_a, Job.STATUS_RUNNING)
+        self._job(self.cluster_a, Job.STATUS_CREATED)
+        self._job(self.cluster_a, Job.STATUS_COMPLETE, start_latency=200)
+        self._job(self.cluster_b, Job.STATUS_COMPLETE)
+
+        with self.assertNumQueries(2):
+            a, b = measure_load([self.cluster_a, self.cluster_b])
+
+        self.assertEqual((a.active_jobs, a.waiting_jobs), (4, 2))
+        self.assertEqual(a.max_jobs, 2)
+        self.assertEqual(a.start_latency, 200)
+        self.assertTrue(a.full)
+        self.assertEqual((b.active_jobs, b.waiting_jobs, b.start_latency), (0, 0, None))
+        self.assertFalse(b.full)
+
+        # The busy, high priority cluster is passed over
+        self.assertEqual(ComputeResource.get_best_available(), self.cluster_b)
+
+    def test_latency_sampled_per_resource(self):
+        # cluster-a's many recent jobs don't crowd out cluster-b's older one
+        for n in range(5):
+            self._job(
+                self.cluster_a,
+                Job.STATUS_COMPLETE,
+                start_latency=100 + n,
+                age=timedelta(minutes=n),
+            )
+        self._job(
+            self.cluster_b, Job.STATUS_COMPLETE, start_latency=50, age=timedelta(days=1)
+        )
+
+        with mock.patch.object(scheduling, "LATENCY_SAMPLE_SIZE", 2):
+            a, b = measure_load([self.cluster_a, self.cluster_b])
+        self.assertEqual(a.start_latency, 100.5)
+        self.assertEqual(b.start_latency, 50)
+
+    def test_input_file_locality(self):
+        files = [
+            File.objects.create(
+                owner=self.user,
+                name=f"reads_{n}.fastq.gz",
+                location=f"laxy+sftp://{self.cluster_b.id}/job/input/reads_{n}.fastq.gz",
+            )
+            for n in range(3)
+        ]
+        inputs = File.objects.filter(id__in=[f.id for f in files])
+
+        a, b = measure_load([self.cluster_a, self.cluster_b], input_files=inputs)
+        self.assertEqual((a.transfers, b.transfers), (3, 0))
+        self.assertEqual(
+            ComputeResource.get_best_available(input_files=inputs), self.cluster_b
+        )
+        self.assertEqual(ComputeResource.get_best_available(), self.cluster_a)
+
+        # Files with just a location (eg from a job submission) work the same
+        unsaved = [File(location=f.location) for f in files]
+        with self.assertNumQueries(2):
+            a, b = measure_load([self.cluster_a, self.cluster_b], input_files=unsaved)
+        self.assertEqual((a.transfers, b.transfers), (3, 0))
+
+        unsaved.append(File(location="https://example.com/reads_3.fastq.gz"))
+        a, b = measure_load([self.cluster_a, self.cluster_b], input_files=unsaved)
+        self.assertEqual((a.transfers, b.transfers), (0, 0))
@@ -1,13 +1,17 @@
+import io
 import os
+import subprocess
 import sys
 import tempfile
 from pathlib import Path
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.utils import timezone
 
 import unittest
+from unittest import mock
 from django.test import TestCase
+from django.urls import reverse
 from django.conf import settings
 from rest_framework.test import APIClient
 
@@ -25,11 +29,24 @@ from ..tasks.job import (
     set_job_status,
     file_should_be_deleted,
     get_job_template_files,
+    job_script_bundle,
+    unused_job_script_bundles,
+    recent_pipeline_versions,
+    compact_job_events,
+    compact_old_job_events,
+    _parse_rsync_itemized_output,
+    _parse_find_printf_output,
 )
 
 from ..tasks.file import (
     add_file_replica_records,
     remove_file_replica_records,
+    stat_files,
+    _remote_file_sizes,
+    plan_file_transfer,
+    TRANSFER_LOCAL,
+    TRANSFER_DIRECT,
+    TRANSFER_RELAY,
 )
 
 tests_path = os.path.dirname(os.path.abspath(__file__))
@@ -186,6 +203,157 @@ class TasksTest(TestCase):
             },
         )
 
+    def test_job_script_bundle(self):
+        settings.JOB_TEMPLATE_PATHS = [
+            str(Path(tests_path, "test_data/templates").resolve())
+        ]
+        pathdict = get_job_template_files("test_pipeline_name", "0.01")
+
+        def infer_chmod(relpath):
+            return 0o700 if relpath.endswith((".sh", ".py")) else 0o600
+
+        bundle_id, files = job_script_bundle(pathdict, infer_chmod)
+
+        # Files with template tags are rendered per job, not bundled
+        self.assertSetEqual(
+            set(files.keys()),
+            {
+                "input/config/conda_environment.yml",
+                "input/scripts/laxy.lib.sh",
+                "input/scripts/add_to_manifest.py",
+            },
+        )
+        content, mode = files["input/scripts/laxy.lib.sh"]
+        self.assertEqual(mode, 0o700)
+        self.assertEqual(
+            content, Path(pathdict["input/scripts/laxy.lib.sh"]).read_bytes()
+        )
+
+        # The same content gives the same bundle, whichever version it's from
+        self.assertEqual(
+            job_script_bundle(
+                get_job_template_files("test_pipeline_name", "default"), infer_chmod
+            )[0],
+            bundle_id,
+        )
+        # .. while any change to a bundled file gives a new one
+        self.assertNotEqual(
+            job_script_bundle(pathdict, lambda relpath: 0o755)[0], bundle_id
+        )
+
+    def test_unused_job_script_bundles(self):
+        bundles_dir = "/scratch/jobs/.script_bundles"
+        links = [
+            f"{bundles_dir}/aaaa/input/scripts/laxy.lib.sh",
+            f"{bundles_dir}/aaaa/kill_job.sh",
+            f"{bundles_dir}/cccc/input/config/conda_environment.yml",
+            "/elsewhere/.script_bundles/bbbb/kill_job.sh",
+        ]
+        self.assertListEqual(
+            unused_job_script_bundles(
+                ["aaaa", "bbbb", "cccc", "dddd.0f1e2d", "dddd.0f1e2d.tar.gz", ""],
+                links,
+                bundles_dir + "/",
+            ),
+            ["bbbb", "dddd.0f1e2d", "dddd.0f1e2d.tar.gz"],
+        )
+
+    def test_recent_pipeline_versions(self):
+        for version in ["3.18.0", "3.12.0", "3.18.0", None]:
+            params = {"pipeline": "nf-core-rnaseq", "params": {}}
+            if version:
+                params["params"]["pipeline_version"] = version
+            Job(owner=self.user, params=params, compute_resource=self.compute).save()
+
+        self.assertListEqual(
+            recent_pipeline_versions(self.compute, timezone.now() - timedelta(days=1)),
+            [
+                ("nf-core-rnaseq", "3.18.0"),
+                ("nf-core-rnaseq", "3.12.0"),
+                ("nf-core-rnaseq", "default"),
+            ],
+        )
+        self.assertListEqual(recent_pipeline_versions(self.compute, timezone.now()), [])
+
+    def test_compact_old_job_events(self):
+        long_ago = timezone.now() - timedelta(days=settings.EVENTLOG_RETENTION_DAYS + 1)
+        finished = Job(owner=self.user, status=Job.STATUS_COMPLETE, params={})
+        finished.save()
+        for i, event in enumerate(["JOB_INFO", "JOB_INFO", "INPUT_DATA_DOWNLOAD_STARTED"]):
+            EventLog.log(event, obj=finished, timestamp=long_ago + timedelta(seconds=i))
+        finished.log_event("JOB_INFO", "recent")
+        EventLog.log(
+            "JOB_PIPELINE_COMPLETED", obj=self.job_one, timestamp=long_ago
+        )  # job_one is still running
+
+        task_data = compact_old_job_events(task_data={})
+        self.assertEqual(task_data["result"], {"jobs": 1, "events_removed": 3})
+
+        events = list(
+            EventLog.objects.filter(object_id=finished.id).order_by("timestamp")
+        )
+        self.assertListEqual(
+            [e.event for e in events], ["JOB_EVENTS_COMPACTED", "job_created", "JOB_INFO"]
+        )
+        self.assertDictEqual(
+            events[0].extra["counts"], {"JOB_INFO": 2, "INPUT_DATA_DOWNLOAD_STARTED": 1}
+        )
+        self.assertEqual(Job.objects.get(id=finished.id).latest_event().message, "recent")
+        self.assertTrue(
+            EventLog.objects.filter(
+                object_id=self.job_one.id, event="JOB_PIPELINE_COMPLETED"
+            ).exists()
+        )
+
+        # Nothing left to compact
+        task_data = compact_old_job_events(task_data={})
+        self.assertEqual(task_data["result"], {"jobs": 0, "events_removed": 0})
+
+    def test_compact_old_job_events_skips_only_latest_event(self):
+        long_ago = timezone.now() - timedelta(days=settings.EVENTLOG_RETENTION_DAYS + 1)
+        finished = Job(owner=self.user, status=Job.STATUS_COMPLETE, params={})
+        finished.save()
+        # The job's only compactable event is also its latest, so it's kept
+        finished.log_event("JOB_INFO", "last")
+        EventLog.objects.filter(object_id=finished.id).update(timestamp=long_ago)
+
+        task_data = compact_old_job_events(task_data={})
+        self.assertEqual(task_data["result"], {"jobs": 0, "events_removed": 0})
+        self.assertEqual(Job.objects.get(id=finished.id).latest_event().message, "last")
+
+        # It doesn't use up a batch slot that another job needs either
+        other = Job(owner=self.user, status=Job.STATUS_FAILED, params={})
+        other.save()
+        for message in ["first", "last"]:
+            other.log_event("JOB_INFO", message)
+        EventLog.objects.filter(object_id=other.id).update(timestamp=long_ago)
+
+        task_data = compact_old_job_events(task_data={}, batch_size=1)
+        self.assertEqual(task_data["result"], {"jobs": 1, "events_removed": 1})
+
+    def test_compact_job_events_without_latest_eventlog(self):
+        long_ago = timezone.now() - timedelta(days=settings.EVENTLOG_RETENTION_DAYS + 1)
+        legacy = Job(owner=self.user, status=Job.STATUS_FAILED, params={})
+        legacy.save()
+        for i, message in enumerate(["first", "second", "last"]):
+            EventLog.log(
+                "JOB_INFO",
+                message=message,
+                obj=legacy,
+                timestamp=long_ago + timedelta(seconds=i),
+            )
+        # As for jobs from before latest_eventlog existed
+        EventLog.objects.filter(object_id=legacy.id, event="job_created").update(
+            timestamp=long_ago - timedelta(seconds=1)
+        )
+        Job.objects.filter(id=legacy.id).update(latest_eventlog=None)
+
+        removed = compact_job_events(
+            Job.objects.get(id=legacy.id), timezone.now() - timedelta(days=1)
+        )
+        self.assertEqual(removed, 2)
+        self.assertEqual(Job.objects.get(id=legacy.id).latest_event().message, "last")
+
     def test_file_expiry_matching(self):
         self.assertTrue(file_should_be_deleted(self.file_bam))
         self.assertTrue(file_should_be_deleted(self.file_bai))
@@ -287,7 +455,12 @@ class TasksTest(TestCase):
             self.assertTrue(f.locations.first().default)
             self.assertTrue(f.location.startswith(f"laxy+sftp://{orig_compute.id}/"))
 
-        add_file_replica_records(files, archive_compute, set_as_default=True)
+        n_added = add_file_replica_records(files, archive_compute, set_as_default=True)
+        self.assertEqual(n_added, 2)
+        # Adding the same replicas again is a no-op
+        self.assertEqual(
+            add_file_replica_records(files, archive_compute, set_as_default=True), 0
+        )
 
         # After adding the replica location as the default, check that we have two locations.
         # The default location should be on archive_compute, non-default should be on orig_compute.
@@ -307,3 +480,165 @@ class TasksTest(TestCase):
         for f in job.get_files():
             self.assertTrue(f.location.startswith(f"laxy+sftp://{archive_compute.id}"))
             self.assertEqual(f.locations.count(), 1)
+
+    def test_parse_rsync_itemized_output(self):
+        output = (
+            "cd+++++++++|4096|Vl4F1U/\r\n"
+            ">f+++++++++|512|Vl4F1U/input/config/pipeline_config.json\r\n"
+            ".f          |1073741824|Vl4F1U/output/bams/alignment.bam\r\n"
+            "cL+++++++++|12|Vl4F1U/output/link\r\n"
+            "*deleting  |0|Vl4F1U/output/old.txt\r\n"
+            "rsync: some warning\r\n"
+            ">f..t......|10|Vl4F1U/output/a|b.txt\r\n"
+        )
+        self.assertDictEqual(
+            _parse_rsync_itemized_output(output),
+            {
+                "Vl4F1U/input/config/pipeline_config.json": 512,
+                "Vl4F1U/output/bams/alignment.bam": 1073741824,
+                "Vl4F1U/output/a|b.txt": 10,
+            },
+        )
+
+    def test_parse_find_printf_output(self):
+        output = "512\tVl4F1U/input/config/pipeline_config.json\n0\tVl4F1U/job.pids\n\n"
+        self.assertDictEqual(
+            _parse_find_printf_output(output),
+            {
+                "Vl4F1U/input/config/pipeline_config.json": 512,
+                "Vl4F1U/job.pids": 0,
+            },
+        )
+
+    @unittest.skipIf(sys.platform != "linux", "needs GNU stat")
+    def test_remote_file_sizes(self):
+        # Run the real remote stat command locally, in place of over SSH
+        class LocalClient:
+            def exec_command(self, cmd):
+                proc = subprocess.run(cmd, shell=True, capture_output=True)
+                return None, io.BytesIO(proc.stdout), io.BytesIO(proc.stderr)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = [
+                os.path.join(tmpdir, "reads.fastq.gz"),
+                os.path.join(tmpdir, "sample name.txt"),
+            ]
+            for size, path in zip((2048, 10), paths):
+                with open(path, "wb") as fh:
+                    fh.write(b"x" * size)
+
+            compute = mock.Mock()
+            compute.ssh_client.return_value.__enter__ = lambda _: LocalClient()
+            compute.ssh_client.return_value.__exit__ = lambda *_: None
+            sizes = _remote_file_sizes(
+                compute, paths + [os.path.join(tmpdir, "missing.txt")]
+            )
+
+        self.assertDictEqual(sizes, {paths[0]: 2048, paths[1]: 10})
+
+    def test_plan_file_transfer(self):
+        src = ComputeResource(
+            host="hpc.example.com",
+            status=ComputeResource.STATUS_ONLINE,
+            extra={"username": "laxy", "base_dir": "/scratch/jobs"},
+        )
+        same_host = ComputeResource(
+            host="hpc.example.com",
+            status=ComputeResource.STATUS_ONLINE,
+            extra={"username": "laxy", "base_dir": "/archive/jobs"},
+        )
+        archive = ComputeResource(
+            host="archive.example.com",
+            status=ComputeResource.STATUS_ONLINE,
+            extra={"username": "laxy", "direct_transfer_sources": [src.id]},
+        )
+        isolated = ComputeResource(
+            host="isolated.example.com",
+            status=ComputeResource.STATUS_ONLINE,
+            extra={"username": "laxy"},
+        )
+
+        self.assertEqual(plan_file_transfer(src, src), TRANSFER_LOCAL)
+        self.assertEqual(plan_file_transfer(src, same_host), TRANSFER_LOCAL)
+        self.assertEqual(plan_file_transfer(src, archive), TRANSFER_DIRECT)
+        self.assertEqual(plan_file_transfer(archive, src), TRANSFER_RELAY)
+        self.assertEqual(plan_file_transfer(src, isolated), TRANSFER_RELAY)
+        self.assertEqual(plan_file_transfer(None, archive), TRANSFER_RELAY)
+
+        isolated.extra["direct_transfer_sources"] = ["*"]
+        self.assertEqual(plan_file_transfer(src, isolated), TRANSFER_DIRECT)
+
+    def test_stat_files(self):
+        job_dir = Path(self.compute.jobs_dir, self.job_one.id)
+        unsized = File(name="reads.fastq.gz", path="input", owner=self.user)
+        unsized.location = laxy_sftp_url(self.job_one, path=unsized.full_path)
+        unsized.save()
+        sized = File(
+            name="counts.txt", path="output", owner=self.user, metadata={"size": 1}
+        )
+        sized.location = laxy_sftp_url(self.job_one, path=sized.full_path)
+        sized.save()
+        self.files.extend([unsized, sized])
+
+        with mock.patch(
+            "laxy_backend.tasks.file._remote_file_sizes",
+            return_value={
+                str(job_dir / "input/reads.fastq.gz"): 2048,
+                str(job_dir / "output/counts.txt"): 4096,
+            },
+        ) as remote_stat:
+            self.assertEqual(stat_files([unsized, sized]), 1)
+            remote_stat.assert_called_once_with(
+                self.compute, [str(job_dir / "input/reads.fastq.gz")]
+            )
+            self.assertEqual(File.objects.get(id=unsized.id).metadata["size"], 2048)
+            self.assertEqual(File.objects.get(id=sized.id).metadata["size"], 1)
+
+            self.assertEqual(stat_files([unsized, sized], refresh=True), 2)
+            self.assertEqual(File.objects.get(id=sized.id).metadata["size"], 4096)
+
+    def test_bulk_file_updates_invalidate_etags(self):
+        archive_compute = ComputeResource(
+            owner=self.user,
+            host="localhost",
+            disposable=False,
+            status=ComputeResource.STATUS_ONLINE,
+            name="archive",
+            extra={"base_dir": get_tmp_dir()},
+        )
+        archive_compute.save()
+
+        out_file = File(name="counts.txt", path="output", owner=self.user)
+        out_file.location = laxy_sftp_url(self.job_one, out_file.full_path)
+        self.job_one.output_files.add(out_file)
+        self.files.append(out_file)
+
+        client = APIClient()
+        client.login(username="testuser", password="testpass")
+        urls = [
+            reverse("laxy_backend:file", args=[out_file.uuid()]),
+            reverse("laxy_backend:fileset", args=[self.job_one.output_files.uuid()]),
+        ]
+
+        def get(url, **headers):
+            return client.get(url, content_type="application/json", **headers)
+
+        def assert_modified(etags):
+            for url, etag in etags.items():
+                response = get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200, url)
+
+        # bulk_create / update() / bulk_update skip the usual modified_time
+        # bookkeeping, so check these paths still change the ETags
+        etags = {url: get(url)["ETag"] for url in urls}
+        add_file_replica_records([out_file], archive_compute, set_as_default=True)
+        assert_modified(etags)
+
+        etags = {url: get(url)["ETag"] for url in urls}
+        archive_path = Path(archive_compute.jobs_dir, self.job_one.id, "output/counts.txt")
+        with mock.patch(
+            "laxy_backend.tasks.file._remote_file_sizes",
+            return_value={str(archive_path): 42},
+        ):
+            self.assertEqual(stat_files([File.objects.get(id=out_file.id)]), 1)
+        assert_modified(etags)
@@ -1,13 +1,26 @@
 import unittest
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
+import io
 import string
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse
 from ..util import (
     sanitize_filename,
     truncate_fastq_to_pair_suffix,
     simplify_fastq_name,
     find_filename_and_size_from_url,
+    iter_text_lines,
+    iter_csv_records,
+    limit_rows,
+    batched,
+    filename_from_url_path,
+    resolve_filenames_from_urls,
+    multikeysort,
+    filter_listing,
 )
 import requests
 
@@ -79,6 +92,49 @@ class UtilFunctionsTest(TestCase):
         self.assertEqual("XXX_BLA_FOO", simplify_fastq_name("XXX_BLA_FOO_2.fasta"))
         self.assertEqual("XXX_BLA_FOO", simplify_fastq_name("XXX_BLA_FOO_1.fastq"))
 
+    def test_multikeysort(self):
+        items = [
+            dict(type="file", name="b", n=1),
+            dict(type="directory", name="z", n=2),
+            dict(type="file", name="a", n=3),
+            dict(type="file", name="a", n=4),
+        ]
+        self.assertEqual(
+            [i["n"] for i in multikeysort(items, ["type", "name"])], [2, 3, 4, 1]
+        )
+        self.assertEqual(
+            [i["n"] for i in multikeysort(items, ["type", "-name"])], [2, 1, 3, 4]
+        )
+        # Reversed, but still stable
+        self.assertEqual(
+            [i["n"] for i in multikeysort(items, ["type", "name"], reverse=True)],
+            [1, 3, 4, 2],
+        )
+
+    def test_filter_listing(self):
+        listing = [
+            dict(type="directory", name="run1"),
+            dict(type="file", name="run1/A_R1.fastq.gz"),
+            dict(type="file", name="run1/A_R2.fastq.gz"),
+            dict(type="file", name="run1/report.html"),
+        ]
+        names = lambda l: [i["name"] for i in l]
+        self.assertEqual(filter_listing(listing), listing)
+        self.assertEqual(
+            names(filter_listing(listing, "*.fastq.gz")),
+            ["run1", "run1/A_R1.fastq.gz", "run1/A_R2.fastq.gz"],
+        )
+        self.assertEqual(
+            names(filter_listing(listing, "*.fastq.gz", regex="_R2")),
+            ["run1", "run1/A_R2.fastq.gz"],
+        )
+        self.assertEqual(names(filter_listing(listing, "run1*")), ["run1"])
+
+        # Catastrophic backtracking is cut short
+        listing.append(dict(type="file", name="a" * 40 + "!"))
+        with self.assertRaises(TimeoutError):
+            filter_listing(listing, regex=r"^(a|aa)+$", timeout=0.5)
+
 
 @patch("laxy_backend.util.cache_memoize", no_op_decorator)
 class TestFindFilenameAndSizeFromUrl(TestCase):
@@ -203,3 +259,193 @@ class TestFindFilenameAndSizeFromUrl(TestCase):
 
 if __name__ == "__main__":
     unittest.main()
+
+
+class SyntheticCSVStream(io.RawIOBase):
+    """
+    A readable stream of `n_rows` generated CSV rows, so large uploads can be
+    parsed without the test itself holding them in memory.
+    """
+
+    HEADER = b"checksum,filepath,metadata,type_tags\r\n"
+
+    def __init__(self, n_rows: int):
+        self._rows = (self.row(n) for n in range(n_rows))
+        self._buffer = self.HEADER
+        self.size = len(self.HEADER) + sum(len(self.row(n)) for n in range(n_rows))
+
+    @staticmethod
+    def row(n: int) -> bytes:
+        return b'md5:%032x,input/dir/sample%d_R1.fastq.gz,{},"fastq,gz"\r\n' % (n, n)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b):
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += row
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class StreamingCSVTest(TestCase):
+    def test_iter_text_lines_across_chunks(self):
+        text = "caf\u00e9,\"two\r\nlines\"\r\nb,\u2603\r\nlast"
+        data = b"\xef\xbb\xbf" + text.encode("utf-8")
+        # Tiny chunks split multibyte characters and \r\n pairs
+        for chunk_size in (1, 2, 3, 7, 1024):
+            lines = list(iter_text_lines(io.BytesIO(data), chunk_size=chunk_size))
+            self.assertEqual("".join(lines), text)
+            self.assertEqual(lines[0], "caf\u00e9,\"two\r\n")
+
+    def test_limits(self):
+        with self.assertRaises(ValueError):
+            list(iter_text_lines(io.BytesIO(b"a\n" * 100), chunk_size=10, max_bytes=50))
+        self.assertEqual(len(list(limit_rows(range(5), 5))), 5)
+        with self.assertRaises(ValueError):
+            list(limit_rows(range(6), 5))
+
+    def test_iter_csv_records(self):
+        tsv = "filepath \tchecksum\tmetadata\nin/a.txt\tmd5:1\t\nin/b.txt\tmd5:2\t{}\textra\n"
+        self.assertEqual(
+            list(iter_csv_records(io.StringIO(tsv))),
+            [
+                {"filepath": "in/a.txt", "checksum": "md5:1", "metadata": None},
+                {"filepath": "in/b.txt", "checksum": "md5:2", "metadata": "{}"},
+            ],
+        )
+        csv_text = 'a,b\n1,"x,y"\n'
+        self.assertEqual(
+            list(iter_csv_records(io.StringIO(csv_text))), [{"a": "1", "b": "x,y"}]
+        )
+        self.assertEqual(list(iter_csv_records(iter([]))), [])
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+
+    def test_streaming_peak_memory(self):
+        # ~20 MB of CSV is parsed while holding only a chunk (and a row) at once
+        stream = SyntheticCSVStream(250000)
+        self.assertGreater(stream.size, 20 * 1024 * 1024)
+
+        tracemalloc.start()
+        try:
+            n_rows = 0
+            for record in iter_csv_records(iter_text_lines(stream)):
+                n_rows += 1
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(n_rows, 250000)
+        self.assertEqual(record["type_tags"], "fastq,gz")
+        self.assertLess(peak, 1024 * 1024)
+
+
+class SlowDownloadServer:
+    """
+    A local stand-in for a slow download host. Answers HEAD /download?id=N
+    after `latency` seconds with a Content-Disposition filename of
+    sampleN.fastq.gz, recording the number of requests and the most it
+    handled at once.
+    """
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.requests = 0
+        self.max_concurrent = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_HEAD(self):
+                with server._lock:
+                    server.requests += 1
+                    server._active += 1
+                    server.max_concurrent = max(server.max_concurrent, server._active)
+                time.sleep(server.latency)
+                with server._lock:
+                    server._active -= 1
+                n = self.path.rsplit("=", 1)[-1]
+                self.send_response(200)
+                self.send_header(
+                    "Content-Disposition", f'attachment; filename="sample{n}.fastq.gz"'
+                )
+                self.send_header("Content-Length", "1024")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class ResolveFilenamesTest(TestCase):
+    def test_filename_from_url_path(self):
+        self.assertEqual(
+            filename_from_url_path("https://example.com/reads/S1_R1.fastq.gz"),
+            "S1_R1.fastq.gz",
+        )
+        self.assertEqual(filename_from_url_path("ftp://example.com/reads/S1"), "S1")
+        self.assertIsNone(filename_from_url_path("https://example.com/download?id=1"))
+        self.assertIsNone(
+            filename_from_url_path("https://example.com/reads/S1.fastq.gz?sig=abc")
+        )
+        self.assertEqual(
+            filename_from_url_path("https://example.com/download?id=1", guess=True),
+            "download",
+        )
+        self.assertIsNone(filename_from_url_path("https://example.com/", guess=True))
+
+    def test_obvious_names_resolved_without_requests(self):
+        with SlowDownloadServer() as server:
+            names = resolve_filenames_from_urls(
+                [
+                    f"{server.url}/reads/S1_R1.fastq.gz",
+                    # Nothing listens here
+                    "ftp://127.0.0.1:1/reads/S1_R2.fastq.gz",
+                ]
+            )
+        self.assertEqual(list(names.values()), ["S1_R1.fastq.gz", "S1_R2.fastq.gz"])
+        self.assertEqual(server.requests, 0)
+
+    def test_resolved_concurrently_per_host_and_cached(self):
+        with SlowDownloadServer(latency=0.3) as server:
+            urls = [f"{server.url}/download?id={n}" for n in range(8)]
+            progress = []
+            start = time.monotonic()
+            names = resolve_filenames_from_urls(
+                urls + urls[:2],
+                max_per_host=4,
+                progress=lambda done, total: progress.append((done, total)),
+            )
+            elapsed = time.monotonic() - start
+
+            self.assertEqual(list(names), urls)
+            self.assertEqual(names[urls[3]], "sample3.fastq.gz")
+            self.assertEqual(server.requests, 8)
+            self.assertEqual(server.max_concurrent, 4)
+            # Serially, this would take 8 x 0.3 s
+            self.assertLess(elapsed, 8 * 0.3 / 2)
+            self.assertEqual(progress[0], (0, 8))
+            self.assertEqual(progress[-1], (8, 8))
+
+            # Results are shared via the find_filename_and_size_from_url cache
+            resolve_filenames_from_urls(urls)
+            self.assertEqual(server.requests, 8)
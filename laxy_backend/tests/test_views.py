@@ -3,6 +3,7 @@ from collections import OrderedDict
 from datetime import timedelta
 from io import BytesIO, StringIO
 import unittest
+from unittest import mock
 import os
 import random
 import codecs
@@ -15,7 +16,10 @@ from pathlib import Path
 
 import jwt
 
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.test.client import Client
 from django.urls import reverse
@@ -24,7 +28,17 @@ from rest_framework.test import APIClient, RequestsClient
 from laxy_backend import util
 from ..util import ordereddicts_to_dicts, laxy_sftp_url
 from ..util import reverse_querystring
-from ..models import Job, File, FileSet, SampleCart, ComputeResource, AccessToken
+from .test_util import SlowDownloadServer
+from ..models import (
+    Job,
+    File,
+    FileSet,
+    SampleCart,
+    ComputeResource,
+    AccessToken,
+    EventLog,
+    Pipeline,
+)
 from ..jwt_helpers import (
     get_jwt_user_header_dict,
     make_jwt_header_dict,
@@ -164,6 +178,52 @@ class FileViewTest(TestCase):
         self.assertEqual(json_data.get("checksum"), None)
         self.assertEqual(json_data.get("metadata"), {})
 
+    def test_file_conditional_get(self):
+        url = reverse("laxy_backend:file", args=[self.file_a.uuid()])
+        response = self.user_client.get(url, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.user_client.get(
+            url, content_type="application/json", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # A new default location changes the File's JSON, so its ETag
+        self.file_a.add_location("file:///tmp/elsewhere/file_a", set_as_default=True)
+        response = self.user_client.get(
+            url, content_type="application/json", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["location"], "file:///tmp/elsewhere/file_a")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_fileset_conditional_get(self):
+        fileset = FileSet(name="fs", owner=self.user)
+        fileset.save()
+        fileset.add([self.file_a])
+        url = reverse("laxy_backend:fileset", args=[fileset.uuid()])
+
+        response = self.user_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Changing a file in the set, or the set's membership, is a change
+        self.file_a.metadata = {"changed": True}
+        self.file_a.save()
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        self.file_a.fileset = None
+        self.file_a.save()
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["files"], [])
+
     def test_update_file_checksum(self):
         new_checksum = "md5:cbda22bcb41ab0151b438589aa4637e2"
         response = self.user_client.patch(
@@ -510,6 +570,145 @@ class JobViewTest(TestCase):
         self.assertNotEqual(j.expiry_time, None)
         self.assertGreater(j.expiry_time, timezone.now())
 
+    def test_job_conditional_get(self):
+        url = reverse("laxy_backend:job", args=[self.admin_job.uuid()])
+
+        def job_queries(queries):
+            return [q for q in queries if 'FROM "laxy_backend_job"' in q["sql"]]
+
+        with CaptureQueriesContext(connection) as full:
+            response = self.admin_authenticated_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # The Job is only fetched once
+        self.assertEqual(len(job_queries(full.captured_queries)), 1)
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+
+        with CaptureQueriesContext(connection) as cached:
+            response = self.admin_authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(len(job_queries(cached.captured_queries)), 1)
+        self.assertLess(len(cached), len(full))
+
+        response = self.admin_authenticated_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # An ETag for another version of the job doesn't match
+        response = self.admin_authenticated_client.get(
+            url, HTTP_IF_NONE_MATCH='W/"2000-01-01T00:00:00+00:00"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.admin_job.status = Job.STATUS_RUNNING
+        self.admin_job.save()
+        response = self.admin_authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], Job.STATUS_RUNNING)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # No 304s for objects the client can't see
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 404)
+
+    def test_job_list_conditional_get(self):
+        url = reverse("laxy_backend:list_jobs")
+        response = self.user_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # A new latest event is shown in the list
+        self.user_job.log_event("JOB_INFO", "Something happened.")
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        self.user_job.delete()
+        response = self.user_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_job_list_conditional_get_by_format(self):
+        url = reverse("laxy_backend:list_jobs")
+        response = self.user_client.get(url, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Accept", response["Vary"])
+        json_etag = response["ETag"]
+
+        # The CSV rendering of the same jobs is a different representation
+        response = self.user_client.get(
+            url, HTTP_ACCEPT="text/csv", HTTP_IF_NONE_MATCH=json_etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"].split(";")[0], "text/csv")
+        self.assertNotEqual(response["ETag"], json_etag)
+
+        response = self.user_client.get(
+            url, HTTP_ACCEPT="text/csv", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("Accept", response["Vary"])
+
+    def test_job_eventlog_batch_create(self):
+        url = reverse("laxy_backend:create_job_eventlog_batch", args=[self.user_job.uuid()])
+        events = [
+            {
+                "event": "JOB_INFO",
+                "message": "second",
+                "timestamp": "2024-03-01T02:03:05.000001Z",
+            },
+            {"message": "no event"},
+            {
+                "event": "JOB_INFO",
+                "message": "first",
+                "extra": {"step": 1},
+                "timestamp": "2024-03-01T02:03:04.123456Z",
+            },
+            {"event": "JOB_INFO", "message": "third"},
+            {"event": "JOB_INFO", "message": "fourth"},
+        ]
+        response = self.user_client.post(url, data=events, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        results = response.json()["results"]
+        self.assertEqual(
+            [r["status"] for r in results], [201, 400, 201, 201, 201]
+        )
+        self.assertIn("event", results[1]["errors"])
+
+        logged = EventLog.objects.filter(
+            object_id=self.user_job.id, event="JOB_INFO"
+        ).order_by("timestamp")
+        self.assertEqual(
+            [e.message for e in logged], ["first", "second", "third", "fourth"]
+        )
+        self.assertEqual(logged[0].extra, {"step": 1})
+        self.assertEqual(logged[0].id, results[2]["id"])
+        self.assertTrue(all(e.user == self.user for e in logged))
+
+    def test_job_eventlog_batch_create_access(self):
+        events = [{"event": "JOB_INFO", "message": "hello"}]
+
+        url = reverse("laxy_backend:create_job_eventlog_batch", args=[self.admin_job.uuid()])
+        response = self.user_client.post(url, data=events, format="json")
+        self.assertEqual(response.status_code, 403)
+
+        url = reverse("laxy_backend:create_job_eventlog_batch", args=["NoSuchJob"])
+        response = self.user_client.post(url, data=events, format="json")
+        self.assertEqual(response.status_code, 404)
+
+        url = reverse("laxy_backend:create_job_eventlog_batch", args=[self.user_job.uuid()])
+        response = self.user_client.post(url, data=events[0], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            EventLog.objects.filter(object_id=self.user_job.id, event="JOB_INFO").exists()
+        )
+
     def test_verify_jwt_token(self):
         token = create_jwt_user_token("testuser")[0]
         client = APIClient(HTTP_CONTENT_TYPE="application/json")
@@ -653,6 +852,29 @@ class JobViewTest(TestCase):
             job.output_files.get_files()[0].type_tags, ["bai", "jbrowse"]
         )
 
+    def test_job_files_from_csv_limits(self):
+        csv = b"filepath,checksum\n" + b"".join(
+            b"input/reads/sample%d.fastq.gz,md5:%d\n" % (n, n) for n in range(5)
+        )
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse("laxy_backend:job_file_bulk", args=[self.job_with_compute.id])
+
+        with override_settings(CSV_UPLOAD_MAX_ROWS=4):
+            response = client.post(url, data=csv, content_type="text/csv")
+        self.assertEqual(response.status_code, 400)
+        # Rows parsed before the limit was hit aren't partially registered
+        job = Job.objects.get(id=self.job_with_compute.id)
+        self.assertEqual(job.input_files.files.count(), 0)
+
+        with override_settings(CSV_UPLOAD_MAX_BYTES=len(csv) - 1):
+            response = client.post(url, data=csv, content_type="text/csv")
+        self.assertEqual(response.status_code, 400)
+
+        response = client.post(url, data=csv, content_type="text/csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["input_files"]), 5)
+
     def test_job_files_from_csv_with_location(self):
         csv = [
             b"checksum,filepath,location,metadata,type_tags\n",
@@ -716,6 +938,146 @@ class JobViewTest(TestCase):
         )
 
 
+class JobCreateViewTest(TestCase):
+    def setUp(self):
+        self.user, self.client = _create_user_and_login(
+            "jobcreator", "jobpass", is_superuser=False
+        )
+        self.user.email = "jobcreator@example.com"
+        self.user.save()
+        Pipeline.objects.create(name="rnasik", public=True, owner=self.user)
+        self.compute = ComputeResource.objects.create(
+            name="cluster-a",
+            host="localhost",
+            status=ComputeResource.STATUS_ONLINE,
+            priority=10,
+            extra={"base_dir": "/tmp"},
+        )
+        self.other_compute = ComputeResource.objects.create(
+            name="cluster-b",
+            host="localhost",
+            status=ComputeResource.STATUS_ONLINE,
+            priority=1,
+            extra={"base_dir": "/tmp"},
+        )
+
+        # The remote part of starting a job is queued, not run in the request
+        patcher = mock.patch("laxy_backend.views.start_job.apply_async")
+        self.apply_async = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch(
+            "laxy_backend.views.get_jwt_user_header_str",
+            return_value="Authorization: Bearer token",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_job(self, **data):
+        params = dict(pipeline="rnasik", params={"genome": "Homo_sapiens/UCSC/hg38"})
+        return self.client.post(
+            reverse("laxy_backend:create_job"),
+            data=json.dumps({"params": json.dumps(params), **data}),
+            content_type="application/json",
+        )
+
+    def test_create_job(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self._create_job()
+        self.assertEqual(response.status_code, 200)
+
+        job = Job.objects.get(id=response.json()["id"])
+        self.assertEqual(job.owner, self.user)
+        self.assertEqual(job.compute_resource, self.compute)
+        self.assertEqual(job.params["pipeline"], "rnasik")
+
+        # The Job, its FileSets and its job_created event are each inserted
+        # once, and not updated afterwards
+        self.assertEqual(FileSet.objects.count(), 2)
+        self.assertEqual(job.input_files.owner, self.user)
+        self.assertEqual(job.output_files.owner, self.user)
+        self.assertEqual(job.latest_event().event, "job_created")
+        self.assertEqual(job.events().get().user, self.user)
+        writes = [
+            q["sql"].split(" (")[0]
+            for q in queries.captured_queries
+            if q["sql"].startswith(("INSERT", "UPDATE"))
+        ]
+        self.assertEqual(
+            sorted(writes),
+            [
+                'INSERT INTO "laxy_backend_eventlog"',
+                'INSERT INTO "laxy_backend_fileset"',
+                'INSERT INTO "laxy_backend_job"',
+            ],
+        )
+
+        self.apply_async.assert_called_once()
+        (task_data,) = self.apply_async.call_args.kwargs["args"]
+        self.assertEqual(task_data["job_id"], job.id)
+        self.assertEqual(task_data["environment"]["JOB_ID"], job.id)
+
+    def test_compute_resource_status_changes_are_seen(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self._create_job()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(
+                [
+                    q
+                    for q in queries.captured_queries
+                    if q["sql"].startswith('SELECT "laxy_backend_computeresource"')
+                ]
+            ),
+            1,
+        )
+
+        # Taken offline elsewhere (eg by a Celery worker, so without any
+        # signal in this process), but seen by the next job
+        ComputeResource.objects.filter(id=self.compute.id).update(
+            status=ComputeResource.STATUS_OFFLINE
+        )
+        response = self._create_job()
+        self.assertEqual(
+            Job.objects.get(id=response.json()["id"]).compute_resource,
+            self.other_compute,
+        )
+
+    @override_settings(
+        EMAIL_DOMAIN_ALLOWED_COMPUTE={"example.com": ["cluster-b"], "*": ["*"]}
+    )
+    def test_compute_resource_rules_by_email_domain(self):
+        response = self._create_job()
+        self.assertEqual(
+            Job.objects.get(id=response.json()["id"]).compute_resource,
+            self.other_compute,
+        )
+
+    def test_input_files_locality(self):
+        # Inputs already on the lower priority cluster-b are used there
+        fileset = FileSet.objects.create(name="uploads", owner=self.user)
+        input_files = [
+            dict(
+                name=f"reads_{n}.fastq.gz",
+                path="input",
+                fileset=fileset.id,
+                location=f"laxy+sftp://{self.other_compute.id}/upload/reads_{n}.fastq.gz",
+            )
+            for n in range(3)
+        ]
+        response = self._create_job(input_files=input_files)
+        self.assertEqual(response.status_code, 200)
+        job = Job.objects.get(id=response.json()["id"])
+        self.assertEqual(job.compute_resource, self.other_compute)
+        self.assertEqual(job.input_files.get_files().count(), 3)
+
+    def test_job_params_validated(self):
+        job = Job(owner=self.user, params={"pipeline": "../../etc"})
+        with self.assertRaises(ValidationError):
+            job.save()
+        self.assertFalse(Job.objects.filter(id=job.id).exists())
+        self.assertEqual(FileSet.objects.count(), 0)
+
+
 class SampleCartViewTest(TestCase):
     def setUp(self):
         # admin_user, authenticated_client = _create_user_and_login()
@@ -870,6 +1232,34 @@ SampleC,ftp://ftp.example.com/pub/foo2_lane5_1.fastq.gz,ftp://ftp.example.com/pu
         self.assertEqual(response.data.get("samples"), self.sample_list)
 
 
+    def test_create_with_csv_background(self):
+        client = APIClient()
+        client.login(username=self.username, password=self.password)
+        with SlowDownloadServer(latency=0.1) as server:
+            csv_text = (
+                f"SampleA,{server.url}/download?id=1,{server.url}/download?id=2\r\n"
+                f"SampleB,{server.url}/reads/B_R1.fastq.gz,{server.url}/download?id=3\r\n"
+            )
+            response = client.post(
+                reverse("laxy_backend:create_samplecart") + "?background=1",
+                data=csv_text,
+                content_type="text/csv",
+            )
+        self.assertEqual(server.requests, 3)
+
+        # The (eager) task has already resolved the names
+        self.assertEqual(response.status_code, 202)
+        self.assertIn("task_id", response.data)
+        cart = SampleCart.objects.get(id=response.data["id"])
+        self.assertEqual(
+            [f["name"] for s in cart.samples for pair in s["files"] for f in pair.values()],
+            ["sample1.fastq.gz", "sample2.fastq.gz", "B_R1.fastq.gz", "sample3.fastq.gz"],
+        )
+        events = EventLog.objects.filter(object_id=cart.id).order_by("timestamp")
+        self.assertEqual(events.last().event, "SAMPLECART_IMPORT_COMPLETE")
+        self.assertEqual(events.first().extra["resolved"], 1)
+
+
 class JobAccessTokenViewTest(TestCase):
     def setUp(self):
         self.admin_user, self.admin_client = _create_user_and_login(
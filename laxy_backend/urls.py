@@ -39,6 +39,7 @@ from laxy_backend.views import (
     EventLogCreate,
     EventLogListView,
     JobEventLogCreate,
+    JobEventLogBatchCreate,
     JobFileView,
     JobFileBulkRegistration,
     trigger_file_registration,
@@ -163,6 +164,11 @@ api_urls = [
         JobEventLogCreate.as_view(),
         name="create_job_eventlog",
     ),
+    re_path(
+        r"job/(?P<uuid>[a-zA-Z0-9\-_]+)/events/$",
+        JobEventLogBatchCreate.as_view(),  # POST (JSON array)
+        name="create_job_eventlog_batch",
+    ),
     re_path(
         r"job/(?P<job_id>[a-zA-Z0-9\-_]+)/accesstoken/$",
         JobAccessTokenView.as_view(),
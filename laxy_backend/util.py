@@ -1,5 +1,20 @@
-from typing import Union, Tuple, Sequence
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 import traceback
+import codecs
+import csv
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import random
 import string
 import re
@@ -14,8 +29,10 @@ import urllib
 from email.message import EmailMessage as HTTPHeaders
 import os
 from operator import itemgetter
-from functools import cmp_to_key
-from typing import Mapping, Sequence
+import fnmatch
+import time
+from typing import Mapping, Pattern
+import regex as regex_module  # (not re, for match timeouts)
 import unicodedata
 from text_unidecode import unidecode
 from contextlib import contextmanager
@@ -177,6 +194,115 @@ def find_filename_and_size_from_url(url, sanitize_name=True, **kwargs):
     return filename, file_size
 
 
+# URL paths ending like this name the file being downloaded - the server is
+# unlikely to say otherwise via Content-Disposition
+DATA_FILE_NAME_RE = re.compile(
+    r"\.(f(ast)?q|fa(sta)?|fna|sam|bam|cram|bai|vcf|bed|gtf|gff3?|sra|txt|csv|tsv"
+    r"|tar|zip)(\.(gz|bz2|xz|zst))?$|\.(tgz|tbz2)$",
+    re.IGNORECASE,
+)
+
+
+def filename_from_url_path(
+    url: str, sanitize_name=True, guess=False
+) -> Optional[str]:
+    """
+    Returns the filename for a download URL when it can be determined from the
+    URL alone, without making a request. ftp://, sftp:// and file:// URLs are
+    always named by their path, as are http(s):// URLs ending in a recognised
+    data file extension without a query string. Other URLs (eg
+    https://example.com/download?id=123) return None, unless `guess` is True
+    in which case the last path component is returned (as
+    find_filename_and_size_from_url falls back to).
+
+    :param url: The URL
+    :type url: str
+    :param sanitize_name: Sanitize the filename with sanitize_filename
+    :type sanitize_name: bool
+    :param guess: Return the last path component even if it may not be the filename
+    :type guess: bool
+    :return: The filename, or None
+    :rtype: str | None
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    filename = os.path.basename(parsed.path).strip()
+    obvious = scheme in ["ftp", "sftp", "file"] or (
+        scheme in ["http", "https"]
+        and not parsed.query
+        and DATA_FILE_NAME_RE.search(filename)
+    )
+    if not filename or not (obvious or guess):
+        return None
+
+    if sanitize_name:
+        filename = sanitize_filename(filename)
+
+    return filename
+
+
+def resolve_filenames_from_urls(
+    urls: Iterable[str],
+    max_workers: int = 8,
+    max_per_host: int = 2,
+    timeout: int = 30,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, str]:
+    """
+    Finds the filenames for many download URLs. URLs that name their file
+    (see filename_from_url_path) are resolved without a request - the rest are
+    resolved concurrently with find_filename_and_size_from_url (so results are
+    shared via its cache), making at most `max_per_host` requests to any one
+    host at a time.
+
+    :param urls: The URLs (duplicates are resolved once).
+    :type urls: Iterable[str]
+    :param max_workers: The maximum number of concurrent requests.
+    :type max_workers: int
+    :param max_per_host: The maximum number of concurrent requests to one host.
+    :type max_per_host: int
+    :param timeout: The timeout for each request, in seconds.
+    :type timeout: int
+    :param progress: Called as progress(resolved, total) as URLs are resolved.
+    :type progress: Callable
+    :return: Filenames keyed by URL.
+    :rtype: Dict[str, str]
+    :raises ValueError: If a filename can't be found for a URL.
+    """
+    urls = list(OrderedDict.fromkeys(urls))
+    filenames = {}
+    remote = []
+    for url in urls:
+        filename = filename_from_url_path(url)
+        if filename:
+            filenames[url] = filename
+        else:
+            remote.append(url)
+
+    if progress is not None:
+        progress(len(filenames), len(urls))
+    if not remote:
+        return filenames
+
+    host_limits = {
+        host: threading.BoundedSemaphore(max_per_host)
+        for host in set(urlparse(url).netloc for url in remote)
+    }
+
+    def _resolve(url):
+        with host_limits[urlparse(url).netloc]:
+            return find_filename_and_size_from_url(url, timeout=timeout)[0]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(remote))) as pool:
+        futures = {pool.submit(_resolve, url): url for url in remote}
+        for future in as_completed(futures):
+            filenames[futures[future]] = future.result()
+            if progress is not None:
+                progress(len(filenames), len(urls))
+
+    return {url: filenames[url] for url in urls}
+
+
 def reverse_querystring(
     view, urlconf=None, args=None, kwargs=None, current_app=None, query_kwargs=None
 ):
@@ -206,7 +332,8 @@ def multikeysort(
 ) -> Sequence[Mapping]:
     """
     Takes a list of dictionaries and returns a list sorted by the value
-    associated with keys specified in 'columns'.
+    associated with keys specified in 'columns'. A column prefixed with '-'
+    (eg '-name') is sorted in descending order.
 
     Alternative is to just use pydash.sort_by instead ...
     (https://pydash.readthedocs.io/en/latest/api.html#pydash.collections.sort_by)
@@ -220,21 +347,69 @@ def multikeysort(
     :return: A sorted list.
     :rtype: list of dicts
     """
-    i = itemgetter
-    comparers = [
-        ((i(col[1:].strip()), -1) if col.startswith("-") else (i(col.strip()), 1))
-        for col in columns
+    # Python's sort is stable, so sorting by each column in turn (the least
+    # significant first) sorts by all of them - with a C-level key per pass,
+    # rather than a Python comparison function per pair of items
+    items = list(items)
+    for col in reversed(columns):
+        col = col.strip()
+        descending = col.startswith("-")
+        key = itemgetter(col[1:].strip() if descending else col)
+        items.sort(key=key, reverse=descending != reverse)
+    return items
+
+
+def filter_listing(
+    listing: Sequence[Mapping],
+    fileglob: Optional[str] = None,
+    regex: Union[str, Pattern, None] = None,
+    timeout: Optional[float] = None,
+) -> List[Mapping]:
+    """
+    Filter a file listing (eg from RemoteBrowseView) - files must have a name
+    matching `fileglob` (ignoring any directory part) and `regex` (anywhere in the
+    name, including directories). Directories are always kept.
+
+    :param listing: Dicts with (at least) `type` and `name` keys.
+    :type listing: Sequence[Mapping]
+    :param fileglob: A glob (wildcard) pattern, eg `*.fastq.gz`
+    :type fileglob: str
+    :param regex: A regular expression, eg `_R[12]_`
+    :type regex: str
+    :param timeout: The most seconds to spend matching `regex`, in total.
+    :type timeout: float
+    :return: The matching directories and files.
+    :rtype: list of dicts
+    :raises TimeoutError: If matching `regex` takes longer than `timeout`.
+    """
+    if fileglob in [None, "", "*"] and not regex:
+        return list(listing)
+
+    glob_match = re.compile(fnmatch.translate(fileglob or "*")).match
+    regex_search = None
+    if regex:
+        pattern = regex_module.compile(getattr(regex, "pattern", regex))
+        if timeout is None:
+            regex_search = pattern.search
+        else:
+            deadline = time.monotonic() + timeout
+
+            def regex_search(name):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Timed out matching regex")
+                return pattern.search(name, timeout=remaining)
+
+    return [
+        item
+        for item in listing
+        if item["type"] == "directory"
+        or (
+            glob_match(os.path.basename(item["name"]))
+            and (regex_search is None or regex_search(item["name"]))
+        )
     ]
 
-    def cmp(a, b):
-        return (a > b) - (a < b)
-
-    def comparer(left, right):
-        comparer_iter = (cmp(fn(left), fn(right)) * mult for fn, mult in comparers)
-        return next((result for result in comparer_iter if result), 0)
-
-    return sorted(items, key=cmp_to_key(comparer), reverse=reverse)
-
 
 def laxy_sftp_url(job, compute_resource=None, path: str = None) -> str:
     """
@@ -346,6 +521,92 @@ def get_content_type(request: Request) -> str:
     return request.content_type.split(";")[0].strip()
 
 
+def iter_text_lines(
+    stream,
+    encoding: str = "utf-8-sig",
+    chunk_size: int = 64 * 1024,
+    max_bytes: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Lazily decode a binary file-like object (eg a request stream or an uploaded
+    file), yielding lines with their line endings (as `csv.reader` expects).
+
+    Only one chunk is held in memory at a time, so large uploads can be parsed
+    without reading the whole body first.
+
+    :param stream: Anything with a `read(size)` method returning bytes.
+    :type stream: file-like
+    :param encoding: The text encoding. utf-8-sig strips any byte order mark.
+    :type encoding: str
+    :param chunk_size: The number of bytes to read at a time.
+    :type chunk_size: int
+    :param max_bytes: Raise ValueError once more than this many bytes are read.
+    :type max_bytes: int
+    :return: An iterator of lines.
+    :rtype: Iterator[str]
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    remainder = ""
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if max_bytes is not None and total > max_bytes:
+            raise ValueError(f"Input is larger than the limit of {max_bytes} bytes")
+        lines = (remainder + decoder.decode(chunk)).splitlines(keepends=True)
+        # The last line may continue in the next chunk (including the \n of a
+        # \r\n split across chunks)
+        remainder = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+
+    yield from (remainder + decoder.decode(b"", final=True)).splitlines(keepends=True)
+
+
+def limit_rows(rows: Iterable, max_rows: Optional[int] = None) -> Iterator:
+    """
+    Pass through `rows`, raising ValueError once more than `max_rows` are seen.
+    """
+    for n, row in enumerate(rows, start=1):
+        if max_rows is not None and n > max_rows:
+            raise ValueError(f"Input has more than the limit of {max_rows} rows")
+        yield row
+
+
+def iter_csv_records(lines: Iterable[str]) -> Iterator[dict]:
+    """
+    Lazily parse CSV or TSV text with a header row into dicts keyed by column
+    name. Tab or comma delimiters are detected from the header. Empty values
+    become None, extra unnamed values are dropped.
+
+    :param lines: Lines of text, eg from `iter_text_lines`.
+    :type lines: Iterable[str]
+    :return: An iterator of records.
+    :rtype: Iterator[dict]
+    """
+    lines = iter(lines)
+    header = next(lines, "")
+    dialect = csv.excel_tab if header.count("\t") > header.count(",") else csv.excel
+    reader = csv.DictReader(itertools.chain([header], lines), dialect=dialect)
+    reader.fieldnames = [name.strip() for name in reader.fieldnames or []]
+    for row in reader:
+        yield {
+            key: value if value != "" else None
+            for key, value in row.items()
+            if key is not None
+        }
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    """
+    Split an iterable into lists of (at most) `size` items.
+    """
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
 def get_traceback_message(ex: BaseException) -> Union[str]:
     message = ""
     if hasattr(ex, "message") and ex.message:
@@ -2,21 +2,29 @@ from collections import OrderedDict
 
 import json_merge_patch
 import jsonpatch
-from io import StringIO, BytesIO
+from io import StringIO
 from rest_framework.generics import GenericAPIView
 from rest_framework.serializers import BaseSerializer
-from typing import List, Union
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple, Union
 import functools
 
 import csv
-import json
-import pandas as pd
 
 from rest_framework.request import Request
 from rest_framework.response import Response
+from django.conf import settings
+from django.db.models import Count, Max, QuerySet
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework import status
-from rest_framework.exceptions import NotAuthenticated, PermissionDenied, NotFound
+from rest_framework.exceptions import (
+    NotAuthenticated,
+    NotFound,
+    ParseError,
+    PermissionDenied,
+)
 from rest_framework.views import APIView
 from rest_framework.schemas import SchemaGenerator
 from rest_framework.renderers import JSONRenderer, SchemaJSRenderer, CoreJSONRenderer
@@ -26,33 +34,134 @@ from rest_framework.parsers import JSONParser, BaseParser
 
 import logging
 
-from .util import get_content_type
+from .util import get_content_type, iter_csv_records, iter_text_lines, limit_rows
 
 logger = logging.getLogger(__name__)
 
 
+def weak_etag(*parts) -> str:
+    # NGINX strips out 'strong' ETags by default, so we use a weak (W/) ETag
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def modified_time_validators(obj) -> Tuple[Optional[str], Optional[datetime]]:
+    """
+    The (ETag, Last-Modified) validators for an object with a modified_time
+    field (eg Timestamped models), or (None, None).
+    """
+    modified_time = getattr(obj, "modified_time", None)
+    if modified_time is None:
+        return None, None
+    return weak_etag(modified_time.isoformat()), modified_time
+
+
+def conditional_response(
+    request: Request, etag: Optional[str], last_modified: Optional[datetime]
+) -> Optional[HttpResponse]:
+    """
+    Returns a `304 Not Modified` response if the client's copy is current
+    according to the `If-None-Match` / `If-Modified-Since` request headers
+    (or `412 Precondition Failed` for a failed `If-Match`), otherwise None.
+    """
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None,
+    )
+    if response is not None:
+        add_validator_headers(response, etag, last_modified)
+    return response
+
+
+def add_validator_headers(
+    response: HttpResponse, etag: Optional[str], last_modified: Optional[datetime]
+):
+    if last_modified is not None and response.get("Last-Modified", None) is None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    if etag is not None and response.get("ETag", None) is None:
+        response["ETag"] = etag
+
+
 def etag_headers(method):
     """
-    A decorator that adds `ETag` and `Last-Modified` headers to `.get` method responses if not already present.
-    Intended to be use with Timestamped models (or any object with a modified_time field).
+    A decorator for `.get` methods that handles conditional requests.
+
+    The object is resolved (and permissions checked) once, before the method
+    runs - the method's own `get_object()` calls reuse it. If the client's
+    `If-None-Match` / `If-Modified-Since` headers match the object's
+    validators a `304 Not Modified` is returned without running the method,
+    otherwise `ETag` and `Last-Modified` headers are added to its response if
+    not already present.
+
+    Validators come from the view's `get_validators(obj)` method if it has
+    one, otherwise from the object's `modified_time` field.
     """
 
     @functools.wraps(method)
-    def add_etag_headers_to_response(*args, **kwargs):
-        response = method(*args, **kwargs)
-        if len(args) > 0:
-            obj = args[0].get_object()
-            if hasattr(obj, "modified_time"):
-                if response.get("Last-Modified", None) is None:
-                    response["Last-Modified"] = obj.modified_time.strftime(
-                        "%a, %d %b %Y %H:%M:%S GMT"
-                    )
-                if response.get("ETag", None) is None:
-                    # NGINX strips out 'strong' ETags by default, so we use a weak (W/) ETag
-                    response["ETag"] = f'W/"{obj.modified_time.isoformat()}"'
+    def conditional_get(view, request, *args, **kwargs):
+        obj = view.get_object()
+        view.get_object = lambda: obj
+        get_validators = getattr(view, "get_validators", modified_time_validators)
+        etag, last_modified = get_validators(obj)
+
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = method(view, request, *args, **kwargs)
+        if 200 <= response.status_code < 300:
+            add_validator_headers(response, etag, last_modified)
+            # Some views return a different representation depending on the
+            # request Content-Type (eg File JSON vs. content)
+            patch_vary_headers(response, ["Content-Type"])
         return response
 
-    return add_etag_headers_to_response
+    return conditional_get
+
+
+class ConditionalListMixin:
+    """
+    Conditional request handling for generic list views. Validators are the
+    newest `etag_modified_field` value and count over the (filtered) queryset,
+    so a `304 Not Modified` can be returned from one aggregate query, before
+    anything is serialized.
+
+    The ETag includes the negotiated format, since a list view may render
+    the same queryset as eg JSON or CSV depending on the Accept header.
+    """
+
+    etag_modified_field = "modified_time"
+
+    def get_list_validators(
+        self, queryset: QuerySet
+    ) -> Tuple[Optional[str], Optional[datetime]]:
+        agg = queryset.order_by().aggregate(
+            last_modified=Max(self.etag_modified_field), count=Count("pk")
+        )
+        last_modified = agg["last_modified"]
+        renderer = getattr(self.request, "accepted_renderer", None)
+        return (
+            weak_etag(
+                last_modified.isoformat() if last_modified else "",
+                agg["count"],
+                getattr(renderer, "format", ""),
+            ),
+            last_modified,
+        )
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_list_validators(
+            self.filter_queryset(self.get_queryset())
+        )
+        not_modified = conditional_response(request, etag, last_modified)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ["Accept"])
+            return not_modified
+
+        response = super().list(request, *args, **kwargs)
+        add_validator_headers(response, etag, last_modified)
+        patch_vary_headers(response, ["Accept"])
+        return response
 
 
 class JSONView(GenericAPIView):
@@ -82,6 +191,13 @@ class JSONView(GenericAPIView):
         kwargs["context"] = self.get_serializer_context()
         return serializer_class(*args, **kwargs)
 
+    def get_validators(self, obj) -> Tuple[Optional[str], Optional[datetime]]:
+        """
+        The (ETag, Last-Modified) validators used by `@etag_headers` for
+        conditional requests on the object. Either may be None.
+        """
+        return modified_time_validators(obj)
+
     def get_response_serializer(self, *args, **kwargs):
         """
         Return the serializer instance that should be used for validating and
@@ -112,6 +228,35 @@ class JSONView(GenericAPIView):
         raise NotFound()
 
 
+def _csv_media_type_params(media_type: str) -> dict:
+    params = dict(
+        [param.strip().split("=") for param in (media_type or "").split(";")[1:]]
+    )
+    # Override utf-8 encoding to always handle byte order mark transparently
+    if params.get("charset", "utf-8").lower() in ("utf-8", "utf8"):
+        params["charset"] = "utf-8-sig"
+    return params
+
+
+def _check_content_length(parser_context: Optional[dict], max_bytes: int):
+    request = (parser_context or {}).get("request", None)
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except (AttributeError, ValueError):
+        return
+    if content_length > max_bytes:
+        raise ParseError(f"CSV upload is larger than the limit of {max_bytes} bytes")
+
+
+def _parse_errors_as_400(rows: Iterator) -> Iterator:
+    # Parsing happens lazily as the view consumes rows, so errors are raised
+    # there - turn them into 400 Bad Request rather than 500s
+    try:
+        yield from rows
+    except (ValueError, csv.Error) as ex:
+        raise ParseError(f"CSV parse error - {ex}")
+
+
 class CSVTextParser(BaseParser):
     """
     A CSV parser for DRF APIViews.
@@ -119,65 +264,50 @@ class CSVTextParser(BaseParser):
     Based on the RFC 4180 text/csv MIME type, but extended with
     a dialect.
     https://tools.ietf.org/html/rfc4180
+
+    Rows are decoded and parsed lazily from the request stream as the view
+    consumes them, with uploads limited to settings.CSV_UPLOAD_MAX_BYTES and
+    settings.CSV_UPLOAD_MAX_ROWS.
     """
 
     media_type = "text/csv"
 
-    def parse(self, stream, media_type=None, parser_context=None) -> List[List]:
+    def parse(self, stream, media_type=None, parser_context=None) -> Iterator[List]:
         """
-        Return a list of lists representing the rows of a CSV file.
+        Return an iterator of lists representing the rows of a CSV file.
         """
-        # return list(csv.reader(stream, dialect='excel'))
-
-        media_type_params = dict(
-            [param.strip().split("=") for param in media_type.split(";")[1:]]
-        )
-        charset = media_type_params.get("charset", "utf-8-sig")
-        # Override utf-8 encoding to always handle byte order mark transparently
-        if charset == "utf-8":
-            charset == "utf-8-sig"
-        dialect = media_type_params.get("dialect", "excel")
-        txt = stream.read().decode(charset)
-
-        # cheating
-        # def remove_prefix(s, prefix):
-        #    return s[len(prefix):] if s.startswith(prefix) else s
-        # txt = remove_prefix(txt, "\ufeff")
+        max_bytes = settings.CSV_UPLOAD_MAX_BYTES
+        _check_content_length(parser_context, max_bytes)
+        params = _csv_media_type_params(media_type)
+        lines = iter_text_lines(stream, params["charset"], max_bytes=max_bytes)
+        rows = csv.reader(lines, dialect=params.get("dialect", "excel"))
+        return _parse_errors_as_400(limit_rows(rows, settings.CSV_UPLOAD_MAX_ROWS))
 
-        csv_table = list(csv.reader(txt.splitlines(), dialect=dialect))
-        return csv_table
 
-
-class CSVTextParserPandas(BaseParser):
+class CSVRecordParser(BaseParser):
     """
-    A CSV/TSV parser for DRF APIViews, using the `pandas` library for parsing.
+    A CSV/TSV parser for DRF APIViews, for tables with a header row.
 
-    Based on the RFC 4180 text/csv MIME type.
+    Based on the RFC 4180 text/csv MIME type (tab-delimited tables are detected
+    from the header).
 
     https://tools.ietf.org/html/rfc4180
+
+    Like CSVTextParser, records are parsed lazily as the view consumes them.
     """
 
     media_type = "text/csv"
 
-    def parse(self, stream, media_type=None, parser_context=None) -> List[dict]:
+    def parse(self, stream, media_type=None, parser_context=None) -> Iterator[dict]:
         """
-        Return a list of lists representing the rows of a CSV file.
+        Return an iterator of dicts (keyed by column name) for the rows of a CSV file.
         """
-        media_type_params = dict(
-            [param.strip().split("=") for param in media_type.split(";")[1:]]
-        )
-        charset = media_type_params.get("charset", "utf-8")
-        dialect = media_type_params.get("dialect", "excel")
-        txt = stream.read()
-        try:
-            table = json.loads(
-                pd.read_table(BytesIO(txt), encoding=charset, dialect=dialect).to_json(
-                    orient="records"
-                )
-            )
-        except Exception as ex:
-            raise ex
-        return table
+        max_bytes = settings.CSV_UPLOAD_MAX_BYTES
+        _check_content_length(parser_context, max_bytes)
+        params = _csv_media_type_params(media_type)
+        lines = iter_text_lines(stream, params["charset"], max_bytes=max_bytes)
+        records = iter_csv_records(lines)
+        return _parse_errors_as_400(limit_rows(records, settings.CSV_UPLOAD_MAX_ROWS))
 
 
 class GetMixin:
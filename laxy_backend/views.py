@@ -1,6 +1,10 @@
 import sys
 from collections import OrderedDict
 
+import base64
+import binascii
+import hashlib
+import itertools
 import json
 import mimetypes
 import shlex
@@ -10,13 +14,15 @@ from django.utils.decorators import method_decorator
 from django.utils import timezone
 from django.views.decorators.cache import cache_page
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.db.models import Q, Count, Max
 from django.utils.functional import cached_property
 from django.shortcuts import redirect
 from fnmatch import fnmatch
 import logging
 import os
+import time
 import pydash
+import regex as regex_module  # (not re, for match timeouts)
 
 from paramiko import SSHClient, ssh_exception, RSAKey, AutoAddPolicy
 
@@ -28,7 +34,10 @@ from laxy_backend.scraping import (
     parse_nextcloud_webdav,
     is_nextcloud_or_owncloud_public_share,
     canonical_nextcloud_public_share_url,
+    crawl_nextcloud_share,
+    extract_nextcloud_public_share_token,
 )
+from laxy_backend.scraping.crawl import DirectoryCrawler, FTPLister, listing_cache
 from laxy_backend.scraping.plugins import run_remote_browse_site_plugins
 from . import paramiko_monkeypatch
 
@@ -36,8 +45,8 @@ from toolz import merge as merge_dicts
 import requests
 import celery
 from celery import shared_task
-from celery.result import AsyncResult
-from datetime import datetime
+from celery.result import AsyncResult, EagerResult
+from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.admin.views.decorators import user_passes_test
 from django.db import transaction
@@ -47,7 +56,7 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
-from fs.errors import DirectoryExpected
+from fs.errors import DirectoryExpected, FSError
 from io import BufferedReader, BytesIO, StringIO
 from pathlib import Path
 import paramiko
@@ -74,7 +83,7 @@ from rest_framework.views import APIView
 from rest_framework_csv.renderers import PaginatedCSVRenderer
 from guardian.shortcuts import get_objects_for_user
 
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Tuple, Union
 import urllib
 from urllib.parse import urlparse, parse_qs, unquote
 from wsgiref.util import FileWrapper
@@ -99,6 +108,7 @@ from .permissions import (
 from .filters import IsOwnerFilter, IsPublicFilter
 
 from . import ena
+from .tasks.file import resolve_samplecart_file_names
 from .tasks.job import (
     bulk_move_job_rsync,
     expire_old_job,
@@ -127,6 +137,7 @@ from .models import (
     get_primary_compute_location_for_files,
     job_path_on_compute,
 )
+from .scheduling import choose_compute_resource
 from .serializers import (
     PatchSerializerResponse,
     PutSerializerResponse,
@@ -146,9 +157,11 @@ from .serializers import (
     PipelineSerializer,
     EventLogSerializer,
     JobEventLogSerializer,
+    JobEventLogBatchItemSerializer,
     JobFileSerializerCreateRequest,
     RedirectResponseSerializer,
     FileListing,
+    FileListingItem,
     AccessTokenSerializer,
     JobAccessTokenRequestSerializer,
     JobAccessTokenResponseSerializer,
@@ -161,6 +174,7 @@ from .util import (
     laxy_sftp_url,
     generate_uuid,
     multikeysort,
+    filter_listing,
     get_content_type,
     find_filename_and_size_from_url,
     simplify_fastq_name,
@@ -175,8 +189,10 @@ from .view_mixins import (
     PostMixin,
     CSVTextParser,
     PutMixin,
-    CSVTextParserPandas,
+    CSVRecordParser,
     etag_headers,
+    weak_etag,
+    ConditionalListMixin,
     JSONPatchMixin,
 )
 
@@ -485,6 +501,41 @@ class RemoteFilesQueryParams(QueryParamFilterBackend):
                     example="*.fastq.gz",
                     description="A glob (wildcard) expression to filter files returned. Doesn't filter directories",
                 ),
+                dict(
+                    name="depth",
+                    example="2",
+                    description="The number of directory levels to list (FTP and Nextcloud shares only)",
+                ),
+                dict(
+                    name="max_entries",
+                    example="10000",
+                    description="The most files and directories to list (FTP and Nextcloud shares only)",
+                ),
+                dict(
+                    name="stream",
+                    example="true",
+                    description="Stream the listing as newline delimited JSON, one line per directory",
+                ),
+                dict(
+                    name="regex",
+                    example="_R[12]_",
+                    description="A regular expression to filter files returned. Doesn't filter directories",
+                ),
+                dict(
+                    name="ordering",
+                    example="type,-name",
+                    description="Fields to sort by (type, name, location), comma separated. Prefix with - for descending",
+                ),
+                dict(
+                    name="page_size",
+                    example="1000",
+                    description="Return the listing a page at a time, with a `next` cursor",
+                ),
+                dict(
+                    name="cursor",
+                    example="",
+                    description="The `next` cursor returned with the previous page",
+                ),
             ]
         )
 
@@ -1045,6 +1096,11 @@ class JobFileView(StreamFileMixin, GetMixin, JSONView):
 
     permission_classes = (IsOwner | IsSuperuser | HasReadonlyObjectAccessToken,)
 
+    def get_validators(self, obj):
+        # The object here is the Job, whose modified_time says nothing about
+        # the File at file_path, so no conditional responses
+        return None, None
+
     @extend_schema(responses=FileSerializer)
     @etag_headers
     def get(self, request: Request, uuid: str, file_path: str, version=None):
@@ -1239,7 +1295,7 @@ class JobFileBulkRegistration(JSONView):
     serializer_class = JobSerializerResponse
     parser_classes = (
         JSONParser,
-        CSVTextParserPandas,
+        CSVRecordParser,
     )
 
     permission_classes = (IsOwner | IsSuperuser,)
@@ -1295,8 +1351,8 @@ class JobFileBulkRegistration(JSONView):
             raise NotImplementedError()
 
         elif content_type == "text/csv":
-            tsv_table = request.stream.read()
-            infiles, outfiles = job.add_files_from_tsv(tsv_table)
+            # CSVRecordParser parses request.data lazily, as rows are registered
+            infiles, outfiles = job.add_files_from_tsv(request.data)
 
             i = FileSerializer(infiles, many=True)
             o = FileSerializer(outfiles, many=True)
@@ -1338,6 +1394,19 @@ class FileSetView(GetMixin, DeleteMixin, PatchMixin, JSONView):
 
     # permission_classes = (DjangoObjectPermissions,)
 
+    def get_validators(self, obj):
+        # The response includes the files, so changes to those count too
+        files = obj.files.aggregate(last_modified=Max("modified_time"), count=Count("id"))
+        last_modified = max(filter(None, [obj.modified_time, files["last_modified"]]))
+        return (
+            weak_etag(
+                obj.modified_time.isoformat(),
+                files["last_modified"].isoformat() if files["last_modified"] else "",
+                files["count"],
+            ),
+            last_modified,
+        )
+
     # @method_decorator(cache_page(60 * 60 * 1))
     @extend_schema(responses=FileSetSerializer)
     @etag_headers
@@ -1374,6 +1443,31 @@ class SampleCartCreateUpdate(JSONView):
         CSVTextParser,
     )
 
+    def _import_csv(self, request, obj, csv_table):
+        """
+        Fills the SampleCart from CSV rows. With `?background=1`, file names that
+        need a request to find are resolved by a task, returning
+        202 Accepted straight away - progress is recorded as events for the
+        SampleCart (`/api/v1/eventlogs/?object_id={samplecart_id}`).
+        """
+        if not obj.name:
+            obj.name = f"CSV uploaded on {datetime.isoformat(timezone.now())}"
+
+        background = request.query_params.get("background", None) in ("1", "true")
+        obj.from_csv(csv_table, resolve_names=not background)
+
+        if background and obj.unresolved_file_locations():
+            result = resolve_samplecart_file_names.apply_async(
+                args=(dict(samplecart_id=obj.id),)
+            )
+            obj.refresh_from_db()
+            data = dict(self.get_serializer(instance=obj).data, task_id=result.id)
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+
+        return Response(
+            self.get_serializer(instance=obj).data, status=status.HTTP_200_OK
+        )
+
     def create_update(self, request, obj):
         """
         Replaces an existing SampleCart with new content, or creates a new one if `uuid` is None.
@@ -1391,26 +1485,16 @@ class SampleCartCreateUpdate(JSONView):
         encoding = "utf-8-sig"
 
         if content_type == "multipart/form-data":
-            if not obj.name:
-                obj.name = f"CSV uploaded on {datetime.isoformat(timezone.now())}"
             fh = request.data.get("file", None)
-            csv_table = fh.read().decode(encoding)
-            obj.from_csv(csv_table)
-
-            return Response(
-                self.get_serializer(instance=obj).data, status=status.HTTP_200_OK
+            # Parse the uploaded file lazily, with the same limits as text/csv
+            csv_table = CSVTextParser().parse(
+                fh, media_type=f"text/csv; charset={encoding}"
             )
+            return self._import_csv(request, obj, csv_table)
 
         elif content_type == "text/csv":
-            if not obj.name:
-                obj.name = f"CSV uploaded on {datetime.isoformat(timezone.now())}"
-            # CSVTextParser ensures request.data is already parsed as a list of lists
-            csv_table = request.data
-            obj.from_csv(csv_table)
-
-            return Response(
-                self.get_serializer(instance=obj).data, status=status.HTTP_200_OK
-            )
+            # CSVTextParser ensures request.data is a (lazy) iterator of parsed rows
+            return self._import_csv(request, obj, request.data)
 
         elif content_type == "application/json":
             if not obj.name:
@@ -1450,6 +1534,10 @@ class SampleCartCreate(SampleCartCreateUpdate):
              https://tools.ietf.org/html/rfc4180
           - `multipart/form-data` where the `file` field is the CSV file.
 
+        For CSV, add `?background=1` to return (with `202 Accepted`) before file
+        names that need a request to the file's host are found - see the
+        `SAMPLECART_IMPORT_*` events for the SampleCart for progress.
+
         CSV example:
 
         ```csv
@@ -1668,6 +1756,15 @@ class ComputeResourceCreate(PostMixin, JSONView):
           * `slurm` (optional) - configuration options for SLURM jobs. `account`
              is used for the `sbatch --account=` option, `extra_args` are any additional
              commandline arguments (eg `--partition=fast`) to add to sbatch calls.
+          * `direct_transfer_sources` (optional) - a list of ComputeResource IDs
+             (or `["*"]`) this host can reach over SSH. File copies from those
+             sources are pulled directly by this host (via rsync) rather than
+             relayed through the Laxy backend.
+          * `conda_prewarm` (optional) - if `true`, a daily task builds the conda
+             environments of pipeline versions recently run on this host ahead of
+             time, so jobs don't wait for them.
+          * `max_jobs` (optional) - the most jobs this host runs at once. New jobs
+             are placed elsewhere while it's full (see laxy_backend.scheduling).
 
         <!--
         :param request: The request object.
@@ -2134,7 +2231,24 @@ class JobCreate(JSONView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            job = serializer.save()  # owner=request.user)
+            # The default ComputeResource is chosen before the Job is created,
+            # so the Job is inserted once, with it set
+            default_compute = None
+            if not serializer.validated_data.get("compute_resource", None):
+                input_files = None
+                input_fileset_id = request.data.get("input_fileset_id", None)
+                if input_fileset_id:
+                    input_files = File.objects.filter(fileset_id=input_fileset_id)
+                elif serializer.validated_data.get("input_files", None):
+                    # (unsaved, just for their locations)
+                    input_files = [
+                        File(location=f["location"])
+                        for f in serializer.validated_data["input_files"]
+                    ]
+                default_compute = _get_default_compute_resource(
+                    user=request.user, input_files=input_files
+                )
+            job = serializer.save(default_compute_resource=default_compute)
 
             # We associate the previously created SampleCart with our new Job object
             # (SampleCarts effectively should be readonly once associated with a Job).
@@ -2142,14 +2256,16 @@ class JobCreate(JSONView):
             samplecart_id = samplecart.get("id", None)
 
             if samplecart_id:
-                samplecart = SampleCart.objects.get(id=samplecart_id)
-                samplecart.job = job
-                samplecart.save()
-
-            if not job.compute_resource:
-                default_compute = _get_default_compute_resource(job)
-                job.compute_resource = default_compute
-                job.save()
+                # One UPDATE, refusing carts already attached to a Job as
+                # SampleCart.save would (prevent_samplecart_update_after_job_assigned)
+                attached = SampleCart.objects.filter(
+                    id=samplecart_id, job__isnull=True
+                ).update(job=job)
+                if not attached:
+                    raise RuntimeError(
+                        f"SampleCart {samplecart_id} doesn't exist, "
+                        "or is already associated with a Job."
+                    )
 
             if job.status == Job.STATUS_HOLD:
                 # JobSerializerRequest.data can't be used here: its
@@ -2161,7 +2277,11 @@ class JobCreate(JSONView):
                 return Response(response_serializer.data, status=status.HTTP_200_OK)
 
             job_id = job.id
-            job = Job.objects.get(id=job_id)
+            # Reloaded since params may still be the JSON string from the request.
+            # The related objects are used by start_job and the response.
+            job = Job.objects.select_related(
+                "owner", "compute_resource", "input_files", "output_files"
+            ).get(id=job_id)
 
             #### Check authorization to run this particular pipeline
             pipeline_name = job.params.get("pipeline", None)
@@ -2209,12 +2329,19 @@ class JobCreate(JSONView):
                 callback_auth_header=callback_auth_header,
             )
 
-            if result.state == "FAILURE":
-                raise result.result
-                # return Response({'error': result.traceback},
-                #                 status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # Only a task that ran eagerly (eg in tests) has a result yet - asking
+            # the result backend about a task that was just queued would be a
+            # wasted round trip
+            if isinstance(result, EagerResult):
+                if result.state == "FAILURE":
+                    raise result.result
+                    # return Response({'error': result.traceback},
+                    #                 status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+                job = Job.objects.select_related(
+                    "compute_resource", "input_files", "output_files"
+                ).get(id=job_id)
 
-            job = Job.objects.get(id=job_id)
             serializer = self.get_response_serializer(instance=job)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -2285,7 +2412,7 @@ class JobCreate(JSONView):
         _min_mapped_reads = job.params.get("params").get("min_mapped_reads", None)
         if _min_mapped_reads is not None:
             job.params["min_mapped_reads"] = int(_min_mapped_reads)
-            job.save()
+            job.save(update_fields=["params", "modified_time"])
 
         if (
             (
@@ -2346,9 +2473,6 @@ class JobCreate(JSONView):
         # TESTING: Start cluster, run job, (pre-existing data), stop cluster
         # tasks.run_job_chain(task_data)
 
-        # Ensure the Job record is saved before starting, since the task may read it
-        job.save()
-
         result = start_job.apply_async(
             args=(task_data,), link_error=_task_err_handler.s(job_id=job_id)
         )
@@ -2382,7 +2506,7 @@ class JobPagination(PageNumberPagination):
     max_page_size = 100
 
 
-class JobListView(generics.ListAPIView):
+class JobListView(ConditionalListMixin, generics.ListAPIView):
     """
     Retrieve a list of jobs. Can return:
     - JSON format (`Accept: application/json` request header,
@@ -2418,10 +2542,11 @@ class JobListView(generics.ListAPIView):
 
         # TODO: Add UI switch to show all jobs, only available in UI to admins
         #       (Or allow a user email filter via text box)
+        jobs = Job.objects.prefetch_related("latest_eventlog")
         if user.is_superuser:  # and self.request.query_params.get('all', False):
-            return Job.objects.order_by("-created_time")
+            return jobs.order_by("-created_time")
 
-        return Job.objects.filter(owner=user).order_by("-created_time")
+        return jobs.filter(owner=user).order_by("-created_time")
 
 
 class PipelineView(JSONView, GetMixin):
@@ -2472,7 +2597,7 @@ class BigPageNumberPagination(PageNumberPagination):
     max_page_size = 1000
 
 
-class EventLogListView(generics.ListAPIView):
+class EventLogListView(ConditionalListMixin, generics.ListAPIView):
     """
     To list all events for a particular job, use:
 
@@ -2482,6 +2607,7 @@ class EventLogListView(generics.ListAPIView):
     lookup_field = "id"
     queryset = EventLog.objects.all()
     serializer_class = EventLogSerializer
+    etag_modified_field = "timestamp"
     filter_backends = (DjangoFilterBackend,)
     filterset_fields = (
         "user",
@@ -2543,6 +2669,7 @@ class EventLogCreate(JSONView):
         - `JOB_STATUS_CHANGED`
         - `INPUT_DATA_DOWNLOAD_STARTED`
         - `INPUT_DATA_DOWNLOAD_FINISHED`
+        - `INPUT_DATA_DOWNLOAD_PROGRESS`
         - `JOB_PIPELINE_STARTING`
         - `JOB_PIPELINE_FAILED`
         - `JOB_PIPELINE_COMPLETED`
@@ -2612,6 +2739,109 @@ class JobEventLogCreate(EventLogCreate):
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
+class JobEventLogBatchCreate(JSONView):
+    queryset = EventLog.objects.all()
+    serializer_class = JobEventLogBatchItemSerializer
+
+    max_batch_size = 1000
+
+    def post(self, request: Request, uuid=None, version=None):
+        """
+        Create several EventLogs for the Job in one request, as sent by running
+        jobs (`send_event` in `laxy.lib.sh` spools events and sends them in
+        batches).
+
+        Request body example:
+        ```json
+        [
+         {"event": "JOB_INFO", "message": "Downloading input data.",
+          "timestamp": "2024-03-01T02:03:04.123456Z"},
+         {"event": "JOB_PIPELINE_STARTING", "message": "Starting pipeline.",
+          "extra": {}, "timestamp": "2024-03-01T02:03:05.000001Z"}
+        ]
+        ```
+
+        Each event is as for <a href="#operation/v1_eventlog_create">/eventlog/</a>
+        (`content_type` and `object_id` are set to the Job), plus an optional
+        `timestamp` for when it happened. Events without one are timestamped on
+        arrival, in the order given.
+
+        The response has a result for each event, in request order - valid
+        events are created even if others in the batch are not:
+        ```json
+        {"results": [{"status": 201, "id": "3Ks8bGwrU8GjDZnNv3KJV1"},
+                     {"status": 400, "errors": {"event": ["This field is required."]}}]}
+        ```
+
+        <!--
+        :param request: The request object.
+        :type request: rest_framework.request.Request
+        :return: The response object.
+        :rtype: rest_framework.response.Response
+        -->
+        """
+
+        try:
+            job = Job.objects.get(id=uuid)
+        except Job.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        if not (job.owner == request.user or request.user.is_superuser):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {"detail": "Expected a JSON array of events."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > self.max_batch_size:
+            return Response(
+                {"detail": f"At most {self.max_batch_size} events per request."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        now = timezone.now()
+        job_content_type = ContentType.objects.get_for_model(Job)
+        results = []
+        events = []
+        for i, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if not serializer.is_valid():
+                results.append(
+                    {"status": status.HTTP_400_BAD_REQUEST, "errors": serializer.errors}
+                )
+                continue
+            data = serializer.validated_data
+            event = EventLog(
+                user=request.user,
+                event=data["event"],
+                message=data.get("message", ""),
+                extra=data.get("extra", {}),
+                content_type=job_content_type,
+                object_id=job.id,
+                # Keep arrival order for events without a client timestamp
+                timestamp=data.get("timestamp", now + timedelta(microseconds=i)),
+            )
+            events.append(event)
+            results.append(event)
+
+        EventLog.objects.bulk_create(events)
+        Job.update_latest_event(job.id, events)
+
+        return Response(
+            {
+                "results": [
+                    {"status": status.HTTP_201_CREATED, "id": r.id}
+                    if isinstance(r, EventLog)
+                    else r
+                    for r in results
+                ]
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 class AccessTokenView(JSONView, GetMixin, DeleteMixin):
     queryset = AccessToken.objects.all()
     serializer_class = AccessTokenSerializer
@@ -2803,7 +3033,6 @@ class JobClone(JSONView):
     lookup_url_kwarg = "job_id"
 
     @extend_schema(responses=JobSerializerResponse)
-    @etag_headers
     def post(self, request: Request, job_id, version=None):
         """
         Returns info about a Job, specified by Job ID (UUID).
@@ -3123,6 +3352,146 @@ class SendFileToDegust(JSONView):
             )
 
 
+REMOTE_BROWSE_PAGE_SIZE = 1000
+"""The default `page_size` when RemoteBrowseView results are paged with a `cursor`."""
+
+REMOTE_BROWSE_PAGE_CACHE_TIMEOUT = 30 * 60
+"""Seconds a RemoteBrowseView listing is kept for paging through with a `cursor`."""
+
+_REMOTE_BROWSE_PAGE_CHUNK_SIZE = 1000
+
+_REMOTE_BROWSE_ORDERING_FIELDS = ["type", "name", "location"]
+
+
+def _ftp_listing_items(entries: List[dict]) -> List[dict]:
+    """
+    FileListingItems for DirectoryCrawler entries.
+    Entries below the top level are named by their path relative to it.
+    """
+    return [
+        dict(
+            type=entry["type"],
+            name=os.path.join(entry["path"], entry["name"]),
+            location=entry["location"],
+            tags=(
+                ["archive"]
+                if entry["type"] == "file" and is_archive_link(entry["name"])
+                else []
+            ),
+        )
+        for entry in entries
+    ]
+
+
+def _streamed_listing_response(
+    crawler: DirectoryCrawler, first_listing: List[dict], listings, prepare
+) -> StreamingHttpResponse:
+    """
+    Respond with the listings from a DirectoryCrawler as newline delimited JSON,
+    one `{"listing": [...]}` line per directory as it's listed, ending with a
+    `{"listing": [], "complete": true, "truncated": ...}` line. Each listing is
+    filtered and sorted by `prepare`.
+    """
+
+    def _lines():
+        try:
+            for listing in itertools.chain([first_listing], listings):
+                yield json.dumps(
+                    {"listing": FileListingItem(prepare(listing), many=True).data}
+                ) + "\n"
+        except BaseException as ex:
+            logger.warning(f"Remote directory listing failed part way: {ex}")
+            yield json.dumps({"listing": [], "complete": False, "error": str(ex)}) + "\n"
+            return
+        yield json.dumps(
+            {"listing": [], "complete": True, "truncated": crawler.truncated}
+        ) + "\n"
+
+    return StreamingHttpResponse(_lines(), content_type="application/x-ndjson")
+
+
+def _listing_query_key(**query) -> str:
+    digest = hashlib.sha1(json.dumps(query, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"remote-browse-query:{digest}"
+
+
+def _encode_cursor(query_key: str, offset: int) -> str:
+    cursor = json.dumps({"query": query_key, "offset": offset})
+    return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    :raises ValueError: If the cursor is malformed.
+    """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return cursor["query"], max(int(cursor["offset"]), 0)
+    except (TypeError, KeyError, UnicodeError, binascii.Error, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def _cache_listing_pages(query_key: str, listing: List[dict], truncated: bool):
+    """
+    Keep a (filtered and sorted) listing for paging through, in chunks, so
+    turning a page only reads the part of the listing it needs.
+    """
+    chunk_size = _REMOTE_BROWSE_PAGE_CHUNK_SIZE
+    chunks = {
+        f"{query_key}:{n}": listing[start : start + chunk_size]
+        for n, start in enumerate(range(0, len(listing), chunk_size))
+    }
+    chunks[query_key] = {"count": len(listing), "truncated": truncated}
+    listing_cache().set_many(chunks, timeout=REMOTE_BROWSE_PAGE_CACHE_TIMEOUT)
+
+
+def _cached_listing_page(
+    query_key: str, offset: int, page_size: int
+) -> Optional[Tuple[List[dict], dict]]:
+    """
+    A page of a listing kept by _cache_listing_pages, and its `count` and `truncated`.
+    None if the listing is no longer cached.
+    """
+    cache = listing_cache()
+    summary = cache.get(query_key, None)
+    if summary is None:
+        return None
+
+    chunk_size = _REMOTE_BROWSE_PAGE_CHUNK_SIZE
+    end = min(offset + page_size, summary["count"])
+    if offset >= end:
+        return [], summary
+    keys = [
+        f"{query_key}:{n}" for n in range(offset // chunk_size, (end - 1) // chunk_size + 1)
+    ]
+    chunks = cache.get_many(keys)
+    if len(chunks) != len(keys):
+        return None
+
+    items = [item for key in keys for item in chunks[key]]
+    start = offset - (offset // chunk_size) * chunk_size
+    return items[start : start + (end - offset)], summary
+
+
+def _listing_page_response(
+    query_key: str, page: List[dict], summary: dict, offset: int
+) -> Response:
+    next_offset = offset + len(page)
+    item_list = FileListing(
+        {
+            "listing": page,
+            "truncated": summary["truncated"],
+            "count": summary["count"],
+            "next": (
+                _encode_cursor(query_key, next_offset)
+                if next_offset < summary["count"]
+                else None
+            ),
+        }
+    )
+    return Response(item_list.data, status=status.HTTP_200_OK)
+
+
 class RemoteBrowseView(JSONView):
     renderer_classes = (JSONRenderer,)
     serializer_class = FileListing
@@ -3133,10 +3502,31 @@ class RemoteBrowseView(JSONView):
     @extend_schema(responses=FileListing)
     def post(self, request, version=None):
         """
-        Returns a single level of a file/directory tree.
+        Returns a single level of a file/directory tree (or, for FTP and Nextcloud
+        shares, up to `depth` levels).
         Takes query parameters:
         * `url` - the URL (http[s]:// or ftp://) to retrieve.
         * `fileglob` - a glob pattern to filter returned files by (eg `*.csv`). Doesn't filter directories.
+        * `depth` - the number of directory levels to list (default 1, at most
+          `REMOTE_BROWSE_MAX_DEPTH`). Entries below the first level are named by their
+          relative path (eg `FastQC_reports/SRR3438011_1_fastqc.html`).
+        * `max_entries` - list at most this many entries (at most `REMOTE_BROWSE_MAX_ENTRIES`).
+          `truncated` is true in the response if the listing stopped there.
+        * `stream` - if `true`, respond with newline delimited JSON, a `{"listing": [...]}`
+          line per directory as it's listed, ending with a
+          `{"listing": [], "complete": true, "truncated": false}` line.
+        * `regex` - a regular expression to filter returned files by (eg `_R[12]_`),
+          searched for anywhere in the name. Doesn't filter directories. At most
+          `REMOTE_BROWSE_REGEX_MAX_LENGTH` characters, and matching gives up (with a
+          400 response) after `REMOTE_BROWSE_REGEX_TIMEOUT` seconds.
+        * `ordering` - the fields to sort by, comma separated (`type`, `name` or `location`,
+          prefixed with `-` for descending order). Default `type,name`.
+        * `page_size` - return the listing a page at a time. The response includes the
+          total `count`, and a `next` cursor for the following page (null on the last).
+        * `cursor` - the `next` cursor from the previous page (with the same `url`,
+          `fileglob`, `regex`, `ordering`, `depth` and `max_entries`). Pages are served from
+          the listing fetched for the first page, for `REMOTE_BROWSE_PAGE_CACHE_TIMEOUT`
+          seconds, rather than listing `url` again.
         eg
 
         **Request:**
@@ -3202,12 +3592,100 @@ class RemoteBrowseView(JSONView):
                 reason=f"Unsupported scheme: {scheme}://",
             )
 
+        try:
+            depth = min(
+                max(int(request.data.get("depth", 1)), 1),
+                settings.REMOTE_BROWSE_MAX_DEPTH,
+            )
+            max_entries = min(
+                max(int(request.data.get("max_entries", settings.REMOTE_BROWSE_MAX_ENTRIES)), 1),
+                settings.REMOTE_BROWSE_MAX_ENTRIES,
+            )
+        except (TypeError, ValueError):
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                reason="depth and max_entries must be integers.",
+            )
+        stream = str(request.data.get("stream", "")).lower() in ["1", "true"]
+
+        regex = request.data.get("regex", None) or None
+        ordering = [
+            col.strip()
+            for col in str(request.data.get("ordering", "") or "type,name").split(",")
+            if col.strip()
+        ]
+        if any(col.lstrip("-") not in _REMOTE_BROWSE_ORDERING_FIELDS for col in ordering):
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                reason=f"ordering fields must be one of: {', '.join(_REMOTE_BROWSE_ORDERING_FIELDS)}",
+            )
+        if regex and len(str(regex)) > settings.REMOTE_BROWSE_REGEX_MAX_LENGTH:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                reason=f"regex is longer than {settings.REMOTE_BROWSE_REGEX_MAX_LENGTH} characters",
+            )
+        try:
+            if regex:
+                regex = regex_module.compile(str(regex))
+        except regex_module.error as ex:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST, reason=f"Invalid regex: {ex}"
+            )
+
+        # Shared by every listing prepared (eg each directory, when streaming)
+        regex_time_left = settings.REMOTE_BROWSE_REGEX_TIMEOUT
+
+        def _prepare(listing: List[dict]) -> List[dict]:
+            nonlocal regex_time_left
+            started = time.monotonic()
+            try:
+                listing = filter_listing(
+                    listing, fileglob, regex, timeout=regex_time_left
+                )
+            finally:
+                regex_time_left -= time.monotonic() - started
+            return multikeysort(listing, ordering)
+
+        cursor = request.data.get("cursor", None)
+        page_size = request.data.get("page_size", None)
+        paginate = not stream and (cursor is not None or page_size is not None)
+        query_key = _listing_query_key(
+            url=url,
+            fileglob=fileglob,
+            regex=regex.pattern if regex else None,
+            ordering=ordering,
+            depth=depth,
+            max_entries=max_entries,
+        )
+        offset = 0
+        if paginate:
+            try:
+                page_size = max(int(page_size or REMOTE_BROWSE_PAGE_SIZE), 1)
+                if cursor is not None:
+                    cursor_query_key, offset = _decode_cursor(cursor)
+                    if cursor_query_key != query_key:
+                        raise ValueError("cursor is for a different query")
+            except (TypeError, ValueError) as ex:
+                return HttpResponse(
+                    status=status.HTTP_400_BAD_REQUEST, reason=f"Invalid paging: {ex}"
+                )
+
+            # Later pages come from the listing kept for the first, if we still have it
+            if cursor is not None:
+                cached = _cached_listing_page(query_key, offset, page_size)
+                if cached is not None:
+                    page, summary = cached
+                    return _listing_page_response(query_key, page, summary, offset)
+
+        truncated = False
+
         try:
             # We need to check the URL given is actually accessible
+            # (the HEAD response is reused for archive introspection below)
             if scheme in ["http", "https"]:
-                resp = requests.head(url)
-                resp.raise_for_status()
+                http_remote.remote_file_head(url)
         except requests.exceptions.HTTPError as ex:
+            resp = ex.response
             return JsonResponse(
                 {
                     "remote_server_response": {
@@ -3300,54 +3778,15 @@ class RemoteBrowseView(JSONView):
                 ]
 
         elif scheme == "ftp":
-            from fs import open_fs
-
+            lister = FTPLister(url)
+            crawler = DirectoryCrawler(lister, max_depth=depth, max_entries=max_entries)
+            listings = (
+                _ftp_listing_items(entries) for entries in crawler.crawl(lister.path)
+            )
             try:
-                try:
-                    # may raise fs.errors.RemoteConnectionError if FTP connection fails
-                    ftp_fs = open_fs(url)
-                except BaseException as exx:
-                    msg = getattr(exx, "msg", "")
-                    return JsonResponse(
-                        {
-                            "remote_server_response": {
-                                "url": url,
-                                "status": 500,
-                                "reason": msg,
-                            }
-                        },
-                        # TODO: When frontend interprets this better, use status 400 and let the
-                        #       frontend report third-party response from the JSON blob
-                        # status=status.HTTP_400_BAD_REQUEST,
-                        status=500,
-                        reason=msg,
-                    )
-
-                for step in ftp_fs.walk(
-                    filter=[fileglob], search="breadth", max_depth=1
-                ):
-                    listing.extend(
-                        [
-                            dict(
-                                type="directory",
-                                name=i.name,
-                                location=f"{url.rstrip('/')}/{i.name}",
-                                tags=[],
-                            )
-                            for i in step.dirs
-                        ]
-                    )
-                    listing.extend(
-                        [
-                            dict(
-                                type="file",
-                                name=i.name,
-                                location=f"{url.rstrip('/')}/{i.name}",
-                                tags=["archive"] if is_archive_link(i.name) else [],
-                            )
-                            for i in step.files
-                        ]
-                    )
+                # The first listing is fetched here, so errors listing `url` itself
+                # (eg, it's a file, or the FTP connection fails) are reported as usual
+                first_listing = next(listings)
             except DirectoryExpected as ex:
                 fn = Path(urlparse(url).path).name
                 listing = [
@@ -3358,6 +3797,29 @@ class RemoteBrowseView(JSONView):
                         tags=["archive"] if is_archive_link(fn) else [],
                     )
                 ]
+            except FSError as exx:
+                msg = getattr(exx, "msg", "") or str(exx)
+                return JsonResponse(
+                    {
+                        "remote_server_response": {
+                            "url": url,
+                            "status": 500,
+                            "reason": msg,
+                        }
+                    },
+                    # TODO: When frontend interprets this better, use status 400 and let the
+                    #       frontend report third-party response from the JSON blob
+                    # status=status.HTTP_400_BAD_REQUEST,
+                    status=500,
+                    reason=msg,
+                )
+            else:
+                if stream:
+                    return _streamed_listing_response(
+                        crawler, first_listing, listings, _prepare
+                    )
+                listing = first_listing + [item for l in listings for item in l]
+                truncated = crawler.truncated
 
         elif scheme == "http" or scheme == "https":
             _url = _check_content_size_and_resolve_redirects(url)
@@ -3367,6 +3829,27 @@ class RemoteBrowseView(JSONView):
                 return site_error
             if site_listing is not None:
                 listing = site_listing
+            elif (
+                (depth > 1 or stream)
+                and extract_nextcloud_public_share_token(_url)
+                and is_nextcloud_or_owncloud_public_share(_url, "")
+            ):
+                crawler, listings = crawl_nextcloud_share(
+                    _url, max_depth=depth, max_entries=max_entries
+                )
+                try:
+                    first_listing = next(listings)
+                except requests.exceptions.RequestException as ex:
+                    return HttpResponse(
+                        status=status.HTTP_400_BAD_REQUEST,
+                        reason=f"Unable to list {_url}",
+                    )
+                if stream:
+                    return _streamed_listing_response(
+                        crawler, first_listing, listings, _prepare
+                    )
+                listing = first_listing + [item for l in listings for item in l]
+                truncated = crawler.truncated
             else:
                 try:
                     text = render_page(_url)
@@ -3374,6 +3857,11 @@ class RemoteBrowseView(JSONView):
                     return HttpResponse(
                         status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, reason=str(ex)
                     )
+                except (TimeoutError, requests.exceptions.Timeout) as ex:
+                    return HttpResponse(
+                        status=status.HTTP_504_GATEWAY_TIMEOUT,
+                        reason=f"Timed out fetching {_url}",
+                    )
                 except ValueError as ex:
                     return HttpResponse(status=status.HTTP_400_BAD_REQUEST, reason=str(ex))
 
@@ -3395,8 +3883,21 @@ class RemoteBrowseView(JSONView):
                     )
 
         # listing = pydash.sort_by(listing, ['type', 'name'])
-        listing = multikeysort(listing, ["type", "name"])
-        item_list = FileListing({"listing": listing})
+        try:
+            listing = _prepare(listing)
+        except TimeoutError:
+            return HttpResponse(
+                status=status.HTTP_400_BAD_REQUEST,
+                reason="regex took too long to match, try a simpler one",
+            )
+
+        if paginate:
+            _cache_listing_pages(query_key, listing, truncated)
+            summary = {"count": len(listing), "truncated": truncated}
+            page = listing[offset : offset + page_size]
+            return _listing_page_response(query_key, page, summary, offset)
+
+        item_list = FileListing({"listing": listing, "truncated": truncated})
         return Response(item_list.data, status=status.HTTP_200_OK)
 
 
@@ -3410,11 +3911,18 @@ def _get_or_create_drf_token(user):
     return token
 
 
-def _get_default_compute_resource(job: Job = None):
-    if job is None:
-        compute = ComputeResource.get_best_available()
+def _get_default_compute_resource(job: Job = None, user: User = None, input_files=None):
+    if job is not None:
+        user = job.owner
+        if input_files is None and job.input_files:
+            input_files = job.input_files.get_files()
+
+    if user is None:
+        compute = ComputeResource.get_best_available(input_files=input_files)
     else:
-        compute = _get_compute_resources_based_on_rules(job).first()
+        compute = choose_compute_resource(
+            _get_eligible_compute_resources(user), input_files=input_files
+        )
 
     if not compute:
         raise Exception(
@@ -3424,7 +3932,24 @@ def _get_default_compute_resource(job: Job = None):
     return compute
 
 
-def _get_compute_resources_based_on_rules(job: Job):
+def _get_eligible_compute_resources(user: User) -> List[ComputeResource]:
+    """
+    The online ComputeResources `user` may run jobs on, highest priority first,
+    as decided by _get_compute_resources_based_on_rules for their email domain.
+
+    This isn't cached, since ComputeResources are brought online or offline
+    by other processes (eg Celery workers) - it's a single query.
+
+    :param user: The user submitting a job.
+    :type user: User
+    :return: The ComputeResources the user may use.
+    :rtype: List[ComputeResource]
+    """
+    domain = (user.email or "").split("@")[-1]
+    return list(_get_compute_resources_based_on_rules(domain))
+
+
+def _get_compute_resources_based_on_rules(domain: str):
     # TODO: This should also incorporate per-user permissions to access specific ComputeResources
     # (eg with django-guardian and/or django-rules). We should be able to do a similar email domain test
     # with django-rules (eg write a can_use_compute(user, compute_resource) rule).
@@ -3435,7 +3960,6 @@ def _get_compute_resources_based_on_rules(job: Job):
         settings, "EMAIL_DOMAIN_ALLOWED_COMPUTE", {"*": ["*"]}
     )
 
-    domain = job.owner.email.split("@")[-1]
     names = email_domain_allowed_compute.get(domain, None)
     if names is None:
         names = email_domain_allowed_compute.get("*", [])
@@ -3447,9 +3971,11 @@ def _get_compute_resources_based_on_rules(job: Job):
     if "*" in names:
         return available_compute
 
-    allowed_compute = available_compute.filter(name__in=names).order_by("-priority")
+    allowed_compute = list(
+        available_compute.filter(name__in=names).order_by("-priority")
+    )
 
-    if not allowed_compute.exists():
+    if not allowed_compute:
         raise Exception(
             f"Cannot find allowed ComputeResource for this email domain ({domain})."
         )
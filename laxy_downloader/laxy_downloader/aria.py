@@ -1,18 +1,48 @@
-from typing import List, Collection
+from typing import List, Collection, Dict, Tuple, Callable, Union
+import json
+from contextlib import AsyncExitStack
 import backoff
 
 import xmlrpc
-from pyaria2 import PyAria2, AriaServerSettings
+import xmlrpc.client
 
-from .core import logger, url_to_cache_key
+import trio
+import trio_websocket
+
+from .core import logger, url_to_cache_key, url_to_download_url
 
 __aria2daemon__ = None
+__rpc_secret__ = None
+
+# pyaria2 starts aria2c with its RPC interface on the default port. The same
+# port serves XML-RPC (/rpc) and JSON-RPC over WebSocket (/jsonrpc), the latter
+# being the only way to receive aria2's push notifications.
+RPC_HOST = "localhost"
+RPC_PORT = 6800
+
+FINISHED_STATES = ("complete", "error", "removed")
+STATUS_KEYS = ["gid", "status", "files", "errorCode", "errorMessage"]
+
+# https://aria2.github.io/manual/en/html/aria2c.html#notifications
+FINISHED_NOTIFICATIONS = (
+    "aria2.onDownloadComplete",
+    "aria2.onDownloadError",
+    "aria2.onDownloadStop",
+    "aria2.onBtDownloadComplete",
+)
+WEBSOCKET_ERRORS = (
+    OSError,
+    trio_websocket.HandshakeError,
+    trio_websocket.ConnectionClosed,
+)
 
 
 def get_daemon(secret=None):
-    global __aria2daemon__
+    global __aria2daemon__, __rpc_secret__
 
     if __aria2daemon__ is None:
+        from pyaria2 import PyAria2, AriaServerSettings
+
         aria_settings = AriaServerSettings()
         aria_settings.continue_flag = True
 
@@ -20,9 +50,102 @@ def get_daemon(secret=None):
             aria_settings.rpc_secret = secret
 
         __aria2daemon__ = PyAria2(aria_settings)
+
+    if secret is not None:
+        __rpc_secret__ = secret
+
     return __aria2daemon__
 
 
+def rpc_url() -> str:
+    return f"http://{RPC_HOST}:{RPC_PORT}/rpc"
+
+
+def websocket_url() -> str:
+    return f"ws://{RPC_HOST}:{RPC_PORT}/jsonrpc"
+
+
+def _with_token(params: List) -> List:
+    if __rpc_secret__ is not None:
+        return [f"token:{__rpc_secret__}"] + list(params)
+    return list(params)
+
+
+def multicall(calls: List[Tuple[str, List]]) -> List:
+    """
+    Run several aria2 RPC methods in a single round trip via system.multicall.
+
+    :param calls: A list of (method_name, params) tuples, eg
+                  [("aria2.tellStatus", [gid, keys])]. The RPC secret token is
+                  added automatically.
+    :return: A list of results in the same order as calls. A call that failed
+             is returned as an xmlrpc.client.Fault instance rather than raising,
+             so one bad gid doesn't hide the status of the others.
+    """
+    if not calls:
+        return []
+
+    client = xmlrpc.client.ServerProxy(rpc_url(), allow_none=True)
+    methods = [
+        {"methodName": method, "params": _with_token(params)}
+        for method, params in calls
+    ]
+    results = []
+    for result in client.system.multicall(methods):
+        if isinstance(result, dict) and "faultCode" in result:
+            results.append(
+                xmlrpc.client.Fault(result["faultCode"], result["faultString"])
+            )
+        else:
+            results.append(result[0])
+    return results
+
+
+def tell_statuses(download_ids: Collection, keys=None) -> Dict[str, dict]:
+    """
+    Returns the status of each download gid, fetched in a single RPC request.
+    Unknown gids (eg already purged) are logged and omitted from the result.
+    """
+    if keys is None:
+        keys = STATUS_KEYS
+    download_ids = list(download_ids)
+    results = multicall([("aria2.tellStatus", [gid, keys]) for gid in download_ids])
+    statuses = {}
+    for gid, result in zip(download_ids, results):
+        if isinstance(result, xmlrpc.client.Fault):
+            logger.error(result.faultString)
+            continue
+        statuses[gid] = result
+    return statuses
+
+
+def _all_statuses(keys=None) -> List[dict]:
+    """
+    Returns the status of every active, waiting and stopped download.
+
+    The number of waiting and stopped downloads is looked up first, so (unlike
+    a fixed limit) nothing is missed when the queue is long.
+    """
+    if keys is None:
+        keys = STATUS_KEYS
+    (stat,) = multicall([("aria2.getGlobalStat", [])])
+    active, waiting, stopped = multicall(
+        [
+            ("aria2.tellActive", [keys]),
+            ("aria2.tellWaiting", [0, int(stat["numWaiting"]), keys]),
+            ("aria2.tellStopped", [0, int(stat["numStopped"]), keys]),
+        ]
+    )
+    return active + waiting + stopped
+
+
+def status_url(status: dict) -> Union[str, None]:
+    try:
+        return status["files"][0]["uris"][0]["uri"]
+    except (KeyError, IndexError):
+        return None
+
+
 def purge_results():
     daemon = get_daemon()
     return daemon.purgeDownloadResult()
@@ -66,7 +189,8 @@ def download_urls(
     active_uris = get_active_uris()
 
     download_ids = []
-    for url in set(urls) - active_uris:
+    # Several archive.tar#fragment URLs share one download
+    for url in set(url_to_download_url(u) for u in urls) - active_uris:
 
         options = dict(default_options)
         if cache_path is not None:
@@ -80,28 +204,98 @@ def download_urls(
 
 
 def downloads_finished(download_ids):
-    aria = get_daemon()
-    statuses = []
-    for gid in download_ids:
-        try:
-            statuses.append(aria.tellStatus(gid))
-        except xmlrpc.client.Fault as ex:
-            logger.error(ex.faultString)
+    statuses = list(tell_statuses(download_ids, keys=["status"]).values())
 
     if not statuses:
         return False
 
-    done = all(
-        [
-            dl.get("status", None) == "complete"
-            or dl.get("status", None) == "error"
-            or dl.get("status", None) == "removed"
-            for dl in statuses
-        ]
-    )
+    done = all([dl.get("status", None) in FINISHED_STATES for dl in statuses])
     return done
 
 
+async def wait_for_downloads(
+    download_ids: Collection,
+    on_finished: Union[Callable[[str, dict], None], None] = None,
+    reconcile_every: float = 60,
+    poll_every: float = 30,
+):
+    """
+    Wait until every download in download_ids has finished (completed, errored
+    or been removed), calling on_finished(gid, status) for each one as soon as
+    it does.
+
+    Completion is event driven: we listen for aria2's onDownloadComplete /
+    onDownloadError notifications on the JSON-RPC WebSocket and only fetch the
+    status of the gids named in each notification. Statuses are also
+    reconciled (in one batched request) right after connecting and every
+    reconcile_every seconds, so notifications sent before we connected are not
+    missed. If the WebSocket is unavailable we fall back to batched polling
+    every poll_every seconds.
+
+    :return: A dict of final statuses, keyed by gid.
+    """
+    pending = set(download_ids)
+    finished = {}
+
+    def _update(gids):
+        gids = [gid for gid in gids if gid in pending]
+        if not gids:
+            return
+        statuses = tell_statuses(gids)
+        for gid in gids:
+            status = statuses.get(gid, None)
+            if status is None:
+                # aria2 no longer knows about this download (eg purged), so
+                # there is nothing left to wait for.
+                status = {"gid": gid, "status": "unknown"}
+            elif status.get("status", None) not in FINISHED_STATES:
+                continue
+            pending.discard(gid)
+            finished[gid] = status
+            logger.info(f"Download {status.get('status')}: {status_url(status) or gid}")
+            if on_finished is not None:
+                on_finished(gid, status)
+
+    # Only the WebSocket connect and receive are guarded, so errors raised by
+    # on_finished (eg an OSError placing a file) propagate rather than being
+    # mistaken for the WebSocket being unavailable.
+    async with AsyncExitStack() as stack:
+        try:
+            ws = await stack.enter_async_context(
+                trio_websocket.open_websocket_url(websocket_url())
+            )
+        except WEBSOCKET_ERRORS as ex:
+            logger.warning(
+                f"aria2 WebSocket notifications unavailable ({ex!r}), "
+                f"polling for download status instead."
+            )
+            ws = None
+
+        _update(list(pending))
+        while pending:
+            if ws is None:
+                await trio.sleep(poll_every)
+                _update(list(pending))
+                continue
+
+            message = None
+            with trio.move_on_after(reconcile_every):
+                try:
+                    message = json.loads(await ws.get_message())
+                except WEBSOCKET_ERRORS as ex:
+                    logger.warning(
+                        f"aria2 WebSocket notifications lost ({ex!r}), "
+                        f"polling for download status instead."
+                    )
+                    ws = None
+            if message is None:
+                _update(list(pending))
+            elif message.get("method", None) in FINISHED_NOTIFICATIONS:
+                _update([p.get("gid") for p in message.get("params", [])])
+
+    return finished
+
+
 def stop_all():
     global __aria2daemon__
     aria = get_daemon()
@@ -115,11 +309,17 @@ def stop_all():
 
 def stop_url_download(url: str):
     aria = get_daemon()
-    statuses = aria.tellActive() + aria.tellWaiting(0, 999) + aria.tellStopped(0, 999)
 
-    for active in statuses:
-        if active["files"][0]["uris"][0]["uri"] == url:
-            aria.remove(active["gid"])
+    calls = []
+    for dl in _all_statuses(keys=["gid", "status", "files"]):
+        if status_url(dl) == url:
+            if dl["status"] in FINISHED_STATES:
+                calls.append(("aria2.removeDownloadResult", [dl["gid"]]))
+            else:
+                calls.append(("aria2.remove", [dl["gid"]]))
+    for result in multicall(calls):
+        if isinstance(result, xmlrpc.client.Fault):
+            logger.warning(result.faultString)
 
     aria.shutdown()
 
@@ -128,11 +328,11 @@ def stop_url_download(url: str):
     backoff.expo, (ConnectionRefusedError,), max_tries=8, jitter=backoff.full_jitter
 )
 def log_status():
-    aria = get_daemon()
-    statuses = aria.tellActive() + aria.tellWaiting(0, 999) + aria.tellStopped(0, 999)
+    get_daemon()
+    statuses = _all_statuses()
+    options = multicall([("aria2.getOption", [dl["gid"]]) for dl in statuses])
 
-    for dl in statuses:
-        options = aria.getOption(dl["gid"])
-        url = dl["files"][0]["uris"][0]["uri"]
+    for dl, dl_options in zip(statuses, options):
+        url = status_url(dl)
         logger.info(f"Downloading: {url} ({url_to_cache_key(url)})")
-        logger.debug(f"Status -- {dl} -- {options}")
+        logger.debug(f"Status -- {dl} -- {dl_options}")
@@ -9,6 +9,8 @@ from typing import List
 import xmlrpc.client
 import psutil
 import platform
+import concurrent.futures
+from functools import partial
 
 import trio
 
@@ -16,7 +18,6 @@ from .secrets import get_secret_key
 from .core import (
     get_default_cache_path,
     sanitize_filename,
-    trio_wait_with_progress,
     init_cache,
     is_cache_path,
     clean_cache,
@@ -33,8 +34,15 @@ from .core import (
     get_url_cached_path,
     create_symlink_to_cache,
     create_copy_from_cache,
+    create_hardlink_from_cache,
+    plan_cache_placements,
+    place_from_cache,
     is_tar_url_with_fragment,
     untar_from_url_fragment,
+    remove_url_fragment,
+    group_tar_fragment_urls,
+    fetch_tar_manifest,
+    extract_tar_fragment_groups,
     notify_event,
     async_notify_event,
 )
@@ -113,6 +121,27 @@ def add_commandline_args(parser: argparse.ArgumentParser) -> argparse.ArgumentPa
         type=int,
         default=8,
     )
+    dl_parser.add_argument(
+        "--connections-per-host",
+        help="The maximum number of concurrent connections to any one host. "
+        "Ignored when using aria2c.",
+        type=int,
+        default=4,
+    )
+    dl_parser.add_argument(
+        "--progress-interval",
+        help="Report overall download progress (and send an INPUT_DATA_DOWNLOAD_PROGRESS "
+        "event) at most this often, in seconds. Ignored when using aria2c.",
+        type=float,
+        default=60,
+    )
+    dl_parser.add_argument(
+        "--connections-per-download",
+        help="Download large files over up to this many concurrent connections, "
+        "when the server supports Range requests. Ignored when using aria2c.",
+        type=int,
+        default=1,
+    )
     dl_parser.add_argument(
         "--queue-then-exit",
         help="Rather than block waiting for downloads to finish, exit after queuing."
@@ -125,6 +154,12 @@ def add_commandline_args(parser: argparse.ArgumentParser) -> argparse.ArgumentPa
         "symlinking.",
         action="store_true",
     )
+    dl_parser.add_argument(
+        "--hardlink-from-cache",
+        help="When using a file from the local cache, hardlink it to the download location rather "
+        "than symlinking (falls back to copying if they are on different filesystems).",
+        action="store_true",
+    )
     dl_parser.add_argument(
         "--destination-path",
         help="Symlink / copy downloaded files to this directory.",
@@ -267,8 +302,86 @@ def _parse_auth_header_file(fh):
     return headers
 
 
+def _placement_method(args):
+    if args.copy_from_cache:
+        return "copy"
+    if args.hardlink_from_cache:
+        return "hardlink"
+    return "symlink"
+
+
+def _place_from_cache(
+    url, args, url_filenames, sanitize_names, sanitize_unpacked=True
+):
+    """
+    Unpack, copy, hardlink or symlink the cached download for url into
+    args.destination_path. Returns False if the URL isn't in the cache.
+    """
+    cached = get_url_cached_path(url, args.cache_path)
+
+    filename = url_filenames.get(url, None)
+    if filename is None:
+        filename, _ = find_filename_and_size_from_url(
+            url, sanitize_name=sanitize_names
+        )
+
+    if not os.path.exists(cached):
+        return False
+
+    if is_tar_url_with_fragment(url) and is_tarfile(cached) and args.unpack:
+        logger.info(f"Untarring file from {cached} ({url})")
+        untar_from_url_fragment(cached, args.destination_path, url)
+    elif is_tarfile(cached) and args.unpack:
+        logger.info(f"Untarring {cached} ({url})")
+        untar(cached, args.destination_path)
+        if sanitize_names and sanitize_unpacked:
+            recursively_sanitize_filenames(args.destination_path)
+    elif is_zipfile(cached) and args.unpack:
+        logger.info(f"Unzipping {cached} ({url})")
+        unzip(cached, args.destination_path)
+        if sanitize_names and sanitize_unpacked:
+            recursively_sanitize_filenames(args.destination_path)
+    elif args.copy_from_cache:
+        logger.info(
+            f"Copying {cached} -> "
+            f"{os.path.join(args.destination_path, filename)} ({url})"
+        )
+        create_copy_from_cache(
+            url,
+            args.destination_path,
+            args.cache_path,
+            filename=filename,
+            sanitize_name=sanitize_names,
+        )
+    elif args.hardlink_from_cache:
+        logger.info(
+            f"Hardlinking {cached} -> "
+            f"{os.path.join(args.destination_path, filename)} ({url})"
+        )
+        create_hardlink_from_cache(
+            url,
+            args.destination_path,
+            args.cache_path,
+            filename=filename,
+            sanitize_name=sanitize_names,
+        )
+    else:
+        logger.info(
+            f"Creating symlink {cached} <- "
+            f"{os.path.join(args.destination_path, filename)} ({url})"
+        )
+        create_symlink_to_cache(
+            url,
+            args.destination_path,
+            args.cache_path,
+            filename=filename,
+            sanitize_name=sanitize_names,
+        )
+
+    return True
+
+
 def _run_download_cli(args, rpc_secret=None):
-    _initial_queued_wait_delay = 10  # seconds
     _polling_delay = 30  # seconds
 
     if args.use_aria:
@@ -302,6 +415,8 @@ def _run_download_cli(args, rpc_secret=None):
         api_auth_headers = _parse_auth_header_file(args.event_notification_auth_file)
 
     verify_ssl_certificate = not args.ignore_self_signed_ssl_certificate
+    placed_urls = set()
+    url_sizes = dict()
 
     if urls:
         if args.cache_path:
@@ -312,15 +427,28 @@ def _run_download_cli(args, rpc_secret=None):
             if args.create_missing_directories:
                 os.makedirs(args.destination_path, exist_ok=True)
 
-            skip_urls = set()
-            for url in urls:
-                filename = url_filenames.get(url, None)
-                if not filename:
-                    filename, _ = find_filename_and_size_from_url(
-                        url, sanitize_name=sanitize_names
-                    )
+            # Filename lookups may need a HEAD request each, so run them
+            # concurrently
+            unnamed_urls = [url for url in urls if not url_filenames.get(url, None)]
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=args.parallel_downloads
+            ) as executor:
+                for url, (filename, size) in zip(
+                    unnamed_urls,
+                    executor.map(
+                        partial(
+                            find_filename_and_size_from_url,
+                            sanitize_name=sanitize_names,
+                        ),
+                        unnamed_urls,
+                    ),
+                ):
                     url_filenames[url] = filename
+                    url_sizes[url] = size
 
+            skip_urls = set()
+            for url in urls:
+                filename = url_filenames[url]
                 filepath = os.path.join(args.destination_path, filename)
 
                 if args.skip_existing and os.path.isfile(filepath):
@@ -358,16 +486,24 @@ def _run_download_cli(args, rpc_secret=None):
                     logger.info("Queued downloads, exiting.")
                     sys.exit()
 
-                logging.debug("Waiting a moment for downloaded to become queued.")
-                await trio_wait_with_progress(
-                    _initial_queued_wait_delay, 1, quiet=args.quiet or args.no_progress
-                )
-
                 aria.log_status()
-                while not aria.downloads_finished(gids):
-                    await trio_wait_with_progress(
-                        _polling_delay, 1, quiet=args.quiet or args.no_progress
-                    )
+
+                def _place_finished(gid, status):
+                    # Place each file as soon as it's downloaded, rather than
+                    # waiting for the whole batch to finish.
+                    url = aria.status_url(status)
+                    if (
+                        args.destination_path is None
+                        or status.get("status", None) != "complete"
+                        or url not in urls
+                    ):
+                        return
+                    if _place_from_cache(url, args, url_filenames, sanitize_names):
+                        placed_urls.add(url)
+
+                await aria.wait_for_downloads(
+                    gids, on_finished=_place_finished, poll_every=_polling_delay
+                )
 
                 await async_notify_event(
                     api_url,
@@ -390,8 +526,33 @@ def _run_download_cli(args, rpc_secret=None):
                 verify_ssl_certificate=verify_ssl_certificate,
             )
 
+            def _notify_progress(progress):
+                percent = ""
+                if progress.bytes_total:
+                    percent = f" ({100 * progress.bytes_done // progress.bytes_total}%)"
+                message = (
+                    f"Downloaded {progress.files_done}/{progress.files_total} "
+                    f"files{percent}."
+                )
+                logger.info(message)
+                notify_event(
+                    api_url,
+                    "INPUT_DATA_DOWNLOAD_PROGRESS",
+                    message=message,
+                    extra=progress._asdict(),
+                    auth_headers=api_auth_headers,
+                    verify_ssl_certificate=verify_ssl_certificate,
+                )
+
             download_concurrent(
-                urls, args.cache_path, concurrent_downloads=args.parallel_downloads
+                urls,
+                args.cache_path,
+                concurrent_downloads=args.parallel_downloads,
+                segments=args.connections_per_download,
+                per_host_connections=args.connections_per_host,
+                sizes=url_sizes,
+                progress_callback=_notify_progress,
+                progress_interval=args.progress_interval,
             )
 
             notify_event(
@@ -405,60 +566,70 @@ def _run_download_cli(args, rpc_secret=None):
             logger.info(f"All files are already downloaded.")
 
         if args.destination_path is not None:
-            for url in urls:
-                cached = get_url_cached_path(url, args.cache_path)
-
-                filename = url_filenames.get(url, None)
-                if filename is None:
-                    filename, _ = find_filename_and_size_from_url(
-                        url, sanitize_name=sanitize_names
+            remaining_urls = [url for url in urls if url not in placed_urls]
+
+            if args.unpack:
+                # Extract all the #fragment files wanted from each tar archive
+                # in one pass, rather than re-reading the archive once per file.
+                fragment_groups = {
+                    archive_url: members
+                    for archive_url, members in group_tar_fragment_urls(
+                        remaining_urls
+                    ).items()
+                    if os.path.exists(get_url_cached_path(archive_url, args.cache_path))
+                    and is_tarfile(get_url_cached_path(archive_url, args.cache_path))
+                }
+                if fragment_groups:
+                    extract_tar_fragment_groups(
+                        fragment_groups,
+                        args.cache_path,
+                        args.destination_path,
+                        manifests={u: fetch_tar_manifest(u) for u in fragment_groups},
+                        max_workers=args.parallel_downloads,
                     )
-
+                    remaining_urls = [
+                        url
+                        for url in remaining_urls
+                        if not is_tar_url_with_fragment(url)
+                        or remove_url_fragment(url) not in fragment_groups
+                    ]
+
+            # Archives are unpacked one by one, everything else is planned up
+            # front (so filename collisions are found before any placement)
+            # and placed concurrently.
+            plain_url_filenames = {}
+            unpacked = False
+            for url in remaining_urls:
+                cached = get_url_cached_path(url, args.cache_path)
                 if not os.path.exists(cached):
                     logger.error(
                         f"Failed to download {url} ({cached}), exiting with error."
                     )
                     sys.exit(1)
-
-                if is_tar_url_with_fragment(url) and is_tarfile(cached) and args.unpack:
-                    # TODO: It's probably more efficient to group all URLs for the same tar file
-                    # and extract all #fragment files from their archive at once. But this works for now.
-                    logger.info(f"Untarring file from {cached} ({url})")
-                    untar_from_url_fragment(cached, args.destination_path, url)
-                elif is_tarfile(cached) and args.unpack:
-                    logger.info(f"Untarring {cached} ({url})")
-                    untar(cached, args.destination_path)
-                    if sanitize_names:
-                        recursively_sanitize_filenames(args.destination_path)
-                elif is_zipfile(cached) and args.unpack:
-                    logger.info(f"Unzipping {cached} ({url})")
-                    unzip(cached, args.destination_path)
-                    if sanitize_names:
-                        recursively_sanitize_filenames(args.destination_path)
-                elif args.copy_from_cache:
-                    logger.info(
-                        f"Copying {cached} -> "
-                        f"{os.path.join(args.destination_path, filename)} ({url})"
-                    )
-                    create_copy_from_cache(
+                if args.unpack and (is_tarfile(cached) or is_zipfile(cached)):
+                    _place_from_cache(
                         url,
-                        args.destination_path,
-                        args.cache_path,
-                        filename=filename,
-                        sanitize_name=sanitize_names,
+                        args,
+                        url_filenames,
+                        sanitize_names,
+                        sanitize_unpacked=False,
                     )
+                    unpacked = True
                 else:
-                    logger.info(
-                        f"Creating symlink {cached} <- "
-                        f"{os.path.join(args.destination_path, filename)} ({url})"
-                    )
-                    create_symlink_to_cache(
-                        url,
-                        args.destination_path,
-                        args.cache_path,
-                        filename=filename,
-                        sanitize_name=sanitize_names,
-                    )
+                    plain_url_filenames[url] = url_filenames[url]
+
+            if unpacked and sanitize_names:
+                recursively_sanitize_filenames(args.destination_path)
+
+            place_from_cache(
+                plan_cache_placements(
+                    plain_url_filenames,
+                    args.destination_path,
+                    args.cache_path,
+                    method=_placement_method(args),
+                ),
+                max_workers=args.parallel_downloads,
+            )
 
 
 def main():
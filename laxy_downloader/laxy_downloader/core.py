@@ -3,6 +3,9 @@ from email.message import EmailMessage as HTTPHeaders
 import json
 import ssl
 import urllib
+import errno
+import ftplib
+import socket
 from contextlib import closing
 from urllib.parse import urlparse, urlsplit, urlunsplit, unquote
 from pathlib import Path
@@ -18,6 +21,7 @@ from typing import (
     Set,
     Callable,
     Optional,
+    NamedTuple,
 )
 import logging
 import sys
@@ -30,6 +34,7 @@ import string
 import tempfile
 import platform
 import tarfile
+import threading
 from functools import partial
 import concurrent.futures
 from http.client import responses as response_codes
@@ -51,7 +56,7 @@ import magic
 import trio
 import asks
 from attrdict import AttrDict
-from filelock import FileLock
+from filelock import FileLock, Timeout
 from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
@@ -86,6 +91,16 @@ def url_to_cache_key(url):
     )
 
 
+def url_to_download_url(url):
+    """
+    The URL that actually needs to be downloaded - archive.tar#path/in/archive
+    style URLs all refer to (and are cached as) the whole archive.
+    """
+    if is_tar_url_with_fragment(url):
+        return remove_url_fragment(url)
+    return url
+
+
 def get_url_cached_path(url, cache_path):
     return os.path.join(cache_path, url_to_cache_key(url))
 
@@ -164,6 +179,267 @@ def temporary_file(mode="wb", dir=None, prefix=None, suffix=None):
         tmp.close()
 
 
+# Partial downloads are flushed to disk every this many bytes, rather than
+# after every chunk, so a crash loses at most this much progress.
+DOWNLOAD_FSYNC_INTERVAL = 64 * 1024 * 1024  # 64 Mb
+
+# Errors that interrupt a transfer part way through (eg the server dropping
+# the connection). Bytes already written are kept and the next attempt resumes
+# from where this one stopped.
+INTERRUPTED_TRANSFER_ERRORS = (
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ftplib.Error,
+    EOFError,
+    ConnectionError,
+    socket.timeout,
+)
+
+
+class _RangesNotSupported(Exception):
+    pass
+
+
+class _PeriodicFsyncWriter:
+    """
+    Wraps a binary file object, calling fsync every fsync_interval bytes
+    written rather than after each write.
+    """
+
+    def __init__(
+        self,
+        fh,
+        fsync_interval: int = DOWNLOAD_FSYNC_INTERVAL,
+        progress: Optional[Callable[[int], None]] = None,
+    ):
+        self.fh = fh
+        self.fsync_interval = fsync_interval
+        self.progress = progress
+        self._unsynced = 0
+
+    def write(self, chunk: bytes):
+        self.fh.write(chunk)
+        if self.progress is not None:
+            self.progress(len(chunk))
+        self._unsynced += len(chunk)
+        if self._unsynced >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self._unsynced = 0
+
+
+def _finalize_download(part_path: str, filepath: str):
+    """
+    Make a completed partial download durable, then atomically move it into
+    place (falling back to a copy if tmp_directory is on another filesystem).
+    """
+    with open(part_path, "rb") as f:
+        os.fsync(f.fileno())
+    try:
+        os.replace(part_path, filepath)
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+        shutil.move(part_path, filepath)
+
+
+def _ftp_connect(
+    url: str, username: Optional[str] = None, password: Optional[str] = None
+) -> Tuple[ftplib.FTP, str]:
+    parts = urlparse(url)
+    ftp = ftplib.FTP(timeout=60)
+    ftp.connect(parts.hostname, parts.port or 21)
+    ftp.login(
+        username or unquote(parts.username or "anonymous"),
+        password or unquote(parts.password or ""),
+    )
+    ftp.voidcmd("TYPE I")
+    return ftp, unquote(parts.path)
+
+
+class _FileProgress:
+    """
+    The number of bytes of one file downloaded so far, which may be written
+    from several threads. Each change is reported to callback as the new
+    total, so data that is discarded (eg a partial download that has to be
+    restarted) is never counted twice.
+    """
+
+    def __init__(self, callback: Callable[[int], None]):
+        self.callback = callback
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, n: int):
+        with self._lock:
+            self.total += n
+            self.callback(self.total)
+
+    def reset(self, total: int = 0):
+        with self._lock:
+            self.total = total
+            self.callback(self.total)
+
+
+def _download_ftp(
+    url: str,
+    part_path: str,
+    username: Optional[str] = None,
+    password: Optional[str] = None,
+    chunk_size: int = 1024 * 1024,
+    progress: Optional[_FileProgress] = None,
+):
+    """
+    Download url into part_path, using REST to continue from the end of any
+    existing partial file. If the server doesn't support REST we start again
+    from the beginning.
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    ftp, path = _ftp_connect(url, username, password)
+    with ftp:
+        if offset:
+            logger.info(f"Resuming FTP download at byte {offset}: {url}")
+        while True:
+            with open(part_path, "ab" if offset else "wb") as f:
+                writer = _PeriodicFsyncWriter(f, progress=progress)
+                try:
+                    ftp.retrbinary(
+                        f"RETR {path}",
+                        writer.write,
+                        blocksize=chunk_size,
+                        rest=offset or None,
+                    )
+                except (ftplib.error_reply, ftplib.error_perm) as ex:
+                    # 500/502/504: REST isn't supported
+                    if not offset or not str(ex).startswith("50"):
+                        raise
+                    logger.warning(
+                        f"FTP server doesn't support REST, restarting: {url}"
+                    )
+                    offset = 0
+                    if progress is not None:
+                        progress.reset(0)
+                    continue
+                f.flush()
+            return
+
+
+def _download_http(
+    url: str,
+    part_path: str,
+    headers: Dict[str, str],
+    auth=None,
+    chunk_size: int = 1024 * 1024,
+    progress: Optional[_FileProgress] = None,
+):
+    """
+    Download url into part_path, using a Range request to append to any
+    existing partial file in place.
+    """
+    partial_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    request_headers = headers.copy()
+    if partial_size > 0:
+        request_headers["Range"] = f"bytes={partial_size}-"
+
+    with closing(
+        request_with_retries(
+            "GET",
+            url,
+            stream=True,
+            headers=request_headers,
+            auth=auth,
+        )
+    ) as download:
+        download.raise_for_status()
+
+        # If server ignored our range request and sent full file
+        if partial_size and download.status_code == 200:
+            mode = "wb"  # Start fresh since we got the full file
+            if progress is not None:
+                progress.reset(0)
+        else:
+            mode = "ab"
+
+        with open(part_path, mode) as f:
+            writer = _PeriodicFsyncWriter(f, progress=progress)
+            for chunk in download.iter_content(chunk_size=chunk_size):
+                writer.write(chunk)
+            f.flush()
+
+
+def _download_segmented(
+    url: str,
+    path: str,
+    content_length: int,
+    segments: int,
+    headers: Dict[str, str],
+    auth=None,
+    chunk_size: int = 1024 * 1024,
+    max_retries: int = 3,
+    progress: Optional[_FileProgress] = None,
+):
+    """
+    Download url into path using several concurrent Range requests, each
+    writing its own region of a preallocated file. An interrupted segment is
+    resumed from its last written byte.
+
+    Raises _RangesNotSupported if the server doesn't answer with 206 Partial
+    Content.
+    """
+    bounds = [
+        (i * content_length // segments, (i + 1) * content_length // segments - 1)
+        for i in range(segments)
+    ]
+    with open(path, "wb") as f:
+        f.truncate(content_length)
+
+    fd = os.open(path, os.O_WRONLY)
+
+    def fetch(start, end):
+        pos = start
+        for attempt in range(max_retries):
+            request_headers = headers.copy()
+            request_headers["Range"] = f"bytes={pos}-{end}"
+            try:
+                with closing(
+                    request_with_retries(
+                        "GET", url, stream=True, headers=request_headers, auth=auth
+                    )
+                ) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise _RangesNotSupported(url)
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        chunk = chunk[: end + 1 - pos]
+                        os.pwrite(fd, chunk, pos)
+                        pos += len(chunk)
+                        if progress is not None:
+                            progress(len(chunk))
+                        if pos > end:
+                            break
+            except INTERRUPTED_TRANSFER_ERRORS as ex:
+                logger.warning(
+                    f"Segment {start}-{end} of {url} interrupted at byte {pos} ({ex})"
+                )
+            if pos > end:
+                return
+        raise Exception(
+            f"Segment {start}-{end} of {url} incomplete after {max_retries} attempts."
+        )
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=segments) as executor:
+            for _ in executor.map(lambda b: fetch(*b), bounds):
+                pass
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def download_url(
     url: str,
     filepath: Union[str, Path],
@@ -176,6 +452,10 @@ def download_url(
     remove_existing: bool = True,
     chunk_size: int = 1024 * 1024,  # 1Mb chunk size
     max_retries: int = 3,
+    keep_partial: bool = True,
+    segments: int = 1,
+    min_segment_size: int = 64 * 1024 * 1024,  # 64Mb
+    progress: Optional[Callable[[int], None]] = None,
 ) -> str:
     """
     Download a file from a given URL to a specified filepath, with support for both HTTP(S) and FTP protocols.
@@ -184,6 +464,10 @@ def download_url(
     attempt to download the same file. It also supports checking and removing existing files,
     as well as cleaning up temporary files in case of exceptions.
 
+    Data is written to a {filename}.part file which is appended to in place
+    when a download is resumed (via an HTTP Range request, or FTP REST), and
+    atomically renamed to filepath once complete.
+
     Args:
         url (str): The URL of the file to download.
         filepath (str): The local path where the downloaded file should be saved.
@@ -196,6 +480,16 @@ def download_url(
         remove_existing (bool): Whether to remove an existing file if its size doesn't match the expected size.
         chunk_size (int): The size of chunks to use when streaming the download.
         max_retries (int): The maximum number of retry attempts for the download.
+        keep_partial (bool): Keep the .part file if the download ultimately fails, so a later call can resume it
+                             (takes precedence over cleanup_on_exception).
+        segments (int): Download large HTTP(S) files using up to this many concurrent Range requests,
+                        if the server supports them.
+        min_segment_size (int): The smallest segment size worth opening another connection for.
+        progress (Optional[Callable[[int], None]]): Called with the number of bytes of the file downloaded
+                                                    so far (including any found already on disk) each
+                                                    time it changes. This can go down, if a partial
+                                                    download is discarded. May be called from several
+                                                    threads.
 
     Returns:
         str: The path to the downloaded file.
@@ -220,14 +514,19 @@ def download_url(
     filename = filepath.name
     filepath = str(filepath)
     scheme = urlparse(url).scheme.lower()
+    part_path = os.path.join(directory, f"{filename}.part")
 
     lock_path = f"{filepath}.lock"
     lock = FileLock(lock_path, timeout=60 * 60 * 12)  # 12 hours timeout
     tmpfile_path = None
+    if progress is not None:
+        progress = _FileProgress(progress)
 
     try:
         with lock:
-            content_length = get_content_length(url, headers, auth, scheme)
+            content_length = get_content_length(
+                url, headers, auth, scheme, username=username, password=password
+            )
 
             if check_existing_size and os.path.exists(filepath):
                 if content_length is not None and os.path.getsize(filepath) == int(
@@ -236,6 +535,8 @@ def download_url(
                     logger.info(
                         f"File of correct size {filepath} ({content_length} bytes) already exists, skipping download"
                     )
+                    if progress is not None:
+                        progress.reset(int(content_length))
                     return filepath
                 elif remove_existing:
                     logger.info(
@@ -243,98 +544,132 @@ def download_url(
                     )
                     os.remove(filepath)
 
-            for attempt in range(max_retries):
+            if (
+                content_length is not None
+                and os.path.exists(part_path)
+                and os.path.getsize(part_path) > int(content_length)
+            ):
+                logger.warning(
+                    f"Partial download {part_path} is larger than the remote file, discarding it."
+                )
+                os.remove(part_path)
+
+            if (
+                segments > 1
+                and scheme in ("http", "https")
+                and content_length is not None
+                and int(content_length) >= 2 * min_segment_size
+                and not os.path.exists(part_path)
+            ):
+                n_segments = min(segments, int(content_length) // min_segment_size)
+                tmpfile_path = f"{part_path}.segmented"
                 logger.info(
-                    f"Starting download (attempt {attempt + 1}/{max_retries}): {url} ({url_to_cache_key(url)})"
+                    f"Starting segmented download ({n_segments} connections): {url} ({url_to_cache_key(url)})"
                 )
+                try:
+                    _download_segmented(
+                        url,
+                        tmpfile_path,
+                        int(content_length),
+                        n_segments,
+                        headers,
+                        auth=auth,
+                        chunk_size=chunk_size,
+                        max_retries=max_retries,
+                        progress=progress,
+                    )
+                    _finalize_download(tmpfile_path, filepath)
+                    return filepath
+                except Exception as ex:
+                    # A failed segmented download leaves holes in a file of
+                    # the full size, so it can't be resumed like a .part file.
+                    logger.warning(
+                        f"Segmented download failed ({ex!r}), falling back to a single connection: {url}"
+                    )
+                    if os.path.exists(tmpfile_path):
+                        os.remove(tmpfile_path)
+                    if progress is not None:
+                        progress.reset(0)
 
-                # Get size of partial download if it exists
-                partial_size = (
-                    os.path.getsize(filepath) if os.path.exists(filepath) else None
-                )
+            tmpfile_path = part_path
+            if progress is not None and os.path.exists(part_path):
+                progress.reset(os.path.getsize(part_path))
 
-                with temporary_file(
-                    mode="wb", dir=directory, prefix=f"{filename}.", suffix=".tmp"
-                ) as tmpfile:
-                    tmpfile_path = tmpfile.name
-                    if partial_size is not None:
-                        # Copy existing partial download
-                        shutil.copy2(filepath, tmpfile.name)
+            for attempt in range(max_retries):
+                logger.info(
+                    f"Starting download (attempt {attempt + 1}/{max_retries}): {url} ({url_to_cache_key(url)})"
+                )
 
+                try:
                     if scheme == "ftp":
-                        urllib.request.urlretrieve(url, filename=tmpfile.name)
+                        _download_ftp(
+                            url,
+                            part_path,
+                            username=username,
+                            password=password,
+                            chunk_size=chunk_size,
+                            progress=progress,
+                        )
                     else:
-                        request_headers = headers.copy()
-                        if partial_size is not None and partial_size > 0:
-                            request_headers["Range"] = f"bytes={partial_size}-"
-
-                        try:
-                            with closing(
-                                request_with_retries(
-                                    "GET",
-                                    url,
-                                    stream=True,
-                                    headers=request_headers,
-                                    auth=auth,
-                                )
-                            ) as download:
-                                download.raise_for_status()
-
-                                # If server ignored our range request and sent full file
-                                if partial_size and download.status_code == 200:
-                                    mode = "wb"  # Start fresh since we got the full file
-                                else:
-                                    mode = "ab" if partial_size else "wb"
-
-                                with open(tmpfile.name, mode) as f:
-                                    for chunk in download.iter_content(
-                                        chunk_size=chunk_size
-                                    ):
-                                        f.write(chunk)
-                                    f.flush()
-                                    os.fsync(f.fileno())
-                        except requests.exceptions.HTTPError as e:
-                            # A Range request can 416 if our local (complete or
-                            # partial) file is no longer a valid prefix of the
-                            # remote content, eg a CDN edge whose Range-serving
-                            # cache hasn't caught up with the current file size.
-                            # Discard it and retry with a full download rather
-                            # than aborting the whole job.
-                            if (
-                                "Range" in request_headers
-                                and e.response is not None
-                                and e.response.status_code == 416
-                                and attempt < max_retries - 1
-                            ):
-                                logger.warning(
-                                    f"Range request for {url} got 416 Range Not "
-                                    f"Satisfiable (local size {partial_size}); "
-                                    "discarding local file and retrying with a "
-                                    "full download."
-                                )
-                                if os.path.exists(filepath):
-                                    os.remove(filepath)
-                                continue
-                            raise
-
-                    # Check if download is complete
-                    file_size = os.path.getsize(tmpfile.name)
-                    if content_length is None or file_size == int(content_length):
-                        shutil.move(tmpfile.name, filepath)
-                        return filepath
-                    else:
-                        # Save partial download for next attempt
-                        shutil.move(tmpfile.name, filepath)
-                        if attempt < max_retries - 1:
-                            logger.warning(
-                                f"Downloaded file size ({file_size}) does not match Content-Length ({content_length}). Retrying..."
-                            )
-                        else:
-                            raise Exception(
-                                f"Downloaded file size ({file_size}) does not match Content-Length ({content_length}) after {max_retries} attempts."
-                            )
+                        _download_http(
+                            url,
+                            part_path,
+                            headers,
+                            auth=auth,
+                            chunk_size=chunk_size,
+                            progress=progress,
+                        )
+                except INTERRUPTED_TRANSFER_ERRORS as e:
+                    if attempt >= max_retries - 1:
+                        raise
+                    partial_size = (
+                        os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                    )
+                    logger.warning(
+                        f"Download interrupted after {partial_size} bytes ({e}). Resuming..."
+                    )
+                    continue
+                except requests.exceptions.HTTPError as e:
+                    # A Range request can 416 if our local partial file is no
+                    # longer a valid prefix of the remote content, eg a CDN
+                    # edge whose Range-serving cache hasn't caught up with the
+                    # current file size. Discard it and retry with a full
+                    # download rather than aborting the whole job.
+                    if (
+                        e.response is not None
+                        and e.response.status_code == 416
+                        and os.path.exists(part_path)
+                        and attempt < max_retries - 1
+                    ):
+                        logger.warning(
+                            f"Range request for {url} got 416 Range Not "
+                            f"Satisfiable (local size {os.path.getsize(part_path)}); "
+                            "discarding local file and retrying with a "
+                            "full download."
+                        )
+                        os.remove(part_path)
+                        if progress is not None:
+                            progress.reset(0)
+                        continue
+                    raise
+
+                # Check if download is complete
+                file_size = os.path.getsize(part_path)
+                if content_length is None or file_size == int(content_length):
+                    _finalize_download(part_path, filepath)
+                    return filepath
+                elif attempt < max_retries - 1:
+                    logger.warning(
+                        f"Downloaded file size ({file_size}) does not match Content-Length ({content_length}). Retrying..."
+                    )
+                else:
+                    raise Exception(
+                        f"Downloaded file size ({file_size}) does not match Content-Length ({content_length}) after {max_retries} attempts."
+                    )
 
     except Exception as e:
+        if keep_partial and tmpfile_path == part_path:
+            tmpfile_path = None
         handle_download_exception(
             e, getattr(e, "status_code", None), url, cleanup_on_exception, tmpfile_path
         )
@@ -348,7 +683,7 @@ def download_url(
             logger.warning(f"Failed to remove lock file {lock_path}: {e}")
 
 
-def get_content_length(url, headers, auth, scheme):
+def get_content_length(url, headers, auth, scheme, username=None, password=None):
     """
     Get the content length of a file from a given URL.
 
@@ -357,13 +692,21 @@ def get_content_length(url, headers, auth, scheme):
         headers (dict): Additional HTTP headers to send with the request.
         auth (requests.auth.HTTPBasicAuth): Authentication credentials.
         scheme (str): The scheme of the URL (http, https or ftp).
+        username (Optional[str]): FTP username, if not given in the URL.
+        password (Optional[str]): FTP password, if not given in the URL.
 
     Returns:
         Optional[int]: The content length if available, None otherwise.
     """
     if scheme == "ftp":
-        with closing(urllib.request.urlopen(url)) as response:
-            return response.info().get("Content-Length", None)
+        # SIZE only needs the control connection, unlike opening the URL
+        # which starts transferring the file.
+        ftp, path = _ftp_connect(url, username, password)
+        with ftp:
+            try:
+                return ftp.size(path)
+            except ftplib.error_perm:
+                return None
     else:
         with closing(
             request_with_retries("HEAD", url, headers=headers, auth=auth)
@@ -415,18 +758,260 @@ def _simple_grab_url(url: str, output_path: str):
     return urllib.request.urlretrieve(url, filename=output_path)
 
 
+class DownloadProgress(NamedTuple):
+    """Aggregate progress of a :func:`download_concurrent` run."""
+
+    bytes_done: int
+    # None if the size of any file is unknown
+    bytes_total: Optional[int]
+    files_done: int
+    files_total: int
+
+
+class _HostState:
+    """
+    Connection accounting for one host, with a simple adaptive limit: while
+    the host is saturated (all its connections busy, more files waiting), add
+    a connection each interval as long as that raised its throughput by at
+    least 10%, otherwise step back one connection and stop probing.
+    """
+
+    def __init__(self, max_connections: int, adaptive: bool = True):
+        self.max_connections = max_connections
+        self.limit = min(2, max_connections) if adaptive else max_connections
+        self.active = 0
+        self.bytes = 0
+        self.last_rate = None
+        self.probing = adaptive
+
+    def adapt(self, elapsed: float, saturated: bool):
+        rate = self.bytes / elapsed if elapsed > 0 else 0
+        self.bytes = 0
+        if not self.probing or not saturated:
+            return
+        if self.last_rate is None or rate > self.last_rate * 1.1:
+            self.last_rate = rate
+            if self.limit < self.max_connections:
+                self.limit += 1
+            else:
+                self.probing = False
+        else:
+            # The last extra connection didn't help
+            self.limit = max(1, self.limit - 1)
+            self.probing = False
+
+
+def _url_host(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def _lookup_sizes(urls: Iterable[str], max_workers: int = 8) -> Dict[str, Optional[int]]:
+    def _size(url):
+        try:
+            return find_filename_and_size_from_url(url)[1]
+        except Exception as ex:
+            logger.debug(f"Couldn't find the size of {url} ({ex})")
+            return None
+
+    urls = list(urls)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(urls, executor.map(_size, urls)))
+
+
+LOCKED_ELSEWHERE_RECHECK_INTERVAL = 5
+"""Seconds before a URL locked by another process is considered again."""
+
+
+def _locked_elsewhere(filepath: str) -> bool:
+    """
+    True if another process holds the download lock for filepath, so a
+    worker would just sit waiting on it.
+    """
+    lock_path = f"{filepath}.lock"
+    # download_url removes its lock file when done, so (unlike acquiring the
+    # lock) this check doesn't leave a new one behind
+    if not os.path.exists(lock_path):
+        return False
+    lock = FileLock(lock_path, timeout=0)
+    try:
+        lock.acquire()
+    except Timeout:
+        return True
+    lock.release()
+    return False
+
+
 def download_concurrent(
-    urls: Union[Sequence[str], Set[str]], cache_path, proxy=None, concurrent_downloads=8
+    urls: Union[Sequence[str], Set[str]],
+    cache_path,
+    proxy=None,
+    concurrent_downloads=8,
+    segments=1,
+    per_host_connections: int = 4,
+    adaptive: bool = True,
+    sizes: Optional[Mapping[str, Optional[int]]] = None,
+    progress_callback: Optional[Callable[[DownloadProgress], None]] = None,
+    progress_interval: float = 60,
+    adapt_interval: float = 10,
 ):
-    # executor = concurrent.futures.ProcessPoolExecutor
-    executor = concurrent.futures.ThreadPoolExecutor
-    with executor(max_workers=concurrent_downloads) as executor:
-        for result in executor.map(
-            download_url,  # _simple_grab_url,
-            urls,
-            [get_url_cached_path(url, cache_path) for url in urls],
-        ):
-            pass
+    """
+    Download URLs into the cache, at most concurrent_downloads at a time.
+
+    Transfers are started largest first, so the biggest files aren't left
+    running alone at the end. No more than per_host_connections run against
+    any one host, so a slow mirror can't take every worker while other hosts
+    sit idle. With adaptive=True each host starts with fewer connections and
+    only gets more while they raise its throughput (see :class:`_HostState`).
+
+    Args:
+        urls: The URLs to download.
+        cache_path: The cache directory.
+        concurrent_downloads (int): The maximum number of transfers overall.
+        segments (int): Passed to :func:`download_url`.
+        per_host_connections (int): The maximum number of transfers per host.
+        adaptive (bool): Adapt the per host limit to observed throughput.
+        sizes (Mapping[str, Optional[int]]): Known file sizes by URL - any missing are looked up.
+        progress_callback (Callable[[DownloadProgress], None]): Called at most every progress_interval
+                                                                seconds, and once at the end.
+        progress_interval (float): Seconds between progress_callback calls.
+        adapt_interval (float): Seconds between adjustments to per host limits.
+
+    Raises:
+        Exception: The first download error, after all other downloads have finished.
+    """
+    # Several archive.tar#fragment URLs share one download
+    urls = sorted(set(url_to_download_url(url) for url in urls))
+
+    sizes = {url_to_download_url(url): size for url, size in (sizes or {}).items()}
+    unsized = [url for url in urls if url not in sizes]
+    if unsized:
+        sizes.update(_lookup_sizes(unsized, max_workers=concurrent_downloads))
+
+    # Files already cached at their known size don't need a worker (or even
+    # another HEAD request)
+    cached_urls = [
+        url
+        for url in urls
+        if sizes.get(url) is not None
+        and os.path.isfile(get_url_cached_path(url, cache_path))
+        and os.path.getsize(get_url_cached_path(url, cache_path)) == sizes[url]
+    ]
+    for url in cached_urls:
+        logger.debug(f"Already cached, skipping download: {url}")
+
+    pending = sorted(
+        set(urls) - set(cached_urls),
+        key=lambda u: (sizes.get(u) or 0, u),
+        reverse=True,
+    )
+    bytes_total = None
+    if all(sizes.get(url) is not None for url in urls):
+        bytes_total = sum(sizes[url] for url in urls)
+
+    hosts = {
+        host: _HostState(per_host_connections, adaptive=adaptive)
+        for host in set(_url_host(url) for url in urls)
+    }
+    cond = threading.Condition()
+    counts = {
+        "bytes": sum(sizes[url] for url in cached_urls),
+        "files": len(cached_urls),
+        "active": 0,
+    }
+    # Bytes downloaded so far, per URL in progress
+    url_bytes = {}
+    # URLs locked by another process: {url: time to check again}
+    locked_until = {}
+    errors = []
+
+    def _progress(url, host, total):
+        with cond:
+            n = total - url_bytes.get(url, 0)
+            url_bytes[url] = total
+            counts["bytes"] += n
+            host.bytes += max(n, 0)
+
+    def _download(url):
+        host = hosts[_url_host(url)]
+        try:
+            download_url(
+                url,
+                get_url_cached_path(url, cache_path),
+                segments=segments,
+                progress=partial(_progress, url, host),
+            )
+        except Exception as ex:
+            errors.append(ex)
+        finally:
+            with cond:
+                host.active -= 1
+                counts["active"] -= 1
+                counts["files"] += 1
+                cond.notify_all()
+
+    def _snapshot():
+        return DownloadProgress(counts["bytes"], bytes_total, counts["files"], len(urls))
+
+    def _next_url():
+        now = time.monotonic()
+        for url in pending:
+            host = hosts[_url_host(url)]
+            if host.active < host.limit and locked_until.get(url, 0) <= now:
+                return url
+        return None
+
+    last_adapt = last_report = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=concurrent_downloads
+    ) as executor:
+        while True:
+            report = None
+            with cond:
+                if not pending and counts["active"] == 0:
+                    break
+                url = None
+                if counts["active"] < concurrent_downloads:
+                    url = _next_url()
+                if url is None:
+                    cond.wait(timeout=min(adapt_interval, progress_interval, 1))
+                    now = time.monotonic()
+                    if adaptive and now - last_adapt >= adapt_interval:
+                        waiting = set(_url_host(u) for u in pending)
+                        for name, host in hosts.items():
+                            host.adapt(
+                                now - last_adapt,
+                                saturated=name in waiting
+                                and host.active >= host.limit,
+                            )
+                        last_adapt = now
+                    if (
+                        progress_callback is not None
+                        and now - last_report >= progress_interval
+                    ):
+                        report = _snapshot()
+                        last_report = now
+            if report is not None:
+                progress_callback(report)
+            if url is None:
+                continue
+
+            # Checked outside cond, and only for the URL about to start. Only
+            # this thread starts downloads, so the slot found is still free.
+            if _locked_elsewhere(get_url_cached_path(url, cache_path)):
+                locked_until[url] = time.monotonic() + LOCKED_ELSEWHERE_RECHECK_INTERVAL
+                continue
+            with cond:
+                locked_until.pop(url, None)
+                pending.remove(url)
+                hosts[_url_host(url)].active += 1
+                counts["active"] += 1
+                executor.submit(_download, url)
+
+    if progress_callback is not None:
+        progress_callback(_snapshot())
+
+    if errors:
+        raise errors[0]
 
     # for url in urls:
     #     output_path = get_url_cached_path(url, cache_path)
@@ -793,7 +1378,160 @@ def create_copy_from_cache(
     cached = get_url_cached_path(url, cache_path=cache_path)
     filepath = os.path.join(target_dir, filename)
 
-    shutil.copyfile(cached, filepath)
+    clone_file(cached, filepath)
+
+
+def create_hardlink_from_cache(
+    url: str,
+    target_dir,
+    cache_path,
+    filename=None,
+    sanitize_name=True,
+):
+    # Attempt to determine the filename based on the URL
+    if filename is None:
+        filename, _ = find_filename_and_size_from_url(url, sanitize_name=sanitize_name)
+
+    cached = get_url_cached_path(url, cache_path=cache_path)
+    filepath = os.path.join(target_dir, filename)
+
+    _place(CachePlacement(cached, filepath, "hardlink"))
+
+
+# From linux/fs.h - _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def clone_file(src: str, dst: str) -> str:
+    """
+    Copy src to dst as cheaply as the filesystem allows: a reflink (FICLONE,
+    eg btrfs, XFS) shares blocks without copying any data, copy_file_range
+    copies within the kernel (and may reflink or offload on some filesystems),
+    with shutil.copyfile as the fallback.
+
+    :return: The method used - 'reflink', 'copy_file_range' or 'copyfile'.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            import fcntl
+
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), min(remaining, 1 << 30)
+                    )
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return "copy_file_range"
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+
+    shutil.copyfile(src, dst)
+    return "copyfile"
+
+
+class CachePlacement(NamedTuple):
+    """Put the cached file source at destination, using method."""
+
+    source: str
+    destination: str
+    # 'symlink', 'hardlink' or 'copy'
+    method: str
+
+
+def plan_cache_placements(
+    url_filenames: Mapping[str, str],
+    target_dir: str,
+    cache_path: str,
+    method: str = "symlink",
+    overwrite: bool = True,
+) -> List[CachePlacement]:
+    """
+    Plan where each cached download should be placed in target_dir.
+
+    Collisions - two URLs with the same filename, or (if overwrite is False) a
+    filename that already exists in target_dir - are found up front and
+    reported together, before anything is placed.
+
+    :param url_filenames: A dictionary of {url: filename}.
+    :param method: 'symlink', 'hardlink' or 'copy'.
+    :param overwrite: Replace files already in target_dir (eg when re-running
+                      a download into the same directory), rather than
+                      treating them as collisions.
+    :raises FileExistsError: If any destination collides.
+    """
+    if method not in ("symlink", "hardlink", "copy"):
+        raise ValueError(f"Unknown placement method: {method}")
+
+    existing = set()
+    if not overwrite and os.path.isdir(target_dir):
+        existing = set(os.listdir(target_dir))
+    by_filename = {}
+    for url, filename in url_filenames.items():
+        by_filename.setdefault(filename, []).append(url)
+
+    collisions = [
+        f"{filename} ({', '.join(sorted(urls))})"
+        for filename, urls in sorted(by_filename.items())
+        if len(urls) > 1 or filename in existing
+    ]
+    if collisions:
+        raise FileExistsError(
+            f"Can't place files in {target_dir}, filenames collide: "
+            + "; ".join(collisions)
+        )
+
+    return [
+        CachePlacement(
+            get_url_cached_path(url, cache_path),
+            os.path.join(target_dir, filename),
+            method,
+        )
+        for filename, (url,) in sorted(by_filename.items())
+    ]
+
+
+def _place(placement: CachePlacement):
+    # Replace (rather than write through) any existing file or link, so an
+    # old symlink or hardlink into the cache is never copied over
+    if os.path.islink(placement.destination) or os.path.isfile(
+        placement.destination
+    ):
+        os.unlink(placement.destination)
+
+    if placement.method == "symlink":
+        os.symlink(placement.source, placement.destination)
+        return
+    if placement.method == "hardlink":
+        try:
+            os.link(placement.source, placement.destination)
+            return
+        except OSError as ex:
+            # Eg the cache and destination are on different filesystems
+            logger.debug(f"Can't hardlink {placement.source} ({ex}), copying")
+    clone_file(placement.source, placement.destination)
+
+
+def place_from_cache(placements: Sequence[CachePlacement], max_workers: int = 8):
+    """
+    Carry out the placements from :func:`plan_cache_placements` concurrently.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in executor.map(_place, placements):
+            pass
+    logger.info(f"Placed {len(placements)} file(s) from the cache")
 
 
 def is_zipfile(fpath: str) -> bool:
@@ -834,44 +1572,94 @@ def unzip(cached, target_dir, extract_files: Union[List[str], None] = None):
     return result
 
 
+def plan_sanitize_renames(
+    rootpath: Union[str, Path],
+    fix_root=True,
+    sanitizer: Union[None, Callable] = None,
+) -> List[List[Tuple[str, str]]]:
+    """
+    Plan the renames needed to sanitize every name under rootpath, from a
+    single walk of the tree.
+
+    Where a sanitized name would clash with another entry in the same
+    directory, a random prefix is added rather than overwriting it.
+
+    Returns:
+        List[List[Tuple[str, str]]]: (old, new) path pairs, grouped by depth,
+                                     deepest first. Renames within a group are
+                                     independent of each other.
+    """
+    if sanitizer is None:
+        sanitizer = sanitize_filename
+
+    rootpath = Path(rootpath)
+    by_depth = {}
+    for root, dirs, files in os.walk(str(rootpath)):
+        entries = sorted(files + dirs)
+        renames = [(e, sanitizer(e)) for e in entries if sanitizer(e) != e]
+        if not renames:
+            continue
+        taken = set(entries) - set(old for old, _ in renames)
+        depth = len(Path(root).relative_to(rootpath).parts)
+        for old, new in renames:
+            candidate = new
+            while candidate in taken:
+                candidate = f"{_random_chars(4)}_{new}"
+            if candidate != new:
+                logger.warning(f"{new} already exists, renaming {old} to {candidate}")
+            taken.add(candidate)
+            by_depth.setdefault(depth, []).append(
+                (str(Path(root, old)), str(Path(root, candidate)))
+            )
+
+    groups = [by_depth[d] for d in sorted(by_depth.keys(), reverse=True)]
+
+    if fix_root:
+        newpath = rootpath.parent / Path(sanitizer(rootpath.name))
+        if newpath != rootpath:
+            groups.append([(str(rootpath), str(newpath))])
+
+    return groups
+
+
 def recursively_sanitize_filenames(
     rootpath: Union[str, Path],
     fix_root=True,
     sanitizer: Union[None, Callable] = None,
+    max_workers: int = 8,
 ) -> List[Tuple[str, str]]:
     """[summary]
     Recursively renames files and directories to remove spaces.
 
+    Renames are planned up front (see :func:`plan_sanitize_renames`), then
+    applied deepest first, with the renames at each depth run concurrently.
+
     Args:
         rootpath (Union[str, Path]): Path to recursively fix.
         fix_root (bool): Also fix the rootpath name (defaults to True).
         sanitizer (Callable): (Optional) A function that takes a string and returns a sanitized version.
                               Defaults to :func:`sanitize_filename`.
+        max_workers (int): The maximum number of concurrent renames.
 
     Returns:
         List[Tuple[str, str]]: A list of tuples containing the old and new path names.
     """
-    if sanitizer is None:
-        sanitizer = sanitize_filename
+    groups = plan_sanitize_renames(rootpath, fix_root=fix_root, sanitizer=sanitizer)
+
+    def _rename(change):
+        oldpath, newpath = change
+        logger.debug(f"Renaming {oldpath} to {newpath}")
+        os.rename(oldpath, newpath)
 
-    rootpath = Path(rootpath)
     changes = []
-    for root, dirs, files in reversed(list(os.walk(str(rootpath)))):
-        entries = files + dirs
-        for e in entries:
-            oldpath = Path(root, e)
-            newpath = Path(root, sanitizer(e))
-            if newpath != oldpath:
-                logger.info(f"Renaming {e} to {sanitizer(e)}")
-                os.rename(oldpath, newpath)
-                changes.append((str(oldpath), str(newpath)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for group in groups:
+            for _ in executor.map(_rename, group):
+                pass
+            changes.extend(group)
 
-    if fix_root:
-        newpath = rootpath.parent / Path(sanitizer(rootpath.name))
-        if newpath != rootpath:
-            logger.info(f"Renaming destination path directory {rootpath} to {newpath}")
-            os.rename(rootpath, newpath)
-            changes.append((str(rootpath), str(newpath)))
+    if changes:
+        logger.info(f"Renamed {len(changes)} file(s) under {rootpath}")
 
     return changes
 
@@ -909,6 +1697,184 @@ def untar_from_url_fragment(cached, target_dir, url: str):
     return untar(cached, target_dir, extract_files=[fn])
 
 
+# GNU tar-like extraction rules (strip leading '/', refuse paths outside
+# target_dir), on Pythons that support extraction filters.
+_TAR_EXTRACT_KWARGS = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+
+
+def _is_relative_member(name: str) -> bool:
+    """True if a (normalised) member path stays inside the extraction directory."""
+    return not os.path.isabs(name) and name != ".." and not name.startswith("../")
+
+
+def group_tar_fragment_urls(urls: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Group archive.tar#path/in/archive style URLs by archive, so each archive
+    only needs to be read once.
+
+    >>> group_tar_fragment_urls(["https://example.com/a.tar#x.txt", "https://example.com/a.tar#y.txt"])
+    {'https://example.com/a.tar': ['x.txt', 'y.txt']}
+
+    :param urls: URLs, some or all with #fragments. URLs without a fragment are ignored.
+    :return: A dictionary of {archive_url: [member_path, ...]}.
+    """
+    groups = OrderedDict()
+    for url in sorted(urls):
+        if not is_tar_url_with_fragment(url):
+            continue
+        groups.setdefault(remove_url_fragment(url), []).append(
+            unquote(urlparse(url).fragment)
+        )
+    return dict(groups)
+
+
+def parse_tar_manifest(text: str) -> List[str]:
+    """
+    Parse a .manifest-md5 file (md5sum output, '<checksum>  <path>' per line)
+    into a list of archive member paths.
+    """
+    paths = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        _checksum, filename = line.split("  ", 1)
+        paths.append(os.path.normpath(filename.strip()))
+    return paths
+
+
+def fetch_tar_manifest(
+    tar_url: str, index_suffix: str = ".manifest-md5"
+) -> Optional[List[str]]:
+    """
+    Fetch the {tar_url}.manifest-md5 file that sits alongside some archives.
+    Returns None if there isn't one.
+    """
+    if urlparse(tar_url).scheme.lower() not in ("http", "https"):
+        return None
+    manifest_url = remove_url_fragment(tar_url) + index_suffix
+    try:
+        with closing(request_with_retries("GET", manifest_url)) as response:
+            if not response.ok:
+                return None
+            return parse_tar_manifest(response.text)
+    except (requests.exceptions.RequestException, ValueError) as ex:
+        logger.debug(f"No usable manifest at {manifest_url} ({ex})")
+        return None
+
+
+def extract_tar_members(
+    cached: str,
+    target_dir: str,
+    members: Iterable[str],
+    manifest: Optional[List[str]] = None,
+) -> List[str]:
+    """
+    Extract several members (files or directories) from a tar archive in a
+    single pass.
+
+    Uncompressed tars are read by seeking from header to header, so the data
+    of members we don't want is never read. Compressed tars are streamed once.
+    The scan stops as soon as every wanted file has been extracted. Directory
+    members otherwise need a full scan, unless a manifest (see
+    :func:`parse_tar_manifest`) lists the files they contain.
+
+    :param cached: Path to the tar archive.
+    :param target_dir: Directory to extract into.
+    :param members: Paths of the members to extract.
+    :param manifest: (Optional) Every file path in the archive. Used to expand
+                     directory members, and to fail fast on missing members.
+    :return: The member paths that were extracted.
+    """
+    wanted = set(os.path.normpath(m) for m in members)
+
+    if manifest is not None:
+        in_manifest = set(manifest)
+        for m in list(wanted):
+            if m in in_manifest:
+                continue
+            contents = [f for f in manifest if f.startswith(f"{m}/")]
+            if not contents:
+                raise ValueError(f"{m} is not in the manifest for {cached}")
+            wanted.discard(m)
+            wanted.update(contents)
+        dir_prefixes = ()
+    else:
+        # Without a manifest we can't tell files from directories up front.
+        dir_prefixes = tuple(f"{m}/" for m in wanted)
+
+    remaining = set(wanted)
+    found_directory = False
+    extracted = []
+
+    try:
+        tar = tarfile.open(cached, mode="r:")
+    except tarfile.ReadError:
+        tar = tarfile.open(cached, mode="r|*")
+
+    with tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if name in wanted:
+                found_directory = found_directory or member.isdir()
+                remaining.discard(name)
+            elif dir_prefixes and name.startswith(dir_prefixes):
+                found_directory = True
+                remaining.difference_update(
+                    m for m in wanted if name.startswith(f"{m}/")
+                )
+            else:
+                continue
+            parent = os.path.dirname(name)
+            if parent and not member.isdir() and _is_relative_member(parent):
+                # tarfile's own makedirs for missing parents isn't exist_ok, so
+                # races when archives sharing a directory are extracted in parallel
+                os.makedirs(os.path.join(target_dir, parent), exist_ok=True)
+            tar.extract(member, target_dir, **_TAR_EXTRACT_KWARGS)
+            extracted.append(name)
+            # Once a directory has matched, more of its contents may follow
+            if not remaining and not found_directory:
+                break
+
+    if remaining:
+        raise ValueError(
+            f"{', '.join(sorted(remaining))} not found in tar archive {cached}"
+        )
+
+    return extracted
+
+
+def extract_tar_fragment_groups(
+    groups: Mapping[str, List[str]],
+    cache_path: str,
+    target_dir: str,
+    manifests: Optional[Mapping[str, Optional[List[str]]]] = None,
+    max_workers: int = 4,
+) -> Dict[str, List[str]]:
+    """
+    Extract the members requested from each archive (as returned by
+    :func:`group_tar_fragment_urls`), one pass per archive, with independent
+    archives extracted in parallel.
+
+    :return: A dictionary of {archive_url: [extracted_member, ...]}.
+    """
+    manifests = manifests or {}
+
+    def _extract(archive_url):
+        cached = get_url_cached_path(archive_url, cache_path)
+        logger.info(
+            f"Untarring {len(groups[archive_url])} file(s) from {cached} ({archive_url})"
+        )
+        return extract_tar_members(
+            cached,
+            target_dir,
+            groups[archive_url],
+            manifest=manifests.get(archive_url, None),
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(groups.keys(), executor.map(_extract, groups.keys())))
+
+
 async def async_notify_event(
     api_url: Union[str, None],
     event: str,
@@ -0,0 +1,188 @@
+import io
+import os
+import tarfile
+import tempfile
+from unittest import mock
+
+import pytest
+
+from ..core import (
+    group_tar_fragment_urls,
+    parse_tar_manifest,
+    extract_tar_members,
+    extract_tar_fragment_groups,
+    get_url_cached_path,
+)
+
+N_MEMBERS = 200
+
+
+def _member_content(name):
+    return f"content of {name}\n".encode() * 64
+
+
+def _make_tarball(path, mode="w"):
+    """
+    A tarball with N_MEMBERS files spread over a few directories, plus the
+    list of member paths in archive order.
+    """
+    names = [f"sample{i % 4}/reads_{i:03d}.fastq" for i in range(N_MEMBERS)]
+    with tarfile.open(path, mode) as tar:
+        for d in sorted(set(os.path.dirname(n) for n in names)):
+            info = tarfile.TarInfo(d)
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            tar.addfile(info)
+        for name in names:
+            data = _member_content(name)
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return names
+
+
+@pytest.fixture
+def cache_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+@pytest.fixture
+def dest_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+def _extracted_files(root):
+    found = []
+    for dirpath, dirs, files in os.walk(root):
+        for f in files:
+            found.append(os.path.relpath(os.path.join(dirpath, f), root))
+    return sorted(found)
+
+
+def test_group_tar_fragment_urls():
+    urls = [
+        "https://example.com/b.tar#sample1/reads_001.fastq",
+        "https://example.com/a.tar#x.txt",
+        "https://example.com/a.tar#dir%20name/y.txt",
+        "https://example.com/plain.fastq.gz",
+    ]
+    assert group_tar_fragment_urls(urls) == {
+        "https://example.com/a.tar": ["dir name/y.txt", "x.txt"],
+        "https://example.com/b.tar": ["sample1/reads_001.fastq"],
+    }
+
+
+def test_parse_tar_manifest():
+    text = "d41d8cd98f00b204e9800998ecf8427e  ./a/b.txt\n\n0cc175b9c0f1b6a831c399e269772661  c d.txt\n"
+    assert parse_tar_manifest(text) == ["a/b.txt", "c d.txt"]
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz"])
+def test_extract_tar_members_single_pass(cache_dir, dest_dir, mode):
+    archive = os.path.join(cache_dir, "many.tar")
+    names = _make_tarball(archive, mode)
+    wanted = names[10:60]
+
+    with mock.patch("laxy_downloader.core.tarfile.open", wraps=tarfile.open) as topen:
+        extracted = extract_tar_members(archive, dest_dir, wanted)
+
+    assert sorted(extracted) == sorted(wanted)
+    assert _extracted_files(dest_dir) == sorted(wanted)
+    for name in wanted:
+        with open(os.path.join(dest_dir, name), "rb") as f:
+            assert f.read() == _member_content(name)
+    # Read once, not once per member
+    assert topen.call_count <= 2
+
+
+def test_extract_tar_members_stops_early(cache_dir, dest_dir):
+    archive = os.path.join(cache_dir, "many.tar")
+    names = _make_tarball(archive)
+
+    seen = []
+    real_next = tarfile.TarFile.next
+
+    def counting_next(self):
+        member = real_next(self)
+        if member is not None:
+            seen.append(member.name)
+        return member
+
+    with mock.patch.object(tarfile.TarFile, "next", counting_next):
+        extract_tar_members(archive, dest_dir, names[:5])
+
+    # 4 directory headers + the 5 members, but not the rest of the archive
+    assert len(set(seen)) == 9
+
+
+def test_extract_tar_members_directory(cache_dir, dest_dir):
+    archive = os.path.join(cache_dir, "many.tar")
+    names = _make_tarball(archive)
+    sample2 = [n for n in names if n.startswith("sample2/")]
+
+    extract_tar_members(archive, dest_dir, ["sample2"])
+    assert _extracted_files(dest_dir) == sorted(sample2)
+
+
+def test_extract_tar_members_manifest(cache_dir, dest_dir):
+    archive = os.path.join(cache_dir, "many.tar.gz")
+    names = _make_tarball(archive, "w:gz")
+
+    with pytest.raises(ValueError):
+        extract_tar_members(archive, dest_dir, ["not/in/archive.txt"], manifest=names)
+    assert _extracted_files(dest_dir) == []
+
+    extract_tar_members(archive, dest_dir, ["sample0"], manifest=names)
+    assert _extracted_files(dest_dir) == sorted(
+        n for n in names if n.startswith("sample0/")
+    )
+
+
+def test_extract_tar_members_missing(cache_dir, dest_dir):
+    archive = os.path.join(cache_dir, "many.tar")
+    names = _make_tarball(archive)
+
+    with pytest.raises(ValueError, match="nope.txt"):
+        extract_tar_members(archive, dest_dir, [names[0], "nope.txt"])
+
+
+def test_extract_tar_fragment_groups(cache_dir, dest_dir):
+    urls = []
+    expected = []
+    for archive_name, mode in [("one.tar", "w"), ("two.tar", "w:gz")]:
+        archive_url = f"https://example.com/{archive_name}"
+        names = _make_tarball(get_url_cached_path(archive_url, cache_dir), mode)
+        members = names[::7] if mode == "w" else names[1::7]
+        urls.extend(f"{archive_url}#{name}" for name in members)
+        expected.extend(members)
+
+    groups = group_tar_fragment_urls(urls)
+    result = extract_tar_fragment_groups(groups, cache_dir, dest_dir, max_workers=2)
+
+    assert sorted(result.keys()) == sorted(groups.keys())
+    assert _extracted_files(dest_dir) == sorted(expected)
+
+
+def test_extract_tar_fragment_groups_shared_parents(cache_dir, dest_dir):
+    # Archives without directory entries, all extracting into the same
+    # (not yet existing) directories at once
+    urls = []
+    expected = []
+    for a in range(8):
+        archive_url = f"https://example.com/part{a}.tar"
+        with tarfile.open(get_url_cached_path(archive_url, cache_dir), "w") as tar:
+            for i in range(4):
+                name = f"shared/deeply/nested/{i}/part{a}.fastq"
+                data = _member_content(name)
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+                urls.append(f"{archive_url}#{name}")
+                expected.append(name)
+
+    groups = group_tar_fragment_urls(urls)
+    extract_tar_fragment_groups(groups, cache_dir, dest_dir, max_workers=8)
+
+    assert _extracted_files(dest_dir) == sorted(expected)
@@ -0,0 +1,228 @@
+import json
+import threading
+from functools import partial
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+import pytest
+import trio
+import trio_websocket
+
+from .. import aria
+
+
+class FakeAria2:
+    """
+    A stand-in for aria2c's RPC interface: XML-RPC (with system.multicall)
+    in a thread, plus an optional JSON-RPC WebSocket for notifications.
+    """
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requests = 0
+        self.calls = []
+
+        fake = self
+
+        class CountingHandler(SimpleXMLRPCRequestHandler):
+            rpc_paths = ("/rpc",)
+
+            def do_POST(self):
+                fake.requests += 1
+                super().do_POST()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = SimpleXMLRPCServer(
+            ("127.0.0.1", 0), requestHandler=CountingHandler, allow_none=True
+        )
+        self.server.register_multicall_functions()
+        self.server.register_function(self.tell_status, "aria2.tellStatus")
+        self.server.register_function(self.remove, "aria2.remove")
+        self.server.register_function(self.global_stat, "aria2.getGlobalStat")
+        self.server.register_function(
+            partial(self.tell_by_state, ("active",)), "aria2.tellActive"
+        )
+        self.server.register_function(
+            partial(self.tell_by_state, ("waiting", "paused"), offset_num=True),
+            "aria2.tellWaiting",
+        )
+        self.server.register_function(
+            partial(self.tell_by_state, aria.FINISHED_STATES, offset_num=True),
+            "aria2.tellStopped",
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def tell_status(self, gid, keys=None):
+        self.calls.append(("tellStatus", gid))
+        if gid not in self.statuses:
+            raise Exception(f"GID {gid} is not found")
+        return self.statuses[gid]
+
+    def tell_by_state(self, states, *params, offset_num=False):
+        if offset_num:
+            offset, num = params[0], params[1]
+        else:
+            offset, num = 0, len(self.statuses)
+        matched = [s for s in self.statuses.values() if s["status"] in states]
+        return matched[offset : offset + num]
+
+    def global_stat(self):
+        states = [s["status"] for s in self.statuses.values()]
+        return {
+            "numActive": str(states.count("active")),
+            "numWaiting": str(states.count("waiting") + states.count("paused")),
+            "numStopped": str(len([s for s in states if s in aria.FINISHED_STATES])),
+        }
+
+    def remove(self, gid):
+        self.calls.append(("remove", gid))
+        self.statuses[gid]["status"] = "removed"
+        return gid
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _status(gid, status="active"):
+    return {
+        "gid": gid,
+        "status": status,
+        "files": [{"uris": [{"uri": f"http://example.com/{gid}.fastq.gz"}]}],
+    }
+
+
+@pytest.fixture
+def fake_aria2(monkeypatch):
+    fake = FakeAria2({gid: _status(gid) for gid in ["a1", "b2", "c3"]})
+    monkeypatch.setattr(aria, "RPC_HOST", "127.0.0.1")
+    monkeypatch.setattr(aria, "RPC_PORT", fake.port)
+    monkeypatch.setattr(aria, "__rpc_secret__", None)
+    yield fake
+    fake.shutdown()
+
+
+def test_tell_statuses_single_request(fake_aria2):
+    statuses = aria.tell_statuses(["a1", "b2", "c3", "missing"])
+
+    assert fake_aria2.requests == 1
+    assert sorted(statuses.keys()) == ["a1", "b2", "c3"]
+    assert not aria.downloads_finished(["a1", "b2"])
+
+    fake_aria2.statuses["a1"]["status"] = "complete"
+    fake_aria2.statuses["b2"]["status"] = "error"
+    assert aria.downloads_finished(["a1", "b2"])
+
+
+def test_stop_url_download_finds_all_queued(fake_aria2, monkeypatch):
+    # More waiting downloads than the old fixed limit of 999
+    for i in range(1200):
+        gid = f"w{i}"
+        fake_aria2.statuses[gid] = _status(gid, status="waiting")
+
+    class FakeDaemon:
+        def shutdown(self):
+            pass
+
+    monkeypatch.setattr(aria, "get_daemon", lambda: FakeDaemon())
+    aria.stop_url_download("http://example.com/w1100.fastq.gz")
+
+    assert fake_aria2.calls == [("remove", "w1100")]
+    assert fake_aria2.requests == 3
+
+
+def test_wait_for_downloads_event_driven(fake_aria2, monkeypatch):
+    finished = []
+
+    async def fake_notifier(request):
+        ws = await request.accept()
+        # Let the initial reconcile happen, then report completions as
+        # aria2 would, one at a time.
+        for gid, status, method in [
+            ("b2", "complete", "aria2.onDownloadComplete"),
+            ("a1", "error", "aria2.onDownloadError"),
+            ("c3", "complete", "aria2.onDownloadComplete"),
+        ]:
+            await trio.sleep(0.05)
+            fake_aria2.statuses[gid]["status"] = status
+            await ws.send_message(
+                json.dumps(
+                    {"jsonrpc": "2.0", "method": method, "params": [{"gid": gid}]}
+                )
+            )
+        await trio.sleep_forever()
+
+    async def run():
+        async with trio.open_nursery() as nursery:
+            listeners = await nursery.start(
+                partial(trio_websocket.serve_websocket, fake_notifier, "127.0.0.1", 0),
+                None,
+            )
+            monkeypatch.setattr(
+                aria, "websocket_url", lambda: listeners.listeners[0].url
+            )
+            with trio.fail_after(5):
+                result = await aria.wait_for_downloads(
+                    ["a1", "b2", "c3"],
+                    on_finished=lambda gid, status: finished.append(gid),
+                    reconcile_every=60,
+                    poll_every=60,
+                )
+            nursery.cancel_scope.cancel()
+        return result
+
+    result = trio.run(run)
+
+    assert finished == ["b2", "a1", "c3"]
+    assert result["a1"]["status"] == "error"
+    # One batched reconcile on connect, then one request per notification
+    assert fake_aria2.requests == 4
+
+
+def test_wait_for_downloads_polling_fallback(fake_aria2, monkeypatch):
+    # Nothing is listening on this port, so there is no WebSocket
+    monkeypatch.setattr(aria, "websocket_url", lambda: "ws://127.0.0.1:1/jsonrpc")
+    fake_aria2.statuses["a1"]["status"] = "complete"
+    finished = []
+
+    async def finish_later():
+        await trio.sleep(0.1)
+        fake_aria2.statuses["b2"]["status"] = "complete"
+        fake_aria2.statuses["c3"]["status"] = "removed"
+
+    async def run():
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(finish_later)
+            with trio.fail_after(5):
+                return await aria.wait_for_downloads(
+                    ["a1", "b2", "c3", "purged"],
+                    on_finished=lambda gid, status: finished.append(gid),
+                    poll_every=0.05,
+                )
+
+    result = trio.run(run)
+
+    assert sorted(finished[:2]) == ["a1", "purged"]
+    assert sorted(finished[2:]) == ["b2", "c3"]
+    assert result["purged"]["status"] == "unknown"
+
+
+def test_wait_for_downloads_callback_errors_propagate(fake_aria2, monkeypatch):
+    monkeypatch.setattr(aria, "websocket_url", lambda: "ws://127.0.0.1:1/jsonrpc")
+    fake_aria2.statuses["a1"]["status"] = "complete"
+
+    def disk_full(gid, status):
+        raise OSError(28, "No space left on device")
+
+    async def run():
+        with trio.fail_after(5):
+            await aria.wait_for_downloads(["a1"], on_finished=disk_full)
+
+    with pytest.raises(OSError, match="No space left"):
+        trio.run(run)
@@ -1,6 +1,11 @@
 import os
+import re
+import socket
+import socketserver
 import tempfile
+import threading
 import hashlib
+import http.server
 from unittest import mock
 from pathlib import Path
 
@@ -418,3 +423,218 @@ def test_download_url_lock_file_cleanup(mock_request, temp_dir):
 
 if __name__ == "__main__":
     pytest.main([__file__])
+
+
+class FlakyHTTPHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves self.server.content, honouring Range requests. The first
+    self.server.drop_after_bytes responses are cut off after that many bytes
+    to simulate a dropped connection.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _range(self):
+        content = self.server.content
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if not m:
+            return 0, len(content) - 1, 200
+        end = int(m.group(2)) if m.group(2) else len(content) - 1
+        return int(m.group(1)), end, 206
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.content)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start, end, status = self._range()
+        self.server.requests.append(self.headers.get("Range", None))
+        body = self.server.content[start : end + 1]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{len(self.server.content)}"
+            )
+        self.end_headers()
+        if self.server.drops_remaining > 0:
+            self.server.drops_remaining -= 1
+            body = body[: self.server.drop_after_bytes]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+@pytest.fixture
+def flaky_http_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FlakyHTTPHandler)
+    server.content = os.urandom(300 * 1024)
+    server.requests = []
+    server.drops_remaining = 0
+    server.drop_after_bytes = 100 * 1024
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FlakyFTPHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough of an FTP server for ftplib: passive mode, SIZE, REST and
+    RETR of self.server.content at any path. The first
+    self.server.drops_remaining transfers are cut off after
+    self.server.drop_after_bytes.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        content = self.server.content
+        rest = 0
+        data_sock = None
+        self.reply("220 Fake FTP")
+        for line in self.rfile:
+            cmd, _, arg = line.decode().strip().partition(" ")
+            cmd = cmd.upper()
+            if cmd in ("USER", "PASS", "TYPE"):
+                self.reply("230 OK" if cmd == "PASS" else "200 OK")
+            elif cmd == "SIZE":
+                self.reply(f"213 {len(content)}")
+            elif cmd == "REST":
+                if not self.server.support_rest:
+                    self.reply("502 REST not implemented")
+                    continue
+                rest = int(arg)
+                self.server.rests.append(rest)
+                self.reply(f"350 Restarting at {rest}")
+            elif cmd == "PASV":
+                data_sock = socket.socket()
+                data_sock.bind(("127.0.0.1", 0))
+                data_sock.listen(1)
+                port = data_sock.getsockname()[1]
+                self.reply(
+                    f"227 Entering Passive Mode (127,0,0,1,{port // 256},{port % 256})"
+                )
+            elif cmd == "RETR":
+                conn, _ = data_sock.accept()
+                self.reply("150 Opening data connection")
+                body = content[rest:]
+                if self.server.drops_remaining > 0:
+                    self.server.drops_remaining -= 1
+                    conn.sendall(body[: self.server.drop_after_bytes])
+                    conn.close()
+                    data_sock.close()
+                    # Hang up the control connection mid-transfer too
+                    return
+                conn.sendall(body)
+                conn.close()
+                data_sock.close()
+                rest = 0
+                self.reply("226 Transfer complete")
+            elif cmd == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+@pytest.fixture
+def flaky_ftp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FlakyFTPHandler)
+    server.daemon_threads = True
+    server.content = os.urandom(300 * 1024)
+    server.rests = []
+    server.support_rest = True
+    server.drops_remaining = 0
+    server.drop_after_bytes = 100 * 1024
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_url_http_resumes_in_place_after_dropped_connection(
+    flaky_http_server, temp_dir
+):
+    server = flaky_http_server
+    server.drops_remaining = 2
+    url = f"http://127.0.0.1:{server.server_address[1]}/reads.bam"
+    file_path = os.path.join(temp_dir, "reads.bam")
+
+    with mock.patch("laxy_downloader.core.shutil.copy2") as copy2:
+        assert download_url(url, file_path, chunk_size=1024) == file_path
+        copy2.assert_not_called()
+
+    with open(file_path, "rb") as f:
+        assert f.read() == server.content
+    # Each attempt picked up where the dropped one left off
+    assert server.requests == [None, "bytes=102400-", "bytes=204800-"]
+    assert not os.path.exists(f"{file_path}.part")
+
+
+def test_download_url_keeps_partial_for_later_resume(flaky_http_server, temp_dir):
+    server = flaky_http_server
+    server.drops_remaining = 1
+    url = f"http://127.0.0.1:{server.server_address[1]}/reads.bam"
+    file_path = os.path.join(temp_dir, "reads.bam")
+
+    with pytest.raises(Exception):
+        download_url(url, file_path, max_retries=1, chunk_size=1024)
+    assert not os.path.exists(file_path)
+    assert os.path.getsize(f"{file_path}.part") == server.drop_after_bytes
+
+    download_url(url, file_path)
+    with open(file_path, "rb") as f:
+        assert f.read() == server.content
+    assert server.requests == [None, "bytes=102400-"]
+
+
+def test_download_url_segmented(flaky_http_server, temp_dir):
+    server = flaky_http_server
+    # One segment gets cut off and has to resume
+    server.drops_remaining = 1
+    server.drop_after_bytes = 10 * 1024
+    url = f"http://127.0.0.1:{server.server_address[1]}/reads.bam"
+    file_path = os.path.join(temp_dir, "reads.bam")
+
+    download_url(url, file_path, segments=3, min_segment_size=64 * 1024)
+
+    with open(file_path, "rb") as f:
+        assert f.read() == server.content
+    assert len(server.requests) == 4
+    assert all(r is not None for r in server.requests)
+
+
+def test_download_url_ftp_rest_resume(flaky_ftp_server, temp_dir):
+    server = flaky_ftp_server
+    server.drops_remaining = 1
+    url = f"ftp://127.0.0.1:{server.server_address[1]}/pub/reads.fastq.gz"
+    file_path = os.path.join(temp_dir, "reads.fastq.gz")
+
+    assert download_url(url, file_path) == file_path
+
+    with open(file_path, "rb") as f:
+        assert f.read() == server.content
+    assert server.rests == [server.drop_after_bytes]
+    assert not os.path.exists(f"{file_path}.part")
+
+
+def test_download_url_ftp_without_rest_restarts(flaky_ftp_server, temp_dir):
+    server = flaky_ftp_server
+    server.drops_remaining = 1
+    server.support_rest = False
+    url = f"ftp://127.0.0.1:{server.server_address[1]}/pub/reads.fastq.gz"
+    file_path = os.path.join(temp_dir, "reads.fastq.gz")
+
+    download_url(url, file_path)
+
+    with open(file_path, "rb") as f:
+        assert f.read() == server.content
@@ -0,0 +1,222 @@
+import os
+import time
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from ..core import (
+    clone_file,
+    plan_cache_placements,
+    place_from_cache,
+    plan_sanitize_renames,
+    recursively_sanitize_filenames,
+    get_url_cached_path,
+    find_filename_and_size_from_url,
+)
+from laxy_downloader.cli import main as cli_main
+
+N_FILES = 5000
+
+
+@pytest.fixture
+def cache_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+@pytest.fixture
+def dest_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+@pytest.fixture
+def cached_urls(cache_dir):
+    """N_FILES URLs that are already in the cache."""
+    urls = {}
+    for i in range(N_FILES):
+        url = f"http://example.com/run1/sample_{i:04d}.fastq.gz"
+        with open(get_url_cached_path(url, cache_dir), "wb") as f:
+            f.write(f"{url}\n".encode())
+        urls[url] = f"sample_{i:04d}.fastq.gz"
+    return urls
+
+
+def test_clone_file(cache_dir):
+    src = os.path.join(cache_dir, "src")
+    dst = os.path.join(cache_dir, "dst")
+    content = os.urandom(3 * 1024 * 1024 + 7)
+    with open(src, "wb") as f:
+        f.write(content)
+
+    method = clone_file(src, dst)
+
+    assert method in ("reflink", "copy_file_range", "copyfile")
+    with open(dst, "rb") as f:
+        assert f.read() == content
+    assert not os.path.samefile(src, dst)
+
+
+@pytest.mark.parametrize("method", ["symlink", "hardlink", "copy"])
+def test_place_from_cache(cache_dir, dest_dir, cached_urls, method):
+    placements = plan_cache_placements(cached_urls, dest_dir, cache_dir, method=method)
+    place_from_cache(placements)
+
+    assert len(os.listdir(dest_dir)) == N_FILES
+    for url, filename in cached_urls.items():
+        path = os.path.join(dest_dir, filename)
+        assert os.path.islink(path) == (method == "symlink")
+        with open(path, "rb") as f:
+            assert f.read() == f"{url}\n".encode()
+
+
+def test_plan_cache_placements_collisions(cache_dir, dest_dir):
+    Path(dest_dir, "exists.txt").touch()
+    url_filenames = {
+        "http://example.com/a/reads.fastq": "reads.fastq",
+        "http://example.com/b/reads.fastq": "reads.fastq",
+        "http://example.com/exists.txt": "exists.txt",
+        "http://example.com/fine.txt": "fine.txt",
+    }
+
+    with pytest.raises(FileExistsError) as ex:
+        plan_cache_placements(url_filenames, dest_dir, cache_dir, overwrite=False)
+
+    # All collisions are reported at once
+    assert "reads.fastq" in str(ex.value)
+    assert "exists.txt" in str(ex.value)
+    assert "fine.txt" not in str(ex.value)
+
+    # Existing files are only collisions if we won't overwrite them
+    del url_filenames["http://example.com/b/reads.fastq"]
+    assert len(plan_cache_placements(url_filenames, dest_dir, cache_dir)) == 3
+
+
+@pytest.mark.parametrize("method", ["symlink", "hardlink", "copy"])
+def test_place_from_cache_overwrites(cache_dir, dest_dir, cached_urls, method):
+    # Re-running a download into the same directory replaces what's there,
+    # whichever way it was placed the first time
+    for first_method in ("symlink", "copy", method):
+        place_from_cache(
+            plan_cache_placements(cached_urls, dest_dir, cache_dir, method=first_method)
+        )
+
+    assert len(os.listdir(dest_dir)) == N_FILES
+    for url, filename in cached_urls.items():
+        path = os.path.join(dest_dir, filename)
+        assert os.path.islink(path) == (method == "symlink")
+        with open(path, "rb") as f:
+            assert f.read() == f"{url}\n".encode()
+        with open(get_url_cached_path(url, cache_dir), "rb") as f:
+            assert f.read() == f"{url}\n".encode()
+
+
+@pytest.mark.parametrize("method", ["symlink", "hardlink", "copy"])
+def test_place_from_cache_over_stale_files(cache_dir, dest_dir, cached_urls, method):
+    # Some destinations are stale files or dangling links, the rest are new
+    stale = list(cached_urls.values())[::2]
+    for i, filename in enumerate(stale):
+        path = os.path.join(dest_dir, filename)
+        if i % 2:
+            os.symlink(os.path.join(cache_dir, "gone"), path)
+        else:
+            Path(path).write_bytes(b"stale\n")
+
+    placements = plan_cache_placements(
+        cached_urls, dest_dir, cache_dir, method=method, overwrite=True
+    )
+    assert len(placements) == N_FILES
+    place_from_cache(placements)
+
+    assert len(os.listdir(dest_dir)) == N_FILES
+    for url, filename in cached_urls.items():
+        path = os.path.join(dest_dir, filename)
+        assert os.path.islink(path) == (method == "symlink")
+        with open(path, "rb") as f:
+            assert f.read() == f"{url}\n".encode()
+    assert not os.path.exists(os.path.join(cache_dir, "gone"))
+
+
+def test_plan_sanitize_renames(dest_dir):
+    Path(dest_dir, "my dir", "sub dir").mkdir(parents=True)
+    Path(dest_dir, "my dir", "sub dir", "a file.txt").touch()
+    Path(dest_dir, "my dir", "ok.txt").touch()
+    # Both sanitize to a_b.txt
+    Path(dest_dir, "a b.txt").write_text("spaces")
+    Path(dest_dir, "a_b.txt").write_text("underscore")
+
+    groups = plan_sanitize_renames(dest_dir, fix_root=False)
+
+    # Deepest renames come first
+    assert groups[0] == [
+        (
+            os.path.join(dest_dir, "my dir", "sub dir", "a file.txt"),
+            os.path.join(dest_dir, "my dir", "sub dir", "a_file.txt"),
+        )
+    ]
+    assert len(groups) == 3
+
+    recursively_sanitize_filenames(dest_dir, fix_root=False)
+
+    names = sorted(os.listdir(dest_dir))
+    assert "a_b.txt" in names and "my_dir" in names
+    # The clashing file was given a prefix rather than overwriting a_b.txt
+    assert Path(dest_dir, "a_b.txt").read_text() == "underscore"
+    (prefixed,) = [n for n in names if n.endswith("_a_b.txt")]
+    assert Path(dest_dir, prefixed).read_text() == "spaces"
+    assert Path(dest_dir, "my_dir", "sub_dir", "a_file.txt").exists()
+
+
+def _run_cached_download(cache_dir, dest_dir, urls, parallel):
+    """
+    Run laxydl download for URLs that are all in the cache, with each HEAD
+    request taking a little time, as it would against a real server.
+    """
+
+    def slow_head(url, **kwargs):
+        time.sleep(0.001)
+        cached = get_url_cached_path(url, cache_dir)
+        return mock.Mock(headers={"Content-Length": str(os.path.getsize(cached))})
+
+    def slow_request(method, url, **kwargs):
+        time.sleep(0.001)
+        cached = get_url_cached_path(url, cache_dir)
+        return mock.Mock(
+            ok=True,
+            status_code=200,
+            headers={"content-length": str(os.path.getsize(cached))},
+        )
+
+    argv = [
+        "laxydl",
+        "download",
+        "--no-aria2c",
+        "--no-progress",
+        "--cache-path",
+        cache_dir,
+        "--destination-path",
+        dest_dir,
+        "--parallel-downloads",
+        str(parallel),
+    ] + list(urls)
+    with mock.patch("sys.argv", argv), mock.patch(
+        "laxy_downloader.core.requests.head", slow_head
+    ), mock.patch("laxy_downloader.core.request_with_retries", slow_request):
+        find_filename_and_size_from_url.cache_clear()
+        start = time.monotonic()
+        cli_main()
+        return time.monotonic() - start
+
+
+def test_cache_hit_placement_is_concurrent(cache_dir, cached_urls):
+    cached_urls = dict(list(cached_urls.items())[:500])
+    with tempfile.TemporaryDirectory() as serial_dest, tempfile.TemporaryDirectory() as parallel_dest:
+        serial = _run_cached_download(cache_dir, serial_dest, cached_urls, 1)
+        parallel = _run_cached_download(cache_dir, parallel_dest, cached_urls, 16)
+
+        assert sorted(os.listdir(serial_dest)) == sorted(cached_urls.values())
+        assert sorted(os.listdir(parallel_dest)) == sorted(cached_urls.values())
+
+    assert parallel < serial / 2
@@ -0,0 +1,225 @@
+import os
+import tempfile
+import threading
+import time
+import http.server
+
+import pytest
+
+from ..core import download_concurrent, get_url_cached_path
+
+CHUNK = 16 * 1024
+
+
+class CappedHTTPHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves self.server.files with a simulated bandwidth cap, either per
+    connection or shared by every connection to the server.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        content = self.server.files[self.path]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+
+    def _throttle(self, n):
+        server = self.server
+        if server.shared_cap:
+            with server.lock:
+                now = time.monotonic()
+                send_at = max(now, server.next_send)
+                server.next_send = send_at + n / server.rate
+            time.sleep(max(0, send_at - now))
+        else:
+            time.sleep(n / server.rate)
+
+    def do_GET(self):
+        server = self.server
+        content = server.files[self.path]
+        with server.lock:
+            server.get_order.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            for i in range(0, len(content), CHUNK):
+                self._throttle(len(content[i : i + CHUNK]))
+                self.wfile.write(content[i : i + CHUNK])
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+def _start_server(files, rate, shared_cap=False):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), CappedHTTPHandler)
+    server.daemon_threads = True
+    server.files = files
+    server.rate = rate
+    server.shared_cap = shared_cap
+    server.lock = threading.Lock()
+    server.next_send = 0
+    server.active = 0
+    server.max_active = 0
+    server.get_order = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def _start(*args, **kwargs):
+        server = _start_server(*args, **kwargs)
+        started.append(server)
+        return server
+
+    yield _start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def cache_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+def _urls(server):
+    port = server.server_address[1]
+    return {
+        f"http://127.0.0.1:{port}{path}": len(content)
+        for path, content in server.files.items()
+    }
+
+
+def _check_cached(server, cache_dir):
+    for url in _urls(server):
+        path = url.split(str(server.server_address[1]), 1)[1]
+        with open(get_url_cached_path(url, cache_dir), "rb") as f:
+            assert f.read() == server.files[path]
+
+
+def test_per_host_limit_and_largest_first(servers, cache_dir):
+    sizes = [10, 300, 40, 200, 120, 80]
+    slow = servers(
+        {f"/slow_{i}.bin": os.urandom(kb * 1024) for i, kb in enumerate(sizes)},
+        rate=4 * 1024 * 1024,
+    )
+    fast = servers(
+        {f"/fast_{i}.bin": os.urandom(kb * 1024) for i, kb in enumerate(sizes)},
+        rate=32 * 1024 * 1024,
+    )
+    url_sizes = {**_urls(slow), **_urls(fast)}
+
+    download_concurrent(
+        list(url_sizes),
+        cache_dir,
+        concurrent_downloads=8,
+        per_host_connections=1,
+        adaptive=False,
+        sizes=url_sizes,
+    )
+
+    _check_cached(slow, cache_dir)
+    _check_cached(fast, cache_dir)
+    assert slow.max_active == 1
+    assert fast.max_active == 1
+    # One connection per host, so each host's files arrive largest first
+    for server, prefix in [(slow, "/slow"), (fast, "/fast")]:
+        order = [int(p.split("_")[1].split(".")[0]) for p in server.get_order]
+        assert [sizes[i] for i in order] == sorted(sizes, reverse=True)
+
+
+def test_adaptive_connections_follow_throughput(servers, cache_dir):
+    # Each connection is capped, so more connections means more throughput
+    per_connection = servers(
+        {f"/a_{i}.bin": os.urandom(256 * 1024) for i in range(24)},
+        rate=1024 * 1024,
+    )
+    # The whole host is capped, so extra connections don't help
+    shared = servers(
+        {f"/b_{i}.bin": os.urandom(256 * 1024) for i in range(12)},
+        rate=2 * 1024 * 1024,
+        shared_cap=True,
+    )
+    url_sizes = {**_urls(per_connection), **_urls(shared)}
+
+    download_concurrent(
+        list(url_sizes),
+        cache_dir,
+        concurrent_downloads=8,
+        per_host_connections=4,
+        adaptive=True,
+        sizes=url_sizes,
+        adapt_interval=0.3,
+    )
+
+    _check_cached(per_connection, cache_dir)
+    _check_cached(shared, cache_dir)
+    assert per_connection.max_active == 4
+    assert shared.max_active < 4
+
+
+def test_progress_reported_at_bounded_rate(servers, cache_dir):
+    server = servers(
+        {f"/c_{i}.bin": os.urandom(128 * 1024) for i in range(6)},
+        rate=1024 * 1024,
+    )
+    url_sizes = _urls(server)
+    reports = []
+
+    download_concurrent(
+        list(url_sizes),
+        cache_dir,
+        concurrent_downloads=2,
+        sizes=url_sizes,
+        progress_callback=lambda p: reports.append((time.monotonic(), p)),
+        progress_interval=0.1,
+    )
+
+    assert len(reports) >= 3
+    # The final report is extra, all the others are at least an interval apart
+    times = [t for t, _ in reports[:-1]]
+    assert all(b - a >= 0.1 for a, b in zip(times, times[1:]))
+    bytes_done = [p.bytes_done for _, p in reports]
+    assert bytes_done == sorted(bytes_done)
+
+    final = reports[-1][1]
+    assert final.bytes_done == final.bytes_total == sum(url_sizes.values())
+    assert final.files_done == final.files_total == 6
+
+
+def test_progress_not_double_counted_on_restart(servers, cache_dir):
+    # This server ignores Range requests, so every partial download already
+    # in the cache is discarded and restarted from the beginning
+    server = servers({f"/d_{i}.bin": os.urandom(64 * 1024) for i in range(4)}, rate=1e9)
+    url_sizes = _urls(server)
+    for url in url_sizes:
+        with open(f"{get_url_cached_path(url, cache_dir)}.part", "wb") as f:
+            f.write(b"x" * 1000)
+    reports = []
+
+    download_concurrent(
+        list(url_sizes),
+        cache_dir,
+        sizes=url_sizes,
+        progress_callback=reports.append,
+        progress_interval=0,
+    )
+
+    _check_cached(server, cache_dir)
+    total = sum(url_sizes.values())
+    assert all(p.bytes_done <= total for p in reports)
+    assert reports[-1].bytes_done == total
+    # Checking for locks held elsewhere doesn't leave lock files behind
+    assert not [f for f in os.listdir(cache_dir) if f.endswith(".lock")]
@@ -0,0 +1,83 @@
+"""
+The reference genome catalogue served by ReferenceGenomesView, serialised once
+(per process) rather than per request, since REFERENCE_GENOMES only changes on
+deploy.
+
+Each genome is rendered to JSON once, so a filtered catalogue (by organism or
+tag) is just the matching records joined together. Every payload has an ETag
+that is a hash of its content.
+"""
+
+import hashlib
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from rest_framework.renderers import JSONRenderer
+
+from laxy_genomes.data.genomes import reference_genomes_for_api
+from laxy_genomes.serializers import ReferenceGenomeSerializer
+
+
+def _normalise_organism(organism: str) -> str:
+    return organism.replace("_", " ").strip().lower()
+
+
+class GenomeCatalogue:
+    def __init__(self, genomes: List[dict]):
+        """
+        :param genomes: Genome records, as returned by reference_genomes_for_api.
+        :type genomes: List[dict]
+        """
+        renderer = JSONRenderer()
+        self._records: List[bytes] = [
+            renderer.render(ReferenceGenomeSerializer(genome).data)
+            for genome in genomes
+        ]
+        self._by_organism: Dict[str, List[int]] = defaultdict(list)
+        self._by_tag: Dict[str, set] = defaultdict(set)
+        for i, genome in enumerate(genomes):
+            organism = _normalise_organism(genome.get("organism") or "")
+            self._by_organism[organism].append(i)
+            for tag in genome.get("tags", None) or []:
+                self._by_tag[tag.lower()].add(i)
+
+        self.payload, self.etag = self._payload(range(len(self._records)))
+
+    def _payload(self, indices) -> Tuple[bytes, str]:
+        payload = b"[" + b",".join(self._records[i] for i in indices) + b"]"
+        return payload, f'"{hashlib.sha256(payload).hexdigest()[:32]}"'
+
+    def filtered(
+        self, organism: Optional[str] = None, tags: FrozenSet[str] = frozenset()
+    ) -> Tuple[bytes, str]:
+        """
+        The catalogue (as JSON) and its ETag, limited to genomes of `organism`
+        (eg 'Homo sapiens' or 'Homo_sapiens', case insensitive) with all of `tags`
+        (eg {'rnaseq'}).
+
+        :return: The JSON payload, and its (strong) ETag.
+        :rtype: Tuple[bytes, str]
+        """
+        if not organism and not tags:
+            return self.payload, self.etag
+        return self._filtered(
+            _normalise_organism(organism) if organism else None,
+            frozenset(tag.lower() for tag in tags),
+        )
+
+    @lru_cache(maxsize=256)
+    def _filtered(
+        self, organism: Optional[str], tags: FrozenSet[str]
+    ) -> Tuple[bytes, str]:
+        if organism is not None:
+            indices = self._by_organism.get(organism, [])
+        else:
+            indices = range(len(self._records))
+        for tag in tags:
+            tagged = self._by_tag.get(tag, set())
+            indices = [i for i in indices if i in tagged]
+        return self._payload(indices)
+
+
+GENOME_CATALOGUE = GenomeCatalogue(reference_genomes_for_api())
@@ -4,6 +4,7 @@ Tests for the ReferenceGenomesView API endpoint.
 These tests use SimpleTestCase to avoid database migrations.
 """
 
+import json
 import os
 import sys
 from unittest.mock import MagicMock, patch
@@ -108,19 +109,19 @@ class ReferenceGenomesViewTest(SimpleTestCase):
         """Test that the response is a list."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        self.assertIsInstance(response.data, list)
+        self.assertIsInstance(json.loads(response.content), list)
 
     def test_get_genomes_returns_all_reference_genomes(self):
         """Test that all genomes from REFERENCE_GENOMES are returned."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        self.assertEqual(len(response.data), len(REFERENCE_GENOMES))
+        self.assertEqual(len(json.loads(response.content)), len(REFERENCE_GENOMES))
 
     def test_get_genomes_has_required_fields(self):
         """Test that each genome has required id and organism fields."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        for genome in response.data:
+        for genome in json.loads(response.content):
             self.assertIn("id", genome)
             self.assertIn("organism", genome)
 
@@ -128,7 +129,7 @@ class ReferenceGenomesViewTest(SimpleTestCase):
         """Test that genome IDs follow the expected format."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        for genome in response.data:
+        for genome in json.loads(response.content):
             self.assertIn("/", genome["id"])
             parts = genome["id"].split("/")
             self.assertGreaterEqual(len(parts), 2)
@@ -137,7 +138,7 @@ class ReferenceGenomesViewTest(SimpleTestCase):
         """Test that organism is derived correctly from ID."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        for genome in response.data:
+        for genome in json.loads(response.content):
             expected_organism = genome["id"].split("/")[0].replace("_", " ")
             self.assertEqual(genome["organism"], expected_organism)
 
@@ -145,7 +146,7 @@ class ReferenceGenomesViewTest(SimpleTestCase):
         """Test that human reference genomes are included."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        human_ids = [g["id"] for g in response.data if "Homo_sapiens" in g["id"]]
+        human_ids = [g["id"] for g in json.loads(response.content) if "Homo_sapiens" in g["id"]]
         self.assertGreater(len(human_ids), 0)
         self.assertIn("Homo_sapiens/UCSC/hg38", human_ids)
         self.assertIn("Homo_sapiens/UCSC/hg19", human_ids)
@@ -154,7 +155,7 @@ class ReferenceGenomesViewTest(SimpleTestCase):
         """Test that mouse reference genomes are included."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        mouse_ids = [g["id"] for g in response.data if "Mus_musculus" in g["id"]]
+        mouse_ids = [g["id"] for g in json.loads(response.content) if "Mus_musculus" in g["id"]]
         self.assertGreater(len(mouse_ids), 0)
         self.assertIn("Mus_musculus/UCSC/mm10", mouse_ids)
 
@@ -163,7 +164,7 @@ class ReferenceGenomesViewTest(SimpleTestCase):
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
         yeast_ids = [
-            g["id"] for g in response.data if "Saccharomyces_cerevisiae" in g["id"]
+            g["id"] for g in json.loads(response.content) if "Saccharomyces_cerevisiae" in g["id"]
         ]
         self.assertGreater(len(yeast_ids), 0)
         self.assertIn("Saccharomyces_cerevisiae/Ensembl/R64-1-1", yeast_ids)
@@ -178,13 +179,68 @@ class ReferenceGenomesViewTest(SimpleTestCase):
         """Test that the response data matches the serializer format."""
         request = self.factory.get(GENOMES_API_PATH)
         response = self.view(request)
-        for genome_data in response.data:
+        for genome_data in json.loads(response.content):
             serializer = ReferenceGenomeSerializer(data=genome_data)
             self.assertTrue(
                 serializer.is_valid(),
                 f"Serializer error: {serializer.errors} for data: {genome_data}",
             )
 
+    def test_get_genomes_matches_serializer_output(self):
+        """Test that the precomputed catalogue matches serializing on each request."""
+        request = self.factory.get(GENOMES_API_PATH)
+        response = self.view(request)
+        expected = ReferenceGenomeSerializer(reference_genomes_for_api(), many=True)
+        self.assertEqual(
+            json.loads(response.content), json.loads(json.dumps(expected.data))
+        )
+
+    def test_get_genomes_is_cacheable(self):
+        """Test that responses have a strong ETag and long-lived cache headers."""
+        request = self.factory.get(GENOMES_API_PATH)
+        response = self.view(request)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("max-age=86400", response["Cache-Control"])
+
+    def test_get_genomes_not_modified(self):
+        """Test that a request with a current ETag gets an empty 304."""
+        etag = self.view(self.factory.get(GENOMES_API_PATH))["ETag"]
+        request = self.factory.get(GENOMES_API_PATH, HTTP_IF_NONE_MATCH=etag)
+        response = self.view(request)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        request = self.factory.get(GENOMES_API_PATH, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(self.view(request).status_code, status.HTTP_200_OK)
+
+    def test_get_genomes_filtered_by_organism(self):
+        """Test filtering by organism, with either spaces or underscores."""
+        all_etag = self.view(self.factory.get(GENOMES_API_PATH))["ETag"]
+        for organism in ["Mus musculus", "mus_musculus"]:
+            request = self.factory.get(GENOMES_API_PATH, {"organism": organism})
+            response = self.view(request)
+            genomes = json.loads(response.content)
+            self.assertGreater(len(genomes), 0)
+            self.assertTrue(all(g["organism"] == "Mus musculus" for g in genomes))
+            self.assertNotEqual(response["ETag"], all_etag)
+
+        request = self.factory.get(GENOMES_API_PATH, {"organism": "Unicorn"})
+        self.assertEqual(json.loads(self.view(request).content), [])
+
+    def test_get_genomes_filtered_by_tags(self):
+        """Test filtering by tags (eg pipeline compatibility)."""
+        tag_sets = [g.get("tags", []) for g in reference_genomes_for_api()]
+        tag = next(tag for tags in tag_sets for tag in tags)
+        request = self.factory.get(GENOMES_API_PATH, {"tags": tag})
+        genomes = json.loads(self.view(request).content)
+        self.assertEqual(len(genomes), sum(tag in tags for tags in tag_sets))
+        self.assertTrue(all(tag in g["tags"] for g in genomes))
+
+        request = self.factory.get(GENOMES_API_PATH, {"tags": f"{tag},no-such-tag"})
+        self.assertEqual(json.loads(self.view(request).content), [])
+
 
 class ReferenceGenomesForApiTest(SimpleTestCase):
     """Tests for reference_genomes_for_api() merged metadata."""
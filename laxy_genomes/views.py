@@ -1,17 +1,21 @@
 import logging
 
-from drf_spectacular.utils import extend_schema
-from rest_framework import status
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework.permissions import AllowAny
 from rest_framework.renderers import JSONRenderer
-from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from laxy_genomes.data.genomes import reference_genomes_for_api
+from laxy_genomes.catalogue import GENOME_CATALOGUE
 from laxy_genomes.serializers import ReferenceGenomeSerializer
 
 logger = logging.getLogger(__name__)
 
+# The catalogue only changes on deploy, and a changed catalogue has a new ETag
+GENOME_CATALOGUE_MAX_AGE = 24 * 60 * 60
+
 
 class ReferenceGenomesView(APIView):
     renderer_classes = (JSONRenderer,)
@@ -19,14 +23,42 @@ class ReferenceGenomesView(APIView):
     api_docs_visible_to = "public"
 
     @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "organism",
+                OpenApiTypes.STR,
+                description="Only genomes of this organism, eg 'Homo sapiens' "
+                "or 'Homo_sapiens' (case insensitive).",
+            ),
+            OpenApiParameter(
+                "tags",
+                OpenApiTypes.STR,
+                description="Only genomes with all of these (comma separated) "
+                "tags, eg 'rnaseq' for genomes compatible with that pipeline.",
+            ),
+        ],
         responses=ReferenceGenomeSerializer(many=True),
-        description="Returns a list of available reference genomes.",
+        description="Returns a list of available reference genomes. "
+        "Responses have an ETag, and a request with a matching If-None-Match "
+        "header gets a 304 Not Modified.",
     )
     def get(self, request, version=None):
         """
         Returns a list of available reference genomes.
-        The genomes are sourced from REFERENCE_GENOMES.
+        The genomes are sourced from REFERENCE_GENOMES, serialized once at import
+        time (see laxy_genomes.catalogue).
         """
-        genomes = reference_genomes_for_api()
-        serializer = ReferenceGenomeSerializer(genomes, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        organism = request.query_params.get("organism", None)
+        tags = frozenset(
+            tag.strip()
+            for tag in request.query_params.get("tags", "").split(",")
+            if tag.strip()
+        )
+        payload, etag = GENOME_CATALOGUE.filtered(organism=organism, tags=tags)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(payload, content_type="application/json")
+        response["ETag"] = etag
+        patch_cache_control(response, public=True, max_age=GENOME_CATALOGUE_MAX_AGE)
+        return response
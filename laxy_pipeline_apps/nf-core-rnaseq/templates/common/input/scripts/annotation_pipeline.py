@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Apply run_job.sh's custom-annotation fixes in one read and one write.
+
+For a custom reference, run_job.sh used to call three bash functions in
+turn, each running one script over the whole annotation and writing a new
+gzipped copy of it:
+
+    insert_missing_transcript    (GFF3 only)         -> re-detect
+    drop_biotype_features        (ANN_DROP_BIOTYPES) -> re-detect
+    filter_annotation_features   (ANN_PROKARYOTIC=yes)
+
+Each later step is configured from the ``detect_annotation_style.py`` run
+on the previous step's output, so for a large eukaryotic annotation this
+meant reading and writing it several times over. Here the same steps are
+chained as :class:`annotation_scan.AnnotationStage` filters: pre-scans
+(eg collecting the IDs a biotype drop removes) read the input through the
+stages before them, each re-detection reads only until the detector's
+decision settles, and the result is written once, to the file name the
+last step would have used. The output is byte-for-byte what the separate
+scripts produce (before gzip compression).
+
+Writes the final detection to ``--style-env`` (as
+``detect_annotation_style.py`` would have after the last re-detect) and
+``ANNOTATION_FILE`` plus any overrides the filter step makes to
+``--prepare-env``, for run_job.sh to source in that order.
+
+Uses Python 3.9+ standard library only.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import detect_annotation_style as das
+from annotation_scan import (
+    AnnotationStage,
+    chain_stages,
+    iter_feature_lines,
+    open_annotation_text,
+    prescan_stages,
+    run_stages,
+)
+from drop_biotype_features import DropBiotypeFeatures
+from filter_annotation_features import FilterAnnotationFeatures
+from insert_missing_transcript import InsertMissingTranscript
+
+logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+log = logging.getLogger(__name__)
+
+
+class StageFailed(Exception):
+    def __init__(self, stage: AnnotationStage, status: int):
+        super().__init__(f"{type(stage).__name__} failed with status {status}")
+        self.status = status
+
+
+def redetect(path: Path, stages: List[AnnotationStage]) -> das.Decision:
+    """What detect_annotation_style.py would decide for ``path`` rewritten
+    by ``stages``, without writing it out.
+
+    :raises StageFailed: if the last stage left nothing to detect and fails
+                         in its own right (eg a drop-list matching every
+                         gene), as its script did before the detector ran.
+    :raises ValueError: if detection fails.
+    """
+    prescan_stages(path, stages)
+    try:
+        with open_annotation_text(path) as fin:
+            return das.decide_from_lines(
+                iter_feature_lines(
+                    line.encode("utf-8") for line in chain_stages(fin, stages)
+                )
+            )
+    except ValueError:
+        # The stage only knows whether it failed after a complete pass.
+        with open_annotation_text(path) as fin:
+            for _ in chain_stages(fin, stages):
+                pass
+        status = stages[-1].report()
+        if status:
+            raise StageFailed(stages[-1], status)
+        raise
+
+
+def prepare(path: Path, style_env: Path, prepare_env: Path) -> int:
+    """Run the steps run_job.sh needs for ``path``, as configured by the
+    detection already in ``style_env``, and write the env files. Returns an
+    exit status."""
+    decision = das.read_env(style_env)
+    fmt, feature_type, group_attr, _, _, prokaryotic, _, _, drop_biotypes = decision
+
+    stages: List[AnnotationStage] = []
+    out_name: Optional[str] = None
+    redetected = False
+    env_lines: List[str] = []
+
+    if fmt == "gff3":
+        stages.append(InsertMissingTranscript(fmt))
+        out_name = "annotation.transcript_fixed.gff.gz"
+        decision = redetect(path, stages)
+        das.log_decision(decision)
+        redetected = True
+        fmt, feature_type, group_attr, _, _, prokaryotic, _, _, drop_biotypes = decision
+
+    if drop_biotypes and fmt:
+        drop_set = {b.strip() for b in drop_biotypes.split(",") if b.strip()}
+        stages.append(DropBiotypeFeatures(fmt, drop_set, path))
+        ext = "gff" if fmt == "gff3" else "gtf"
+        out_name = f"annotation.biotype_filtered.{ext}.gz"
+        decision = redetect(path, stages)
+        das.log_decision(decision)
+        redetected = True
+        fmt, feature_type, group_attr, _, _, prokaryotic, _, _, drop_biotypes = decision
+
+    if prokaryotic == "yes" and feature_type and fmt:
+        stages.append(
+            FilterAnnotationFeatures(
+                feature_type,
+                fmt,
+                path,
+                prokaryotic=prokaryotic,
+                group_feature=group_attr,
+            )
+        )
+        out_name = "annotation.filtered.gtf.gz"
+        # The synthesised GTF uses standard GTF attribute names regardless of
+        # what detect_annotation_style.py picked from the original GFF3.
+        env_lines += [
+            "export ANN_FORMAT='gtf'",
+            "export ANN_GROUP_FEATURES='gene_id'",
+            "export ANN_BIOTYPE_ATTR='gene_biotype'",
+        ]
+
+    if out_name is not None:
+        output = path.parent / out_name
+        run_stages(path, output, stages)
+        for stage in stages:
+            status = stage.report()
+            if status:
+                return status
+        env_lines.insert(
+            0, f"export ANNOTATION_FILE={das.shell_quote_single(str(output))}"
+        )
+
+    if redetected:
+        with style_env.open("w", encoding="utf-8") as fp:
+            das.emit_env(fp, *decision)
+    with prepare_env.open("w", encoding="utf-8") as fp:
+        fp.writelines(line + "\n" for line in env_lines)
+    return 0
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    p.add_argument("--input", type=Path, required=True,
+                   help="Input annotation (GTF or GFF3, plain or .gz).")
+    p.add_argument("--style-env", type=Path, required=True,
+                   help="annotation_style.env from detect_annotation_style.py "
+                        "on --input; rewritten if any step re-detects.")
+    p.add_argument("--prepare-env", type=Path, required=True,
+                   help="Env file to write ANNOTATION_FILE and any overrides to.")
+    args = p.parse_args()
+
+    if not args.input.is_file():
+        log.error("Input does not exist or is not a file: %s", args.input)
+        return 1
+
+    try:
+        return prepare(args.input, args.style_env, args.prepare_env)
+    except StageFailed as e:
+        return e.status
+    except ValueError as e:
+        log.error("%s", e)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,613 @@
+"""Shared GTF/GFF3 reading and scanning helpers for the annotation scripts.
+
+``detect_annotation_style.py`` and the filter/repair scripts all start the
+same way: open a possibly-gzipped annotation, skip comments and any
+``##FASTA`` section, split the 9-column feature rows and pick apart column 9.
+This module does that once, and does it cheaply:
+
+* gzipped input larger than a few MB is decompressed by an external
+  ``pigz -dc`` (or ``gzip -dc``) process when there's more than one CPU, so
+  decompression runs on another core alongside parsing;
+* rows are handled as bytes and only the columns a caller asks for are
+  decoded;
+* a scan can be stopped early by a caller-supplied ``settled`` check;
+* the resulting :class:`AnnotationSummary` can be cached on disk keyed by the
+  file's SHA-256, so re-running on the same annotation (eg a later job using
+  the same custom genome) doesn't parse it again.
+
+The rewrite scripts (insert_missing_transcript.py, drop_biotype_features.py,
+filter_annotation_features.py, propagate_biotype_to_features.py) are each an
+:class:`AnnotationStage`, so ``annotation_pipeline.py`` can chain several of
+them over one read and one write of the annotation.
+
+Uses Python 3.9+ standard library only.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    IO,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
+
+log = logging.getLogger(__name__)
+
+FormatKind = Literal["gtf", "gff3"]
+
+MAX_FEATURE_LINES = 200_000
+
+# Lines longer than this (eg an embedded sequence that lost its newlines) are
+# skipped rather than decoded.
+MAX_LINE_BYTES = 10 * 1024 * 1024
+
+# Spawning a decompressor costs a few milliseconds, more than the gzip module
+# needs for a small file, so only bother for compressed files at least this big.
+EXTERNAL_GUNZIP_MIN_BYTES = 4 * 1024 * 1024
+
+READ_BUFFER_BYTES = 1024 * 1024
+
+# Bump when the summary fields or how they're collected change, so stale
+# cache entries are ignored rather than misread.
+SUMMARY_VERSION = 1
+
+_BIOTYPE_ATTR_CANDIDATES: Tuple[str, ...] = ("gene_biotype", "gene_type", "biotype")
+
+ALL_COLUMNS: Tuple[int, ...] = tuple(range(9))
+
+
+def is_gzipped(path: Path) -> bool:
+    try:
+        with path.open("rb") as fp:
+            return fp.read(2) == b"\x1f\x8b"
+    except OSError:
+        return path.suffix == ".gz"
+
+
+def external_gunzip_command() -> Optional[List[str]]:
+    """The best available external decompressor, or None.
+
+    ``pigz`` decompresses on one thread but reads, writes and checksums on
+    others, so it's noticeably quicker than ``gzip``; either is quicker than
+    decompressing in-process while we're also busy parsing.
+    """
+    for name in ("pigz", "gzip"):
+        exe = shutil.which(name)
+        if exe:
+            return [exe, "-dc"]
+    return None
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class _DecompressorPipe(io.RawIOBase):
+    """Read the stdout of an external decompressor as a raw binary stream.
+
+    If the caller stops reading early the process is killed on close;
+    if it read to the end, a non-zero exit (eg a truncated or corrupt file)
+    is raised as an OSError, as the gzip module would.
+    """
+
+    def __init__(self, argv: List[str], path: Path):
+        super().__init__()
+        self._argv = argv
+        self._path = path
+        self._proc = subprocess.Popen(
+            argv + [str(path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+        )
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = cast(io.RawIOBase, self._proc.stdout).readinto(buffer) or 0
+        if n == 0 and len(buffer):
+            self._eof = True
+        return n
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        proc = self._proc
+        try:
+            if not self._eof:
+                proc.kill()
+            cast(BinaryIO, proc.stdout).close()
+            stderr = cast(BinaryIO, proc.stderr).read()
+            cast(BinaryIO, proc.stderr).close()
+            rc = proc.wait()
+        finally:
+            super().close()
+        # gzip exits with 2 for warnings such as trailing garbage, which
+        # the gzip module ignores too.
+        if self._eof and rc not in (0, 2):
+            raise OSError(
+                f"{Path(self._argv[0]).name} failed to decompress {self._path} "
+                f"(exit {rc}): {stderr.decode('utf-8', errors='replace').strip()}"
+            )
+
+
+def open_annotation(path: Path, external: Optional[bool] = None) -> BinaryIO:
+    """Open ``path`` for binary reading, decompressing if it really is gzipped.
+
+    Trusts the file's magic bytes rather than its extension: many GFF/GTF files
+    in the wild are named ``.gz`` but are actually plain text, and (less often)
+    the reverse. We only fall back to the extension when we couldn't peek.
+
+    :param external: Decompress with an external ``pigz``/``gzip`` process.
+                     None (the default) does so for gzipped files of at least
+                     EXTERNAL_GUNZIP_MIN_BYTES when one is installed and
+                     there's a spare CPU for it to run on.
+    """
+    try:
+        with path.open("rb") as fp:
+            magic = fp.read(2)
+    except OSError:
+        magic = b""
+
+    if magic:
+        gzipped = magic == b"\x1f\x8b"
+    else:
+        gzipped = path.suffix == ".gz" or str(path).endswith(".gz")
+
+    if not gzipped:
+        return cast(BinaryIO, path.open("rb", buffering=READ_BUFFER_BYTES))
+
+    argv = None
+    if external is None:
+        try:
+            external = (
+                path.stat().st_size >= EXTERNAL_GUNZIP_MIN_BYTES
+                and available_cpus() > 1
+            )
+        except OSError:
+            external = False
+    if external:
+        argv = external_gunzip_command()
+    # GzipFile.readline is pure Python; a BufferedReader on top splits lines
+    # in C from large decompressed chunks.
+    raw = _DecompressorPipe(argv, path) if argv else gzip.open(path, "rb")
+    return cast(
+        BinaryIO,
+        io.BufferedReader(cast(io.RawIOBase, raw), buffer_size=READ_BUFFER_BYTES),
+    )
+
+
+def iter_feature_lines(raw: BinaryIO) -> Iterator[bytes]:
+    """Yield each non-comment, non-blank line before any ##FASTA section,
+    with the line ending removed."""
+    for raw_line in raw:
+        if len(raw_line) > MAX_LINE_BYTES:
+            continue
+        if raw_line.startswith(b"#"):
+            if raw_line.startswith(b"##FASTA"):
+                return
+            continue
+        line = raw_line.rstrip(b"\n\r")
+        if not line.strip():
+            continue
+        yield line
+
+
+def split_columns(
+    line: bytes, columns: Sequence[int] = ALL_COLUMNS
+) -> Optional[Tuple[str, ...]]:
+    """Return the requested columns of a 9-column feature row, decoded.
+
+    Returns None for rows that don't have exactly nine tab-separated columns.
+    Columns that aren't asked for are never decoded.
+    """
+    if line.count(b"\t") != 8:
+        return None
+    parts = line.split(b"\t")
+    return tuple(parts[i].decode("utf-8", errors="replace") for i in columns)
+
+
+_ATTR_QUOTED_RE = re.compile(r'([\w.:-]+)\s+"([^"]*)"')
+
+
+def sniff_format(attr: str) -> Optional[FormatKind]:
+    """Return gtf vs gff3 from the attributes column, or None if unclear."""
+    s = attr.lstrip()
+    # GFF3: starts with key=value
+    if re.match(r'^\w[\w.:-]*=', s):
+        return "gff3"
+    # GTF: starts with key "value"
+    if re.match(r'^\w[\w.:-]*\s+"', s):
+        return "gtf"
+    # Looser fallbacks
+    if "=" in s and '"' not in s:
+        return "gff3"
+    if ';' in s and '"' in s:
+        return "gtf"
+    return None
+
+
+def parse_gtf_attributes(attr: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    # Standard GTF: key "value"
+    for k, v in _ATTR_QUOTED_RE.findall(attr):
+        if k not in out:
+            out[k] = v
+    # Tolerant: also accept key="value" or key=value within the same column.
+    if "=" in attr:
+        for part in attr.split(";"):
+            part = part.strip()
+            if "=" not in part:
+                continue
+            k, _, v = part.partition("=")
+            k = k.strip()
+            v = v.strip().strip('"').strip()
+            if k:
+                out.setdefault(k, v)
+    return out
+
+
+def parse_gff3_attributes(attr: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for part in attr.strip().split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        if "=" in part:
+            key, val = part.split("=", 1)
+            out.setdefault(key.strip(), val.strip().strip('"').strip())
+    # Tolerant: also harvest GTF-style key "value" pairs.
+    if '"' in attr:
+        for k, v in _ATTR_QUOTED_RE.findall(attr):
+            if k not in out:
+                out[k] = v
+    return out
+
+
+def parse_attributes(attr: str, fmt: FormatKind) -> Dict[str, str]:
+    if fmt == "gtf":
+        return parse_gtf_attributes(attr)
+    return parse_gff3_attributes(attr)
+
+
+def biotype_value(attrs: Dict[str, str]) -> Optional[str]:
+    for cand in _BIOTYPE_ATTR_CANDIDATES:
+        v = attrs.get(cand)
+        if v:
+            return v
+    return None
+
+
+@dataclass
+class AnnotationSummary:
+    """What a scan learnt about an annotation: its format, how many rows of
+    each feature type it has, which attribute keys each type carries and
+    which biotype values occur.
+
+    ``complete`` is False when the scan stopped before the end of the file
+    (the line cap, or a ``settled`` check), in which case the counts are for
+    the first ``feature_lines`` rows only.
+    """
+
+    fmt: FormatKind
+    ft_counts: Dict[str, int] = field(default_factory=dict)
+    ft_keys: Dict[str, Set[str]] = field(default_factory=dict)
+    biotype_values: Set[str] = field(default_factory=set)
+    feature_lines: int = 0
+    # The feature line at which a feature type, attribute key or biotype
+    # value was last seen for the first time.
+    last_new_fact_line: int = 0
+    complete: bool = True
+
+    def to_json(self) -> dict:
+        return {
+            "version": SUMMARY_VERSION,
+            "fmt": self.fmt,
+            "ft_counts": self.ft_counts,
+            "ft_keys": {ft: sorted(keys) for ft, keys in self.ft_keys.items()},
+            "biotype_values": sorted(self.biotype_values),
+            "feature_lines": self.feature_lines,
+            "last_new_fact_line": self.last_new_fact_line,
+            "complete": self.complete,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "AnnotationSummary":
+        if data.get("version") != SUMMARY_VERSION:
+            raise ValueError(f"Unsupported summary version {data.get('version')!r}")
+        return cls(
+            fmt=data["fmt"],
+            ft_counts={ft: int(n) for ft, n in data["ft_counts"].items()},
+            ft_keys={ft: set(keys) for ft, keys in data["ft_keys"].items()},
+            biotype_values=set(data["biotype_values"]),
+            feature_lines=int(data["feature_lines"]),
+            last_new_fact_line=int(data["last_new_fact_line"]),
+            complete=bool(data["complete"]),
+        )
+
+
+def scan_annotation(
+    path: Path,
+    max_feature_lines: int = MAX_FEATURE_LINES,
+    settled: Optional[Callable[[AnnotationSummary], bool]] = None,
+    check_every: int = 10_000,
+    external: Optional[bool] = None,
+) -> AnnotationSummary:
+    """Summarise the first ``max_feature_lines`` feature lines of ``path``.
+
+    See :func:`summarise_lines`; reading stops as soon as the summary does.
+    """
+    with open_annotation(path, external=external) as raw:
+        return summarise_lines(
+            iter_feature_lines(raw),
+            max_feature_lines=max_feature_lines,
+            settled=settled,
+            check_every=check_every,
+        )
+
+
+def summarise_lines(
+    lines: Iterable[bytes],
+    max_feature_lines: int = MAX_FEATURE_LINES,
+    settled: Optional[Callable[[AnnotationSummary], bool]] = None,
+    check_every: int = 10_000,
+) -> AnnotationSummary:
+    """Summarise the first ``max_feature_lines`` of ``lines``, as yielded by
+    :func:`iter_feature_lines`.
+
+    Only columns 3 and 9 of each row are decoded. Every ``check_every``
+    feature lines the partial summary is passed to ``settled``; if it returns
+    True the scan stops there.
+
+    :raises ValueError: if the format can't be detected or there are no
+                        feature rows at all.
+    """
+    ft_counts: Dict[str, int] = defaultdict(int)
+    ft_keys: Dict[str, Set[str]] = defaultdict(set)
+    biotype_values: Set[str] = set()
+    summary = AnnotationSummary(fmt="gtf")
+
+    fmt_resolved: Optional[FormatKind] = None
+    n_lines = 0
+    last_new_fact = 0
+    pending_attrs: List[Tuple[str, str]] = []
+    complete = True
+
+    def _record(ft: str, attrs: Dict[str, str]) -> None:
+        nonlocal last_new_fact
+        ft_counts[ft] += 1
+        keys = ft_keys[ft]
+        if not keys.issuperset(attrs):
+            keys.update(attrs)
+            last_new_fact = n_lines
+        for cand in _BIOTYPE_ATTR_CANDIDATES:
+            bt = attrs.get(cand)
+            if bt:
+                if bt not in biotype_values:
+                    biotype_values.add(bt)
+                    last_new_fact = n_lines
+                break
+
+    def _summary() -> AnnotationSummary:
+        summary.fmt = cast(FormatKind, fmt_resolved)
+        summary.ft_counts = dict(ft_counts)
+        summary.ft_keys = dict(ft_keys)
+        summary.biotype_values = biotype_values
+        summary.feature_lines = n_lines
+        summary.last_new_fact_line = last_new_fact
+        summary.complete = complete
+        return summary
+
+    for line in lines:
+        if n_lines >= max_feature_lines:
+            complete = False
+            break
+        if (
+            settled is not None
+            and fmt_resolved is not None
+            and n_lines % check_every == 0
+            and settled(_summary())
+        ):
+            complete = False
+            break
+        n_lines += 1
+        # split_columns, inlined: this loop is the hot path.
+        if line.count(b"\t") != 8:
+            continue
+        parts = line.split(b"\t")
+        feature_type = parts[2].decode("utf-8", errors="replace")
+        attr_col = parts[8].decode("utf-8", errors="replace")
+        if fmt_resolved is None:
+            fmt_resolved = sniff_format(attr_col)
+            if fmt_resolved is None:
+                pending_attrs.append((feature_type, attr_col))
+                if len(pending_attrs) > 50:
+                    text = line[:200].decode("utf-8", errors="replace")
+                    raise ValueError(
+                        "Could not detect GTF vs GFF3 from attributes column "
+                        f"(first ambiguous line: {text!r}...)"
+                    )
+                continue
+            for ft, ac in pending_attrs:
+                _record(ft, parse_attributes(ac, fmt_resolved))
+            pending_attrs = []
+        _record(feature_type, parse_attributes(attr_col, fmt_resolved))
+
+    if fmt_resolved is None:
+        raise ValueError("No valid annotation feature rows found (empty file?)")
+
+    return _summary()
+
+
+def file_checksum(path: Path) -> str:
+    """SHA-256 of the file as stored (compressed or not)."""
+    digest = hashlib.sha256()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(READ_BUFFER_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_file(cache_dir: Path, checksum: str, variant: str) -> Path:
+    return cache_dir / f"{checksum}.{variant}.json"
+
+
+def load_cached_summary(
+    cache_dir: Path, checksum: str, variant: str
+) -> Optional[AnnotationSummary]:
+    try:
+        with _cache_file(cache_dir, checksum, variant).open("r", encoding="utf-8") as fp:
+            return AnnotationSummary.from_json(json.load(fp))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.debug("Ignoring unreadable annotation summary cache entry: %s", e)
+        return None
+
+
+def store_cached_summary(
+    cache_dir: Path, checksum: str, variant: str, summary: AnnotationSummary
+) -> None:
+    """Write the summary atomically, so concurrent jobs never see half a file.
+    Failing to write the cache is logged, not raised."""
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".summary-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump(summary.to_json(), fp)
+            os.replace(tmp, _cache_file(cache_dir, checksum, variant))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError as e:
+        log.warning("Could not write annotation summary cache in %s: %s", cache_dir, e)
+
+
+def cached_scan(
+    path: Path,
+    cache_dir: Optional[Path],
+    variant: str,
+    scan: Callable[[Path], AnnotationSummary],
+) -> AnnotationSummary:
+    """Return the cached summary for ``path``, or ``scan(path)`` and cache it.
+
+    Entries are keyed by the file's checksum, so a renamed or copied
+    annotation still hits and a modified one never does. ``variant`` names
+    the kind of scan (line cap, early stopping rule, ...) since different
+    callers may summarise the same file differently.
+    """
+    if cache_dir is None:
+        return scan(path)
+
+    checksum = file_checksum(path)
+    summary = load_cached_summary(cache_dir, checksum, variant)
+    if summary is not None:
+        log.debug("Using cached annotation summary for %s (%s)", path, checksum)
+        return summary
+
+    summary = scan(path)
+    store_cached_summary(cache_dir, checksum, variant, summary)
+    return summary
+
+
+def open_annotation_text(path: Path, external: Optional[bool] = None) -> IO[str]:
+    """Open ``path`` for reading as text, as the rewrite scripts always have:
+    UTF-8 with undecodable bytes replaced, and universal newlines."""
+    return io.TextIOWrapper(
+        open_annotation(path, external=external), encoding="utf-8", errors="replace"
+    )
+
+
+def open_text_write(path: Path) -> IO[str]:
+    if path.suffix == ".gz" or str(path).endswith(".gz"):
+        return cast(IO[str], gzip.open(path, "wt", encoding="utf-8"))
+    return open(path, "wt", encoding="utf-8")
+
+
+class AnnotationStage:
+    """One rewrite of an annotation, as a filter over its text lines.
+
+    Stages are chained so a single read of the input and a single write of
+    the output apply several rewrites (see :func:`run_stages`). A stage that
+    needs to see the whole annotation before it can rewrite any of it (eg to
+    find every ID a row's ``Parent=`` might point at) sets ``needs_prescan``
+    and gathers what it needs in :meth:`prescan`, which is given the input
+    as rewritten by the stages before it. Anything :meth:`transform` counts
+    is kept per run, so it can be run more than once (eg while a later
+    stage pre-scans).
+    """
+
+    needs_prescan = False
+
+    def prescan(self, lines: Iterable[str]) -> None:
+        """Gather what :meth:`transform` needs. If ``needs_prescan`` is still
+        True afterwards, another pass is made."""
+
+    def transform(self, lines: Iterable[str]) -> Iterator[str]:
+        raise NotImplementedError
+
+    def report(self) -> int:
+        """Log what the last complete :meth:`transform` did and return the
+        exit status the stage's own script would."""
+        return 0
+
+
+def chain_stages(lines: Iterable[str], stages: Sequence[AnnotationStage]) -> Iterable[str]:
+    for stage in stages:
+        lines = stage.transform(lines)
+    return lines
+
+
+def prescan_stages(
+    path: Path, stages: Sequence[AnnotationStage], external: Optional[bool] = None
+) -> None:
+    """Run every pre-scan the stages need, each on the input as rewritten by
+    the stages before it."""
+    for i, stage in enumerate(stages):
+        while stage.needs_prescan:
+            with open_annotation_text(path, external=external) as fin:
+                stage.prescan(chain_stages(fin, stages[:i]))
+
+
+def run_stages(
+    path: Path,
+    output: Path,
+    stages: Sequence[AnnotationStage],
+    external: Optional[bool] = None,
+) -> None:
+    """Rewrite ``path`` through ``stages`` into ``output``, with one read of
+    the input (plus any pre-scans) and one write."""
+    prescan_stages(path, stages, external=external)
+    with open_annotation_text(path, external=external) as fin, open_text_write(
+        output
+    ) as fout:
+        fout.writelines(chain_stages(fin, stages))
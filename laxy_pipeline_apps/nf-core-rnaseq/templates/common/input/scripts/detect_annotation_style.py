@@ -4,130 +4,52 @@
 Reads up to a capped number of feature lines, detects attribute conventions,
 and emits a shell-sourceable env file for run_job.sh.
 
+Scanning stops early once the decision has settled (see
+EARLY_STOP_STABLE_LINES), and the scan summary is cached by file checksum
+in ``--summary-cache`` (default ``$ANNOTATION_SUMMARY_CACHE_PATH``) so a
+rerun on the same annotation skips parsing entirely.
+
 Uses Python 3.9+ standard library only.
 """
 
 from __future__ import annotations
 
 import argparse
-import gzip
 import logging
-import re
+import os
+import shlex
 import sys
-from collections import defaultdict
 from pathlib import Path
-from typing import BinaryIO, Dict, Iterator, Literal, Optional, Set, Tuple, cast
-
-MAX_FEATURE_LINES = 200_000
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple, cast
+
+from annotation_scan import (
+    MAX_FEATURE_LINES,
+    AnnotationSummary,
+    FormatKind,
+    cached_scan,
+    scan_annotation,
+    summarise_lines,
+)
 
-FormatKind = Literal["gtf", "gff3"]
+# Stop scanning once this many feature lines have gone by without a new
+# feature type, attribute key or biotype value turning up, and without the
+# decision changing. Real annotations repeat the same few attribute layouts
+# for every gene, so by then the rest of the capped sample wouldn't change
+# the outcome.
+EARLY_STOP_STABLE_LINES = 50_000
+EARLY_STOP_CHECK_EVERY = 10_000
+
+# Names the kind of scan in the summary cache: a different cap or stopping
+# rule gives a different summary of the same file.
+SUMMARY_VARIANT = (
+    f"detect-max{MAX_FEATURE_LINES}-stable{EARLY_STOP_STABLE_LINES}"
+    f"-every{EARLY_STOP_CHECK_EVERY}"
+)
 
 logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
 log = logging.getLogger(__name__)
 
 
-def open_maybe_gzip(path: Path) -> BinaryIO:
-    """Open ``path`` for binary reading, decompressing if it really is gzipped.
-
-    Trusts the file's magic bytes rather than its extension: many GFF/GTF files
-    in the wild are named ``.gz`` but are actually plain text, and (less often)
-    the reverse. We only fall back to the extension when we couldn't peek.
-    """
-    try:
-        with path.open("rb") as fp:
-            magic = fp.read(2)
-    except OSError:
-        magic = b""
-
-    if magic == b"\x1f\x8b":
-        return cast(BinaryIO, gzip.open(path, "rb"))
-
-    if magic:
-        return path.open("rb")
-
-    if path.suffix == ".gz" or str(path).endswith(".gz"):
-        return cast(BinaryIO, gzip.open(path, "rb"))
-    return path.open("rb")
-
-
-def iter_feature_lines(raw: BinaryIO) -> Iterator[str]:
-    in_fasta = False
-    for raw_line in raw:
-        if len(raw_line) > 10 * 1024 * 1024:
-            continue
-        try:
-            line = raw_line.decode("utf-8", errors="replace")
-        except UnicodeDecodeError:
-            line = raw_line.decode("latin-1", errors="replace")
-        if in_fasta:
-            continue
-        if line.startswith("##FASTA"):
-            in_fasta = True
-            continue
-        if line.startswith("#"):
-            continue
-        line = line.rstrip("\n\r")
-        if not line.strip():
-            continue
-        yield line
-
-
-def sniff_format(attr: str) -> Optional[FormatKind]:
-    """Return gtf vs gff3 from the attributes column, or None if unclear."""
-    s = attr.lstrip()
-    # GFF3: starts with key=value
-    if re.match(r'^\w[\w.:-]*=', s):
-        return "gff3"
-    # GTF: starts with key "value"
-    if re.match(r'^\w[\w.:-]*\s+"', s):
-        return "gtf"
-    # Looser fallbacks
-    if "=" in s and '"' not in s:
-        return "gff3"
-    if ';' in s and '"' in s:
-        return "gtf"
-    return None
-
-
-def parse_gtf_attributes(attr: str) -> Dict[str, str]:
-    out: Dict[str, str] = {}
-    # Standard GTF: key "value"
-    for m in re.finditer(r'([\w.:-]+)\s+"([^"]*)"', attr):
-        out.setdefault(m.group(1), m.group(2))
-    # Tolerant: also accept key="value" or key=value within the same column.
-    for part in attr.split(";"):
-        part = part.strip()
-        if "=" not in part:
-            continue
-        k, _, v = part.partition("=")
-        k = k.strip()
-        v = v.strip().strip('"').strip()
-        if k:
-            out.setdefault(k, v)
-    return out
-
-
-def parse_gff3_attributes(attr: str) -> Dict[str, str]:
-    out: Dict[str, str] = {}
-    for part in attr.strip().split(";"):
-        part = part.strip()
-        if not part:
-            continue
-        if "=" in part:
-            key, val = part.split("=", 1)
-            out.setdefault(key.strip(), val.strip().strip('"').strip())
-    # Tolerant: also harvest GTF-style key "value" pairs.
-    for m in re.finditer(r'([\w.:-]+)\s+"([^"]*)"', attr):
-        out.setdefault(m.group(1), m.group(2))
-    return out
-
-
-def parse_attributes(attr: str, fmt: FormatKind) -> Dict[str, str]:
-    if fmt == "gtf":
-        return parse_gtf_attributes(attr)
-    return parse_gff3_attributes(attr)
-
-
 def first_present(keys: Set[str], candidates: Tuple[str, ...]) -> Optional[str]:
     for c in candidates:
         if c in keys:
@@ -135,66 +57,6 @@ def first_present(keys: Set[str], candidates: Tuple[str, ...]) -> Optional[str]:
     return None
 
 
-_BIOTYPE_ATTR_CANDIDATES: Tuple[str, ...] = ("gene_biotype", "gene_type", "biotype")
-
-
-def _biotype_value(attrs: Dict[str, str]) -> Optional[str]:
-    for cand in _BIOTYPE_ATTR_CANDIDATES:
-        v = attrs.get(cand)
-        if v:
-            return v
-    return None
-
-
-def scan_annotation(
-    path: Path,
-) -> Tuple[Dict[str, int], Dict[str, Set[str]], FormatKind, Set[str]]:
-    ft_counts: Dict[str, int] = defaultdict(int)
-    ft_keys: Dict[str, Set[str]] = defaultdict(set)
-    biotype_values: Set[str] = set()
-
-    fmt_resolved: Optional[FormatKind] = None
-    n_lines = 0
-    pending_attrs: list[Tuple[str, str]] = []
-
-    def _record(ft: str, attrs: Dict[str, str]) -> None:
-        ft_counts[ft] += 1
-        ft_keys[ft].update(attrs.keys())
-        bt = _biotype_value(attrs)
-        if bt:
-            biotype_values.add(bt)
-
-    with open_maybe_gzip(path) as raw:
-        for line in iter_feature_lines(raw):
-            n_lines += 1
-            if n_lines > MAX_FEATURE_LINES:
-                break
-            parts = line.split("\t")
-            if len(parts) != 9:
-                continue
-            feature_type = parts[2]
-            attr_col = parts[8]
-            if fmt_resolved is None:
-                fmt_resolved = sniff_format(attr_col)
-                if fmt_resolved is None:
-                    pending_attrs.append((feature_type, attr_col))
-                    if len(pending_attrs) > 50:
-                        raise ValueError(
-                            "Could not detect GTF vs GFF3 from attributes column "
-                            f"(first ambiguous line: {line[:200]!r}...)"
-                        )
-                    continue
-                for ft, ac in pending_attrs:
-                    _record(ft, parse_attributes(ac, fmt_resolved))
-                pending_attrs = []
-            _record(feature_type, parse_attributes(attr_col, fmt_resolved))
-
-    if fmt_resolved is None:
-        raise ValueError("No valid annotation feature rows found (empty file?)")
-
-    return dict(ft_counts), {k: v for k, v in ft_keys.items()}, fmt_resolved, biotype_values
-
-
 def build_extra_attributes(
     fmt: FormatKind, keys_on_features: Set[str], prokaryotic: bool = False
 ) -> str:
@@ -406,20 +268,72 @@ _STRUCTURAL_FEATURE_TYPES: frozenset[str] = frozenset((
 ))
 
 
+Decision = Tuple[str, str, str, str, str, str, str, str, str]
+
+
+def decision_settled(
+    stable_lines: int = EARLY_STOP_STABLE_LINES,
+) -> Callable[[AnnotationSummary], bool]:
+    """A ``settled`` check for scan_annotation: True once the decision has
+    been the same at consecutive checks and no new fact has turned up for
+    ``stable_lines`` feature lines."""
+    previous: list[Optional[Decision]] = [None]
+
+    def settled(summary: AnnotationSummary) -> bool:
+        try:
+            decision: Optional[Decision] = decide_from_summary(summary)
+        except ValueError:
+            decision = None
+        same = decision is not None and decision == previous[0]
+        previous[0] = decision
+        return same and (
+            summary.feature_lines - summary.last_new_fact_line >= stable_lines
+        )
+
+    return settled
+
+
+def scan_for_decision(path: Path, early_stop: bool = True) -> AnnotationSummary:
+    return scan_annotation(
+        path,
+        settled=decision_settled() if early_stop else None,
+        check_every=EARLY_STOP_CHECK_EVERY,
+    )
+
+
 def decide(
     path: Path,
-) -> Tuple[
-    str,
-    str,
-    str,
-    str,
-    str,
-    str,
-    str,
-    str,
-    str,
-]:
-    ft_counts, ft_keys, fmt, biotype_values = scan_annotation(path)
+    cache_dir: Optional[Path] = None,
+    early_stop: bool = True,
+) -> Decision:
+    if early_stop:
+        summary = cached_scan(path, cache_dir, SUMMARY_VARIANT, scan_for_decision)
+    else:
+        summary = cached_scan(
+            path,
+            cache_dir,
+            f"detect-max{MAX_FEATURE_LINES}",
+            lambda p: scan_for_decision(p, early_stop=False),
+        )
+    return decide_from_summary(summary)
+
+
+def decide_from_lines(lines: Iterable[bytes]) -> Decision:
+    """:func:`decide` for feature lines (as yielded by iter_feature_lines)
+    rather than a file, eg an annotation that's still being rewritten.
+    Stops consuming ``lines`` once the decision settles."""
+    return decide_from_summary(
+        summarise_lines(
+            lines, settled=decision_settled(), check_every=EARLY_STOP_CHECK_EVERY
+        )
+    )
+
+
+def decide_from_summary(summary: AnnotationSummary) -> Decision:
+    ft_counts = summary.ft_counts
+    ft_keys = summary.ft_keys
+    fmt = summary.fmt
+    biotype_values = summary.biotype_values
 
     is_prokaryotic_hint = _looks_prokaryotic(ft_counts, ft_keys)
     feature_type = choose_counting_feature(ft_counts, ft_keys, is_prokaryotic_hint)
@@ -574,6 +488,64 @@ def emit_env(
     fp.write(f"ANN_DROP_BIOTYPES={shell_quote_single(drop_biotypes)}\n")
 
 
+# The order emit_env writes them in, which is also the order of a Decision.
+ENV_KEYS = (
+    "ANN_FORMAT",
+    "ANN_FEATURE_TYPE",
+    "ANN_GROUP_FEATURES",
+    "ANN_EXTRA_ATTRIBUTES",
+    "ANN_BIOTYPE_ATTR",
+    "ANN_PROKARYOTIC",
+    "ANN_PROFILE",
+    "ANN_SKIP_FLAGS",
+    "ANN_DROP_BIOTYPES",
+)
+
+
+def read_env(path: Path) -> Decision:
+    """Read back the decision from an env file written by :func:`emit_env`.
+
+    :raises ValueError: if the file is missing a key.
+    """
+    values: Dict[str, str] = {}
+    with path.open("r", encoding="utf-8") as fp:
+        for line in fp:
+            key, sep, value = line.rstrip("\n").partition("=")
+            if sep:
+                values[key] = "".join(shlex.split(value))
+    missing = [k for k in ENV_KEYS if k not in values]
+    if missing:
+        raise ValueError(f"{path} is missing {', '.join(missing)}")
+    return cast(Decision, tuple(values[k] for k in ENV_KEYS))
+
+
+def log_decision(decision: Decision) -> None:
+    (
+        fmt,
+        feature_type,
+        group_attr,
+        extras,
+        biotype_out,
+        prokaryotic,
+        profile,
+        skip_str,
+        drop_biotypes,
+    ) = decision
+    log.info(
+        "annotation_style: profile=%s format=%s feature=%s group_by=%s "
+        "extras=%r biotype_attr=%r prokaryotic=%s skip=%r drop_biotypes=%r",
+        profile,
+        fmt,
+        feature_type,
+        group_attr,
+        extras,
+        biotype_out,
+        prokaryotic,
+        skip_str,
+        drop_biotypes,
+    )
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(
         description="Detect annotation style for nf-core/rnaseq (emit shell env)."
@@ -590,6 +562,20 @@ def main() -> int:
         default=None,
         help="Write env file here (default: stdout)",
     )
+    parser.add_argument(
+        "--summary-cache",
+        type=Path,
+        default=os.environ.get("ANNOTATION_SUMMARY_CACHE_PATH") or None,
+        help="Directory of scan summaries keyed by file checksum "
+        "(default: $ANNOTATION_SUMMARY_CACHE_PATH, unset disables caching)",
+    )
+    parser.add_argument(
+        "--no-early-stop",
+        dest="early_stop",
+        action="store_false",
+        help=f"Always scan the first {MAX_FEATURE_LINES} feature lines, even once "
+        "the decision has settled",
+    )
     args = parser.parse_args()
 
     path = args.annotation
@@ -598,43 +584,18 @@ def main() -> int:
         return 1
 
     try:
-        (
-            fmt,
-            feature_type,
-            group_attr,
-            extras,
-            biotype_out,
-            prokaryotic,
-            profile,
-            skip_str,
-            drop_biotypes,
-        ) = decide(path)
+        decision = decide(
+            path, cache_dir=args.summary_cache, early_stop=args.early_stop
+        )
     except ValueError as e:
         log.error("%s", e)
         return 1
 
-    summary = (
-        f"annotation_style: profile={profile} format={fmt} "
-        f"feature={feature_type} group_by={group_attr} extras={extras!r} "
-        f"biotype_attr={biotype_out!r} prokaryotic={prokaryotic} skip={skip_str!r} "
-        f"drop_biotypes={drop_biotypes!r}"
-    )
-    log.info("%s", summary)
+    log_decision(decision)
 
     out_fp = args.output.open("w", encoding="utf-8") if args.output else sys.stdout
     try:
-        emit_env(
-            out_fp,
-            fmt,
-            feature_type,
-            group_attr,
-            extras,
-            biotype_out,
-            prokaryotic,
-            profile,
-            skip_str,
-            drop_biotypes,
-        )
+        emit_env(out_fp, *decision)
     finally:
         if args.output:
             out_fp.close()
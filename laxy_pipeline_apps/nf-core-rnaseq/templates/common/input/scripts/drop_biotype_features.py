@@ -34,11 +34,12 @@ Uses Python 3.9+ standard library only.
 from __future__ import annotations
 
 import argparse
-import gzip
 import logging
 import sys
 from pathlib import Path
-from typing import IO, Dict, List, Optional, Set, cast
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from annotation_scan import AnnotationStage, run_stages
 
 logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
 log = logging.getLogger(__name__)
@@ -46,26 +47,6 @@ log = logging.getLogger(__name__)
 _BIOTYPE_ATTR_CANDIDATES = ("gene_biotype", "gene_type", "biotype")
 
 
-def is_gzipped(path: Path) -> bool:
-    try:
-        with path.open("rb") as fp:
-            return fp.read(2) == b"\x1f\x8b"
-    except OSError:
-        return path.suffix == ".gz"
-
-
-def open_text_read(path: Path) -> IO[str]:
-    if is_gzipped(path):
-        return cast(IO[str], gzip.open(path, "rt", encoding="utf-8", errors="replace"))
-    return open(path, "rt", encoding="utf-8", errors="replace")
-
-
-def open_text_write(path: Path) -> IO[str]:
-    if path.suffix == ".gz" or str(path).endswith(".gz"):
-        return cast(IO[str], gzip.open(path, "wt", encoding="utf-8"))
-    return open(path, "wt", encoding="utf-8")
-
-
 def parse_gff3_attrs(col9: str) -> Dict[str, str]:
     out: Dict[str, str] = {}
     for part in col9.strip().split(";"):
@@ -101,33 +82,32 @@ def biotype_value(attrs: Dict[str, str]) -> Optional[str]:
     return None
 
 
-def find_drop_ids_gff3(path: Path, drop_biotypes: Set[str]) -> Set[str]:
+def find_drop_ids_gff3(lines: Iterable[str], drop_biotypes: Set[str]) -> Set[str]:
     """Return the set of GFF3 row IDs to drop: biotype-matched rows plus
     every descendant reached by walking ``Parent=`` chains."""
     id_biotype: Dict[str, str] = {}
     id_parents: Dict[str, List[str]] = {}
 
-    with open_text_read(path) as fp:
-        in_fasta = False
-        for raw in fp:
-            if raw.startswith("##FASTA"):
-                in_fasta = True
-                continue
-            if in_fasta or raw.startswith("#") or not raw.strip():
-                continue
-            parts = raw.rstrip("\r\n").split("\t")
-            if len(parts) != 9:
-                continue
-            attrs = parse_gff3_attrs(parts[8])
-            row_id = attrs.get("ID")
-            if not row_id:
-                continue
-            bt = biotype_value(attrs)
-            if bt:
-                id_biotype[row_id] = bt
-            parent = attrs.get("Parent")
-            if parent:
-                id_parents[row_id] = [p.strip() for p in parent.split(",") if p.strip()]
+    in_fasta = False
+    for raw in lines:
+        if raw.startswith("##FASTA"):
+            in_fasta = True
+            continue
+        if in_fasta or raw.startswith("#") or not raw.strip():
+            continue
+        parts = raw.rstrip("\r\n").split("\t")
+        if len(parts) != 9:
+            continue
+        attrs = parse_gff3_attrs(parts[8])
+        row_id = attrs.get("ID")
+        if not row_id:
+            continue
+        bt = biotype_value(attrs)
+        if bt:
+            id_biotype[row_id] = bt
+        parent = attrs.get("Parent")
+        if parent:
+            id_parents[row_id] = [p.strip() for p in parent.split(",") if p.strip()]
 
     drop_ids: Set[str] = {rid for rid, bt in id_biotype.items() if bt in drop_biotypes}
     changed = True
@@ -142,54 +122,51 @@ def find_drop_ids_gff3(path: Path, drop_biotypes: Set[str]) -> Set[str]:
     return drop_ids
 
 
-def main() -> int:
-    p = argparse.ArgumentParser(description=__doc__)
-    p.add_argument("--input", type=Path, required=True,
-                   help="Input annotation (GTF or GFF3, plain or .gz).")
-    p.add_argument("--output", type=Path, required=True,
-                   help="Output path (same format as input).")
-    p.add_argument("--format", required=True, choices=("gtf", "gff3"),
-                   help="Matches detect_annotation_style.py ANN_FORMAT.")
-    p.add_argument("--drop-biotypes", default="",
-                   help="Comma-separated gene_biotype/gene_type/biotype "
-                        "values to remove (matches ANN_DROP_BIOTYPES).")
-    args = p.parse_args()
-
-    if not args.input.is_file():
-        log.error("Input does not exist or is not a file: %s", args.input)
-        return 1
-
-    drop_biotypes = {b.strip() for b in args.drop_biotypes.split(",") if b.strip()}
-    args.output.parent.mkdir(parents=True, exist_ok=True)
-
-    if not drop_biotypes:
-        log.info("annotation_drop_biotype: no drop_biotypes given, passing through unchanged")
-        with open_text_read(args.input) as fin, open_text_write(args.output) as fout:
-            for line in fin:
-                fout.write(line)
-        return 0
-
-    is_gff3 = args.format == "gff3"
-    drop_ids = find_drop_ids_gff3(args.input, drop_biotypes) if is_gff3 else set()
-
-    input_rows = 0
-    kept_rows = 0
-    dropped_rows = 0
-
-    with open_text_read(args.input) as fin, open_text_write(args.output) as fout:
+class DropBiotypeFeatures(AnnotationStage):
+    """Drop rows whose gene biotype is in ``drop_biotypes``.
+
+    For GFF3 the pre-scan collects which IDs to drop (see
+    :func:`find_drop_ids_gff3`); GTF rows are judged one at a time.
+    """
+
+    def __init__(self, fmt: str, drop_biotypes: Set[str], source: Path):
+        self.fmt = fmt
+        self.drop_biotypes = drop_biotypes
+        self.source = source
+        self.needs_prescan = fmt == "gff3" and bool(drop_biotypes)
+        self.drop_ids: Set[str] = set()
+        self.input_rows = 0
+        self.kept_rows = 0
+        self.dropped_rows = 0
+
+    def prescan(self, lines: Iterable[str]) -> None:
+        self.drop_ids = find_drop_ids_gff3(lines, self.drop_biotypes)
+        self.needs_prescan = False
+
+    def transform(self, lines: Iterable[str]) -> Iterator[str]:
+        if not self.drop_biotypes:
+            yield from lines
+            return
+
+        is_gff3 = self.fmt == "gff3"
+        drop_ids = self.drop_ids
+        drop_biotypes = self.drop_biotypes
+        input_rows = 0
+        kept_rows = 0
+        dropped_rows = 0
         in_fasta = False
-        for raw in fin:
+        for raw in lines:
             if raw.startswith("##FASTA"):
                 in_fasta = True
-                fout.write(raw)
+                yield raw
                 continue
             if in_fasta or raw.startswith("#") or not raw.strip():
-                fout.write(raw)
+                yield raw
                 continue
 
             parts = raw.rstrip("\r\n").split("\t")
             if len(parts) != 9:
-                fout.write(raw)
+                yield raw
                 continue
 
             input_rows += 1
@@ -205,23 +182,56 @@ def main() -> int:
                 dropped_rows += 1
                 continue
 
-            fout.write(raw)
+            yield raw
             kept_rows += 1
-
-    log.info(
-        "annotation_drop_biotype: format=%s drop_biotypes=%s "
-        "input_rows=%d kept_rows=%d dropped_rows=%d dropped_ids=%d",
-        args.format, ",".join(sorted(drop_biotypes)),
-        input_rows, kept_rows, dropped_rows, len(drop_ids),
-    )
-
-    if kept_rows == 0:
-        log.error(
-            "Dropping biotypes %s left no annotation rows in %s.",
-            ",".join(sorted(drop_biotypes)), args.input,
+        self.input_rows, self.kept_rows, self.dropped_rows = (
+            input_rows, kept_rows, dropped_rows)
+
+    def report(self) -> int:
+        if not self.drop_biotypes:
+            return 0
+        log.info(
+            "annotation_drop_biotype: format=%s drop_biotypes=%s "
+            "input_rows=%d kept_rows=%d dropped_rows=%d dropped_ids=%d",
+            self.fmt, ",".join(sorted(self.drop_biotypes)),
+            self.input_rows, self.kept_rows, self.dropped_rows, len(self.drop_ids),
         )
-        return 2
-    return 0
+
+        if self.kept_rows == 0:
+            log.error(
+                "Dropping biotypes %s left no annotation rows in %s.",
+                ",".join(sorted(self.drop_biotypes)), self.source,
+            )
+            return 2
+        return 0
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("--input", type=Path, required=True,
+                   help="Input annotation (GTF or GFF3, plain or .gz).")
+    p.add_argument("--output", type=Path, required=True,
+                   help="Output path (same format as input).")
+    p.add_argument("--format", required=True, choices=("gtf", "gff3"),
+                   help="Matches detect_annotation_style.py ANN_FORMAT.")
+    p.add_argument("--drop-biotypes", default="",
+                   help="Comma-separated gene_biotype/gene_type/biotype "
+                        "values to remove (matches ANN_DROP_BIOTYPES).")
+    args = p.parse_args()
+
+    if not args.input.is_file():
+        log.error("Input does not exist or is not a file: %s", args.input)
+        return 1
+
+    drop_biotypes = {b.strip() for b in args.drop_biotypes.split(",") if b.strip()}
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+
+    if not drop_biotypes:
+        log.info("annotation_drop_biotype: no drop_biotypes given, passing through unchanged")
+
+    stage = DropBiotypeFeatures(args.format, drop_biotypes, args.input)
+    run_stages(args.input, args.output, [stage])
+    return stage.report()
 
 
 if __name__ == "__main__":
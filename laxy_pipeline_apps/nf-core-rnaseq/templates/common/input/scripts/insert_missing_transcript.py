@@ -34,11 +34,12 @@ Uses Python 3.9+ standard library only.
 from __future__ import annotations
 
 import argparse
-import gzip
 import logging
 import sys
 from pathlib import Path
-from typing import IO, Dict, List, Tuple, cast
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from annotation_scan import AnnotationStage, run_stages
 
 logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
 log = logging.getLogger(__name__)
@@ -52,26 +53,6 @@ _LEAF_FEATURE_TYPES: frozenset[str] = frozenset((
 ))
 
 
-def is_gzipped(path: Path) -> bool:
-    try:
-        with path.open("rb") as fp:
-            return fp.read(2) == b"\x1f\x8b"
-    except OSError:
-        return path.suffix == ".gz"
-
-
-def open_text_read(path: Path) -> IO[str]:
-    if is_gzipped(path):
-        return cast(IO[str], gzip.open(path, "rt", encoding="utf-8", errors="replace"))
-    return open(path, "rt", encoding="utf-8", errors="replace")
-
-
-def open_text_write(path: Path) -> IO[str]:
-    if path.suffix == ".gz" or str(path).endswith(".gz"):
-        return cast(IO[str], gzip.open(path, "wt", encoding="utf-8"))
-    return open(path, "wt", encoding="utf-8")
-
-
 def parse_gff3_attrs(col9: str) -> Dict[str, str]:
     out: Dict[str, str] = {}
     for part in col9.strip().split(";"):
@@ -85,6 +66,197 @@ def parse_gff3_attrs(col9: str) -> Dict[str, str]:
     return out
 
 
+def _flat_child_parent(parts: List[str], attrs: Dict[str, str]) -> Optional[str]:
+    """The single Parent of a leaf feature row, or None."""
+    # Only true leaf features (exon/CDS/UTRs/codons) are ever expected
+    # to sit directly under a transcript-level row. Anything else
+    # (mRNA, tRNA, rRNA, ncRNA, transcript, miRNA, snoRNA, ...) is
+    # itself a valid transcript unit, and its Parent=<gene> is normal.
+    if not attrs or parts[2] not in _LEAF_FEATURE_TYPES:
+        return None
+    parent = attrs.get("Parent", "")
+    parents = [p.strip() for p in parent.split(",") if p.strip()]
+    return parents[0] if len(parents) == 1 else None
+
+
+class InsertMissingTranscript(AnnotationStage):
+    """Insert a transcript row for each gene with flat children.
+
+    The pre-scan finds gene IDs and, for every leaf row with a single
+    Parent, that parent's first row and the span of its leaf rows - which
+    parents turn out to be genes is only known at the end of the file.
+    A second pre-scan is only needed in the odd case where a gene's ID was
+    first used by some other row, whose columns the synthetic row copies.
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.needs_prescan = fmt == "gff3"
+        # gene ID -> (synthetic transcript row, its ID)
+        self.synthetic: Dict[str, Tuple[List[str], str]] = {}
+        self._first_rows: Dict[str, Optional[List[str]]] = {}
+        self._spans: Dict[str, Tuple[int, int]] = {}
+        self.output_rows = 0
+
+    def prescan(self, lines: Iterable[str]) -> None:
+        if self._first_rows:
+            return self._prescan_first_rows(lines)
+
+        gene_ids: Set[str] = set()
+        existing_ids: Set[str] = set()
+        # First row of each ID, only kept for gene-ish rows: None means some
+        # other row used the ID first.
+        first_rows: Dict[str, Optional[List[str]]] = {}
+        # Parent ID -> (min start, max end) of its leaf rows, in the order
+        # each parent's first leaf row appears.
+        spans: Dict[str, Tuple[int, int]] = {}
+        bad_coords: Dict[str, ValueError] = {}
+        in_fasta = False
+        for raw in lines:
+            if raw.startswith("##FASTA"):
+                in_fasta = True
+            if in_fasta or raw.startswith("#") or not raw.strip():
+                continue
+            parts = raw.rstrip("\r\n").split("\t")
+            if len(parts) != 9:
+                continue
+            attrs = parse_gff3_attrs(parts[8])
+            row_id = attrs.get("ID")
+            if row_id:
+                # Top-level gene-ish rows never carry their own Parent=, and NCBI
+                # uses several column-3 types for them (gene, pseudogene, ...).
+                is_gene = not attrs.get("Parent") and parts[2] != "region"
+                if is_gene:
+                    gene_ids.add(row_id)
+                if row_id not in existing_ids:
+                    existing_ids.add(row_id)
+                    first_rows[row_id] = parts if is_gene else None
+            parent = _flat_child_parent(parts, attrs)
+            if parent is None:
+                continue
+            try:
+                start, end = int(parts[3]), int(parts[4])
+            except ValueError as e:
+                bad_coords.setdefault(parent, e)
+                continue
+            span = spans.get(parent)
+            spans[parent] = (
+                (start, end) if span is None
+                else (min(span[0], start), max(span[1], end))
+            )
+
+        flat_genes = [p for p in spans if p in gene_ids]
+        flat_genes += [p for p in bad_coords if p in gene_ids and p not in spans]
+        if not flat_genes:
+            self.needs_prescan = False
+            log.info("insert_missing_transcript: no flat gene->feature rows found, passing through unchanged")
+            return
+        for gene_id in flat_genes:
+            if gene_id in bad_coords:
+                raise bad_coords[gene_id]
+
+        def synth_id(gene_id: str) -> str:
+            base = f"rna-{gene_id[5:]}" if gene_id.startswith("gene-") else f"rna-{gene_id}"
+            candidate = base
+            suffix = 1
+            while candidate in existing_ids:
+                suffix += 1
+                candidate = f"{base}_{suffix}"
+            existing_ids.add(candidate)
+            return candidate
+
+        for gene_id in flat_genes:
+            self.synthetic[gene_id] = ([], synth_id(gene_id))
+        self._first_rows = {g: first_rows[g] for g in flat_genes}
+        self._spans = {g: spans[g] for g in flat_genes}
+        self.needs_prescan = any(row is None for row in self._first_rows.values())
+        if not self.needs_prescan:
+            self._build_rows()
+
+    def _prescan_first_rows(self, lines: Iterable[str]) -> None:
+        missing = {g for g, row in self._first_rows.items() if row is None}
+        in_fasta = False
+        for raw in lines:
+            if raw.startswith("##FASTA"):
+                in_fasta = True
+            if in_fasta or raw.startswith("#") or not raw.strip():
+                continue
+            parts = raw.rstrip("\r\n").split("\t")
+            if len(parts) != 9:
+                continue
+            row_id = parse_gff3_attrs(parts[8]).get("ID")
+            if row_id in missing:
+                self._first_rows[row_id] = parts
+                missing.discard(row_id)
+                if not missing:
+                    break
+        self.needs_prescan = False
+        self._build_rows()
+
+    def _build_rows(self) -> None:
+        for gene_id, (_, new_id) in self.synthetic.items():
+            seqid, source, _, _, _, score, strand, _, _ = self._first_rows[gene_id]
+            start, end = self._spans[gene_id]
+            self.synthetic[gene_id] = ([
+                seqid, source, "transcript", str(start), str(end),
+                score, strand, ".", f"ID={new_id};Parent={gene_id}",
+            ], new_id)
+        self._first_rows = {}
+        self._spans = {}
+
+    def transform(self, lines: Iterable[str]) -> Iterator[str]:
+        if not self.synthetic:
+            output_rows = 0
+            for raw in lines:
+                output_rows += 1
+                yield raw
+            self.output_rows = output_rows
+            return
+
+        synthetic = self.synthetic
+        emitted: Set[str] = set()
+        output_rows = 0
+        in_fasta = False
+        for raw in lines:
+            if raw.startswith("##FASTA"):
+                in_fasta = True
+            if in_fasta or raw.startswith("#") or not raw.strip():
+                output_rows += 1
+                yield raw
+                continue
+            parts = raw.rstrip("\r\n").split("\t")
+            if len(parts) != 9:
+                output_rows += 1
+                yield raw
+                continue
+            attrs = parse_gff3_attrs(parts[8])
+            parent = _flat_child_parent(parts, attrs)
+            if parent in synthetic:
+                row, new_id = synthetic[parent]
+                if parent not in emitted:
+                    emitted.add(parent)
+                    output_rows += 1
+                    yield "\t".join(row) + "\n"
+                new_attrs = f"ID={attrs['ID']};Parent={new_id}" if attrs.get("ID") else f"Parent={new_id}"
+                extra = ";".join(
+                    f"{k}={v}" for k, v in attrs.items() if k not in ("ID", "Parent")
+                )
+                if extra:
+                    new_attrs += ";" + extra
+                parts = parts[:8] + [new_attrs]
+            output_rows += 1
+            yield "\t".join(parts) + "\n"
+        self.output_rows = output_rows
+
+    def report(self) -> int:
+        if self.synthetic:
+            log.info(
+                "insert_missing_transcript: genes_fixed=%d synthetic_rows=%d output_rows=%d",
+                len(self.synthetic), len(self.synthetic), self.output_rows,
+            )
+        return 0
+
+
 def main() -> int:
     p = argparse.ArgumentParser(description=__doc__)
     p.add_argument("--input", type=Path, required=True,
@@ -103,117 +275,10 @@ def main() -> int:
 
     if args.format != "gff3":
         log.info("insert_missing_transcript: format=%s, nothing to do (GTF has no Parent= hierarchy)", args.format)
-        with open_text_read(args.input) as fin, open_text_write(args.output) as fout:
-            for line in fin:
-                fout.write(line)
-        return 0
-
-    # Pass 1: find gene IDs and every row whose Parent points directly at one.
-    gene_ids: set = set()
-    rows: List[Tuple[int, List[str], Dict[str, str]]] = []
-    with open_text_read(args.input) as fin:
-        in_fasta = False
-        for i, raw in enumerate(fin):
-            if raw.startswith("##FASTA"):
-                in_fasta = True
-            if in_fasta or raw.startswith("#") or not raw.strip():
-                rows.append((i, [raw], {}))
-                continue
-            parts = raw.rstrip("\r\n").split("\t")
-            if len(parts) != 9:
-                rows.append((i, parts if len(parts) == 9 else [raw], {}))
-                continue
-            attrs = parse_gff3_attrs(parts[8])
-            rows.append((i, parts, attrs))
-            # Top-level gene-ish rows never carry their own Parent=, and NCBI
-            # uses several column-3 types for them (gene, pseudogene, ...).
-            if attrs.get("ID") and not attrs.get("Parent") and parts[2] != "region":
-                gene_ids.add(attrs["ID"])
-
-    flat_children_by_gene: Dict[str, List[int]] = {}
-    for idx, parts, attrs in rows:
-        if not attrs or len(parts) != 9:
-            continue
-        # Only true leaf features (exon/CDS/UTRs/codons) are ever expected
-        # to sit directly under a transcript-level row. Anything else
-        # (mRNA, tRNA, rRNA, ncRNA, transcript, miRNA, snoRNA, ...) is
-        # itself a valid transcript unit, and its Parent=<gene> is normal.
-        if parts[2] not in _LEAF_FEATURE_TYPES:
-            continue
-        parent = attrs.get("Parent", "")
-        parents = [p.strip() for p in parent.split(",") if p.strip()]
-        if len(parents) == 1 and parents[0] in gene_ids:
-            flat_children_by_gene.setdefault(parents[0], []).append(idx)
-
-    if not flat_children_by_gene:
-        log.info("insert_missing_transcript: no flat gene->feature rows found, passing through unchanged")
-        with open_text_read(args.input) as fin, open_text_write(args.output) as fout:
-            for line in fin:
-                fout.write(line)
-        return 0
 
-    existing_ids = {attrs["ID"] for _, _, attrs in rows if attrs.get("ID")}
-
-    def synth_id(gene_id: str) -> str:
-        base = f"rna-{gene_id[5:]}" if gene_id.startswith("gene-") else f"rna-{gene_id}"
-        candidate = base
-        suffix = 1
-        while candidate in existing_ids:
-            suffix += 1
-            candidate = f"{base}_{suffix}"
-        existing_ids.add(candidate)
-        return candidate
-
-    # For each affected gene, build the synthetic transcript row (spanning
-    # all of its flat children) and remember the repointed Parent.
-    synthetic_by_first_child_idx: Dict[int, List[str]] = {}
-    repoint: Dict[int, str] = {}
-    for gene_id, child_idxs in flat_children_by_gene.items():
-        gene_row = next(parts for i, parts, attrs in rows if attrs.get("ID") == gene_id)
-        seqid, source, _, _, _, score, strand, _, _ = gene_row
-        starts = []
-        ends = []
-        for idx in child_idxs:
-            child_parts = rows[idx][1]
-            starts.append(int(child_parts[3]))
-            ends.append(int(child_parts[4]))
-        new_id = synth_id(gene_id)
-        new_row = [
-            seqid, source, "transcript", str(min(starts)), str(max(ends)),
-            score, strand, ".", f"ID={new_id};Parent={gene_id}",
-        ]
-        first_idx = min(child_idxs)
-        synthetic_by_first_child_idx[first_idx] = new_row
-        for idx in child_idxs:
-            repoint[idx] = new_id
-
-    output_lines = 0
-    genes_fixed = len(flat_children_by_gene)
-    with open_text_write(args.output) as fout:
-        for i, parts, attrs in rows:
-            if i in synthetic_by_first_child_idx:
-                fout.write("\t".join(synthetic_by_first_child_idx[i]) + "\n")
-                output_lines += 1
-            if not attrs or len(parts) != 9:
-                fout.write(parts[0] if len(parts) == 1 else "\t".join(parts) + "\n")
-                output_lines += 1
-                continue
-            if i in repoint:
-                new_attrs = f"ID={attrs['ID']};Parent={repoint[i]}" if attrs.get("ID") else f"Parent={repoint[i]}"
-                extra = ";".join(
-                    f"{k}={v}" for k, v in attrs.items() if k not in ("ID", "Parent")
-                )
-                if extra:
-                    new_attrs += ";" + extra
-                parts = parts[:8] + [new_attrs]
-            fout.write("\t".join(parts) + "\n")
-            output_lines += 1
-
-    log.info(
-        "insert_missing_transcript: genes_fixed=%d synthetic_rows=%d output_rows=%d",
-        genes_fixed, len(synthetic_by_first_child_idx), output_lines,
-    )
-    return 0
+    stage = InsertMissingTranscript(args.format)
+    run_stages(args.input, args.output, [stage])
+    return stage.report()
 
 
 if __name__ == "__main__":
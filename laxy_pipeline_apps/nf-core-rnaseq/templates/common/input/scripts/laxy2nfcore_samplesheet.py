@@ -8,10 +8,12 @@
 
 import argparse
 import logging
+import shutil
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Sequence, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 import json
 import os
@@ -225,27 +227,148 @@ def get_filelist_from_filesystem(path, strandedness="auto") -> Sequence[str]:
     return sheetlines
 
 
-def gzip_uncompressed(path):
-    """[summary]
+GZIP_MAGIC = b"\x1f\x8b"
+
+# The same level gzip, pigz and bgzip default to. nf-core decompresses these
+# again almost immediately, so a smaller file isn't worth the extra CPU.
+GZIP_LEVEL = 6
+
+
+def is_gzipped(path) -> bool:
+    """True if the file starts with the gzip magic bytes (which includes
+    BGZF), whatever its name says."""
+    with open(path, "rb") as fh:
+        return fh.read(2) == GZIP_MAGIC
+
+
+def available_cpus() -> int:
+    """The CPUs this job was given: SLURM_CPUS_PER_TASK when run under
+    sbatch (set from the ComputeResource's ``extra.slurm.cpus``), otherwise
+    the CPUs this process may run on."""
+    try:
+        return max(1, int(os.environ["SLURM_CPUS_PER_TASK"]))
+    except (KeyError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def compressor_command(threads: int = 1) -> List[str]:
+    """A command that gzips its file argument to stdout, preferring the
+    multithreaded pigz or bgzip when installed."""
+    pigz = shutil.which("pigz")
+    if pigz:
+        return [pigz, f"-{GZIP_LEVEL}", "-p", str(threads), "-c"]
+    bgzip = shutil.which("bgzip")
+    if bgzip:
+        return [bgzip, "-l", str(GZIP_LEVEL), "-@", str(threads), "-c"]
+    return ["gzip", f"-{GZIP_LEVEL}", "-c"]
+
+
+def find_reads_to_gzip(path) -> List[Tuple[Path, Path]]:
+    """
+    Recursively walk path for FASTQ files that aren't gzipped, judged by
+    their content rather than their name.
+
+    Returns:
+        List[Tuple[Path, Path]]: (current path, gzipped path) pairs. The
+                                 gzipped path always ends in .gz, since
+                                 nf-core/rnaseq goes by the extension.
+    """
+    todo = []
+    for root, _d, fs in os.walk(path, followlinks=True):
+        for f in fs:
+            if not f.endswith((".fastq", ".fq", ".fastq.gz", ".fq.gz")):
+                continue
+            f_path = Path(root, f)
+            gz_path = f_path if f.endswith(".gz") else Path(root, f"{f}.gz")
+            if f_path == gz_path and is_gzipped(f_path):
+                continue
+            todo.append((f_path, gz_path))
+    return todo
+
+
+def gzip_file(src: Path, dest: Path, threads: int = 1) -> None:
+    """
+    gzip src to dest, removing src. A file that is already gzipped but
+    lacks the .gz extension is just renamed.
+    """
+    if src != dest and is_gzipped(src):
+        os.replace(src, dest)
+        return
+
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    try:
+        with open(tmp, "wb") as out:
+            subprocess.run(compressor_command(threads) + [str(src)], stdout=out, check=True)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if src != dest:
+        src.unlink()
+
+
+def gzip_uncompressed(path, threads: Optional[int] = None):
+    """
     nf-core/rnaseq only takes gzipped reads. Recursively walk path and
     if we find any uncompressed fastqs, compress them before proceeding.
 
+    Files are compressed concurrently, largest first, sharing `threads`
+    CPUs (default: all this job was given) between the files in flight and,
+    where pigz/bgzip are available, the threads each compressor uses.
+
     Args:
         path ([type]): Path to recursively search for uncompressed fastqs.
+        threads (int): Total CPUs to use.
 
     Returns:
         List[Tuple[str, str]]: List of tuples of original fastq paths and
                                new gzipped fastq paths.
     """
-    gzipped_files = []
-    for root, _d, fs in os.walk(path, followlinks=True):
-        for f in fs:
-            if f.endswith(".fastq") or f.endswith(".fq"):
-                f_path = str(Path(root, f))
-                subprocess.run(["gzip", f_path])
-                gzipped_files.append((f_path, f"{f_path}.gz"))
+    todo = find_reads_to_gzip(path)
+    if not todo:
+        return []
+
+    threads = threads or available_cpus()
+    todo.sort(key=lambda pair: pair[0].stat().st_size, reverse=True)
+    workers = min(threads, len(todo))
+    per_file_threads = max(1, threads // workers)
+    logging.info(
+        f"Compressing {len(todo)} FASTQ file(s), {workers} at a time "
+        f"with {compressor_command(per_file_threads)[0]}"
+    )
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() so the first failure is raised here
+        list(
+            pool.map(
+                lambda pair: gzip_file(*pair, threads=per_file_threads), todo
+            )
+        )
 
-    return gzipped_files
+    return [(str(src), str(dest)) for src, dest in todo]
+
+
+def has_archive_inputs(jblob) -> bool:
+    """
+    True if any input file is an archive (eg a tar of FASTQs). The archives
+    are extracted before this script runs (eg by laxydl), so the samplesheet
+    is built from the files on the filesystem rather than
+    pipeline_config.json.
+    """
+    for sample in jblob["sample_cart"].get("samples", []):
+        for f in sample["files"]:
+            r1_fn = f.get("R1", {}).get("sanitized_filename", "")
+            tags = f.get("R1", {}).get("tags", [])
+            if "archive" in tags or any(
+                [r1_fn.endswith(ext) for ext in archive_extensions]
+            ):
+                return True
+    return False
 
 
 def main():
@@ -258,6 +381,7 @@ Examples:
   %(prog)s pipeline_config.json /path/to/reads
   %(prog)s pipeline_config.json /path/to/reads forward
   %(prog)s pipeline_config.json /path/to/reads reverse --output samplesheet.csv
+  %(prog)s pipeline_config.json /path/to/reads --compress-only --threads 8
 
 This script processes a Laxy pipeline configuration JSON file and generates a samplesheet
 compatible with nf-core/rnaseq. It handles both individual FASTQ files and archive
@@ -294,6 +418,22 @@ used by Illumina instruments, SRA/ENA, and other sequencing platforms.
         help="Output file path. If not specified, prints to stdout. Use '-' for stdout."
     )
     
+    parser.add_argument(
+        "--threads", "-t",
+        type=int,
+        default=None,
+        help="CPUs to use compressing uncompressed FASTQs (default: "
+        "SLURM_CPUS_PER_TASK, or all CPUs available to this process)"
+    )
+
+    parser.add_argument(
+        "--compress-only",
+        action="store_true",
+        help="Only gzip any uncompressed FASTQs under reads_path, without writing "
+        "a samplesheet. Lets run_job.sh compress the reads in the background "
+        "while it fetches the reference."
+    )
+
     parser.add_argument(
         "--verbose", "-v",
         action="store_true",
@@ -329,29 +469,19 @@ used by Illumina instruments, SRA/ENA, and other sequencing platforms.
         logging.error(f"Error reading configuration file: {e}")
         sys.exit(1)
 
-    outlines = []
-    outlines.append("sample,fastq_1,fastq_2,strandedness")
+    is_archive = has_archive_inputs(jblob)
 
-    # check if an input file is a tar archive - if so, we use the files
-    # on the filesystem to generate the samplesheet rather than the
-    # pipeline_config.json. tar archives should need to be pre-extracted
-    # before this script is run (eg via laxydl)
-    is_archive = False
-    for sample in jblob["sample_cart"].get("samples", []):
+    if args.compress_only:
         if is_archive:
-            break
-        for f in sample["files"]:
-            r1_fn = f.get("R1", {}).get("sanitized_filename", "")
-            tags = f.get("R1", {}).get("tags", [])
-            if "archive" in tags or any(
-                [r1_fn.endswith(ext) for ext in archive_extensions]
-            ):
-                is_archive = True
-                break
+            gzip_uncompressed(args.reads_path, threads=args.threads)
+        return
+
+    outlines = []
+    outlines.append("sample,fastq_1,fastq_2,strandedness")
 
     if is_archive:
         logging.info("Archive files detected, processing filesystem")
-        gzip_uncompressed(args.reads_path)
+        gzip_uncompressed(args.reads_path, threads=args.threads)
         sheetlines = get_filelist_from_filesystem(
             args.reads_path, strandedness=args.strandedness
         )
@@ -32,36 +32,17 @@ Uses Python 3.9+ standard library only.
 from __future__ import annotations
 
 import argparse
-import gzip
 import logging
 import sys
 from pathlib import Path
-from typing import IO, Dict, Tuple, cast
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from annotation_scan import AnnotationStage, run_stages
 
 logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
 log = logging.getLogger(__name__)
 
 
-def is_gzipped(path: Path) -> bool:
-    try:
-        with path.open("rb") as fp:
-            return fp.read(2) == b"\x1f\x8b"
-    except OSError:
-        return path.suffix == ".gz"
-
-
-def open_text_read(path: Path) -> IO[str]:
-    if is_gzipped(path):
-        return cast(IO[str], gzip.open(path, "rt", encoding="utf-8", errors="replace"))
-    return open(path, "rt", encoding="utf-8", errors="replace")
-
-
-def open_text_write(path: Path) -> IO[str]:
-    if path.suffix == ".gz" or str(path).endswith(".gz"):
-        return cast(IO[str], gzip.open(path, "wt", encoding="utf-8"))
-    return open(path, "wt", encoding="utf-8")
-
-
 def parse_gtf_attrs(col9: str) -> Dict[str, str]:
     out: Dict[str, str] = {}
     for part in col9.split(";"):
@@ -83,62 +64,49 @@ def parse_attr_rule(raw: str) -> Tuple[str, str]:
     return src, dst
 
 
-def main() -> int:
-    p = argparse.ArgumentParser(description=__doc__)
-    p.add_argument("--input", type=Path, required=True,
-                   help="Input GTF (plain or .gz).")
-    p.add_argument("--output", type=Path, required=True,
-                   help="Output GTF path (same compression as input).")
-    p.add_argument("--attr", dest="attrs", action="append", default=[],
-                   help="SRC or SRC:DST attribute to propagate, e.g. gbkey or "
-                        "Name:gene_name. Repeatable.")
-    p.add_argument("--biotype-attr",
-                   help="Deprecated alias for --attr (no rename).")
-    p.add_argument("--parent-feature-type", default="transcript",
-                   help="Column-3 feature type carrying the source attribute.")
-    args = p.parse_args()
-
-    rules: list[Tuple[str, str]] = [parse_attr_rule(a) for a in args.attrs]
-    if args.biotype_attr:
-        rules.append((args.biotype_attr, args.biotype_attr))
-    if not rules:
-        log.error("At least one --attr (or --biotype-attr) is required.")
-        return 1
+class PropagateAttributes(AnnotationStage):
+    """Copy ``rules`` attributes from parent rows onto child rows lacking
+    them; the pre-scan collects the parent rows' values."""
 
-    if not args.input.is_file():
-        log.error("Input does not exist or is not a file: %s", args.input)
-        return 1
+    needs_prescan = True
 
-    args.output.parent.mkdir(parents=True, exist_ok=True)
+    def __init__(self, rules: List[Tuple[str, str]], parent_feature_type: str = "transcript"):
+        self.rules = rules
+        self.parent_feature_type = parent_feature_type
+        # transcript_id -> {dst_attr: value}
+        self.transcript_values: Dict[str, Dict[str, str]] = {}
+        self.input_rows = 0
+        self.propagated_rows = 0
 
-    # transcript_id -> {dst_attr: value}
-    transcript_values: Dict[str, Dict[str, str]] = {}
-    with open_text_read(args.input) as fin:
-        for raw in fin:
+    def prescan(self, lines: Iterable[str]) -> None:
+        transcript_values = self.transcript_values
+        for raw in lines:
             if not raw.strip() or raw.startswith("#"):
                 continue
             parts = raw.rstrip("\r\n").split("\t")
-            if len(parts) != 9 or parts[2] != args.parent_feature_type:
+            if len(parts) != 9 or parts[2] != self.parent_feature_type:
                 continue
             attrs = parse_gtf_attrs(parts[8])
             tid = attrs.get("transcript_id")
             if not tid:
                 continue
-            for src, dst in rules:
+            for src, dst in self.rules:
                 value = attrs.get(src)
                 if value:
                     transcript_values.setdefault(tid, {}).setdefault(dst, value)
+        self.needs_prescan = False
 
-    input_rows = 0
-    propagated_rows = 0
-    with open_text_read(args.input) as fin, open_text_write(args.output) as fout:
-        for raw in fin:
+    def transform(self, lines: Iterable[str]) -> Iterator[str]:
+        transcript_values = self.transcript_values
+        input_rows = 0
+        propagated_rows = 0
+        for raw in lines:
             if not raw.strip() or raw.startswith("#"):
-                fout.write(raw)
+                yield raw
                 continue
             parts = raw.rstrip("\r\n").split("\t")
             if len(parts) != 9:
-                fout.write(raw)
+                yield raw
                 continue
 
             input_rows += 1
@@ -157,15 +125,50 @@ def main() -> int:
                 parts[8] = col9
                 raw = "\t".join(parts) + "\n"
                 propagated_rows += 1
-            fout.write(raw)
-
-    log.info(
-        "propagate_biotype_to_features: rules=%s parent_feature_type=%s "
-        "transcripts_with_values=%d input_rows=%d propagated_rows=%d",
-        rules, args.parent_feature_type,
-        len(transcript_values), input_rows, propagated_rows,
-    )
-    return 0
+            yield raw
+        self.input_rows, self.propagated_rows = input_rows, propagated_rows
+
+    def report(self) -> int:
+        log.info(
+            "propagate_biotype_to_features: rules=%s parent_feature_type=%s "
+            "transcripts_with_values=%d input_rows=%d propagated_rows=%d",
+            self.rules, self.parent_feature_type,
+            len(self.transcript_values), self.input_rows, self.propagated_rows,
+        )
+        return 0
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("--input", type=Path, required=True,
+                   help="Input GTF (plain or .gz).")
+    p.add_argument("--output", type=Path, required=True,
+                   help="Output GTF path (same compression as input).")
+    p.add_argument("--attr", dest="attrs", action="append", default=[],
+                   help="SRC or SRC:DST attribute to propagate, e.g. gbkey or "
+                        "Name:gene_name. Repeatable.")
+    p.add_argument("--biotype-attr",
+                   help="Deprecated alias for --attr (no rename).")
+    p.add_argument("--parent-feature-type", default="transcript",
+                   help="Column-3 feature type carrying the source attribute.")
+    args = p.parse_args()
+
+    rules: list[Tuple[str, str]] = [parse_attr_rule(a) for a in args.attrs]
+    if args.biotype_attr:
+        rules.append((args.biotype_attr, args.biotype_attr))
+    if not rules:
+        log.error("At least one --attr (or --biotype-attr) is required.")
+        return 1
+
+    if not args.input.is_file():
+        log.error("Input does not exist or is not a file: %s", args.input)
+        return 1
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+
+    stage = PropagateAttributes(rules, args.parent_feature_type)
+    run_stages(args.input, args.output, [stage])
+    return stage.report()
 
 
 if __name__ == "__main__":
@@ -19,6 +19,7 @@ export PIPELINE_CONFIG="${INPUT_CONFIG_PATH}/pipeline_config.json"
 export SITE_CONFIGS="${JOB_PATH}/../../config"
 export CONDA_BASE="${JOB_PATH}/../miniconda3"
 export DOWNLOAD_CACHE_PATH="${JOB_PATH}/../../cache/downloads"
+export ANNOTATION_SUMMARY_CACHE_PATH="${JOB_PATH}/../../cache/annotation_summaries"
 export SINGULARITY_CACHEDIR="${JOB_PATH}/../../cache/singularity"
 export APPTAINER_CACHEDIR="${SINGULARITY_CACHEDIR}"
 export SINGULARITY_TMPDIR="${TMP}"
@@ -78,6 +78,7 @@ set -o errexit
 
 function job_done() {
     trap - EXIT
+    stop_compress_reads || true
 
     local _exit_code=${1:-$?}
     # Use the EXIT_CODE global if set
@@ -92,6 +93,7 @@ function job_done() {
 
 function job_fail_or_cancel() {
     trap - EXIT
+    stop_compress_reads || true
 
     cd "${JOB_PATH}"
     capture_environment_variables || true
@@ -354,9 +356,7 @@ function normalize_annotations() {
 
     source "${INPUT_CONFIG_PATH}/annotation_style.env"
 
-    insert_missing_transcript
-    drop_biotype_features
-    filter_annotation_features
+    prepare_annotation_features
 
     if [[ -n "${ANNOTATION_FILE:-}" ]] && [[ -f "${ANNOTATION_FILE}" ]]; then
         if [[ "${ANN_FORMAT}" == "gtf" ]]; then
@@ -495,7 +495,37 @@ function remove_index_reads() {
     find ${INPUT_READS_PATH} -type f -name "*_I2_001.f*.gz" -delete
 }
 
+# Reads from archives (eg IonTorrent tarballs) are often uncompressed FASTQ, but
+# nf-core/rnaseq only takes gzipped reads. We start compressing them (in parallel,
+# using the CPUs the job was given) as soon as the reads are downloaded, so it
+# overlaps with fetching and preparing the reference. generate_samplesheet waits for it.
+# It runs in its own process group (setsid), so stop_compress_reads can stop
+# its pigz/bgzip children too.
+function compress_reads_background() {
+    setsid python ${INPUT_SCRIPTS_PATH}/laxy2nfcore_samplesheet.py \
+      ${INPUT_CONFIG_PATH}/pipeline_config.json ${INPUT_READS_PATH} \
+      --compress-only \
+      >>"${JOB_PATH}/output/compress_reads.log" 2>&1 &
+    export COMPRESS_READS_PID=$!
+}
+
+# Called from the EXIT trap, so compression isn't left running (orphaned) when
+# the job fails or exits before generate_samplesheet has waited for it.
+function stop_compress_reads() {
+    if [[ -n "${COMPRESS_READS_PID:-}" ]]; then
+        kill -TERM -- -${COMPRESS_READS_PID} 2>/dev/null || true
+        wait ${COMPRESS_READS_PID} 2>/dev/null || true
+        unset COMPRESS_READS_PID
+    fi
+}
+
 function generate_samplesheet() {
+    if [[ -n "${COMPRESS_READS_PID:-}" ]]; then
+        local _compress_pid=${COMPRESS_READS_PID}
+        unset COMPRESS_READS_PID
+        wait ${_compress_pid} || fail_job 'compress_reads' 'Failed to compress input reads' $?
+    fi
+
     export STRANDEDNESS=$(jq --raw-output '.params."nf-core-rnaseq".strandedness // "auto"' "${PIPELINE_CONFIG}")
 
     python ${INPUT_SCRIPTS_PATH}/laxy2nfcore_samplesheet.py  \
@@ -889,12 +919,14 @@ get_settings_from_pipeline_config || fail_job 's' 'get_settings_from_pipeline_co
 #### Stage input data ###
 ####
 
-download_input_data "${INPUT_REFERENCE_PATH}" "reference_genome" || fail_job 'download_input_data' 'Failed to download reference genome' $?
-
 download_input_data "${INPUT_READS_PATH}" "ngs_reads" || fail_job 'download_input_data' 'Failed to download input data' $?
 
 remove_index_reads
 
+compress_reads_background
+
+download_input_data "${INPUT_REFERENCE_PATH}" "reference_genome" || fail_job 'download_input_data' 'Failed to download reference genome' $?
+
 set_genome_args
 
 normalize_annotations
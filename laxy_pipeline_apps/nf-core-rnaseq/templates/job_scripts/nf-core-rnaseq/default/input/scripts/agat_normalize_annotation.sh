@@ -113,161 +113,41 @@ function check_fasta_annotation_seqids() {
     fi
 }
 
-# Trim a prokaryotic annotation to ANN_FEATURE_TYPE rows and (for GFF3 input)
-# expand each kept row into a synthesised transcript+exon+<feature_type>
-# hierarchy in GTF format. The output is always GTF, so nf-core/rnaseq's
-# PREPARE_GENOME skips its lossy gffread synthesis step (which would drop
-# exon rows and gene_id attributes when fed a flat CDS-only GFF3) and the
-# annotation flows straight into RSEM, STAR, featureCounts, gtf2bed, and
-# CUSTOM_TX2GENE with the gene_id/transcript_id they expect.
+# Repair and filter a custom annotation in a single process
+# (annotation_pipeline.py), each step gated on the ANN_* values from
+# detect_annotation_style.py, which is re-run on the result of each step:
 #
-# Runs AFTER detect_annotation_style.py so ANN_FORMAT / ANN_FEATURE_TYPE /
-# ANN_GROUP_FEATURES / ANN_PROKARYOTIC are populated.
+#   * insert_missing_transcript (GFF3 only): give genes whose exon/CDS rows
+#     point Parent= straight at the gene (eg NCBI RefSeq single-exon
+#     processed pseudogenes) a transcript row, which nf-core/rnaseq's
+#     GFF3->GTF conversion needs to resolve gene_id.
+#     See ANNOTATION_REQUIREMENTS_AND_FILTERING.md §6 item 8.
+#   * drop_biotype_features (ANN_DROP_BIOTYPES): remove gene groups with
+#     non-coding RNA biotypes, which break nf-core's tximport step with
+#     --gtf_group_features Parent. A CDS-only remainder is then re-detected as
+#     prokaryotic-shaped. See ANNOTATION_REQUIREMENTS_AND_FILTERING.md §6 item 7.
+#   * filter_annotation_features (ANN_PROKARYOTIC=yes only): trim to
+#     ANN_FEATURE_TYPE rows and synthesise a transcript+exon+<feature_type>
+#     hierarchy as GTF, so PREPARE_GENOME skips its lossy gffread step.
 #
-# Restricted to prokaryotic annotations (ANN_PROKARYOTIC=yes) by design:
-#   * It exists to repair malformed prokaryotic inputs (e.g. SnapGene-exported
-#     GFF3 with `variation` rows where end<start; CDS-only annotations
-#     without ID=/Parent= that make gffread silently emit a 0-row GTF).
-#   * Synthesising one transcript+exon per CDS only makes sense for
-#     prokaryotes (1 gene = 1 ORF = 1 transcript). Running it on eukaryotic
-#     GFF3 would destroy the shared-Parent grouping that RSEM/STAR rely on
-#     to reconstruct multi-exon transcripts.
-#
-# Repair GFF3 genes whose children (exon/CDS/...) point Parent= directly at
-# the gene, skipping the usual mRNA/tRNA/rRNA/ncRNA transcript level. Real
-# NCBI RefSeq annotations do this for single-exon "processed pseudogenes"
-# (no introns, so no felt need for an explicit transcript row) - nf-core/
-# rnaseq's own GFF3->GTF conversion (used to build the transcript FASTA via
-# rsem-prepare-reference regardless of aligner choice) then can't resolve
-# gene_id for these flat rows and dies with "Cannot find gene_id!",
-# aborting the whole run. Confirmed against real Laxy prod with genuine
-# NCBI human (chr21, gene RPL8P2) and mouse (chr19, gene Gm36006) RefSeq
-# annotations. See ANNOTATION_REQUIREMENTS_AND_FILTERING.md §6 item 8.
-#
-# Runs BEFORE drop_biotype_features/filter_annotation_features, right after
-# the first detect_annotation_style.py pass, then re-runs the detector so
-# ANN_* reflects the repaired annotation (the extra "transcript" rows can
-# shift exon/CDS counts, though not the classification in practice).
-function insert_missing_transcript() {
+# The annotation is read once and written once, gzipped, to the file name the
+# last step that applies would have used. The uploaded file is left in place.
+# annotation_style.env is rewritten with the final detection and
+# annotation_prepare.env carries ANNOTATION_FILE plus the filter step's
+# ANN_FORMAT/ANN_GROUP_FEATURES/ANN_BIOTYPE_ATTR overrides.
+function prepare_annotation_features() {
     [[ "${USING_CUSTOM_REFERENCE}" == "yes" ]] || return 0
     [[ -n "${ANNOTATION_FILE:-}" && -f "${ANNOTATION_FILE}" ]] || return 0
-    [[ "${ANN_FORMAT:-}" == "gff3" ]] || return 0
-    # GTF rows carry gene_id/transcript_id directly (no Parent= hierarchy to
-    # walk), so this is a GFF3-only concern.
-
-    local _in="${ANNOTATION_FILE}"
-    local _dir _out_gz
-    _dir="$(dirname "${_in}")"
-    _out_gz="${_dir}/annotation.transcript_fixed.gff.gz"
 
     mkdir -p "${JOB_PATH}/output"
 
-    python "${INPUT_SCRIPTS_PATH}/insert_missing_transcript.py" \
-        --input "${_in}" \
-        --output "${_out_gz}" \
-        --format "${ANN_FORMAT}" \
-        >>"${JOB_PATH}/output/insert_missing_transcript.log" 2>&1 \
-      || fail_job 'insert_missing_transcript' 'failed to repair flat gene->feature rows' $?
-
-    export ANNOTATION_FILE="${_out_gz}"
-
-    python "${INPUT_SCRIPTS_PATH}/detect_annotation_style.py" \
-        "${ANNOTATION_FILE}" \
-        --output "${INPUT_CONFIG_PATH}/annotation_style.env" \
-      || fail_job 'detect_annotation_style_post_transcript_fix' '' $?
-
-    source "${INPUT_CONFIG_PATH}/annotation_style.env"
-}
-
-# The uploaded file is left in place; the filtered GTF is written alongside it
-# and ANNOTATION_FILE / ANN_FORMAT / ANN_GROUP_FEATURES / ANN_BIOTYPE_ATTR are
-# re-exported to point at the new GTF.
-function filter_annotation_features() {
-    [[ "${USING_CUSTOM_REFERENCE}" == "yes" ]] || return 0
-    [[ "${ANN_PROKARYOTIC:-no}" == "yes" ]] || return 0
-    [[ -n "${ANNOTATION_FILE:-}" && -f "${ANNOTATION_FILE}" ]] || return 0
-    [[ -n "${ANN_FEATURE_TYPE:-}" ]] || return 0
-    [[ -n "${ANN_FORMAT:-}" ]] || return 0
-
-    local _in="${ANNOTATION_FILE}"
-    local _dir _out_gz
-    _dir="$(dirname "${_in}")"
-    _out_gz="${_dir}/annotation.filtered.gtf.gz"
-
-
-    mkdir -p "${JOB_PATH}/output"
-
-    python "${INPUT_SCRIPTS_PATH}/filter_annotation_features.py" \
-        --input "${_in}" \
-        --output "${_out_gz}" \
-        --feature-type "${ANN_FEATURE_TYPE}" \
-        --format "${ANN_FORMAT}" \
-        --prokaryotic "${ANN_PROKARYOTIC}" \
-        --group-feature "${ANN_GROUP_FEATURES:-}" \
-        >>"${JOB_PATH}/output/annotation_filter.log" 2>&1 \
-      || fail_job 'filter_annotation_features' 'feature-type filter failed' $?
-
-    export ANNOTATION_FILE="${_out_gz}"
-    # The synthesised GTF uses standard GTF attribute names regardless of
-    # what detect_annotation_style.py picked from the original GFF3.
-    export ANN_FORMAT="gtf"
-    export ANN_GROUP_FEATURES="gene_id"
-    export ANN_BIOTYPE_ATTR="gene_biotype"
-}
-
-# Remove whole gene groups whose biotype is in ANN_DROP_BIOTYPES (set by
-# detect_annotation_style.py when non-coding RNA biotypes like tRNA/rRNA are
-# found alongside protein-coding genes). Works around a real nf-core/rnaseq
-# bug: with --gtf_group_features Parent, Salmon quantifies a transcript for
-# every group regardless of biotype, but nf-core's tximport/
-# SummarizedExperiment step (QUANTIFY_STAR_SALMON / QUANTIFY_PSEUDO_ALIGNMENT
-# - the *same* subworkflow under two names) can't find a metadata column
-# containing non-coding RNA ids and the whole run dies with "No column
-# contains all vector entries ...". Confirmed against real Laxy prod with
-# the genuine NCBI human (NC_012920.1) and mouse (NC_005089.1) mitochondrial
-# RefSeq annotations. See ANNOTATION_REQUIREMENTS_AND_FILTERING.md §6 item 7.
-#
-# Runs BEFORE filter_annotation_features (which only fires for prokaryotic
-# input), on whatever the original detect_annotation_style.py saw - real
-# organelle genomes (e.g. mitochondrial RefSeq) can have protein-coding
-# genes that are gene+CDS only with no mRNA/exon at all, so once the
-# tRNA/rRNA exon rows are stripped there may be *no* exon rows left, which
-# would make STAR's GTF/sjdb parsing die with "no exon lines in the GTF
-# file". So after dropping, the detector is re-run on what's left and its
-# output adopted as authoritative - this naturally reclassifies a
-# CDS-only remainder as prokaryotic-shaped, and the subsequent
-# filter_annotation_features call synthesises the transcript+exon+CDS
-# hierarchy STAR/RSEM/featureCounts need, exactly as it already does for
-# real bacterial CDS-only annotations.
-function drop_biotype_features() {
-    [[ "${USING_CUSTOM_REFERENCE}" == "yes" ]] || return 0
-    [[ -n "${ANN_DROP_BIOTYPES:-}" ]] || return 0
-    [[ -n "${ANNOTATION_FILE:-}" && -f "${ANNOTATION_FILE}" ]] || return 0
-    [[ -n "${ANN_FORMAT:-}" ]] || return 0
-
-    local _in="${ANNOTATION_FILE}"
-    local _dir _ext _out_gz
-    _dir="$(dirname "${_in}")"
-    _ext="gtf"
-    [[ "${ANN_FORMAT}" == "gff3" ]] && _ext="gff"
-    _out_gz="${_dir}/annotation.biotype_filtered.${_ext}.gz"
-
-    mkdir -p "${JOB_PATH}/output"
-
-    python "${INPUT_SCRIPTS_PATH}/drop_biotype_features.py" \
-        --input "${_in}" \
-        --output "${_out_gz}" \
-        --format "${ANN_FORMAT}" \
-        --drop-biotypes "${ANN_DROP_BIOTYPES}" \
-        >>"${JOB_PATH}/output/annotation_drop_biotype.log" 2>&1 \
-      || fail_job 'drop_biotype_features' 'non-coding RNA biotype filter failed' $?
-
-    export ANNOTATION_FILE="${_out_gz}"
-
-    python "${INPUT_SCRIPTS_PATH}/detect_annotation_style.py" \
-        "${ANNOTATION_FILE}" \
-        --output "${INPUT_CONFIG_PATH}/annotation_style.env" \
-      || fail_job 'detect_annotation_style_post_drop' '' $?
+    python "${INPUT_SCRIPTS_PATH}/annotation_pipeline.py" \
+        --input "${ANNOTATION_FILE}" \
+        --style-env "${INPUT_CONFIG_PATH}/annotation_style.env" \
+        --prepare-env "${INPUT_CONFIG_PATH}/annotation_prepare.env" \
+        >>"${JOB_PATH}/output/annotation_prepare.log" 2>&1 \
+      || fail_job 'prepare_annotation_features' 'annotation repair/filtering failed' $?
 
     source "${INPUT_CONFIG_PATH}/annotation_style.env"
+    source "${INPUT_CONFIG_PATH}/annotation_prepare.env"
 }
@@ -0,0 +1 @@
+../../../../../common/input/scripts/annotation_pipeline.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../../../common/input/scripts/annotation_scan.py
\ No newline at end of file
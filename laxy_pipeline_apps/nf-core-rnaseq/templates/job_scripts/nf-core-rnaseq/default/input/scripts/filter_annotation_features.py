@@ -34,12 +34,13 @@ eukaryotic GFF3/GTF like this would clobber the multi-exon ``Parent=``/
 from __future__ import annotations
 
 import argparse
-import gzip
 import logging
 import re
 import sys
 from pathlib import Path
-from typing import IO, Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from annotation_scan import AnnotationStage, run_stages
 
 logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
 log = logging.getLogger(__name__)
@@ -63,26 +64,6 @@ _ATTRS_HANDLED = frozenset((
 ))
 
 
-def is_gzipped(path: Path) -> bool:
-    try:
-        with path.open("rb") as fp:
-            return fp.read(2) == b"\x1f\x8b"
-    except OSError:
-        return path.suffix == ".gz"
-
-
-def open_text_read(path: Path) -> IO[str]:
-    if is_gzipped(path):
-        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
-    return open(path, "rt", encoding="utf-8", errors="replace")
-
-
-def open_text_write(path: Path) -> IO[str]:
-    if path.suffix == ".gz" or str(path).endswith(".gz"):
-        return gzip.open(path, "wt", encoding="utf-8")
-    return open(path, "wt", encoding="utf-8")
-
-
 def parse_gff3_attrs(col9: str) -> Dict[str, str]:
     """Parse a GFF3 column-9 string into a key->value dict (first wins)."""
     out: Dict[str, str] = {}
@@ -195,64 +176,53 @@ def dedupe(base_id: str, assigned: set, counter_hits: List[int]) -> str:
     return candidate
 
 
-def main() -> int:
-    p = argparse.ArgumentParser(description=__doc__)
-    p.add_argument("--input", type=Path, required=True,
-                   help="Input annotation (GTF or GFF3, plain or .gz).")
-    p.add_argument("--output", type=Path, required=True,
-                   help="Output path. For GFF3 input the output is GTF and "
-                        "should typically end in .gtf or .gtf.gz.")
-    p.add_argument("--feature-type", required=True,
-                   help="Value to match in column 3 (e.g. CDS, exon).")
-    p.add_argument("--format", required=True, choices=("gtf", "gff3"),
-                   help="Input format (matches detect_annotation_style.py ANN_FORMAT).")
-    p.add_argument("--prokaryotic", default="no", choices=("yes", "no"),
-                   help="Matches detect_annotation_style.py ANN_PROKARYOTIC. "
-                        "When 'yes', GTF input is also expanded into a "
-                        "transcript+exon+<feature_type> hierarchy (a flat, "
-                        "CDS-only prokaryotic GTF can't be assumed to "
-                        "already have exon/transcript rows). When 'no', GTF "
-                        "input is passed through unchanged on the assumption "
-                        "it's already self-contained (Ensembl/GENCODE/RefSeq).")
-    p.add_argument("--group-feature", default="",
-                   help="Attribute used to derive ID/gene_id when the row "
-                        "has no ID= (e.g. 'gene', 'locus_tag').")
-    p.add_argument("--biotype", default="protein_coding",
-                   help="Default gene_biotype for synthesised rows.")
-    p.add_argument("--source-tag", default="laxy_filter",
-                   help="Fallback value for column 2 of synthesised GTF rows "
-                        "when the input row has an empty source column.")
-    args = p.parse_args()
-
-    if not args.input.is_file():
-        log.error("Input does not exist or is not a file: %s", args.input)
-        return 1
-
-    args.output.parent.mkdir(parents=True, exist_ok=True)
-
-    is_gff_in = args.format == "gff3"
-    synthesise = is_gff_in or args.prokaryotic == "yes"
-    feature_type = args.feature_type
-    feature_type_lc = feature_type.lower()
-
-    input_rows_kept = 0
-    output_rows_written = 0
-    dropped = 0
-    in_fasta = False
-    ids_kept_existing = 0
-    ids_stamped_from_group = 0
-    auto_counter = [0]
-    dupe_counter = [0]
-    assigned_ids: set = set()
-
-    with open_text_read(args.input) as fin, open_text_write(args.output) as fout:
-        for raw in fin:
+class FilterAnnotationFeatures(AnnotationStage):
+    """Keep rows of one feature type, expanding each into a
+    transcript/exon/<feature_type> hierarchy when synthesising GTF."""
+
+    def __init__(
+        self,
+        feature_type: str,
+        fmt: str,
+        source: Path,
+        prokaryotic: str = "no",
+        group_feature: str = "",
+        biotype: str = "protein_coding",
+        source_tag: str = "laxy_filter",
+    ):
+        self.feature_type = feature_type
+        self.fmt = fmt
+        self.source = source
+        self.group_feature = group_feature
+        self.biotype = biotype
+        self.source_tag = source_tag
+        self.synthesise = fmt == "gff3" or prokaryotic == "yes"
+        self.counts: Dict[str, int] = {}
+
+    def transform(self, lines: Iterable[str]) -> Iterator[str]:
+        is_gff_in = self.fmt == "gff3"
+        synthesise = self.synthesise
+        feature_type = self.feature_type
+        feature_type_lc = feature_type.lower()
+        group_feature = self.group_feature
+
+        input_rows_kept = 0
+        output_rows_written = 0
+        dropped = 0
+        in_fasta = False
+        ids_kept_existing = 0
+        ids_stamped_from_group = 0
+        auto_counter = [0]
+        dupe_counter = [0]
+        assigned_ids: set = set()
+
+        for raw in lines:
             if in_fasta:
                 # FASTA section: only keep for unsynthesised passthrough;
                 # drop for synthesised-GTF output (RSEM/featureCounts don't
                 # want it).
                 if not synthesise:
-                    fout.write(raw)
+                    yield raw
                 continue
             if raw.startswith("##FASTA"):
                 in_fasta = True
@@ -262,7 +232,7 @@ def main() -> int:
                 # them for the synthesised GTF (cleaner, and avoids leaking
                 # GFF3 directives like ##gff-version 3 into a GTF file).
                 if not synthesise:
-                    fout.write(raw)
+                    yield raw
                 continue
             if not raw.strip():
                 continue
@@ -277,7 +247,7 @@ def main() -> int:
                 continue
 
             if not synthesise:
-                fout.write("\t".join(parts) + "\n")
+                yield "\t".join(parts) + "\n"
                 input_rows_kept += 1
                 output_rows_written += 1
                 continue
@@ -285,12 +255,12 @@ def main() -> int:
             if is_gff_in:
                 attrs = parse_gff3_attrs(parts[8])
                 base_id, source = pick_base_id(
-                    attrs, args.group_feature, feature_type_lc, auto_counter
+                    attrs, group_feature, feature_type_lc, auto_counter
                 )
             else:
                 attrs = parse_gtf_attrs(parts[8])
                 base_id, source = pick_base_id_gtf(
-                    attrs, args.group_feature, feature_type_lc, auto_counter
+                    attrs, group_feature, feature_type_lc, auto_counter
                 )
             if source == "id":
                 ids_kept_existing += 1
@@ -309,7 +279,7 @@ def main() -> int:
             biotype = (
                 attrs.get("gene_biotype")
                 or attrs.get("biotype")
-                or args.biotype
+                or self.biotype
             )
 
             extras: List[Tuple[str, str]] = []
@@ -319,7 +289,7 @@ def main() -> int:
                 extras.append((k, v))
 
             seqid = parts[0]
-            src = parts[1] or args.source_tag
+            src = parts[1] or self.source_tag
             start = parts[3]
             end = parts[4]
             score = parts[5]
@@ -334,50 +304,110 @@ def main() -> int:
             ]
 
             tx_pairs = core_pairs + extras
-            fout.write("\t".join([
+            yield "\t".join([
                 seqid, src, "transcript", start, end, score, strand, ".",
                 build_gtf_attrs(tx_pairs),
-            ]) + "\n")
+            ]) + "\n"
             output_rows_written += 1
 
             exon_pairs = core_pairs + [("exon_number", "1")]
-            fout.write("\t".join([
+            yield "\t".join([
                 seqid, src, "exon", start, end, score, strand, ".",
                 build_gtf_attrs(exon_pairs),
-            ]) + "\n")
+            ]) + "\n"
             output_rows_written += 1
 
             # The original feature type (typically CDS) - skipped if the user
             # already filtered to ``exon`` since we just wrote one above.
             if feature_type_lc != "exon":
-                fout.write("\t".join([
+                yield "\t".join([
                     seqid, src, feature_type, start, end, score, strand, frame,
                     build_gtf_attrs(core_pairs),
-                ]) + "\n")
+                ]) + "\n"
                 output_rows_written += 1
 
             input_rows_kept += 1
 
-    log.info(
-        "annotation_filter: feature_type=%s input_format=%s "
-        "input_rows_kept=%d output_rows=%d dropped=%d "
-        "ids_kept=%d ids_from_%s=%d ids_synthesised=%d duplicates_suffixed=%d",
-        feature_type, args.format,
-        input_rows_kept, output_rows_written, dropped,
-        ids_kept_existing,
-        args.group_feature or "group_feature",
-        ids_stamped_from_group,
-        auto_counter[0],
-        dupe_counter[0],
-    )
-
-    if input_rows_kept == 0:
-        log.error(
-            "After filtering to feature_type='%s', no rows remain in %s.",
-            feature_type, args.input,
+        self.counts = {
+            "input_rows_kept": input_rows_kept,
+            "output_rows": output_rows_written,
+            "dropped": dropped,
+            "ids_kept": ids_kept_existing,
+            "ids_from_group": ids_stamped_from_group,
+            "ids_synthesised": auto_counter[0],
+            "duplicates_suffixed": dupe_counter[0],
+        }
+
+    def report(self) -> int:
+        c = self.counts
+        log.info(
+            "annotation_filter: feature_type=%s input_format=%s "
+            "input_rows_kept=%d output_rows=%d dropped=%d "
+            "ids_kept=%d ids_from_%s=%d ids_synthesised=%d duplicates_suffixed=%d",
+            self.feature_type, self.fmt,
+            c["input_rows_kept"], c["output_rows"], c["dropped"],
+            c["ids_kept"],
+            self.group_feature or "group_feature",
+            c["ids_from_group"],
+            c["ids_synthesised"],
+            c["duplicates_suffixed"],
         )
-        return 2
-    return 0
+
+        if c["input_rows_kept"] == 0:
+            log.error(
+                "After filtering to feature_type='%s', no rows remain in %s.",
+                self.feature_type, self.source,
+            )
+            return 2
+        return 0
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("--input", type=Path, required=True,
+                   help="Input annotation (GTF or GFF3, plain or .gz).")
+    p.add_argument("--output", type=Path, required=True,
+                   help="Output path. For GFF3 input the output is GTF and "
+                        "should typically end in .gtf or .gtf.gz.")
+    p.add_argument("--feature-type", required=True,
+                   help="Value to match in column 3 (e.g. CDS, exon).")
+    p.add_argument("--format", required=True, choices=("gtf", "gff3"),
+                   help="Input format (matches detect_annotation_style.py ANN_FORMAT).")
+    p.add_argument("--prokaryotic", default="no", choices=("yes", "no"),
+                   help="Matches detect_annotation_style.py ANN_PROKARYOTIC. "
+                        "When 'yes', GTF input is also expanded into a "
+                        "transcript+exon+<feature_type> hierarchy (a flat, "
+                        "CDS-only prokaryotic GTF can't be assumed to "
+                        "already have exon/transcript rows). When 'no', GTF "
+                        "input is passed through unchanged on the assumption "
+                        "it's already self-contained (Ensembl/GENCODE/RefSeq).")
+    p.add_argument("--group-feature", default="",
+                   help="Attribute used to derive ID/gene_id when the row "
+                        "has no ID= (e.g. 'gene', 'locus_tag').")
+    p.add_argument("--biotype", default="protein_coding",
+                   help="Default gene_biotype for synthesised rows.")
+    p.add_argument("--source-tag", default="laxy_filter",
+                   help="Fallback value for column 2 of synthesised GTF rows "
+                        "when the input row has an empty source column.")
+    args = p.parse_args()
+
+    if not args.input.is_file():
+        log.error("Input does not exist or is not a file: %s", args.input)
+        return 1
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+
+    stage = FilterAnnotationFeatures(
+        args.feature_type,
+        args.format,
+        args.input,
+        prokaryotic=args.prokaryotic,
+        group_feature=args.group_feature,
+        biotype=args.biotype,
+        source_tag=args.source_tag,
+    )
+    run_stages(args.input, args.output, [stage])
+    return stage.report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+../../../../../common/input/scripts/laxy2nfcore_samplesheet.py
\ No newline at end of file
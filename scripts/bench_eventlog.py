@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark EventLog queries against a synthetic table of (by default) a
+million events.
+
+Runs in a throwaway test database (as `manage.py test` would create), so it
+is safe to point at a real settings module:
+
+    DJANGO_SETTINGS_MODULE=laxy.settings python scripts/bench_eventlog.py \\
+        [--events 1000000] [--jobs 5000]
+
+Reports the time for the queries job pages make - a page of the job list
+with each job's latest event (via the Job.latest_eventlog pointer, and the
+per-job EventLog query it replaces) and a page of a job's events (with the
+(object_id, timestamp) index, and the object_id-only index it replaces) -
+and for compacting old events.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "laxy.settings")
+
+import django
+
+django.setup()
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.utils import timezone
+
+EVENT_TYPES = [
+    "JOB_INFO",
+    "JOB_INFO",
+    "JOB_INFO",
+    "INPUT_DATA_DOWNLOAD_STARTED",
+    "JOB_PIPELINE_STARTING",
+    "JOB_STATUS_CHANGED",
+]
+
+
+def timed(label, fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"  {label:<48} {elapsed * 1000:9.2f} ms")
+    return result
+
+
+def populate(n_events: int, n_jobs: int):
+    from laxy_backend.models import EventLog, Job, User
+
+    user = User.objects.create_user("bench", "", "bench")
+    jobs = Job.objects.bulk_create(
+        [Job(owner=user, params={}, status=Job.STATUS_COMPLETE) for _ in range(n_jobs)]
+    )
+    job_ct = ContentType.objects.get_for_model(Job)
+    start = timezone.now() - timedelta(days=365)
+    rng = random.Random(42)
+
+    batch = []
+    for i in range(n_events):
+        job = jobs[rng.randrange(n_jobs)]
+        batch.append(
+            EventLog(
+                user=user,
+                event=rng.choice(EVENT_TYPES),
+                message="Synthetic event.",
+                extra={},
+                content_type=job_ct,
+                object_id=job.id,
+                timestamp=start + timedelta(seconds=i * 30),
+            )
+        )
+        if len(batch) == 10000:
+            EventLog.objects.bulk_create(batch)
+            batch = []
+    EventLog.objects.bulk_create(batch)
+
+    # As each job's events would have left it
+    for job in jobs:
+        job.latest_event()
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {EventLog._meta.db_table}")
+    return user, jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--jobs", type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        from laxy_backend.models import EventLog, Job
+        from laxy_backend.tasks.job import compact_old_job_events
+
+        print(f"Populating {args.events} events over {args.jobs} jobs ..")
+        start = time.perf_counter()
+        user, jobs = populate(args.events, args.jobs)
+        print(f"  done in {time.perf_counter() - start:.1f} s\n")
+
+        sample = random.Random(1).sample(jobs, 50)
+        table = EventLog._meta.db_table
+
+        def job_list_page():
+            page = Job.objects.prefetch_related("latest_eventlog").filter(owner=user)
+            return [j.latest_event().event for j in page.order_by("-created_time")[:10]]
+
+        def job_list_page_without_pointer():
+            page = Job.objects.filter(owner=user).order_by("-created_time")[:10]
+            return [
+                EventLog.objects.filter(object_id=j.id)
+                .exclude(event__in=EventLog.NOT_LATEST_EVENTS)
+                .latest()
+                .event
+                for j in page
+            ]
+
+        def event_pages():
+            for job in sample:
+                list(EventLog.objects.filter(object_id=job.id).order_by("-timestamp")[:100])
+
+        def explain_event_page():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"EXPLAIN SELECT * FROM {table} WHERE object_id = %s "
+                    f"ORDER BY timestamp DESC LIMIT 100",
+                    [sample[0].id],
+                )
+                for (line,) in cursor.fetchall():
+                    print(f"    {line}")
+
+        print("Job list page (10 jobs, with latest event):")
+        for label, fn in [
+            ("via Job.latest_eventlog", job_list_page),
+            ("via an EventLog query per job", job_list_page_without_pointer),
+        ]:
+            with CaptureQueriesContext(connection) as queries:
+                fn()
+            timed(f"{label} ({len(queries)} queries)", fn, 20)
+
+        print("\nNewest 100 events of each of 50 jobs:")
+        timed("(object_id, timestamp) index", event_pages, 5)
+        explain_event_page()
+
+        # The object_id-only index this replaced
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX eventlog_object_id_ts_idx")
+            cursor.execute(f"CREATE INDEX bench_object_id_idx ON {table} (object_id)")
+            cursor.execute(f"ANALYZE {table}")
+        timed("object_id index", event_pages, 5)
+        explain_event_page()
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX bench_object_id_idx")
+            cursor.execute(
+                f"CREATE INDEX eventlog_object_id_ts_idx ON {table} (object_id, timestamp)"
+            )
+
+        print("\nCompaction (500 jobs per run):")
+        result = timed("compact_old_job_events", lambda: compact_old_job_events(task_data={}))
+        print(f"  {result['result']}")
+        print(f"  {EventLog.objects.count()} events remain")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark the reference genome catalogue endpoint (ReferenceGenomesView).
+
+No database is needed:
+
+    DJANGO_SETTINGS_MODULE=laxy.settings python scripts/bench_genomes.py \\
+        [--seconds 3]
+
+Reports requests per second for the precomputed catalogue (unfiltered,
+filtered, and a conditional request answered with 304 Not Modified), and for
+the view it replaces, which rebuilt and re-serialized the catalogue from
+REFERENCE_GENOMES on every request.
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "laxy.settings")
+
+import django
+
+django.setup()
+
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from laxy_genomes.data.genomes import reference_genomes_for_api
+from laxy_genomes.serializers import ReferenceGenomeSerializer
+from laxy_genomes.views import ReferenceGenomesView
+
+GENOMES_API_PATH = "/api/v1/genomes/"
+
+
+class PerRequestReferenceGenomesView(APIView):
+    """The view as it was before the catalogue was precomputed."""
+
+    renderer_classes = (JSONRenderer,)
+    permission_classes = (AllowAny,)
+
+    def get(self, request, version=None):
+        genomes = reference_genomes_for_api()
+        serializer = ReferenceGenomeSerializer(genomes, many=True)
+        return Response(serializer.data)
+
+
+def throughput(label, view, request_fn, seconds):
+    n = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        response = view(request_fn())
+        if isinstance(response, Response):
+            response.render()
+        n += 1
+    elapsed = time.perf_counter() - start
+    print(
+        f"  {label:<50} {n / elapsed:9.0f} req/s "
+        f"({response.status_code}, {len(response.content)} bytes)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    factory = APIRequestFactory()
+    view = ReferenceGenomesView.as_view()
+    etag = view(factory.get(GENOMES_API_PATH))["ETag"]
+
+    print(f"GET {GENOMES_API_PATH}:")
+    throughput(
+        "serialized per request",
+        PerRequestReferenceGenomesView.as_view(),
+        lambda: factory.get(GENOMES_API_PATH),
+        args.seconds,
+    )
+    throughput(
+        "precomputed",
+        view,
+        lambda: factory.get(GENOMES_API_PATH),
+        args.seconds,
+    )
+    throughput(
+        "precomputed, ?organism=Homo_sapiens&tags=rnaseq",
+        view,
+        lambda: factory.get(
+            GENOMES_API_PATH, {"organism": "Homo_sapiens", "tags": "rnaseq"}
+        ),
+        args.seconds,
+    )
+    throughput(
+        "precomputed, If-None-Match (304)",
+        view,
+        lambda: factory.get(GENOMES_API_PATH, HTTP_IF_NONE_MATCH=etag),
+        args.seconds,
+    )
+
+
+if __name__ == "__main__":
+    main()
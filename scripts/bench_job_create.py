@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark job submission (a POST to JobCreate) latency.
+
+Runs in a throwaway test database (as `manage.py test` would create), so it
+is safe to point at a real settings module:
+
+    DJANGO_SETTINGS_MODULE=laxy.settings python scripts/bench_job_create.py \\
+        [--jobs 500]
+
+The start_job task is queued but never run (a worker would do the remote
+part), so this times only the work done in the request. Reports the mean,
+median and 95th percentile latency, and the database statements per
+submission.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "laxy.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+PARAMS = {
+    "pipeline": "rnasik",
+    "params": {"genome": "Homo_sapiens/UCSC/hg38", "pipeline_version": "1.5.4"},
+}
+
+
+def populate():
+    from laxy_backend.models import ComputeResource, Pipeline, User
+
+    user = User.objects.create_user("bench", "bench@example.com", "bench")
+    Pipeline.objects.create(name="rnasik", public=True, owner=user)
+    for n in range(3):
+        ComputeResource.objects.create(
+            name=f"cluster-{n}",
+            host="localhost",
+            status=ComputeResource.STATUS_ONLINE,
+            priority=n,
+            extra={"base_dir": "/tmp"},
+        )
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=500)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        client = populate()
+        url = reverse("laxy_backend:create_job")
+        data = json.dumps({"params": json.dumps(PARAMS)})
+
+        def submit():
+            response = client.post(url, data=data, content_type="application/json")
+            assert response.status_code == 200, response.content
+
+        with mock.patch("laxy_backend.views.start_job.apply_async"):
+            # Warm up (ContentType, URL resolver and any per-process caches)
+            submit()
+
+            with CaptureQueriesContext(connection) as queries:
+                submit()
+            # (later requests reset the query log)
+            n_queries = len(queries)
+
+            latencies = []
+            for _ in range(args.jobs):
+                start = time.perf_counter()
+                submit()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        latencies.sort()
+        print(f"Job submission ({args.jobs} jobs):")
+        print(f"  mean   {statistics.mean(latencies):8.2f} ms")
+        print(f"  median {statistics.median(latencies):8.2f} ms")
+        print(f"  p95    {latencies[int(len(latencies) * 0.95)]:8.2f} ms")
+        print(f"  {n_queries} database statements per submission")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Benchmark detect_annotation_style.py's annotation scan on the corpus.
+
+The corpus annotations are tiny, so each one is first scaled up (its
+feature rows repeated, gzipped) to roughly the size of a real eukaryotic
+annotation's capped sample, then scanned four ways:
+
+  full        every row up to the line cap, gzip module (the old behaviour)
+  external    the same, decompressed by an external pigz/gzip process
+  early stop  what the detector does by default
+  cached      a second run with a warm summary cache
+
+Usage:
+
+    python tests/data/annotation_corpus/shared/bench_annotation_scan.py [--lines N] [CASE_ID ...]
+
+Stdlib only, like the rest of shared/.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import corpus_lib as cl
+
+sys.path.insert(0, str(cl.SCRIPTS))
+import annotation_scan as scan  # noqa: E402
+import detect_annotation_style as das  # noqa: E402
+
+
+def _best_of(repeats: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_case(ann: Path, lines: int, repeats: int, workdir: Path) -> dict:
+    scaled = workdir / f"{ann.parent.name}.gz"
+    n_rows = cl.scale_annotation(ann, scaled, lines)
+    cache_dir = workdir / "summaries"
+
+    early = das.scan_for_decision(scaled)
+    timings = {
+        "full": _best_of(repeats, lambda: scan.scan_annotation(scaled, external=False)),
+        "external": _best_of(repeats, lambda: scan.scan_annotation(scaled, external=True))
+        if scan.external_gunzip_command() else None,
+        "early stop": _best_of(repeats, lambda: das.scan_for_decision(scaled)),
+    }
+    das.decide(scaled, cache_dir=cache_dir)
+    timings["cached"] = _best_of(repeats, lambda: das.decide(scaled, cache_dir=cache_dir))
+    return {
+        "case": ann.parent.name,
+        "rows": n_rows,
+        "early_stop_rows": early.feature_lines,
+        "seconds": timings,
+    }
+
+
+def main() -> int:
+    p = argparse.ArgumentParser(description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("cases", nargs="*", help="Case ids (default: every detectable case)")
+    p.add_argument("--lines", type=int, default=scan.MAX_FEATURE_LINES,
+                   help="Feature rows to scale each annotation up to")
+    p.add_argument("--repeats", type=int, default=3, help="Report the best of N runs")
+    p.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = p.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for case_dir in cl.discover_cases():
+            manifest = cl.load_manifest(case_dir)
+            if args.cases and manifest["id"] not in args.cases:
+                continue
+            if manifest["expected"]["detect"]["exit"] != 0:
+                continue
+            results.append(bench_case(
+                cl.annotation_path(case_dir), args.lines, args.repeats, Path(tmp)))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    cols = ["full", "external", "early stop", "cached"]
+    print(f"{'case':<32}{'rows':>9}{'stopped at':>12}" + "".join(f"{c:>12}" for c in cols))
+    for r in results:
+        secs = "".join(
+            f"{r['seconds'][c]:>11.3f}s" if r["seconds"][c] is not None else f"{'-':>12}"
+            for c in cols
+        )
+        print(f"{r['case']:<32}{r['rows']:>9}{r['early_stop_rows']:>12}{secs}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -31,6 +31,8 @@ DETECT = _SCRIPTS / "detect_annotation_style.py"
 FILTER = _SCRIPTS / "filter_annotation_features.py"
 DROP_BIOTYPE = _SCRIPTS / "drop_biotype_features.py"
 INSERT_TRANSCRIPT = _SCRIPTS / "insert_missing_transcript.py"
+PIPELINE = _SCRIPTS / "annotation_pipeline.py"
+SCRIPTS = _SCRIPTS
 CASES = _CORPUS_ROOT / "cases"
 SHARED = _HERE
 GENOME = SHARED / "genome.fa"
@@ -61,7 +63,8 @@ def annotation_path(case_dir: Path) -> Optional[Path]:
 
 
 def parse_env(env_path: Path) -> dict[str, str]:
-    """Parse a detector env file (KEY='value' lines) into a plain dict.
+    """Parse a detector env file (KEY='value' lines, optionally prefixed
+    with ``export``) into a plain dict.
 
     Values are single-quoted in the file; we strip the quotes via ast.literal_eval
     so embedded quotes survive correctly.
@@ -79,7 +82,7 @@ def parse_env(env_path: Path) -> dict[str, str]:
                 v = ast.literal_eval(v)
             except (SyntaxError, ValueError):
                 v = v[1:-1]
-        out[k.strip()] = v
+        out[k.strip().removeprefix("export ")] = v
     return out
 
 
@@ -281,6 +284,141 @@ def run_post_drop_chain(ann: Path, fmt: str, drop_biotypes: str) -> dict:
             stripped_path.unlink(missing_ok=True)
 
 
+def read_annotation_bytes(path: Path) -> bytes:
+    """The annotation's content, decompressed if it's gzipped."""
+    data = path.read_bytes()
+    return gzip.decompress(data) if data[:2] == b"\x1f\x8b" else data
+
+
+def _prepare_workdir(ann: Path, workdir: Path) -> tuple[Path, Path]:
+    """Copy ``ann`` into ``workdir`` (the steps write alongside their input)
+    and run the first detector pass, as run_job.sh does."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    local = workdir / ann.name
+    local.write_bytes(ann.read_bytes())
+    style_env = workdir / "annotation_style.env"
+    proc = subprocess.run(
+        [sys.executable, str(DETECT), str(local), "--output", str(style_env)],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"detect failed on {ann}: {proc.stderr}")
+    return local, style_env
+
+
+def _prepare_result(rc: int, annotation: Path, style_env: Path, stderr: str) -> dict:
+    return {
+        "rc": rc,
+        "annotation": annotation.name,
+        "content": read_annotation_bytes(annotation) if rc == 0 else None,
+        "env": parse_env(style_env),
+        "stderr": stderr,
+    }
+
+
+def run_prepare(ann: Path, workdir: Path) -> dict:
+    """Run annotation_pipeline.py the way run_job.sh's
+    prepare_annotation_features does; return rc, the final annotation's name
+    and (decompressed) content, and the resulting ANN_* env."""
+    local, style_env = _prepare_workdir(ann, workdir)
+    prepare_env = workdir / "annotation_prepare.env"
+    proc = subprocess.run(
+        [sys.executable, str(PIPELINE),
+         "--input", str(local),
+         "--style-env", str(style_env),
+         "--prepare-env", str(prepare_env)],
+        capture_output=True, text=True,
+    )
+    overrides = parse_env(prepare_env) if proc.returncode == 0 else {}
+    annotation = Path(overrides.pop("ANNOTATION_FILE", local))
+    result = _prepare_result(proc.returncode, annotation, style_env, proc.stderr)
+    result["env"].update(overrides)
+    return result
+
+
+def run_prepare_scripts(ann: Path, workdir: Path) -> dict:
+    """The steps annotation_pipeline.py replaces, one script (and one file)
+    at a time, as run_job.sh's insert_missing_transcript,
+    drop_biotype_features and filter_annotation_features used to; same
+    result shape as :func:`run_prepare`."""
+    annotation, style_env = _prepare_workdir(ann, workdir)
+    env = parse_env(style_env)
+    stderr = ""
+
+    def _run(script: Path, out_name: str, args: list[str], redetect: bool) -> int:
+        nonlocal annotation, env, stderr
+        out = workdir / out_name
+        proc = subprocess.run(
+            [sys.executable, str(script), "--input", str(annotation),
+             "--output", str(out)] + args,
+            capture_output=True, text=True,
+        )
+        stderr += proc.stderr
+        if proc.returncode != 0:
+            return proc.returncode
+        annotation = out
+        if redetect:
+            proc = subprocess.run(
+                [sys.executable, str(DETECT), str(annotation),
+                 "--output", str(style_env)],
+                capture_output=True, text=True,
+            )
+            stderr += proc.stderr
+            env = parse_env(style_env)
+        return proc.returncode
+
+    rc = 0
+    if env["ANN_FORMAT"] == "gff3":
+        rc = _run(INSERT_TRANSCRIPT, "annotation.transcript_fixed.gff.gz",
+                  ["--format", env["ANN_FORMAT"]], redetect=True)
+    if rc == 0 and env.get("ANN_DROP_BIOTYPES"):
+        ext = "gff" if env["ANN_FORMAT"] == "gff3" else "gtf"
+        rc = _run(DROP_BIOTYPE, f"annotation.biotype_filtered.{ext}.gz",
+                  ["--format", env["ANN_FORMAT"],
+                   "--drop-biotypes", env["ANN_DROP_BIOTYPES"]], redetect=True)
+    if rc == 0 and env.get("ANN_PROKARYOTIC") == "yes" and env.get("ANN_FEATURE_TYPE"):
+        rc = _run(FILTER, "annotation.filtered.gtf.gz",
+                  ["--feature-type", env["ANN_FEATURE_TYPE"],
+                   "--format", env["ANN_FORMAT"],
+                   "--prokaryotic", env["ANN_PROKARYOTIC"],
+                   "--group-feature", env.get("ANN_GROUP_FEATURES", "")],
+                  redetect=False)
+        if rc == 0:
+            env.update(ANN_FORMAT="gtf", ANN_GROUP_FEATURES="gene_id",
+                       ANN_BIOTYPE_ATTR="gene_biotype")
+    result = _prepare_result(rc, annotation, style_env, stderr)
+    result["env"] = env
+    return result
+
+
+def scale_annotation(ann: Path, out_path: Path, min_feature_lines: int) -> int:
+    """Write a gzipped copy of ``ann`` with its feature rows repeated until
+    there are at least ``min_feature_lines`` of them; return the row count.
+
+    Header comments are kept once and any ##FASTA section is dropped, so the
+    copy looks like a (much) longer version of the same annotation. Used to
+    benchmark and stress the detector's scanning on corpus-shaped input.
+    """
+    header: list[str] = []
+    rows: list[str] = []
+    with open_text(ann) as fp:
+        for line in fp:
+            if line.startswith("##FASTA"):
+                break
+            if line.startswith("#") and not rows:
+                header.append(line)
+            elif line.strip() and not line.startswith("#"):
+                rows.append(line if line.endswith("\n") else line + "\n")
+    if not rows:
+        raise ValueError(f"{ann} has no feature rows to scale")
+    repeats = -(-min_feature_lines // len(rows))
+    with gzip.open(out_path, "wt", encoding="utf-8") as fp:
+        fp.writelines(header)
+        for _ in range(repeats):
+            fp.writelines(rows)
+    return repeats * len(rows)
+
+
 def fasta_seqids(fasta: Path) -> set[str]:
     """First whitespace token of every '>' header (mirrors check_fasta_annotation_seqids awk)."""
     ids: set[str] = set()
@@ -0,0 +1,116 @@
+"""Tier 2d: annotation_pipeline.py, the single-pass run of Tiers 2a-2c.
+
+run_job.sh's prepare_annotation_features runs insert_missing_transcript ->
+re-detect -> drop_biotype_features -> re-detect -> filter_annotation_features
+as chained stages over one read and one write. Whatever the case, the final
+annotation (decompressed), its file name and the ANN_* env run_job.sh ends
+up with must be exactly what running the scripts one after another gives.
+"""
+
+from __future__ import annotations
+
+import sys
+
+import pytest
+
+import conftest as ctx  # type: ignore  # noqa: E402
+import corpus_lib as cl  # type: ignore  # noqa: E402
+
+sys.path.insert(0, str(cl.SCRIPTS))
+import annotation_scan as scan  # type: ignore  # noqa: E402
+import detect_annotation_style as das  # type: ignore  # noqa: E402
+from drop_biotype_features import DropBiotypeFeatures  # type: ignore  # noqa: E402
+from filter_annotation_features import FilterAnnotationFeatures  # type: ignore  # noqa: E402
+from insert_missing_transcript import InsertMissingTranscript  # type: ignore  # noqa: E402
+
+
+def test_read_env_round_trips(tmp_path):
+    decision = ("gff3", "CDS", "locus_tag", "gene,product", "",
+                "yes", "prok", "--skip_biotype_qc --x 'y'", "tRNA,rRNA")
+    env = tmp_path / "annotation_style.env"
+    with env.open("w", encoding="utf-8") as fp:
+        das.emit_env(fp, *decision)
+
+    assert das.read_env(env) == decision
+
+
+def _detectable_cases():
+    return [
+        pytest.param(p.values[0], id=p.id)
+        for p in ctx.case_params(stage="detect")
+        if p.values[0][1]["expected"]["detect"]["exit"] == 0
+    ]
+
+
+def _assert_same(manifest, pipeline, scripts):
+    case_id = manifest["id"]
+    assert pipeline["rc"] == scripts["rc"], (
+        f"[{case_id}] exit {pipeline['rc']} vs {scripts['rc']}; "
+        f"stderr={pipeline['stderr']!r}")
+    assert pipeline["annotation"] == scripts["annotation"], case_id
+    assert pipeline["env"] == scripts["env"], case_id
+    assert pipeline["content"] == scripts["content"], (
+        f"[{case_id}] single-pass output differs from the script chain")
+
+
+@pytest.mark.corpus
+@pytest.mark.parametrize("case", _detectable_cases())
+def test_prepare_matches_script_chain(case, tmp_path):
+    case_dir, manifest = case
+    ann = cl.annotation_path(case_dir)
+
+    _assert_same(
+        manifest,
+        cl.run_prepare(ann, tmp_path / "pipeline"),
+        cl.run_prepare_scripts(ann, tmp_path / "scripts"),
+    )
+
+
+@pytest.mark.corpus
+@pytest.mark.parametrize("case_id", ["E5_eukaryote_ncrna_ids", "E7_eukaryote_flat_pseudogene"])
+def test_prepare_matches_script_chain_scaled(case_id, tmp_path):
+    # Long enough for each re-detect to stop early, as it does on real input.
+    case_dir = cl.CASES / case_id
+    scaled = tmp_path / "annotation.gff3.gz"
+    cl.scale_annotation(cl.annotation_path(case_dir), scaled, 80_000)
+
+    _assert_same(
+        cl.load_manifest(case_dir),
+        cl.run_prepare(scaled, tmp_path / "pipeline"),
+        cl.run_prepare_scripts(scaled, tmp_path / "scripts"),
+    )
+
+
+def _gff3_cases():
+    return [
+        p for p in _detectable_cases()
+        if p.values[0][1]["expected"]["detect"]["env"]["ANN_FORMAT"] == "gff3"
+    ]
+
+
+@pytest.mark.corpus
+@pytest.mark.parametrize("case", _gff3_cases())
+def test_chained_stages_match_scripts(case, tmp_path):
+    """Every stage at once, whether or not the detector would ask for it."""
+    case_dir, manifest = case
+    ann = cl.annotation_path(case_dir)
+
+    chained = tmp_path / "chained.gtf"
+    scan.run_stages(ann, chained, [
+        InsertMissingTranscript("gff3"),
+        DropBiotypeFeatures("gff3", {"tRNA", "rRNA"}, ann),
+        FilterAnnotationFeatures("CDS", "gff3", ann, group_feature="locus_tag"),
+    ])
+
+    fixed = cl.run_insert_transcript(ann, "gff3", keep_output=True)
+    dropped = cl.run_drop_biotype(fixed["output_path"], "gff3", "tRNA,rRNA", keep_output=True)
+    filtered = tmp_path / "filtered.gtf"
+    try:
+        scan.run_stages(dropped["output_path"], filtered, [
+            FilterAnnotationFeatures("CDS", "gff3", ann, group_feature="locus_tag"),
+        ])
+    finally:
+        fixed["output_path"].unlink(missing_ok=True)
+        dropped["output_path"].unlink(missing_ok=True)
+
+    assert chained.read_bytes() == filtered.read_bytes(), manifest["id"]
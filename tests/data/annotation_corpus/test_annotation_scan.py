@@ -0,0 +1,123 @@
+"""Tier 1b: annotation_scan.py, the scanning library behind the detector.
+
+Early stopping, the external decompressor and the summary cache must never
+change what detect_annotation_style.py decides, so each is checked against a
+plain full scan on corpus-shaped input.
+"""
+
+from __future__ import annotations
+
+import sys
+
+import pytest
+
+import conftest as ctx  # type: ignore  # noqa: E402
+import corpus_lib as cl  # type: ignore  # noqa: E402
+
+sys.path.insert(0, str(cl.SCRIPTS))
+import annotation_scan as scan  # type: ignore  # noqa: E402
+import detect_annotation_style as das  # type: ignore  # noqa: E402
+
+
+def _detectable_cases():
+    # Without the detect stage's xfail mark: a misclassification is still
+    # expected to be the same misclassification with or without early stopping.
+    return [
+        pytest.param(p.values[0], id=p.id)
+        for p in ctx.case_params(stage="detect")
+        if p.values[0][1]["expected"]["detect"]["exit"] == 0
+    ]
+
+
+@pytest.mark.corpus
+@pytest.mark.parametrize("case", _detectable_cases())
+def test_early_stop_same_decision(case, tmp_path):
+    case_dir, manifest = case
+    scaled = tmp_path / "scaled.gtf.gz"
+    n_rows = cl.scale_annotation(cl.annotation_path(case_dir), scaled, 20_000)
+
+    full = scan.scan_annotation(scaled)
+    early = scan.scan_annotation(
+        scaled, settled=das.decision_settled(stable_lines=2_000), check_every=500
+    )
+
+    assert full.complete and full.feature_lines == n_rows
+    assert not early.complete
+    assert early.feature_lines < n_rows // 2
+    assert das.decide_from_summary(early) == das.decide_from_summary(full), (
+        f"[{manifest['id']}] early stop changed the decision")
+
+
+@pytest.mark.corpus
+def test_external_gunzip_matches_gzip_module(tmp_path):
+    case_dir = cl.CASES / "P3gz_prokaryote_bakta_gz"
+    ann = cl.annotation_path(case_dir)
+    scaled = tmp_path / "scaled.gff3.gz"
+    cl.scale_annotation(ann, scaled, 5_000)
+
+    if scan.external_gunzip_command() is None:
+        pytest.skip("no pigz or gzip on PATH")
+    for path in (ann, scaled):
+        assert scan.scan_annotation(path, external=True) == scan.scan_annotation(
+            path, external=False)
+
+
+@pytest.mark.corpus
+def test_external_gunzip_reports_corrupt_input(tmp_path):
+    if scan.external_gunzip_command() is None:
+        pytest.skip("no pigz or gzip on PATH")
+    scaled = tmp_path / "scaled.gtf.gz"
+    cl.scale_annotation(
+        cl.annotation_path(cl.CASES / "E1_eukaryote_ensembl"), scaled, 5_000)
+    truncated = tmp_path / "truncated.gtf.gz"
+    truncated.write_bytes(scaled.read_bytes()[:-100])
+
+    with pytest.raises(OSError):
+        scan.scan_annotation(truncated, external=True)
+
+
+@pytest.mark.corpus
+def test_summary_cache(tmp_path):
+    ann = cl.annotation_path(cl.CASES / "E3_eukaryote_refseq")
+    cache_dir = tmp_path / "summaries"
+    scans = []
+
+    def counting_scan(path):
+        scans.append(path)
+        return das.scan_for_decision(path)
+
+    first = scan.cached_scan(ann, cache_dir, "test", counting_scan)
+    # Same content under another name is still a hit
+    copy = tmp_path / "renamed.gff3"
+    copy.write_bytes(ann.read_bytes())
+    second = scan.cached_scan(copy, cache_dir, "test", counting_scan)
+
+    assert scans == [ann]
+    assert second == first
+    assert len(list(cache_dir.glob("*.test.json"))) == 1
+
+    # A modified file, or another kind of scan, misses
+    copy.write_bytes(ann.read_bytes() + b"\n")
+    scan.cached_scan(copy, cache_dir, "test", counting_scan)
+    scan.cached_scan(ann, cache_dir, "other", counting_scan)
+    assert len(scans) == 3
+
+    # A corrupt entry is ignored and rewritten
+    for entry in cache_dir.glob("*.json"):
+        entry.write_text("{not json")
+    assert scan.cached_scan(ann, cache_dir, "test", counting_scan) == first
+    assert len(scans) == 4
+
+
+@pytest.mark.corpus
+def test_detect_cli_uses_summary_cache(tmp_path, monkeypatch):
+    ann = cl.annotation_path(cl.CASES / "E2_eukaryote_gencode")
+    cache_dir = tmp_path / "summaries"
+    monkeypatch.setenv("ANNOTATION_SUMMARY_CACHE_PATH", str(cache_dir))
+
+    first = cl.run_detect(ann)
+    assert first["rc"] == 0, first["stderr"]
+    assert len(list(cache_dir.glob("*.json"))) == 1
+
+    second = cl.run_detect(ann)
+    assert second["env"] == first["env"]
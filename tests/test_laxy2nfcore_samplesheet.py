@@ -0,0 +1,93 @@
+"""Smoke tests for the samplesheet builder used by nf-core-rnaseq job scripts."""
+
+from __future__ import annotations
+
+import gzip
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+
+SCRIPT = (
+    Path(__file__).resolve().parent.parent
+    / "laxy_pipeline_apps/nf-core-rnaseq/templates/common/input/scripts/laxy2nfcore_samplesheet.py"
+)
+
+FASTQ = b"@r1\nACGT\n+\nIIII\n"
+
+
+def _run(config: Path, reads: Path, *args: str) -> "subprocess.CompletedProcess[str]":
+    return subprocess.run(
+        [sys.executable, str(SCRIPT), str(config), str(reads), *args],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+
+def _archive_config(tmp_path: Path) -> Path:
+    config = tmp_path / "pipeline_config.json"
+    config.write_text(
+        json.dumps(
+            {
+                "sample_cart": {
+                    "samples": [
+                        {
+                            "name": "run",
+                            "files": [{"R1": {"sanitized_filename": "run.tar.gz"}}],
+                        }
+                    ]
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+    return config
+
+
+def test_archive_reads_compressed_in_parallel(tmp_path: Path) -> None:
+    reads = tmp_path / "reads"
+    (reads / "sub").mkdir(parents=True)
+    for i in range(4):
+        (reads / "sub" / f"S{i}_R1_001.fastq").write_bytes(FASTQ * (i + 1))
+        (reads / "sub" / f"S{i}_R2_001.fastq").write_bytes(FASTQ * (i + 1))
+
+    r = _run(_archive_config(tmp_path), reads, "--threads", "3")
+    assert r.returncode == 0, r.stderr
+
+    names = sorted(p.name for p in (reads / "sub").iterdir())
+    assert names == sorted(
+        f"S{i}_R{n}_001.fastq.gz" for i in range(4) for n in (1, 2)
+    )
+    assert gzip.decompress((reads / "sub" / "S2_R1_001.fastq.gz").read_bytes()) == FASTQ * 3
+
+    lines = r.stdout.splitlines()
+    assert lines[0] == "sample,fastq_1,fastq_2,strandedness"
+    assert len(lines) == 5
+    assert all(line.endswith("_R2_001.fastq.gz,auto") for line in lines[1:])
+
+
+def test_compression_judged_by_content_not_name(tmp_path: Path) -> None:
+    reads = tmp_path / "reads"
+    reads.mkdir()
+    # Already gzipped, but missing the .gz nf-core needs: renamed, not recompressed
+    (reads / "A_R1_001.fastq").write_bytes(gzip.compress(FASTQ, mtime=0))
+    # Named .gz, but plain text
+    (reads / "B_R1_001.fastq.gz").write_bytes(FASTQ)
+    # Already fine: left alone
+    ok = gzip.compress(FASTQ * 2, mtime=0)
+    (reads / "C_R1_001.fastq.gz").write_bytes(ok)
+
+    r = _run(_archive_config(tmp_path), reads, "--compress-only")
+    assert r.returncode == 0, r.stderr
+    assert r.stdout == ""
+
+    assert sorted(p.name for p in reads.iterdir()) == [
+        "A_R1_001.fastq.gz",
+        "B_R1_001.fastq.gz",
+        "C_R1_001.fastq.gz",
+    ]
+    assert (reads / "A_R1_001.fastq.gz").read_bytes() == gzip.compress(FASTQ, mtime=0)
+    assert gzip.decompress((reads / "B_R1_001.fastq.gz").read_bytes()) == FASTQ
+    assert (reads / "C_R1_001.fastq.gz").read_bytes() == ok